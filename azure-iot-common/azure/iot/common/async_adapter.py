@@ -29,6 +29,9 @@ def emulate_async(fn):
 
 class AwaitableCallback(object):
     """A sync callback whose completion can be waited upon.
+
+    If the callback is called with an "error" keyword argument that is not None, waiting upon
+    completion raises that error.
     """
 
     def __init__(self, callback):
@@ -43,7 +46,11 @@ class AwaitableCallback(object):
             result = callback(*args, **kwargs)
             # Use event loop from outer scope, since the threads it will be used in will not have
             # an event loop. future.set_result() has to be called in an event loop or it does not work.
-            loop.call_soon_threadsafe(self.future.set_result, result)
+            error = kwargs.get("error")
+            if error is not None:
+                loop.call_soon_threadsafe(self.future.set_exception, error)
+            else:
+                loop.call_soon_threadsafe(self.future.set_result, result)
             return result
 
         self.callback = wrapping_callback
@@ -79,3 +79,13 @@ class TestAwaitableCallback(object):
         callback()
         assert await callback.completion() == mock_function.return_value
         assert callback.future.done()
+
+    async def test_awaiting_completion_of_callback_called_with_error_raises_error(
+        self, mock_function
+    ):
+        callback = async_adapter.AwaitableCallback(mock_function)
+        error = RuntimeError("failed")
+        callback(error=error)
+        with pytest.raises(RuntimeError):
+            await callback.completion()
+        assert mock_function.call_count == 1
@@ -6,6 +6,39 @@ as a Device or Module.
 
 from .sync_clients import DeviceClient, ModuleClient
 from .sync_inbox import InboxEmpty
+from .errors import MessageExpiredError
 from .common import Message
+from .transport.compression import PayloadCompressor
+from .transport.batching import BatchPolicy
+from .transport.chunking import ChunkingPolicy
+from .transport.dedupe import DedupePolicy
+from .transport.dispatch import ThreadDispatcher, PoolDispatcher
+from .transport.mqtt.multiplexer import MqttMultiplexer
+from .diagnostics import (
+    LatencyRecorder,
+    MetricsReporter,
+    OpenMetricsExporter,
+    Tracer,
+    OpenTelemetryTracer,
+)
 
-__all__ = ["DeviceClient", "ModuleClient", "Message", "InboxEmpty", "auth"]
+__all__ = [
+    "DeviceClient",
+    "ModuleClient",
+    "Message",
+    "InboxEmpty",
+    "MessageExpiredError",
+    "PayloadCompressor",
+    "BatchPolicy",
+    "ChunkingPolicy",
+    "DedupePolicy",
+    "ThreadDispatcher",
+    "PoolDispatcher",
+    "MqttMultiplexer",
+    "LatencyRecorder",
+    "MetricsReporter",
+    "OpenMetricsExporter",
+    "Tracer",
+    "OpenTelemetryTracer",
+    "auth",
+]
@@ -10,6 +10,8 @@ import six
 import abc
 import logging
 from .transport import MQTTTransport
+from .diagnostics import tracing
+from .inbox_manager import DEFAULT_SUBSCRIBER_INBOX_SIZE
 
 logger = logging.getLogger(__name__)
 
@@ -26,7 +28,7 @@ class AbstractClient(object):
         self._transport = transport
 
     @classmethod
-    def from_authentication_provider(cls, authentication_provider, transport_name):
+    def from_authentication_provider(cls, authentication_provider, transport_name, **kwargs):
         """Creates a client with the specified authentication provider and transport.
 
         When creating the client, you need to pass in an authorization provider and a transport_name.
@@ -41,6 +43,15 @@ class AbstractClient(object):
 
         Currently "mqtt" is the only supported transport.
 
+        Any additional keyword arguments are passed to the transport, in order to enable optional
+        transport features such as payload compression (payload_compressor), telemetry batching
+        (batch_policy), chunking of large payloads (chunking_policy), suppression of
+        redelivered messages (dedupe_policy), latency recording (latency_recorder), tracing
+        (tracer), recording of recent events (flight_recorder), timing of the handlers run on
+        the network thread (watchdog), running callbacks off the network thread (dispatcher) and
+        sharing one network thread between many clients (multiplexer). The port to connect to
+        (port), the QoS level of telemetry (telemetry_qos) and the clock (clock) can also be set.
+
         :param authentication_provider: The authentication provider.
         :param transport_name: The name of the transport that the client will use.
 
@@ -51,13 +62,76 @@ class AbstractClient(object):
         """
         transport_name = transport_name.lower()
         if transport_name == "mqtt":
-            transport = MQTTTransport(authentication_provider)
+            transport = MQTTTransport(authentication_provider, **kwargs)
         elif transport_name == "amqp" or transport_name == "http":
             raise NotImplementedError("This transport has not yet been implemented")
         else:
             raise ValueError("No specific transport can be instantiated based on the choice.")
         return cls(transport)
 
+    @property
+    def codecs(self):
+        """The CodecRegistry used to serialize payloads.
+
+        Messages whose payload is a dict or a list are encoded with the codec matching the
+        message's content_type (JSON by default), and the codec's content type and content
+        encoding are set on the outgoing message. Set codecs.decode_received_payloads to True to
+        have received C2D and input message payloads decoded according to their content type.
+        """
+        return self._transport.codec_registry
+
+    def _start_span(self, name, message=None):
+        """Start a span for a client call, if tracing is enabled.
+
+        :param str name: The name of the span.
+        :param Message message: The message being sent, if any, whose attributes are traced.
+        :returns: The Span, or None if tracing is disabled.
+        """
+        tracer = self._transport.tracer
+        if not tracer:
+            return None
+        return tracer.start_span(name, tracing.message_attributes(message) if message else None)
+
+    def get_stats(self):
+        """Take a snapshot of the client's statistics, for monitoring.
+
+        Counters (messages and bytes sent and received, connects, reconnects and disconnects,
+        expired messages, suppressed duplicates and subscriber discards) only increase. Gauges
+        (pending_actions, in_progress_actions, unknown_mid_responses, the transport state and the
+        depth of each inbox) are read when this is called. Pass the snapshot to an exporter such as
+        diagnostics.OpenMetricsExporter, or export it periodically with diagnostics.MetricsReporter.
+
+        :returns: A dictionary mapping the names of statistics to their values. inbox_depth maps
+        the name of each inbox to the number of items waiting in it.
+        """
+        stats = self._transport.get_stats()
+        stats["inbox_depth"] = self._inbox_manager.get_inbox_depths()
+        stats["subscriber_discards"] = self._inbox_manager.subscriber_discard_count
+        return stats
+
+    def create_message_template(self, message):
+        """Create a template for sending many payloads with the same properties.
+
+        The topic used to send the message, including its system and custom properties, is encoded
+        once, so that sending a payload with send_event_from_template does not need to create a
+        Message or encode its properties again. Payloads sent with a template are sent as-is: they
+        are not encoded by a codec, compressed or batched.
+
+        :param message: The Message holding the properties to send with each payload. Its payload
+        is ignored. For a module, set the output_name of the message to send to an output.
+
+        :returns: A MessageTemplate for use with send_event_from_template.
+        """
+        return self._transport.create_message_template(message)
+
+    def unsubscribe(self, inbox):
+        """Stop delivering messages to a subscriber inbox.
+
+        :param inbox: An inbox returned by subscribe_to_c2d_messages or subscribe_to_input_messages.
+        :returns: Boolean indicating if the inbox was subscribed.
+        """
+        return self._inbox_manager.unsubscribe(inbox)
+
     @abc.abstractmethod
     def connect(self):
         pass
@@ -70,6 +144,10 @@ class AbstractClient(object):
     def send_event(self, message):
         pass
 
+    @abc.abstractmethod
+    def send_event_from_template(self, template, payload):
+        pass
+
     @abc.abstractmethod
     def receive_method_request(self, method_name=None):
         pass
@@ -85,6 +163,10 @@ class AbstractDeviceClient(AbstractClient):
     def receive_c2d_message(self):
         pass
 
+    @abc.abstractmethod
+    def subscribe_to_c2d_messages(self, maxsize=DEFAULT_SUBSCRIBER_INBOX_SIZE):
+        pass
+
 
 @six.add_metaclass(abc.ABCMeta)
 class AbstractModuleClient(AbstractClient):
@@ -95,3 +177,7 @@ class AbstractModuleClient(AbstractClient):
     @abc.abstractmethod
     def receive_input_message(self, input_name):
         pass
+
+    @abc.abstractmethod
+    def subscribe_to_input_messages(self, input_name, maxsize=DEFAULT_SUBSCRIBER_INBOX_SIZE):
+        pass
@@ -5,3 +5,4 @@ as a Device or Module.
 """
 
 from .async_clients import DeviceClient, ModuleClient
+from .async_dispatch import AsyncioDispatcher
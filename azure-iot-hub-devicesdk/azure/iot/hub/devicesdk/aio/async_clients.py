@@ -16,10 +16,13 @@ from azure.iot.hub.devicesdk.abstract_clients import (
 )
 from azure.iot.hub.devicesdk.common import Message
 from azure.iot.hub.devicesdk.transport import constant
-from azure.iot.hub.devicesdk.inbox_manager import InboxManager
+from azure.iot.hub.devicesdk.inbox_manager import InboxManager, DEFAULT_SUBSCRIBER_INBOX_SIZE
+from azure.iot.hub.devicesdk.diagnostics import tracing
+from azure.iot.hub.devicesdk.diagnostics.message_log import MessageLogger
 from .async_inbox import AsyncClientInbox
 
 logger = logging.getLogger(__name__)
+message_logger = MessageLogger(logger)
 
 __all__ = ["DeviceClient", "ModuleClient"]
 
@@ -38,7 +41,11 @@ class GenericClient(AbstractClient):
         :param transport: The transport that the client will use.
         """
         super().__init__(transport)
-        self._inbox_manager = InboxManager(inbox_type=AsyncClientInbox)
+        self._inbox_manager = InboxManager(
+            inbox_type=AsyncClientInbox,
+            latency_recorder=transport.latency_recorder,
+            tracer=transport.tracer,
+        )
         self._transport.on_transport_connected = self._on_state_change
         self._transport.on_transport_disconnected = self._on_state_change
         self._transport.on_transport_method_request_received = (
@@ -47,7 +54,7 @@ class GenericClient(AbstractClient):
 
     def _on_state_change(self, new_state):
         """Handler to be called by the transport upon a connection state change."""
-        logger.info("Connection State - {}".format(new_state))
+        logger.info("Connection State - %s", new_state)
 
         if new_state == "disconnected":
             self._on_disconnected()
@@ -96,21 +103,52 @@ class GenericClient(AbstractClient):
 
         :param message: The actual message to send. Anything passed that is not an instance of the
         Message class will be converted to Message object.
+
+        :raises: MessageExpiredError if the expiry time of the message passed before it was sent.
         """
         if not isinstance(message, Message):
             message = Message(message)
 
-        logger.info("Sending message to Hub...")
-        send_event_async = async_adapter.emulate_async(self._transport.send_event)
+        message_logger.log("Sending message to Hub...")
+        span = self._start_span("client.send_event", message)
+        send_event_async = async_adapter.emulate_async(
+            tracing.bind(span, self._transport.send_event)
+        )
 
-        def sync_callback():
-            logger.info("Successfully sent message to Hub")
+        def sync_callback(error=None):
+            if not error:
+                message_logger.log("Successfully sent message to Hub")
+            if span:
+                span.end(error=error)
 
         callback = async_adapter.AwaitableCallback(sync_callback)
 
         await send_event_async(message, callback=callback)
         await callback.completion()
 
+    async def send_event_from_template(self, template, payload):
+        """Sends a payload with the properties of a message template.
+
+        If the connection to the service has not previously been opened by a call to connect, this
+        function will open the connection before sending the event.
+
+        :param template: The MessageTemplate created by create_message_template.
+        :param payload: The payload to send, as bytes or a string.
+        """
+        span = self._start_span("client.send_event_from_template")
+        send_async = async_adapter.emulate_async(
+            tracing.bind(span, self._transport.send_event_from_template)
+        )
+
+        def sync_callback():
+            if span:
+                span.end()
+
+        callback = async_adapter.AwaitableCallback(sync_callback)
+
+        await send_async(template, payload, callback=callback)
+        await callback.completion()
+
     async def receive_method_request(self, method_name=None):
         """Receive a method request via the Azure IoT Hub or Azure IoT Edge Hub.
 
@@ -127,9 +165,9 @@ class GenericClient(AbstractClient):
 
         method_inbox = self._inbox_manager.get_method_request_inbox(method_name)
 
-        logger.info("Waiting for method request...")
+        message_logger.log("Waiting for method request...")
         method_request = await method_inbox.get()
-        logger.info("Received method request")
+        message_logger.log("Received method request")
         return method_request
 
     async def send_method_response(self, method_request, payload, status):
@@ -140,13 +178,13 @@ class GenericClient(AbstractClient):
         :param payload: The desired payload for the method response.
         :param int status: The desired return status code for the method response.
         """
-        logger.info("Sending method response to Hub...")
+        message_logger.log("Sending method response to Hub...")
         send_method_response_async = async_adapter.emulate_async(
             self._transport.send_method_response
         )
 
         def sync_callback():
-            logger.info("Successfully sent method response to Hub")
+            message_logger.log("Successfully sent method response to Hub")
 
         callback = async_adapter.AwaitableCallback(sync_callback)
 
@@ -160,11 +198,11 @@ class GenericClient(AbstractClient):
         :param feature_name: The name of the feature to enable.
         See azure.iot.hub.devicesdk.transport.constant for possible values.
         """
-        logger.info("Enabling feature:" + feature_name + "...")
+        logger.info("Enabling feature: %s...", feature_name)
         enable_feature_async = async_adapter.emulate_async(self._transport.enable_feature)
 
         def sync_callback():
-            logger.info("Successfully enabled feature:" + feature_name)
+            logger.info("Successfully enabled feature: %s", feature_name)
 
         callback = async_adapter.AwaitableCallback(sync_callback)
 
@@ -192,11 +230,29 @@ class DeviceClient(GenericClient, AbstractDeviceClient):
             await self._enable_feature(constant.C2D_MSG)
         c2d_inbox = self._inbox_manager.get_c2d_message_inbox()
 
-        logger.info("Waiting for C2D message...")
+        message_logger.log("Waiting for C2D message...")
         message = await c2d_inbox.get()
-        logger.info("C2D message received")
+        message_logger.log("C2D message received")
         return message
 
+    async def subscribe_to_c2d_messages(self, maxsize=DEFAULT_SUBSCRIBER_INBOX_SIZE):
+        """Subscribe to every C2D message sent from the Azure IoT Hub.
+
+        Every C2D message is delivered to every subscriber, as well as to receive_c2d_message.
+        Each subscriber has its own inbox, which discards its oldest message when full so that a
+        slow subscriber does not hold up the others. The same Message object is delivered to
+        every consumer, so it must be treated as read-only.
+
+        :param int maxsize: The maximum number of messages held for this subscriber. Default 1000.
+        :returns: An inbox receiving every C2D message. Messages are awaited with get, and it is
+        removed with unsubscribe.
+        """
+        # Subscribe before enabling the feature, so that no message is missed
+        inbox = self._inbox_manager.subscribe_to_c2d_messages(maxsize=maxsize)
+        if not self._transport.feature_enabled[constant.C2D_MSG]:
+            await self._enable_feature(constant.C2D_MSG)
+        return inbox
+
 
 class ModuleClient(GenericClient, AbstractModuleClient):
     """An asynchronous module client that connects to an Azure IoT Hub or Azure IoT Edge instance.
@@ -221,17 +277,25 @@ class ModuleClient(GenericClient, AbstractModuleClient):
         :param message: message to send to the given output. Anything passed that is not an instance of the
         Message class will be converted to Message object.
         :param output_name: Name of the output to send the event to.
+
+        :raises: MessageExpiredError if the expiry time of the message passed before it was sent.
         """
         if not isinstance(message, Message):
             message = Message(message)
 
         message.output_name = output_name
 
-        logger.info("Sending message to output:" + output_name + "...")
-        send_output_event_async = async_adapter.emulate_async(self._transport.send_output_event)
+        message_logger.log("Sending message to output: %s...", output_name)
+        span = self._start_span("client.send_to_output", message)
+        send_output_event_async = async_adapter.emulate_async(
+            tracing.bind(span, self._transport.send_output_event)
+        )
 
-        def sync_callback():
-            logger.info("Successfully sent message to output: " + output_name)
+        def sync_callback(error=None):
+            if not error:
+                message_logger.log("Successfully sent message to output: %s", output_name)
+            if span:
+                span.end(error=error)
 
         callback = async_adapter.AwaitableCallback(sync_callback)
 
@@ -246,11 +310,32 @@ class ModuleClient(GenericClient, AbstractModuleClient):
         :param str input_name: The input name to receive a message on.
         :returns: Message that was sent to the specified input.
         """
+        # Create the inbox before subscribing, so that messages which arrive as soon as the
+        # subscription completes are not dropped for want of an inbox
+        inbox = self._inbox_manager.get_input_message_inbox(input_name)
         if not self._transport.feature_enabled[constant.INPUT_MSG]:
             await self._enable_feature(constant.INPUT_MSG)
-        inbox = self._inbox_manager.get_input_message_inbox(input_name)
 
-        logger.info("Waiting for input message on: " + input_name + "...")
+        message_logger.log("Waiting for input message on: %s...", input_name)
         message = await inbox.get()
-        logger.info("Input message received on: " + input_name)
+        message_logger.log("Input message received on: %s", input_name)
         return message
+
+    async def subscribe_to_input_messages(self, input_name, maxsize=DEFAULT_SUBSCRIBER_INBOX_SIZE):
+        """Subscribe to every message sent from another Module to a specific input.
+
+        Every message on the input is delivered to every subscriber, as well as to
+        receive_input_message. Each subscriber has its own inbox, which discards its oldest message
+        when full so that a slow subscriber does not hold up the others. The same Message object is
+        delivered to every consumer, so it must be treated as read-only.
+
+        :param str input_name: The input name to subscribe to.
+        :param int maxsize: The maximum number of messages held for this subscriber. Default 1000.
+        :returns: An inbox receiving every message on the input. Messages are awaited with get,
+        and it is removed with unsubscribe.
+        """
+        # Subscribe before enabling the feature, so that no message is missed
+        inbox = self._inbox_manager.subscribe_to_input_messages(input_name, maxsize=maxsize)
+        if not self._transport.feature_enabled[constant.INPUT_MSG]:
+            await self._enable_feature(constant.INPUT_MSG)
+        return inbox
@@ -0,0 +1,62 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a dispatcher which runs a transport's callbacks on an asyncio event loop."""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncioDispatcher(object):
+    """Runs callbacks on an asyncio event loop, in the order they were dispatched.
+
+    Callbacks run on the loop's thread, between the application's coroutines, so they must not
+    block. In particular, inboxes with a maximum size must not be used, as putting a message into a
+    full inbox would block the loop.
+    """
+
+    def __init__(self, loop):
+        """Initializer for AsyncioDispatcher.
+
+        :param loop: The event loop to run callbacks on.
+        """
+        self._loop = loop
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """The number of callbacks waiting to run."""
+        return self._pending
+
+    def dispatch(self, key, function, *args):
+        """Schedule a function to run on the event loop.
+
+        :param key: Identifies the work which must run in order. Ignored, as all work runs in order.
+        :param function: The function to run. Exceptions it raises are logged.
+        :param args: The arguments to call it with.
+        :raises: RuntimeError if the event loop has been closed.
+        """
+        with self._lock:
+            self._pending += 1
+        try:
+            self._loop.call_soon_threadsafe(self._run, function, args)
+        except RuntimeError:
+            with self._lock:
+                self._pending -= 1
+            raise
+
+    def shutdown(self, wait=True):
+        """Does nothing, as the event loop belongs to the application."""
+
+    def _run(self, function, args):
+        with self._lock:
+            self._pending -= 1
+        try:
+            function(*args)
+        except Exception:
+            logger.exception("Unhandled exception in dispatched callback %s", function)
@@ -15,9 +15,19 @@ class AsyncClientInbox(AbstractInbox):
     All methods implemented in this class are threadsafe.
     """
 
-    def __init__(self):
-        """Initializer for AsyncClientInbox."""
-        self._queue = janus.Queue()
+    def __init__(self, maxsize=0, latency_recorder=None, tracer=None):
+        """Initializer for AsyncClientInbox.
+
+        :param int maxsize: Optionally provide the maximum number of items the inbox can hold.
+        Default 0, meaning the inbox is unbounded.
+        :param latency_recorder: Optional LatencyRecorder which records the time each item waits in
+        the inbox.
+        :param tracer: Optional Tracer which traces the time each item waits in the inbox, as a
+        child of the span active when the item was put in it.
+        """
+        self._latency_recorder = latency_recorder
+        self._tracer = tracer
+        self._queue = janus.Queue(maxsize=maxsize)
 
     def _put(self, item):
         """Put an item into the Inbox.
@@ -27,8 +37,31 @@ class AsyncClientInbox(AbstractInbox):
 
         :param item: The item to be put in the Inbox.
         """
+        item = self._wrap_item(item)
         self._queue.sync_q.put(item)
 
+    def _put_discarding_oldest(self, item):
+        """Put an item into the Inbox without blocking.
+
+        If the Inbox is full, the oldest item is discarded to make room for the new one.
+        Only to be used by the InboxManager.
+
+        :param item: The item to be put in the Inbox.
+        :returns: Boolean indicating if an item was discarded.
+        """
+        item = self._wrap_item(item)
+        discarded = False
+        while True:
+            try:
+                self._queue.sync_q.put_nowait(item)
+                return discarded
+            except janus.SyncQueueFull:
+                try:
+                    self._queue.sync_q.get_nowait()
+                    discarded = True
+                except janus.SyncQueueEmpty:
+                    pass
+
     async def get(self):
         """Remove and return an item from the Inbox.
 
@@ -36,7 +69,8 @@ class AsyncClientInbox(AbstractInbox):
 
         :returns: An item from the Inbox.
         """
-        return await self._queue.async_q.get()
+        item = await self._queue.async_q.get()
+        return self._unwrap_item(item)
 
     def empty(self):
         """Returns True if the inbox is empty, False otherwise
@@ -45,6 +79,13 @@ class AsyncClientInbox(AbstractInbox):
         """
         return self._queue.async_q.empty()
 
+    def qsize(self):
+        """Returns the approximate number of items in the inbox
+
+        :returns: The number of items in the inbox
+        """
+        return self._queue.sync_q.qsize()
+
     def clear(self):
         """Remove all items from the inbox.
         """
@@ -5,13 +5,12 @@
 # --------------------------------------------------------------------------
 """This module provides a base class for renewable token authentication providers"""
 
-import time
 import abc
 import logging
 import math
-from threading import Timer
 import six.moves.urllib as urllib
 from .authentication_provider import AuthenticationProvider
+from azure.iot.hub.devicesdk.common.clock import SYSTEM_CLOCK
 
 logger = logging.getLogger(__name__)
 
@@ -35,6 +34,10 @@ class BaseRenewableTokenAuthenticationProvider(AuthenticationProvider):
     which is expected to be provided by derived objects.  This base also
     implements the functionality necessary for timing and executing the
     token renewal operation.
+
+    Time is read from, and renewals are scheduled on, the clock attribute, which is the system
+    clock unless it is replaced before the first token is generated, for example with a
+    SimulatedClock to run many renewals in moments.
     """
 
     def __init__(self, hostname, device_id, module_id=None):
@@ -53,6 +56,7 @@ class BaseRenewableTokenAuthenticationProvider(AuthenticationProvider):
         AuthenticationProvider.__init__(self, hostname, device_id, module_id)
         self.token_validity_period = DEFAULT_TOKEN_VALIDITY_PERIOD
         self.token_renewal_margin = DEFAULT_TOKEN_RENEWAL_MARGIN
+        self.clock = SYSTEM_CLOCK
         self._token_update_timer = None
         self.shared_access_key_name = None
         self.sas_token_str = None
@@ -114,7 +118,7 @@ class BaseRenewableTokenAuthenticationProvider(AuthenticationProvider):
             self.module_id,
             self.token_validity_period,
         )
-        expiry = int(math.floor(time.time()) + self.token_validity_period)
+        expiry = int(math.floor(self.clock.time()) + self.token_validity_period)
         resource_uri = self.hostname + "/devices/" + self.device_id
         if self.module_id:
             resource_uri += "/modules/" + self.module_id
@@ -160,8 +164,7 @@ class BaseRenewableTokenAuthenticationProvider(AuthenticationProvider):
             logger.info("Timed SAS update for (%s,%s)", self.device_id, self.module_id)
             self.generate_new_sas_token()
 
-        self._token_update_timer = Timer(seconds_until_update, timerfunc)
-        self._token_update_timer.start()
+        self._token_update_timer = self.clock.call_later(seconds_until_update, timerfunc)
 
     def _notify_token_updated(self):
         """Notify clients that the SAS token has been updated by calling self.on_sas_token_updated.
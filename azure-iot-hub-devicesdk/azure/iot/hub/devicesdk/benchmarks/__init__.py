@@ -0,0 +1,10 @@
+"""Azure IoT Hub Device SDK Benchmarks
+
+This package provides runnable benchmarks for measuring the performance of the Azure IoT Hub
+Device SDK. Each module can be run directly, for example:
+
+    python -m azure.iot.hub.devicesdk.benchmarks.message_memory
+
+The benchmarks require Python 3.6+.
+INTERNAL USAGE ONLY
+"""
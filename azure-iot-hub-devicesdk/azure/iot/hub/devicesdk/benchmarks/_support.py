@@ -0,0 +1,109 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains helpers shared by the benchmarks which drive clients over a socket.
+"""
+
+import os
+import platform
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+LATENCY_PERCENTILES = (50, 99, 99.9)
+
+
+def latency_percentiles(samples):
+    """Summarize latency samples as nearest-rank percentiles in milliseconds.
+
+    :param samples: A list of latencies in seconds.
+    :returns: A dictionary with p50, p99 and p999 keys, with None values if there are no samples.
+    """
+    ordered = sorted(samples)
+    summary = {}
+    for percentile in LATENCY_PERCENTILES:
+        key = "p" + str(percentile).replace(".", "")
+        if ordered:
+            index = int(round(percentile / 100.0 * (len(ordered) - 1)))
+            summary[key] = round(ordered[index] * 1000, 3)
+        else:
+            summary[key] = None
+    return summary
+
+
+def rss_bytes():
+    """Return the resident set size of this process in bytes, or None if it is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        pass
+    if resource:
+        # ru_maxrss is the peak rather than the current size, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+
+def open_fds():
+    """Return the number of file descriptors open in this process, or None if it is unavailable."""
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except (IOError, OSError):
+        return None
+
+
+def slope(samples):
+    """Fit a line to (x, y) samples by least squares.
+
+    :returns: The slope, or None if there are fewer than two distinct x values.
+    """
+    n = len(samples)
+    if n < 2:
+        return None
+    mean_x = sum(x for x, _ in samples) / float(n)
+    mean_y = sum(y for _, y in samples) / float(n)
+    variance = sum((x - mean_x) ** 2 for x, _ in samples)
+    if not variance:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in samples) / variance
+
+
+def rss_mb():
+    """Return the resident set size of this process in MiB, rounded, or None."""
+    rss = rss_bytes()
+    return round(rss / (1024.0 * 1024), 1) if rss is not None else None
+
+
+def environment():
+    """Describe the environment the benchmark ran in, so results can be compared across runs."""
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def report(benchmark, parameters, results):
+    """Build the JSON document written by a benchmark.
+
+    :param str benchmark: The name of the benchmark.
+    :param dict parameters: The parameters the benchmark ran with.
+    :param list results: The result dictionaries.
+    :returns: A dictionary ready to be serialized as JSON.
+    """
+    return {
+        "benchmark": benchmark,
+        "environment": environment(),
+        "parameters": parameters,
+        "results": results,
+    }
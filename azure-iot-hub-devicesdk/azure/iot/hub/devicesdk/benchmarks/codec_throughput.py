@@ -0,0 +1,110 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a benchmark measuring the encode and decode throughput of each
+payload codec that is available in the current environment.
+
+Usage:
+    python -m azure.iot.hub.devicesdk.benchmarks.codec_throughput [--duration SECONDS]
+"""
+
+import argparse
+import json
+import timeit
+from azure.iot.hub.devicesdk.common.payload_codecs import JsonCodec, available_codecs
+
+
+def make_payloads():
+    """Create representative telemetry payloads of increasing size.
+
+    :returns: A dictionary mapping payload names to payload objects.
+    """
+    small = {"deviceId": "sensor-0001", "temperature": 21.5, "humidity": 40.2}
+    medium = {
+        "deviceId": "sensor-0001",
+        "timestamp": "2019-01-01T00:00:00Z",
+        "readings": [{"sensor": "t" + str(i), "value": i * 1.5, "ok": True} for i in range(20)],
+    }
+    large = {
+        "deviceId": "sensor-0001",
+        "samples": [[i, i * 0.25, "status-" + str(i % 7)] for i in range(1000)],
+    }
+    return {"small": small, "medium": medium, "large": large}
+
+
+def _ops_per_second(fn, duration):
+    """Run fn repeatedly for roughly duration seconds and return the rate.
+
+    :param fn: A function taking no arguments.
+    :param float duration: The approximate number of seconds to run for.
+    :returns: Calls per second.
+    """
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    repeats = max(1, int(duration / max(elapsed, 1e-9)))
+    elapsed = timer.timeit(number * repeats)
+    return number * repeats / elapsed
+
+
+def run(duration):
+    """Measure encode and decode throughput for each codec and payload.
+
+    :param float duration: The approximate number of seconds to spend on each measurement.
+    :returns: A list of result dictionaries.
+    """
+    codecs = available_codecs()
+    if type(codecs[0]) is not JsonCodec:
+        # Always include the standard library codec as the reference point
+        codecs.insert(0, JsonCodec())
+
+    results = []
+    for payload_name, payload in sorted(make_payloads().items()):
+        for codec in codecs:
+            encoded = codec.encode(payload)
+            encode_rate = _ops_per_second(lambda: codec.encode(payload), duration)
+            decode_rate = _ops_per_second(lambda: codec.decode(encoded), duration)
+            results.append(
+                {
+                    "codec": type(codec).__name__,
+                    "content_type": codec.content_type,
+                    "payload": payload_name,
+                    "encoded_bytes": len(encoded),
+                    "encode_per_sec": round(encode_rate),
+                    "decode_per_sec": round(decode_rate),
+                    "encode_mb_per_sec": round(encode_rate * len(encoded) / 1e6, 2),
+                }
+            )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure payload codec throughput")
+    parser.add_argument(
+        "--duration", type=float, default=0.5, help="seconds to spend on each measurement"
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.duration)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        row = "{:<14} {:<8} {:>10} {:>14} {:>14} {:>10}"
+        print(row.format("codec", "payload", "bytes", "encode/s", "decode/s", "enc MB/s"))
+        for r in results:
+            print(
+                row.format(
+                    r["codec"],
+                    r["payload"],
+                    r["encoded_bytes"],
+                    r["encode_per_sec"],
+                    r["decode_per_sec"],
+                    r["encode_mb_per_sec"],
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a benchmark reporting the bytes saved and the CPU cost of payload
+compression for representative JSON telemetry.
+
+Usage:
+    python -m azure.iot.hub.devicesdk.benchmarks.compression [--count N]
+"""
+
+import argparse
+import json
+import random
+import time
+from azure.iot.hub.devicesdk.transport.compression import PayloadCompressor
+
+# A preset dictionary containing the content that is common to every telemetry message.
+TELEMETRY_ZDICT = (
+    b'{"deviceId":"sensor-","timestamp":"2019-01-01T00:00:00Z","temperature":'
+    b'"humidity":"pressure":"status":"nominal","readings":[{"sensor":"value":}]}'
+)
+
+
+def make_payloads(count, readings, seed=0):
+    """Create JSON telemetry payloads with realistic repetition and varying values.
+
+    :param int count: The number of payloads to create.
+    :param int readings: The number of readings in each payload.
+    :param int seed: Seed for the random values, so that runs are comparable.
+    :returns: A list of payloads as bytes.
+    """
+    rng = random.Random(seed)
+    payloads = []
+    for i in range(count):
+        body = {
+            "deviceId": "sensor-" + str(i % 100),
+            "timestamp": "2019-01-01T00:00:{:02d}Z".format(i % 60),
+            "temperature": round(rng.uniform(15, 30), 2),
+            "humidity": round(rng.uniform(30, 60), 2),
+            "status": "nominal",
+        }
+        if readings:
+            body["readings"] = [
+                {"sensor": "s" + str(r), "value": round(rng.uniform(0, 100), 3)}
+                for r in range(readings)
+            ]
+        payloads.append(json.dumps(body, separators=(",", ":")).encode("utf-8"))
+    return payloads
+
+
+def measure(compressor, payloads):
+    """Compress each payload and measure the size reduction and CPU time.
+
+    :param compressor: The PayloadCompressor to measure.
+    :param payloads: A list of payloads as bytes.
+    :returns: A result dictionary.
+    """
+    original_bytes = 0
+    sent_bytes = 0
+    compressed_count = 0
+    start = time.process_time()
+    for payload in payloads:
+        result, encoding = compressor.compress(payload)
+        original_bytes += len(payload)
+        sent_bytes += len(result)
+        if encoding:
+            compressed_count += 1
+    compress_cpu = time.process_time() - start
+
+    return {
+        "messages": len(payloads),
+        "compressed_messages": compressed_count,
+        "original_bytes_per_msg": round(float(original_bytes) / len(payloads), 1),
+        "sent_bytes_per_msg": round(float(sent_bytes) / len(payloads), 1),
+        "saved_percent": round(100.0 * (original_bytes - sent_bytes) / original_bytes, 1),
+        "cpu_us_per_msg": round(compress_cpu * 1e6 / len(payloads), 2),
+    }
+
+
+def run(count):
+    """Run the benchmark for small and large payloads with several compressor configurations.
+
+    :param int count: The number of payloads to compress for each measurement.
+    :returns: A list of result dictionaries.
+    """
+    configurations = [
+        ("gzip", PayloadCompressor("gzip", threshold=0)),
+        ("deflate", PayloadCompressor("deflate", threshold=0)),
+        ("deflate+zdict", PayloadCompressor("deflate", threshold=0, zdict=TELEMETRY_ZDICT)),
+        ("deflate>=1KiB", PayloadCompressor("deflate", threshold=1024)),
+    ]
+    results = []
+    for payload_name, readings in (("small", 0), ("large", 50)):
+        payloads = make_payloads(count, readings)
+        for name, compressor in configurations:
+            result = measure(compressor, payloads)
+            result["payload"] = payload_name
+            result["compressor"] = name
+            results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure payload compression savings and cost")
+    parser.add_argument("--count", type=int, default=10000, help="payloads per measurement")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.count)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        row = "{:<8} {:<14} {:>12} {:>12} {:>8} {:>12}"
+        print(row.format("payload", "compressor", "bytes/msg", "sent/msg", "saved", "cpu us/msg"))
+        for r in results:
+            print(
+                row.format(
+                    r["payload"],
+                    r["compressor"],
+                    r["original_bytes_per_msg"],
+                    r["sent_bytes_per_msg"],
+                    str(r["saved_percent"]) + "%",
+                    r["cpu_us_per_msg"],
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a benchmark of the transport's callback dispatchers under slow consumers.
+
+A module transport runs against a LoopbackMqttClient which leaves each PUBLISH unacknowledged until
+a thread standing in for paho's network thread acknowledges it. Each turn of the network thread's loop
+processes the PUBACKs waiting for it, then receives the next input message if one is due at the
+offered rate, spreading messages over a number of inputs. The consumer of every input does a fixed
+amount of blocking work per message, and checks that messages reach it in the order they were
+received. Meanwhile a sender thread sends telemetry one message at a time, waiting for each
+completion, as the sync client does.
+
+Each dispatcher is run in turn:
+    inline   no dispatcher, so consumers run on the network thread
+    thread   a ThreadDispatcher, one ordered worker thread
+    pool     a PoolDispatcher, which runs different inputs in parallel
+    asyncio  an AsyncioDispatcher, running callbacks on an event loop in another thread
+
+and reports:
+    sends_per_second      telemetry messages completed per second
+    send_latency_ms       time from send_event to its completion callback
+    consumed_per_second   input messages consumed per second
+    receive_latency_ms    time from the network thread receiving a message to its consumer
+    max_stall_ms          the longest turn of the network thread's loop, during which no packets
+                          are read or acknowledged
+    max_backlog           the most callbacks seen waiting in the dispatcher
+    order_violations      messages which reached their consumer out of order
+
+Usage:
+    python -m azure.iot.hub.devicesdk.benchmarks.dispatch [--dispatchers inline thread ...]
+        [--duration SECONDS] [--rate MESSAGES_PER_SECOND] [--inputs N] [--consumer-delay SECONDS]
+        [--workers N] [--check] [--json]
+
+With --check, the exit status is 1 if any message is lost or reaches its consumer out of order.
+"""
+
+import argparse
+import asyncio
+import json
+import struct
+import sys
+import threading
+import time
+from azure.iot.hub.devicesdk.aio import AsyncioDispatcher
+from azure.iot.hub.devicesdk.common import Message
+from azure.iot.hub.devicesdk.transport.dispatch import ThreadDispatcher, PoolDispatcher
+from azure.iot.hub.devicesdk.transport.mqtt.mqtt_transport import MQTTTransport
+from azure.iot.hub.devicesdk.auth.authentication_provider_factory import from_connection_string
+from azure.iot.hub.devicesdk.testing.loopback import LoopbackMqttClient
+from . import _support
+
+DISPATCHERS = ("inline", "thread", "pool", "asyncio")
+DEFAULT_DURATION = 2.0
+DEFAULT_RATE = 2000
+DEFAULT_INPUTS = 4
+DEFAULT_CONSUMER_DELAY = 0.001
+DEFAULT_WORKERS = 4
+# Seconds given to the consumers to drain their backlog once the network thread stops
+DRAIN_TIMEOUT = 60
+
+_DEVICE_ID = "dispatch-device"
+_MODULE_ID = "dispatch-module"
+_CONNECTION_STRING = (
+    "HostName=dispatch-hub.azure-devices.net;DeviceId={};ModuleId={};"
+    "SharedAccessKey=Zm9vYmFyYmF6cXV4Zm9vYmFyYmF6cXV4Zm9vYmFyYmF6cXV4".format(
+        _DEVICE_ID, _MODULE_ID
+    )
+)
+_INPUT_TOPIC = "devices/{}/modules/{}/inputs/{{}}/%24.mid={{}}".format(_DEVICE_ID, _MODULE_ID)
+# Each input payload holds its sequence number on its input and the time it was received
+_STAMP = struct.Struct(">Qd")
+_TELEMETRY = b'{"temperature": 21.5}'
+
+
+class _Consumers(object):
+    """Consumes input messages slowly, recording their latency and checking their order."""
+
+    def __init__(self, inputs, delay):
+        self.delay = delay
+        self.next_sequence = {name: 0 for name in inputs}
+        self.latencies = []
+        self.order_violations = 0
+        self.consumed = 0
+        self._lock = threading.Lock()
+
+    def consume(self, input_name, message):
+        sequence, received = _STAMP.unpack(message.data)
+        started = time.perf_counter()
+        time.sleep(self.delay)
+        with self._lock:
+            if sequence != self.next_sequence[input_name]:
+                self.order_violations += 1
+            self.next_sequence[input_name] = sequence + 1
+            self.latencies.append(started - received)
+            self.consumed += 1
+
+
+class _Network(object):
+    """Stands in for paho's network thread."""
+
+    def __init__(self, loopback, dispatcher, inputs, rate):
+        self.loopback = loopback
+        self.dispatcher = dispatcher
+        self.inputs = inputs
+        self.rate = rate
+        self.received = 0
+        self.max_stall = 0.0
+        self.max_backlog = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="network")
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        loopback, inputs = self.loopback, self.inputs
+        sequences = [0] * len(inputs)
+        started = time.perf_counter()
+        turns = 0
+        while not self._stopped.is_set():
+            turn_started = time.perf_counter()
+            busy = loopback.acknowledge_publishes() > 0
+            if self.received < (turn_started - started) * self.rate:
+                index = self.received % len(inputs)
+                topic = _INPUT_TOPIC.format(inputs[index], self.received).encode("utf-8")
+                payload = _STAMP.pack(sequences[index], time.perf_counter())
+                sequences[index] += 1
+                loopback.deliver(topic, payload)
+                self.received += 1
+                busy = True
+            self.max_stall = max(self.max_stall, time.perf_counter() - turn_started)
+            turns += 1
+            if self.dispatcher and turns % 64 == 0:
+                self.max_backlog = max(self.max_backlog, self.dispatcher.pending)
+            if not busy:
+                time.sleep(0.0001)
+
+
+class _Sender(object):
+    """Sends telemetry one message at a time, waiting for each to complete."""
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.latencies = []
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sender")
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        completed = threading.Event()
+        while not self._stopped.is_set():
+            completed.clear()
+            started = time.perf_counter()
+            self.transport.send_event(Message(_TELEMETRY), completed.set)
+            if not completed.wait(DRAIN_TIMEOUT):
+                return
+            self.latencies.append(time.perf_counter() - started)
+
+
+def _create_dispatcher(name, workers):
+    """Create a dispatcher, and a function which stops it once its callbacks have run."""
+    if name == "inline":
+        return None, lambda: None
+    if name == "thread":
+        dispatcher = ThreadDispatcher()
+        return dispatcher, dispatcher.shutdown
+    if name == "pool":
+        dispatcher = PoolDispatcher(workers=workers)
+        return dispatcher, dispatcher.shutdown
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="asyncio")
+    thread.start()
+
+    def stop():
+        # Callbacks scheduled before this run before the loop stops
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    return AsyncioDispatcher(loop), stop
+
+
+def measure(
+    dispatcher_name,
+    duration=DEFAULT_DURATION,
+    rate=DEFAULT_RATE,
+    inputs=DEFAULT_INPUTS,
+    consumer_delay=DEFAULT_CONSUMER_DELAY,
+    workers=DEFAULT_WORKERS,
+):
+    """Run the sender, the network thread and slow consumers with one dispatcher.
+
+    :param str dispatcher_name: One of DISPATCHERS.
+    :param float duration: Seconds to run for.
+    :param float rate: Input messages received per second.
+    :param int inputs: The number of inputs messages are spread over.
+    :param float consumer_delay: Seconds of blocking work done by a consumer per message.
+    :param int workers: The number of workers of the pool dispatcher.
+    :returns: A result dictionary.
+    """
+    if dispatcher_name not in DISPATCHERS:
+        raise ValueError("Unknown dispatcher: {}".format(dispatcher_name))
+    input_names = ["input-{}".format(index) for index in range(inputs)]
+    dispatcher, stop_dispatcher = _create_dispatcher(dispatcher_name, workers)
+    transport = MQTTTransport(from_connection_string(_CONNECTION_STRING), dispatcher=dispatcher)
+    provider = transport._mqtt_provider
+    loopback = provider._mqtt_client = LoopbackMqttClient(provider._mqtt_client, acknowledge=False)
+    consumers = _Consumers(input_names, consumer_delay)
+    transport.on_transport_input_message_received = consumers.consume
+    connected = threading.Event()
+    transport.connect(callback=connected.set)
+    connected.wait(DRAIN_TIMEOUT)
+
+    network = _Network(loopback, dispatcher, input_names, rate)
+    sender = _Sender(transport)
+    started = time.perf_counter()
+    network.start()
+    sender.start()
+    time.sleep(duration)
+    # Stop the sender while the network thread is still acknowledging its last message
+    sender.stop()
+    network.stop()
+    elapsed = time.perf_counter() - started
+
+    deadline = time.perf_counter() + DRAIN_TIMEOUT
+    while consumers.consumed < network.received and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    drained = time.perf_counter() - started
+    disconnected = threading.Event()
+    transport.disconnect(callback=disconnected.set)
+    disconnected.wait(DRAIN_TIMEOUT)
+    stop_dispatcher()
+
+    return {
+        "dispatcher": dispatcher_name,
+        "duration": duration,
+        "rate": rate,
+        "inputs": inputs,
+        "consumer_delay": consumer_delay,
+        "sent": len(sender.latencies),
+        "sends_per_second": round(len(sender.latencies) / elapsed, 1),
+        "send_latency_ms": _support.latency_percentiles(sender.latencies),
+        "received": network.received,
+        "consumed": consumers.consumed,
+        "consumed_per_second": round(consumers.consumed / drained, 1),
+        "receive_latency_ms": _support.latency_percentiles(consumers.latencies),
+        "max_stall_ms": round(network.max_stall * 1000, 3),
+        "max_backlog": network.max_backlog,
+        "order_violations": consumers.order_violations,
+    }
+
+
+def check(result):
+    """Find the problems in a result.
+
+    :param dict result: A result returned by measure. A "failures" key is added to it.
+    :returns: A list of descriptions of the problems found, which is empty if there are none.
+    """
+    failures = []
+    if result["consumed"] < result["received"]:
+        failures.append("{} received, {} consumed".format(result["received"], result["consumed"]))
+    if result["order_violations"]:
+        failures.append("{} messages out of order".format(result["order_violations"]))
+    result["failures"] = failures
+    return failures
+
+
+def run(
+    dispatchers=DISPATCHERS,
+    duration=DEFAULT_DURATION,
+    rate=DEFAULT_RATE,
+    inputs=DEFAULT_INPUTS,
+    consumer_delay=DEFAULT_CONSUMER_DELAY,
+    workers=DEFAULT_WORKERS,
+):
+    """Measure and check each dispatcher.
+
+    :returns: A list of result dictionaries.
+    """
+    results = []
+    for name in dispatchers:
+        result = measure(name, duration, rate, inputs, consumer_delay, workers)
+        check(result)
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark callback dispatchers")
+    parser.add_argument("--dispatchers", nargs="+", choices=DISPATCHERS, default=list(DISPATCHERS))
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION)
+    parser.add_argument(
+        "--rate", type=float, default=DEFAULT_RATE, help="input messages received per second"
+    )
+    parser.add_argument("--inputs", type=int, default=DEFAULT_INPUTS)
+    parser.add_argument(
+        "--consumer-delay",
+        type=float,
+        default=DEFAULT_CONSUMER_DELAY,
+        help="seconds of work per consumed message",
+    )
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="pool workers")
+    parser.add_argument("--check", action="store_true", help="exit with 1 if a check fails")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(
+        args.dispatchers, args.duration, args.rate, args.inputs, args.consumer_delay, args.workers
+    )
+    if args.json:
+        parameters = {k: v for k, v in vars(args).items() if k != "json"}
+        print(json.dumps(_support.report("dispatch", parameters, results), indent=2))
+    else:
+        for r in results:
+            print(
+                "{:>8}: {} sends/s, {} consumed/s of {} received, max stall {} ms, max backlog {}, "
+                "{} out of order".format(
+                    r["dispatcher"],
+                    r["sends_per_second"],
+                    r["consumed_per_second"],
+                    r["received"],
+                    r["max_stall_ms"],
+                    r["max_backlog"],
+                    r["order_violations"],
+                )
+            )
+            print("          send latency ms: {}".format(r["send_latency_ms"]))
+            print("          receive latency ms: {}".format(r["receive_latency_ms"]))
+            for failure in r["failures"]:
+                print("  FAILED: " + failure)
+
+    if args.check and any(r["failures"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains microbenchmarks of the functions which run once per message or once per
+SAS token, and compares them with a stored baseline so that regressions are visible.
+
+Timings depend on the machine, so each case is also expressed relative to a fixed calibration
+workload measured in the same run. The relative cost is what is stored in the baseline and compared,
+which lets a baseline recorded on one machine be checked on another.
+
+Usage:
+    python -m azure.iot.hub.devicesdk.benchmarks.hot_paths [--cases NAME ...]
+        [--duration SECONDS] [--tolerance FRACTION] [--check] [--update-baseline] [--json]
+
+With --check, the exit status is 1 if any case is slower than its baseline by more than the
+tolerance. The baseline is installed with the package as hot_paths_baseline.json; without it, only
+--update-baseline can be run. The cases also run under pytest, in tests/benchmarks/test_hot_paths.py.
+"""
+
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+import timeit
+from azure.iot.common.connection_string import ConnectionString
+from azure.iot.common.sastoken import SasToken
+from azure.iot.hub.devicesdk.common import Message
+from azure.iot.hub.devicesdk.auth.sk_authentication_provider import (
+    SymmetricKeyAuthenticationProvider,
+)
+from azure.iot.hub.devicesdk.auth.sas_authentication_provider import (
+    SharedAccessSignatureAuthenticationProvider,
+)
+from azure.iot.hub.devicesdk.transport.mqtt.mqtt_transport import (
+    _encode_properties,
+    _extract_properties,
+    _is_c2d_topic,
+    _is_input_topic,
+)
+from . import _support
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hot_paths_baseline.json")
+DEFAULT_TOLERANCE = 0.5
+# Seconds per timed repeat. Many short repeats are kept so that the fastest is likely to be one
+# which was not disturbed by other processes.
+REPEAT_DURATION = 0.002
+
+_HOSTNAME = "bench-hub.azure-devices.net"
+_DEVICE_ID = "bench-device"
+_MODULE_ID = "bench-module"
+_SHARED_ACCESS_KEY = "Zm9vYmFyYmF6cXV4Zm9vYmFyYmF6cXV4Zm9vYmFyYmF6cXV4"
+_EVENTS_TOPIC = "devices/{}/messages/events/".format(_DEVICE_ID)
+
+
+def _make_message(property_count=0, key_format="property{}", value="value"):
+    message = Message(b"payload", message_id="message-id-0001", content_type="application/json")
+    for i in range(property_count):
+        message.custom_properties[key_format.format(i)] = value
+    return message
+
+
+# The messages whose properties are encoded and extracted. Unicode keys and large values take the
+# slower paths through URL quoting.
+_MESSAGES = collections.OrderedDict(
+    [
+        ("0_props", _make_message(0)),
+        ("10_props", _make_message(10)),
+        ("50_props", _make_message(50)),
+        ("10_unicode_keys", _make_message(10, key_format=u"température-{}-ключ")),
+        ("large_value", _make_message(1, value="v" * 4096)),
+    ]
+)
+
+
+def _encode_case(message):
+    return lambda: _encode_properties(message, _EVENTS_TOPIC)
+
+
+def _extract_case(message):
+    properties = _encode_properties(message, _EVENTS_TOPIC)[len(_EVENTS_TOPIC) :]
+    return lambda: _extract_properties(properties, Message(b"payload"))
+
+
+def _topic_case(check, topic):
+    # The transport passes the whole topic string, despite the parameter name
+    return lambda: check(topic)
+
+
+def _sign_case():
+    auth_provider = SymmetricKeyAuthenticationProvider(
+        _HOSTNAME, _DEVICE_ID, None, _SHARED_ACCESS_KEY
+    )
+    uri = "{}%2Fdevices%2F{}".format(_HOSTNAME, _DEVICE_ID)
+    expiry = int(time.time()) + 3600
+    return lambda: auth_provider._sign(uri, expiry)
+
+
+def _build_token_case():
+    token = SasToken("{}/devices/{}".format(_HOSTNAME, _DEVICE_ID), _SHARED_ACCESS_KEY)
+    return token._build_token
+
+
+def _connection_string_case(connection_string):
+    return lambda: ConnectionString(connection_string)
+
+
+def _sas_parse_case():
+    sas_token_str = str(SasToken("{}/devices/{}".format(_HOSTNAME, _DEVICE_ID), _SHARED_ACCESS_KEY))
+    return lambda: SharedAccessSignatureAuthenticationProvider.parse(sas_token_str)
+
+
+def _make_cases():
+    cases = collections.OrderedDict()
+    for name, message in _MESSAGES.items():
+        cases["encode_properties[{}]".format(name)] = _encode_case(message)
+    for name, message in _MESSAGES.items():
+        cases["extract_properties[{}]".format(name)] = _extract_case(message)
+
+    c2d_topic = "devices/{}/messages/devicebound/%24.to=%2Fdevices%2F{}".format(
+        _DEVICE_ID, _DEVICE_ID
+    )
+    input_topic = "devices/{}/modules/{}/inputs/input1/%24.to=x".format(_DEVICE_ID, _MODULE_ID)
+    cases["is_c2d_topic[c2d]"] = _topic_case(_is_c2d_topic, c2d_topic)
+    cases["is_c2d_topic[input]"] = _topic_case(_is_c2d_topic, input_topic)
+    cases["is_input_topic[input]"] = _topic_case(_is_input_topic, input_topic)
+    cases["is_input_topic[c2d]"] = _topic_case(_is_input_topic, c2d_topic)
+
+    cases["symmetric_key_sign"] = _sign_case()
+    cases["sas_token_build"] = _build_token_case()
+    cases["connection_string[device]"] = _connection_string_case(
+        "HostName={};DeviceId={};SharedAccessKey={}".format(
+            _HOSTNAME, _DEVICE_ID, _SHARED_ACCESS_KEY
+        )
+    )
+    cases["connection_string[module_gateway]"] = _connection_string_case(
+        "HostName={};DeviceId={};ModuleId={};SharedAccessKey={};GatewayHostName=gateway".format(
+            _HOSTNAME, _DEVICE_ID, _MODULE_ID, _SHARED_ACCESS_KEY
+        )
+    )
+    cases["sas_authentication_provider_parse"] = _sas_parse_case()
+    return cases
+
+
+CASES = _make_cases()
+
+
+_CALIBRATION_KEYS = ["key" + str(i) for i in range(32)]
+
+
+def _calibration():
+    """A fixed workload of dictionary and string operations, used as the unit of cost."""
+    d = {}
+    for key in _CALIBRATION_KEYS:
+        d[key] = key.upper()
+    return "&".join(d.values())
+
+
+def _ns_per_call(fn, duration):
+    """Time fn, keeping the fastest of many short repeats, which is the least disturbed by noise.
+
+    :param fn: A function taking no arguments.
+    :param float duration: The approximate total number of seconds to spend.
+    :returns: Nanoseconds per call.
+    """
+    timer = timeit.Timer(fn)
+    number = 1
+    while timer.timeit(number) < REPEAT_DURATION:
+        number *= 2
+    repeats = max(3, int(duration / REPEAT_DURATION))
+    return min(timer.repeat(repeats, number)) / number * 1e9
+
+
+def measure_calibration(duration=0.2):
+    """Measure the calibration workload.
+
+    :param float duration: The approximate number of seconds to spend.
+    :returns: Nanoseconds per run of the calibration workload.
+    """
+    return _ns_per_call(_calibration, duration)
+
+
+def measure(name, duration=0.2, calibration_ns=None):
+    """Measure one case.
+
+    :param str name: The name of a case in CASES.
+    :param float duration: The approximate number of seconds to spend.
+    :param float calibration_ns: The cost of the calibration workload, measured if not given.
+    :returns: A result dictionary with the cost per call in nanoseconds and relative to the
+    calibration workload.
+    """
+    if calibration_ns is None:
+        calibration_ns = measure_calibration(duration)
+    ns = _ns_per_call(CASES[name], duration)
+    return {"case": name, "ns_per_call": round(ns, 1), "relative": round(ns / calibration_ns, 4)}
+
+
+def load_baseline(path=None, required=True):
+    """Load the stored baseline.
+
+    :param str path: The path of the baseline file. Default BASELINE_PATH.
+    :param bool required: Whether a missing baseline is an error. Default True.
+    :returns: A dictionary mapping case names to relative costs, which is empty if there is no
+    baseline and it is not required.
+    :raises: IOError if there is no baseline and it is required.
+    """
+    path = path or BASELINE_PATH
+    try:
+        with open(path) as f:
+            return json.load(f)["cases"]
+    except (IOError, OSError):
+        if required:
+            raise IOError(
+                "No hot path baseline at {}. Record one with --update-baseline.".format(path)
+            )
+        return {}
+
+
+def write_baseline(results, path=None):
+    """Store results as the baseline, replacing the entries for the cases they cover.
+
+    :param list results: Result dictionaries returned by measure.
+    :param str path: The path of the baseline file. Default BASELINE_PATH.
+    """
+    path = path or BASELINE_PATH
+    cases = load_baseline(path, required=False)
+    cases.update((r["case"], r["relative"]) for r in results)
+    document = {"environment": _support.environment(), "cases": cases}
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(result, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compare a result with the baseline.
+
+    :param dict result: A result dictionary returned by measure. It is updated with the baseline
+    relative cost, the change from it, and whether that change is a regression.
+    :param dict baseline: The baseline returned by load_baseline.
+    :param float tolerance: The fraction by which a case may be slower than its baseline.
+    :returns: True if the case regressed.
+    """
+    expected = baseline.get(result["case"])
+    result["baseline"] = expected
+    result["change"] = round(result["relative"] / expected - 1, 3) if expected else None
+    result["regressed"] = bool(expected) and result["change"] > tolerance
+    return result["regressed"]
+
+
+def run(names=None, duration=0.2, tolerance=DEFAULT_TOLERANCE, baseline=None):
+    """Measure cases and compare them with the baseline.
+
+    :param names: The names of the cases to run. Default all of CASES.
+    :param float duration: The approximate number of seconds to spend on each case.
+    :param float tolerance: The fraction by which a case may be slower than its baseline.
+    :param dict baseline: The baseline to compare with. Default the stored baseline.
+    :returns: A list of result dictionaries.
+    """
+    if baseline is None:
+        baseline = load_baseline()
+    names = names or list(CASES)
+    # Calibrate before and after, keeping the faster, in case the machine was busy for either
+    calibration_ns = measure_calibration(duration)
+    results = [measure(name, duration, calibration_ns) for name in names]
+    final_calibration_ns = measure_calibration(duration)
+    if final_calibration_ns < calibration_ns:
+        for result in results:
+            result["relative"] = round(result["ns_per_call"] / final_calibration_ns, 4)
+    for result in results:
+        compare(result, baseline, tolerance)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmark the per-message hot paths")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--duration", type=float, default=0.2, help="seconds to spend per case")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="fraction by which a case may be slower than its baseline",
+    )
+    parser.add_argument("--check", action="store_true", help="exit with 1 on any regression")
+    parser.add_argument(
+        "--update-baseline", action="store_true", help="store these results as the baseline"
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        baseline = load_baseline(required=not args.update_baseline)
+    except IOError as e:
+        parser.error(str(e))
+    results = run(args.cases, args.duration, args.tolerance, baseline)
+    if args.update_baseline:
+        write_baseline(results)
+
+    if args.json:
+        parameters = {k: v for k, v in vars(args).items() if k != "json"}
+        print(json.dumps(_support.report("hot_paths", parameters, results), indent=2))
+    else:
+        row = "{:<40} {:>12} {:>10} {:>10} {:>8}"
+        print(row.format("case", "ns/call", "relative", "baseline", "change"))
+        for r in results:
+            change = "{:+.0%}".format(r["change"]) if r["change"] is not None else "-"
+            if r["regressed"]:
+                change += " !"
+            print(
+                row.format(r["case"], r["ns_per_call"], r["relative"], str(r["baseline"]), change)
+            )
+
+    if args.check and any(r["regressed"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a harness which looks for memory retained by long-running clients.
+
+A client runs many send and receive cycles against a LoopbackMqttClient, which stands in for the
+paho client so that millions of cycles take minutes. Each cycle sends a new message with
+send_event, delivers a C2D message to the MQTT provider, and reads it back with
+receive_c2d_message. The loopback acknowledges every publish before the call returns, so every send
+goes through the transport's handling of responses which arrive before their MID is known.
+
+Memory is traced with tracemalloc after a warmup, and sampled at intervals after a full garbage
+collection. The harness reports:
+    bytes_per_message         memory still allocated at the end, per cycle
+    steady_bytes_per_message  the growth per cycle over the second half of the samples, fitted by
+                              least squares, which excludes caches filling up early on
+    top_sites                 the lines which allocated the most memory still held at the end
+    samples                   the traced memory at each interval, to show the trend
+
+With consume disabled, received messages are left in the C2D inbox, which is unbounded, to show
+what accumulation looks like in the report.
+
+Usage:
+    python -m azure.iot.hub.devicesdk.benchmarks.leak_check [--client sync|async]
+        [--cycles N] [--warmup N] [--samples N] [--frames N] [--top N] [--no-consume]
+        [--threshold BYTES] [--check] [--json]
+
+With --check, the exit status is 1 if steady_bytes_per_message exceeds the threshold. The check
+also runs under pytest, in tests/benchmarks/test_leak_check.py.
+"""
+
+import argparse
+import array
+import asyncio
+import gc
+import json
+import linecache
+import sys
+import tracemalloc
+from azure.iot.hub.devicesdk import sync_clients
+from azure.iot.hub.devicesdk.aio import async_clients
+from azure.iot.hub.devicesdk.common import Message
+from azure.iot.hub.devicesdk.transport import constant
+from azure.iot.hub.devicesdk.auth.authentication_provider_factory import from_connection_string
+from azure.iot.hub.devicesdk.testing.loopback import use_loopback
+from . import _support
+
+CLIENT_TYPES = ("sync", "async")
+DEFAULT_CYCLES = 1000000
+DEFAULT_WARMUP = 10000
+DEFAULT_SAMPLES = 20
+# Steady-state growth, in bytes per cycle, above which a check fails
+DEFAULT_THRESHOLD = 1.0
+
+_DEVICE_ID = "leak-check-device"
+_CONNECTION_STRING = (
+    "HostName=leak-check-hub.azure-devices.net;DeviceId={};"
+    "SharedAccessKey=Zm9vYmFyYmF6cXV4Zm9vYmFyYmF6cXV4Zm9vYmFyYmF6cXV4".format(_DEVICE_ID)
+)
+_C2D_TOPIC = "devices/{}/messages/devicebound/%24.to=%2Fdevices%2F{}".format(
+    _DEVICE_ID, _DEVICE_ID
+).encode("utf-8")
+_PAYLOAD = b'{"temperature": 21.5}'
+
+# Allocations made by the harness itself, rather than by the client
+_IGNORED_FILES = (tracemalloc.__file__, linecache.__file__, "<frozen importlib._bootstrap>")
+
+
+class _SyncCycles(object):
+    def __init__(self, consume):
+        self.client = sync_clients.DeviceClient.from_authentication_provider(
+            from_connection_string(_CONNECTION_STRING), "mqtt"
+        )
+        self.loopback = use_loopback(self.client)
+        self.consume = consume
+        self.client.connect()
+        self.client._enable_feature(constant.C2D_MSG)
+
+    def run(self, count):
+        client, loopback, consume = self.client, self.loopback, self.consume
+        for _ in range(count):
+            client.send_event(Message(_PAYLOAD))
+            loopback.deliver(_C2D_TOPIC, _PAYLOAD)
+            if consume:
+                client.receive_c2d_message(block=False)
+
+    def close(self):
+        self.client.disconnect()
+
+
+class _AsyncCycles(object):
+    def __init__(self, consume):
+        self.loop = asyncio.new_event_loop()
+        self.consume = consume
+        self.client = async_clients.DeviceClient.from_authentication_provider(
+            from_connection_string(_CONNECTION_STRING), "mqtt"
+        )
+        self.loopback = use_loopback(self.client)
+        self.loop.run_until_complete(self._connect())
+
+    async def _connect(self):
+        await self.client.connect()
+        await self.client._enable_feature(constant.C2D_MSG)
+
+    async def _run(self, count):
+        client, loopback, consume = self.client, self.loopback, self.consume
+        for _ in range(count):
+            await client.send_event(Message(_PAYLOAD))
+            loopback.deliver(_C2D_TOPIC, _PAYLOAD)
+            if consume:
+                await client.receive_c2d_message()
+
+    def run(self, count):
+        self.loop.run_until_complete(self._run(count))
+
+    def close(self):
+        self.loop.run_until_complete(self.client.disconnect())
+        self.loop.close()
+
+
+def _traced_bytes():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def _top_sites(before, after, top):
+    filters = [tracemalloc.Filter(False, filename) for filename in _IGNORED_FILES]
+    before = before.filter_traces(filters)
+    after = after.filter_traces(filters)
+    sites = []
+    for diff in after.compare_to(before, "lineno")[:top]:
+        if diff.size_diff <= 0:
+            break
+        frame = diff.traceback[0]
+        sites.append(
+            {
+                "file": frame.filename,
+                "line": frame.lineno,
+                "size_diff": diff.size_diff,
+                "count_diff": diff.count_diff,
+            }
+        )
+    return sites
+
+
+def measure(
+    client_type="sync",
+    cycles=DEFAULT_CYCLES,
+    warmup=DEFAULT_WARMUP,
+    samples=DEFAULT_SAMPLES,
+    frames=1,
+    top=10,
+    consume=True,
+):
+    """Run send and receive cycles on one client, tracing the memory it retains.
+
+    :param str client_type: One of CLIENT_TYPES.
+    :param int cycles: The number of cycles traced.
+    :param int warmup: The number of cycles run before tracing starts.
+    :param int samples: The number of times traced memory is sampled.
+    :param int frames: The number of frames kept for each allocation.
+    :param int top: The number of allocation sites reported.
+    :param bool consume: If False, received messages are left in the inbox.
+    :returns: A result dictionary.
+    """
+    if client_type not in CLIENT_TYPES:
+        raise ValueError("Unknown client type: {}".format(client_type))
+    samples = max(2, min(samples, cycles))
+    cycle_runner = (_SyncCycles if client_type == "sync" else _AsyncCycles)(consume)
+    try:
+        cycle_runner.run(warmup)
+        # Samples are stored in preallocated arrays, so that recording them allocates nothing
+        # which would be counted as growth
+        done = array.array("q", [0]) * (samples + 1)
+        traced = array.array("q", [0]) * (samples + 1)
+        tracemalloc.start(frames)
+        try:
+            first = tracemalloc.take_snapshot()
+            traced[0] = _traced_bytes()
+            for i in range(1, samples + 1):
+                done[i] = cycles * i // samples
+                cycle_runner.run(done[i] - done[i - 1])
+                traced[i] = _traced_bytes()
+            last = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        stats = cycle_runner.client._transport.get_stats()
+        inbox_depth = cycle_runner.client._inbox_manager.get_c2d_message_inbox().qsize()
+    finally:
+        cycle_runner.close()
+
+    trend = list(zip(done, traced))
+    retained = traced[-1] - traced[0]
+    steady = _support.slope(trend[len(trend) // 2 :])
+    return {
+        "client": client_type,
+        "cycles": cycles,
+        "consume": consume,
+        "retained_bytes": retained,
+        "bytes_per_message": round(float(retained) / cycles, 3),
+        "steady_bytes_per_message": round(steady, 3) if steady is not None else None,
+        "top_sites": _top_sites(first, last, top),
+        "samples": [{"cycles": x, "traced_bytes": y} for x, y in trend],
+        "inbox_depth": inbox_depth,
+        "in_progress_actions": stats["in_progress_actions"],
+        "unknown_mid_responses": stats["unknown_mid_responses"],
+    }
+
+
+def check(result, threshold=DEFAULT_THRESHOLD):
+    """Mark a result as leaking if its steady-state growth exceeds a threshold.
+
+    :param dict result: A result returned by measure. A "leaking" key is added to it.
+    :param float threshold: The most bytes per cycle the client may grow by in the steady state.
+    :returns: True if the result is leaking.
+    """
+    steady = result["steady_bytes_per_message"]
+    result["threshold"] = threshold
+    result["leaking"] = steady is not None and steady > threshold
+    return result["leaking"]
+
+
+def run(
+    client_types=CLIENT_TYPES,
+    cycles=DEFAULT_CYCLES,
+    warmup=DEFAULT_WARMUP,
+    samples=DEFAULT_SAMPLES,
+    frames=1,
+    top=10,
+    consume=True,
+    threshold=DEFAULT_THRESHOLD,
+):
+    """Measure and check each client type.
+
+    :returns: A list of result dictionaries.
+    """
+    results = []
+    for client_type in client_types:
+        result = measure(client_type, cycles, warmup, samples, frames, top, consume)
+        check(result, threshold)
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Look for memory retained per message")
+    parser.add_argument("--client", nargs="+", choices=CLIENT_TYPES, default=list(CLIENT_TYPES))
+    parser.add_argument("--cycles", type=int, default=DEFAULT_CYCLES)
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP)
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES)
+    parser.add_argument("--frames", type=int, default=1, help="frames kept per allocation")
+    parser.add_argument("--top", type=int, default=10, help="allocation sites to report")
+    parser.add_argument(
+        "--no-consume", action="store_true", help="leave received messages in the inbox"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="steady-state bytes per message above which a check fails",
+    )
+    parser.add_argument("--check", action="store_true", help="exit with 1 if any client leaks")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(
+        args.client,
+        args.cycles,
+        args.warmup,
+        args.samples,
+        args.frames,
+        args.top,
+        not args.no_consume,
+        args.threshold,
+    )
+    if args.json:
+        parameters = {k: v for k, v in vars(args).items() if k != "json"}
+        print(json.dumps(_support.report("leak_check", parameters, results), indent=2))
+    else:
+        for r in results:
+            print(
+                "{} client, {} cycles: {} bytes retained ({} per message, {} per message in the "
+                "steady state){}".format(
+                    r["client"],
+                    r["cycles"],
+                    r["retained_bytes"],
+                    r["bytes_per_message"],
+                    r["steady_bytes_per_message"],
+                    " - LEAKING" if r["leaking"] else "",
+                )
+            )
+            print(
+                "  inbox depth {}, in progress {}, unknown MID responses {}".format(
+                    r["inbox_depth"], r["in_progress_actions"], r["unknown_mid_responses"]
+                )
+            )
+            print("  traced bytes: " + " ".join(str(s["traced_bytes"]) for s in r["samples"]))
+            for site in r["top_sites"]:
+                print(
+                    "  {:>+10} B {:>+8} blocks  {}:{}".format(
+                        site["size_diff"], site["count_diff"], site["file"], site["line"]
+                    )
+                )
+
+    if args.check and any(r["leaking"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
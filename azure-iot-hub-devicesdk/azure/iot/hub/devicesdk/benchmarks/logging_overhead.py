@@ -0,0 +1,252 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a benchmark of the cost of logging on the send and receive paths.
+
+Each message is a round trip through a sync DeviceClient: send_event through the transport and the
+MQTT provider, which is acknowledged at once, then a C2D message delivered to the provider's
+message callback and read back with receive_c2d_message. The paho client is replaced by a loopback
+which completes every operation synchronously, so that no network time is measured and the cost of
+logging is a visible fraction of the total.
+
+The round trip is measured with the package logger configured in each mode:
+    off      logging.disable, the cost without any logging calls
+    warning  the default configuration, where per-message events cost a level check
+    info     lifecycle events are logged, per-message events are not
+    sampled  info, with one in every N occurrences of each per-message event logged
+    debug    every per-message event is formatted and written
+
+Records are formatted and written to os.devnull. For each mode, the benchmark reports the CPU time
+per message with messages sent as fast as possible, the records written per message, and the
+fraction of one CPU used when messages are paced to a target rate of 10,000 per second by default.
+
+Usage:
+    python -m azure.iot.hub.devicesdk.benchmarks.logging_overhead [--modes off warning ...]
+        [--rate MESSAGES_PER_SECOND] [--messages N] [--duration SECONDS]
+        [--sample-every N] [--json]
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import time
+from azure.iot.hub.devicesdk import sync_clients
+from azure.iot.hub.devicesdk.common import Message
+from azure.iot.hub.devicesdk.transport import constant
+from azure.iot.hub.devicesdk.diagnostics import message_log
+from azure.iot.hub.devicesdk.auth.authentication_provider_factory import from_connection_string
+from azure.iot.hub.devicesdk.testing.loopback import use_loopback
+from . import _support
+
+MODES = ("off", "warning", "info", "sampled", "debug")
+DEFAULT_RATE = 10000
+DEFAULT_SAMPLE_EVERY = 1000
+# Unpaced round trips are timed in this many repeats, keeping the fastest
+REPEATS = 5
+
+PACKAGE_LOGGER = "azure.iot.hub.devicesdk"
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s %(threadName)s %(message)s"
+
+_DEVICE_ID = "bench-device"
+_CONNECTION_STRING = (
+    "HostName=bench-hub.azure-devices.net;DeviceId={};"
+    "SharedAccessKey=Zm9vYmFyYmF6cXV4Zm9vYmFyYmF6cXV4Zm9vYmFyYmF6cXV4".format(_DEVICE_ID)
+)
+_C2D_TOPIC = "devices/{}/messages/devicebound/%24.to=%2Fdevices%2F{}".format(
+    _DEVICE_ID, _DEVICE_ID
+).encode("utf-8")
+
+
+class _CountingFilter(logging.Filter):
+    def __init__(self):
+        super(_CountingFilter, self).__init__()
+        self.count = 0
+
+    def filter(self, record):
+        self.count += 1
+        return True
+
+
+@contextlib.contextmanager
+def _logging_mode(mode, sample_every):
+    """Configure the package logger for a mode, restoring its configuration afterwards.
+
+    :returns: A filter counting the records written.
+    """
+    package_logger = logging.getLogger(PACKAGE_LOGGER)
+    saved = (package_logger.level, package_logger.propagate, message_log._sampling)
+    stream = open(os.devnull, "w")
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    counter = _CountingFilter()
+    handler.addFilter(counter)
+    package_logger.addHandler(handler)
+    package_logger.propagate = False
+    if mode == "off":
+        logging.disable(logging.CRITICAL)
+    elif mode == "warning":
+        package_logger.setLevel(logging.WARNING)
+    elif mode in ("info", "sampled"):
+        package_logger.setLevel(logging.INFO)
+    else:
+        package_logger.setLevel(logging.DEBUG)
+    if mode == "sampled":
+        message_log.enable_sampling(every=sample_every)
+    else:
+        message_log.disable_sampling()
+    try:
+        yield counter
+    finally:
+        logging.disable(logging.NOTSET)
+        package_logger.removeHandler(handler)
+        package_logger.setLevel(saved[0])
+        package_logger.propagate = saved[1]
+        if saved[2] is None:
+            message_log.disable_sampling()
+        else:
+            message_log.enable_sampling(saved[2].every, saved[2].level)
+        stream.close()
+
+
+def _create_client():
+    """Create a connected client whose paho client is a loopback.
+
+    :returns: A (client, loopback) tuple.
+    """
+    client = sync_clients.DeviceClient.from_authentication_provider(
+        from_connection_string(_CONNECTION_STRING), "mqtt"
+    )
+    loopback = use_loopback(client)
+    client.connect()
+    # Subscribe before measuring, so that every round trip takes the same path
+    client._enable_feature(constant.C2D_MSG)
+    return client, loopback
+
+
+def _round_trip(client, loopback, message, payload):
+    client.send_event(message)
+    loopback.deliver(_C2D_TOPIC, payload)
+    client.receive_c2d_message(block=False)
+
+
+def _cpu_per_message(client, loopback, count):
+    """The fastest CPU time per round trip of several unpaced repeats, in seconds."""
+    message = Message(b"telemetry", message_id="m")
+    payload = b"c2d"
+    best = None
+    for _ in range(REPEATS):
+        start = time.process_time()
+        for _ in range(count):
+            _round_trip(client, loopback, message, payload)
+        elapsed = (time.process_time() - start) / count
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _paced(client, loopback, rate, duration):
+    """Run round trips paced to a rate.
+
+    :returns: A (messages, wall seconds, CPU seconds) tuple.
+    """
+    message = Message(b"telemetry", message_id="m")
+    payload = b"c2d"
+    count = int(rate * duration)
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    for i in range(count):
+        delay = start + float(i) / rate - time.perf_counter()
+        # Sleep in batches, since a sleep per message would cost more than the round trip
+        if delay > 0.001:
+            time.sleep(delay)
+        _round_trip(client, loopback, message, payload)
+    return count, time.perf_counter() - start, time.process_time() - cpu_start
+
+
+def measure(mode, rate=DEFAULT_RATE, messages=2000, duration=1.0, sample_every=None):
+    """Measure the round trip with logging in one mode.
+
+    :param str mode: One of MODES.
+    :param int rate: The rate to pace messages to, per second.
+    :param int messages: The number of messages in each unpaced repeat.
+    :param float duration: Seconds to pace messages for.
+    :param int sample_every: For the sampled mode, log one in every N events.
+    :returns: A result dictionary.
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown logging mode: {}".format(mode))
+    sample_every = sample_every or DEFAULT_SAMPLE_EVERY
+    client, loopback = _create_client()
+    try:
+        with _logging_mode(mode, sample_every) as counter:
+            cpu = _cpu_per_message(client, loopback, messages)
+            records_per_message = float(counter.count) / (messages * REPEATS)
+            paced_count, wall, paced_cpu = _paced(client, loopback, rate, duration)
+    finally:
+        client.disconnect()
+    return {
+        "mode": mode,
+        "us_per_message": round(cpu * 1e6, 2),
+        "records_per_message": round(records_per_message, 3),
+        "offered_rate": rate,
+        "achieved_rate": round(paced_count / wall),
+        "cpu_fraction": round(paced_cpu / wall, 3),
+    }
+
+
+def run(modes=MODES, rate=DEFAULT_RATE, messages=2000, duration=1.0, sample_every=None):
+    """Measure each logging mode, and the overhead of each relative to the off mode.
+
+    :returns: A list of result dictionaries.
+    """
+    results = [measure(mode, rate, messages, duration, sample_every) for mode in modes]
+    reference = next((r for r in results if r["mode"] == "off"), None)
+    for result in results:
+        if reference:
+            overhead = result["us_per_message"] - reference["us_per_message"]
+            result["overhead_us_per_message"] = round(overhead, 2)
+            # The share of one CPU spent on logging at the offered rate
+            result["overhead_cpu_at_rate"] = round(overhead * 1e-6 * rate, 3)
+        else:
+            result["overhead_us_per_message"] = None
+            result["overhead_cpu_at_rate"] = None
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cost of logging per message")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--rate", type=int, default=DEFAULT_RATE, help="messages per second")
+    parser.add_argument("--messages", type=int, default=2000, help="messages per unpaced repeat")
+    parser.add_argument("--duration", type=float, default=1.0, help="seconds to pace messages")
+    parser.add_argument("--sample-every", type=int, default=DEFAULT_SAMPLE_EVERY)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.modes, args.rate, args.messages, args.duration, args.sample_every)
+    if args.json:
+        parameters = {k: v for k, v in vars(args).items() if k != "json"}
+        print(json.dumps(_support.report("logging_overhead", parameters, results), indent=2))
+        return
+
+    row = "{:<8} {:>10} {:>10} {:>10} {:>12} {:>10} {:>12}"
+    print(row.format("mode", "us/msg", "overhead", "records", "achieved/s", "cpu", "log cpu@rate"))
+    for r in results:
+        print(
+            row.format(
+                r["mode"],
+                r["us_per_message"],
+                str(r["overhead_us_per_message"]),
+                r["records_per_message"],
+                r["achieved_rate"],
+                r["cpu_fraction"],
+                str(r["overhead_cpu_at_rate"]),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a benchmark measuring the memory cost of queued messages.
+
+It compares the current Message class against a replica of the original dict-based
+implementation by filling a queue with messages and measuring the bytes allocated per message.
+
+Usage:
+    python -m azure.iot.hub.devicesdk.benchmarks.message_memory [--count N] [--custom-properties N]
+"""
+
+import argparse
+import gc
+import json
+import tracemalloc
+from six.moves import queue
+from azure.iot.hub.devicesdk.common import Message
+
+
+class DictMessage(object):
+    """Replica of the original Message class, which stored its attributes in a per-instance
+    __dict__ and always allocated a custom_properties dictionary.
+    """
+
+    def __init__(self, data, message_id=None, content_encoding=None, content_type=None):
+        self.data = data
+        self.custom_properties = {}
+        self.lock_token = None
+        self.message_id = message_id
+        self.sequence_number = None
+        self.to = None
+        self.expiry_time_utc = None
+        self.enqueued_time = None
+        self.correlation_id = None
+        self.user_id = None
+        self.ack = None
+        self.content_encoding = content_encoding
+        self.content_type = content_type
+        self.output_name = None
+
+
+def measure_bytes_per_message(message_class, count, custom_property_count=0):
+    """Measure the number of bytes allocated for each message held in a queue.
+
+    The payload is shared between all messages so that only the overhead of the message
+    object itself is measured.
+
+    :param message_class: The class used to construct messages.
+    :param int count: The number of messages to queue.
+    :param int custom_property_count: The number of custom properties to set on each message.
+    :returns: The average number of bytes allocated per queued message.
+    """
+    payload = b"x" * 64
+    property_names = ["property" + str(i) for i in range(custom_property_count)]
+    q = queue.Queue()
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(count):
+            message = message_class(payload)
+            for name in property_names:
+                message.custom_properties[name] = "value"
+            q.put_nowait(message)
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return float(after - before) / count
+
+
+def run(count, custom_property_counts):
+    """Run the benchmark for each number of custom properties.
+
+    :param int count: The number of messages to queue for each measurement.
+    :param custom_property_counts: An iterable of custom property counts to measure.
+    :returns: A list of result dictionaries.
+    """
+    results = []
+    for custom_property_count in custom_property_counts:
+        original = measure_bytes_per_message(DictMessage, count, custom_property_count)
+        current = measure_bytes_per_message(Message, count, custom_property_count)
+        results.append(
+            {
+                "custom_properties": custom_property_count,
+                "messages": count,
+                "dict_message_bytes": round(original, 1),
+                "slots_message_bytes": round(current, 1),
+                "saved_percent": round(100.0 * (original - current) / original, 1),
+            }
+        )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure memory used per queued message")
+    parser.add_argument("--count", type=int, default=100000, help="messages to queue")
+    parser.add_argument(
+        "--custom-properties",
+        type=int,
+        nargs="+",
+        default=[0, 1, 5],
+        help="numbers of custom properties to measure",
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.count, args.custom_properties)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(
+            "{:>18} {:>18} {:>18} {:>8}".format(
+                "custom properties", "dict bytes/msg", "slots bytes/msg", "saved"
+            )
+        )
+        for r in results:
+            print(
+                "{:>18} {:>18} {:>18} {:>7}%".format(
+                    r["custom_properties"],
+                    r["dict_message_bytes"],
+                    r["slots_message_bytes"],
+                    r["saved_percent"],
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
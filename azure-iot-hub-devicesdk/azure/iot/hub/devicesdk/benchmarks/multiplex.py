@@ -0,0 +1,211 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a benchmark of the cost of each device in a process, with and without an
+MqttMultiplexer.
+
+A number of device clients connect to a FakeIoTHubProcess over TLS, each device sends a few
+telemetry messages, and the devices disconnect. Each mode runs in a fresh child process, so that
+its memory is measured from the same baseline:
+    threaded      each client runs paho's network loop on a thread of its own, and renews its SAS
+                  token on a Timer thread
+    multiplexed   every client shares one MqttMultiplexer, whose I/O thread runs every network
+                  loop and whose timer thread makes every timed call
+
+and reports, once every device is connected:
+    threads_per_device   threads started per device
+    fds_per_device       file descriptors opened per device, including paho's internal socket pair
+    rss_per_device_kb    growth of the resident set size per device
+    connect_seconds      time taken to connect every device, one after another
+    sends_per_second     telemetry messages completed per second, each device sending in turn
+
+Usage:
+    python -m azure.iot.hub.devicesdk.benchmarks.multiplex [--modes threaded multiplexed]
+        [--devices N] [--messages PER_DEVICE] [--json]
+
+Thousands of devices need a file descriptor limit of a few times the number of devices, in this
+process and in the hub's. The soft limit is raised to the hard limit where the platform allows it.
+Paho's own network loop waits with select(), which cannot watch file descriptors above 1024, so the
+threaded mode is run with at most THREADED_MAX_DEVICES devices.
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import threading
+import time
+from azure.iot.hub.devicesdk import sync_clients
+from azure.iot.hub.devicesdk.auth.authentication_provider_factory import from_connection_string
+from azure.iot.hub.devicesdk.common import Message
+from azure.iot.hub.devicesdk.testing import FakeIoTHubProcess
+from azure.iot.hub.devicesdk.transport.mqtt.multiplexer import MqttMultiplexer
+from . import _support
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+MODES = ("threaded", "multiplexed")
+DEFAULT_DEVICES = 200
+DEFAULT_MESSAGES = 5
+# Each device opens three file descriptors, which must stay below select()'s limit of 1024
+THREADED_MAX_DEVICES = 300
+
+
+def _raise_fd_limit():
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def _per_device(before, after, devices, scale=1):
+    if before is None or after is None:
+        return None
+    return round((after - before) / float(devices) / scale, 2)
+
+
+def measure(mode, hub, devices=DEFAULT_DEVICES, messages=DEFAULT_MESSAGES):
+    """Connect devices to a hub, send telemetry from each, and disconnect them.
+
+    :param str mode: One of MODES.
+    :param hub: The running FakeIoTHubProcess.
+    :param int devices: The number of devices.
+    :param int messages: The number of messages sent by each device.
+    :returns: A result dictionary.
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown mode: {}".format(mode))
+    multiplexer = MqttMultiplexer() if mode == "multiplexed" else None
+    kwargs = {"multiplexer": multiplexer} if multiplexer else {}
+    # Collect garbage first so that the baseline is steady
+    gc.collect()
+    threads_before = threading.active_count()
+    fds_before = _support.open_fds()
+    rss_before = _support.rss_bytes()
+
+    clients = []
+    started = time.perf_counter()
+    for index in range(devices):
+        auth_provider = from_connection_string(hub.connection_string("device-{}".format(index)))
+        auth_provider.ca_cert = hub.ca_cert
+        client = sync_clients.DeviceClient.from_authentication_provider(
+            auth_provider, "mqtt", port=hub.tls_port, **kwargs
+        )
+        client.connect()
+        clients.append(client)
+    connect_seconds = time.perf_counter() - started
+
+    gc.collect()
+    threads = threading.active_count() - threads_before
+    fds_after = _support.open_fds()
+    rss_after = _support.rss_bytes()
+
+    started = time.perf_counter()
+    for _ in range(messages):
+        for client in clients:
+            client.send_event(Message(b'{"temperature": 21.5}'))
+    send_seconds = time.perf_counter() - started
+
+    for client in clients:
+        client.disconnect()
+    if multiplexer:
+        multiplexer.stop()
+
+    return {
+        "mode": mode,
+        "devices": devices,
+        "threads": threads,
+        "threads_per_device": round(threads / float(devices), 3),
+        "fds_per_device": _per_device(fds_before, fds_after, devices),
+        "rss_per_device_kb": _per_device(rss_before, rss_after, devices, 1024),
+        "connect_seconds": round(connect_seconds, 3),
+        "sends_per_second": round(devices * messages / send_seconds, 1),
+    }
+
+
+def _measure_in_child(connection, mode, hub_address, devices, messages):
+    _raise_fd_limit()
+    hostname, shared_access_key, tls_port, ca_cert = hub_address
+    # A stopped FakeIoTHubProcess builds connection strings for the hub started by the parent
+    hub = FakeIoTHubProcess(hostname, shared_access_key)
+    hub.tls_port = tls_port
+    hub.ca_cert = ca_cert
+    try:
+        connection.send(("result", measure(mode, hub, devices, messages)))
+    except Exception as e:
+        connection.send(("error", repr(e)))
+    connection.close()
+
+
+def run(modes=MODES, devices=DEFAULT_DEVICES, messages=DEFAULT_MESSAGES):
+    """Measure each mode in a child process of its own, against a hub of its own.
+
+    :returns: A list of result dictionaries.
+    :raises: RuntimeError if the hub could not be started, or a measurement failed.
+    """
+    # The hub's process inherits the raised limit
+    _raise_fd_limit()
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for mode in modes:
+        mode_devices = min(devices, THREADED_MAX_DEVICES) if mode == "threaded" else devices
+        with FakeIoTHubProcess() as hub:
+            hub_address = (hub.hostname, hub.shared_access_key, hub.tls_port, hub.ca_cert)
+            connection, child_connection = context.Pipe()
+            process = context.Process(
+                target=_measure_in_child,
+                args=(child_connection, mode, hub_address, mode_devices, messages),
+            )
+            process.start()
+            try:
+                status, value = connection.recv()
+            except EOFError:
+                status, value = "error", "exit code {}".format(process.exitcode)
+            process.join()
+        if status != "result":
+            raise RuntimeError("Measuring {} failed: {}".format(mode, value))
+        results.append(value)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the cost of each device in a process")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--devices", type=int, default=DEFAULT_DEVICES)
+    parser.add_argument(
+        "--messages", type=int, default=DEFAULT_MESSAGES, help="messages sent by each device"
+    )
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.modes, args.devices, args.messages)
+    if args.json:
+        parameters = {k: v for k, v in vars(args).items() if k != "json"}
+        print(json.dumps(_support.report("multiplex", parameters, results), indent=2))
+        return
+    for r in results:
+        print(
+            "{:>11}: {} devices, {} threads per device, {} fds per device, {} KiB RSS per device, "
+            "connected in {} s, {} sends/s".format(
+                r["mode"],
+                r["devices"],
+                r["threads_per_device"],
+                r["fds_per_device"],
+                r["rss_per_device_kb"],
+                r["connect_seconds"],
+                r["sends_per_second"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
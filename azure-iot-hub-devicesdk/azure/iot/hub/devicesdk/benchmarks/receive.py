@@ -0,0 +1,511 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a benchmark of the receive path, from the network thread through the
+transport and InboxManager to application code reading from an inbox.
+
+Messages are injected in two ways:
+    inprocess  a thread standing in for the paho network thread calls
+               MQTTTransport._on_provider_message_received_callback directly
+    socket     a fake IoT Hub in a child process publishes to a client connected over TLS
+
+and consumed from sync inboxes (sync_inbox) or async inboxes (aio.async_inbox). The transport does
+not route method request topics yet, so method requests are only measured in-process, injected at
+the transport's on_transport_method_request_received hook which routes them through InboxManager.
+
+For each path, message kind and inbox type, messages are injected at a sweep of increasing rates.
+Each step reports delivery latency percentiles, and the saturation point is the highest offered
+rate which was delivered in full at that rate. An overload phase then injects messages as fast as
+possible to a slow consumer and reports the growth of the process's memory with the backlog.
+
+Latency is measured from a timestamp written into each payload by the injector with time.time(),
+so that it can be compared across processes.
+
+Usage:
+    python -m azure.iot.hub.devicesdk.benchmarks.receive [--paths inprocess socket]
+        [--kinds c2d input method] [--inboxes sync async] [--rates 1000 5000 ...]
+        [--step-duration SECONDS] [--overload-messages N] [--json]
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import struct
+import threading
+import time
+from azure.iot.hub.devicesdk import sync_clients, InboxEmpty
+from azure.iot.hub.devicesdk.aio import async_clients
+from azure.iot.hub.devicesdk.common import MethodRequest
+from azure.iot.hub.devicesdk.transport import constant
+from azure.iot.hub.devicesdk.auth.authentication_provider_factory import from_connection_string
+from azure.iot.hub.devicesdk.testing import FakeIoTHubProcess
+from azure.iot.hub.devicesdk.testing.fake_hub import TIMESTAMP_FORMAT, TIMESTAMP_SIZE
+from . import _support
+
+PATHS = ("inprocess", "socket")
+KINDS = ("c2d", "input", "method")
+INBOX_TYPES = ("sync", "async")
+DEFAULT_RATES = (1000, 2000, 5000, 10000, 20000, 50000)
+
+INPUT_NAME = "bench-input"
+METHOD_NAME = "bench-method"
+
+# A step is sustained if at least this fraction of the offered rate was injected and delivered
+SUSTAINED_FRACTION = 0.95
+# Seconds a consumer waits for the next message before giving up on the rest of a step
+RECEIVE_TIMEOUT = 5
+# Seconds given to messages in flight on the socket to arrive before measuring an overload
+SETTLE_TIME = 0.5
+
+_ids = itertools.count()
+
+
+class _Receiver(object):
+    """A client together with the ids it was created for, and how to read from it."""
+
+    def __init__(self, path, kind, client_module, hub):
+        self.kind = kind
+        self.device_id = "bench-receiver-" + str(next(_ids))
+        self.module_id = "bench-module" if kind == "input" else None
+        self.client_id = self.device_id + ("/" + self.module_id if self.module_id else "")
+        client_class = client_module.ModuleClient if self.module_id else client_module.DeviceClient
+        auth_provider = from_connection_string(
+            hub.connection_string(self.device_id, self.module_id)
+        )
+        auth_provider.ca_cert = hub.ca_cert
+        self.client = client_class.from_authentication_provider(
+            auth_provider, "mqtt", port=hub.tls_port
+        )
+
+        inbox_manager = self.client._inbox_manager
+        if path == "socket":
+            # Read through the client API, which also subscribes on the first call
+            if kind == "c2d":
+                self.get = self.client.receive_c2d_message
+            else:
+                self.get = lambda **kwargs: self.client.receive_input_message(INPUT_NAME, **kwargs)
+            self.inbox = None
+        else:
+            if kind == "c2d":
+                self.inbox = inbox_manager.get_c2d_message_inbox()
+            elif kind == "input":
+                self.inbox = inbox_manager.get_input_message_inbox(INPUT_NAME)
+            else:
+                self.inbox = inbox_manager.get_method_request_inbox(METHOD_NAME)
+            self.get = self.inbox.get
+
+    def inbox_depth(self):
+        """The number of messages waiting in the inbox being read."""
+        inbox = self.inbox or self._client_inbox()
+        queue = inbox._queue
+        # Async inboxes wrap a janus queue, which has a sync and an async side
+        return (queue.sync_q if hasattr(queue, "sync_q") else queue).qsize()
+
+    def _client_inbox(self):
+        inbox_manager = self.client._inbox_manager
+        if self.kind == "c2d":
+            return inbox_manager.get_c2d_message_inbox()
+        return inbox_manager.get_input_message_inbox(INPUT_NAME)
+
+
+def _paced(count, rate, send):
+    """Call send count times, paced to rate calls per second, or unpaced if rate is 0.
+
+    :returns: The number of seconds taken.
+    """
+    start = time.perf_counter()
+    for i in range(count):
+        if rate:
+            delay = start + float(i) / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        send()
+    return time.perf_counter() - start
+
+
+def _inject_inprocess(receiver, count, rate, payload_size):
+    """Inject messages into the transport of a receiver, as the network thread would.
+
+    :returns: The number of seconds taken.
+    """
+    transport = receiver.client._transport
+    padding = b"\0" * max(0, payload_size - TIMESTAMP_SIZE)
+    request_ids = itertools.count()
+
+    if receiver.kind == "method":
+
+        def send():
+            payload = struct.pack(TIMESTAMP_FORMAT, time.time()) + padding
+            request = MethodRequest(str(next(request_ids)), METHOD_NAME, payload)
+            transport.on_transport_method_request_received(request)
+
+    else:
+        if receiver.kind == "c2d":
+            topic = "devices/{}/messages/devicebound/".format(receiver.device_id)
+        else:
+            topic = "devices/{}/modules/{}/inputs/{}/".format(
+                receiver.device_id, receiver.module_id, INPUT_NAME
+            )
+        topic = (topic + "%24.to=bench").encode("utf-8")
+
+        def send():
+            payload = struct.pack(TIMESTAMP_FORMAT, time.time()) + padding
+            transport._on_provider_message_received_callback(topic, payload)
+
+    return _paced(count, rate, send)
+
+
+def _inject_socket(hub, receiver, count, rate, payload_size):
+    """Ask the fake hub to publish messages to a receiver.
+
+    :returns: The number of seconds taken.
+    """
+    start = time.perf_counter()
+    hub.call(
+        "send_timed_messages",
+        receiver.device_id,
+        count,
+        rate,
+        payload_size,
+        receiver.module_id,
+        INPUT_NAME if receiver.module_id else None,
+    )
+    return time.perf_counter() - start
+
+
+def _latency(item):
+    payload = item.payload if isinstance(item, MethodRequest) else item.data
+    return time.time() - struct.unpack_from(TIMESTAMP_FORMAT, payload)[0]
+
+
+class _Consumption(object):
+    """The latencies observed by a consumer, and when it received its last message."""
+
+    def __init__(self, consumer_delay=0):
+        self.latencies = []
+        self.finished = None
+        self.consumer_delay = consumer_delay
+        self.stopped = False
+
+
+def _consume_sync(receiver, count, consumption):
+    for _ in range(count):
+        if consumption.stopped:
+            return
+        try:
+            item = receiver.get(timeout=RECEIVE_TIMEOUT)
+        except InboxEmpty:
+            return
+        consumption.latencies.append(_latency(item))
+        consumption.finished = time.perf_counter()
+        if consumption.consumer_delay:
+            time.sleep(consumption.consumer_delay)
+
+
+async def _consume_async(receiver, count, consumption):
+    for _ in range(count):
+        if consumption.stopped:
+            return
+        try:
+            item = await asyncio.wait_for(receiver.get(), RECEIVE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return
+        consumption.latencies.append(_latency(item))
+        consumption.finished = time.perf_counter()
+        if consumption.consumer_delay:
+            await asyncio.sleep(consumption.consumer_delay)
+
+
+def _feature_name(kind):
+    return constant.C2D_MSG if kind == "c2d" else constant.INPUT_MSG
+
+
+def _step_result(rate, count, inject_time, start, consumption):
+    delivered = len(consumption.latencies)
+    delivery_time = (consumption.finished - start) if consumption.finished else None
+    injected_rate = count / inject_time if inject_time else None
+    delivered_rate = delivered / delivery_time if delivery_time else 0
+    sustained = (
+        delivered == count
+        and injected_rate >= SUSTAINED_FRACTION * rate
+        and delivered_rate >= SUSTAINED_FRACTION * rate
+    )
+    return {
+        "offered_rate": rate,
+        "messages": count,
+        "delivered": delivered,
+        "injected_rate": round(injected_rate, 1),
+        "delivered_rate": round(delivered_rate, 1),
+        "latency_ms": _support.latency_percentiles(consumption.latencies),
+        "sustained": sustained,
+    }
+
+
+def _run_sync(path, kind, hub, rates, step_duration, overload_messages, payload_size):
+    steps = []
+    for rate in rates:
+        count = max(100, int(rate * step_duration))
+        receiver = _Receiver(path, kind, sync_clients, hub)
+        consumption = _Consumption()
+        consumer = threading.Thread(target=_consume_sync, args=(receiver, count, consumption))
+        if path == "socket":
+            receiver.client.connect()
+            consumer.start()
+            if not hub.call("wait_for_subscription", receiver.client_id, _feature_name(kind)):
+                raise RuntimeError("Receiver did not subscribe")
+            start = time.perf_counter()
+            inject_time = _inject_socket(hub, receiver, count, rate, payload_size)
+        else:
+            consumer.start()
+            start = time.perf_counter()
+            inject_time = _inject_inprocess(receiver, count, rate, payload_size)
+        consumer.join()
+        if path == "socket":
+            receiver.client.disconnect()
+        steps.append(_step_result(rate, count, inject_time, start, consumption))
+        if not steps[-1]["sustained"]:
+            break
+
+    receiver = _Receiver(path, kind, sync_clients, hub)
+    consumption = _Consumption(consumer_delay=0.001)
+    consumer = threading.Thread(
+        target=_consume_sync, args=(receiver, overload_messages, consumption)
+    )
+    if path == "socket":
+        receiver.client.connect()
+        consumer.start()
+        hub.call("wait_for_subscription", receiver.client_id, _feature_name(kind))
+    else:
+        consumer.start()
+    rss_before = _support.rss_bytes()
+    if path == "socket":
+        inject_time = _inject_socket(hub, receiver, overload_messages, 0, payload_size)
+        time.sleep(SETTLE_TIME)
+    else:
+        inject_time = _inject_inprocess(receiver, overload_messages, 0, payload_size)
+    overload = _overload_result(receiver, overload_messages, inject_time, rss_before)
+    consumption.stopped = True
+    consumer.join()
+    if path == "socket":
+        receiver.client.disconnect()
+    return steps, overload
+
+
+async def _run_async(path, kind, hub, rates, step_duration, overload_messages, payload_size):
+    loop = asyncio.get_event_loop()
+    steps = []
+    for rate in rates:
+        count = max(100, int(rate * step_duration))
+        receiver = _Receiver(path, kind, async_clients, hub)
+        consumption = _Consumption()
+        if path == "socket":
+            await receiver.client.connect()
+            consumer = asyncio.ensure_future(_consume_async(receiver, count, consumption))
+            subscribed = await loop.run_in_executor(
+                None, hub.call, "wait_for_subscription", receiver.client_id, _feature_name(kind)
+            )
+            if not subscribed:
+                raise RuntimeError("Receiver did not subscribe")
+            start = time.perf_counter()
+            inject = _inject_socket
+            inject_args = (hub, receiver, count, rate, payload_size)
+        else:
+            consumer = asyncio.ensure_future(_consume_async(receiver, count, consumption))
+            start = time.perf_counter()
+            inject = _inject_inprocess
+            inject_args = (receiver, count, rate, payload_size)
+        # Inject from another thread, as the network thread would
+        inject_time = await loop.run_in_executor(None, inject, *inject_args)
+        await consumer
+        if path == "socket":
+            await receiver.client.disconnect()
+        steps.append(_step_result(rate, count, inject_time, start, consumption))
+        if not steps[-1]["sustained"]:
+            break
+
+    receiver = _Receiver(path, kind, async_clients, hub)
+    consumption = _Consumption(consumer_delay=0.001)
+    if path == "socket":
+        await receiver.client.connect()
+    consumer = asyncio.ensure_future(_consume_async(receiver, overload_messages, consumption))
+    if path == "socket":
+        await loop.run_in_executor(
+            None, hub.call, "wait_for_subscription", receiver.client_id, _feature_name(kind)
+        )
+        inject_args = (_inject_socket, hub, receiver, overload_messages, 0, payload_size)
+    else:
+        inject_args = (_inject_inprocess, receiver, overload_messages, 0, payload_size)
+    rss_before = _support.rss_bytes()
+    inject_time = await loop.run_in_executor(None, *inject_args)
+    if path == "socket":
+        await asyncio.sleep(SETTLE_TIME)
+    overload = _overload_result(receiver, overload_messages, inject_time, rss_before)
+    consumption.stopped = True
+    await consumer
+    if path == "socket":
+        await receiver.client.disconnect()
+    return steps, overload
+
+
+def _overload_result(receiver, count, inject_time, rss_before):
+    backlog = receiver.inbox_depth()
+    rss_after = _support.rss_bytes()
+    growth = rss_after - rss_before if rss_before is not None else None
+    return {
+        "messages": count,
+        "injected_rate": round(count / inject_time, 1),
+        "backlog": backlog,
+        "rss_growth_mb": round(growth / (1024.0 * 1024), 1) if growth is not None else None,
+        "bytes_per_backlog_msg": int(growth / backlog) if growth is not None and backlog else None,
+    }
+
+
+def measure(
+    path, kind, inbox_type, hub, rates=DEFAULT_RATES, step_duration=1.0, overload_messages=20000
+):
+    """Measure one combination of injection path, message kind and inbox type.
+
+    :param str path: One of PATHS.
+    :param str kind: One of KINDS. Method requests can only be measured in-process.
+    :param str inbox_type: One of INBOX_TYPES.
+    :param hub: The running FakeIoTHubProcess. It also provides the connection string used for
+    in-process clients, which never connect.
+    :param rates: The offered rates to step through, in messages per second. The sweep stops at
+    the first rate which is not sustained.
+    :param float step_duration: The approximate number of seconds of messages offered per step.
+    :param int overload_messages: The number of messages injected during the overload phase.
+    :returns: A result dictionary.
+    """
+    if path == "socket" and kind == "method":
+        raise ValueError("Method requests can only be measured in-process")
+    args = (path, kind, hub, rates, step_duration, overload_messages, 64)
+    if inbox_type == "sync":
+        steps, overload = _run_sync(*args)
+    else:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            steps, overload = loop.run_until_complete(_run_async(*args))
+        finally:
+            loop.close()
+            asyncio.set_event_loop(None)
+
+    sustained = [step["offered_rate"] for step in steps if step["sustained"]]
+    return {
+        "path": path,
+        "kind": kind,
+        "inbox": inbox_type,
+        "steps": steps,
+        "saturation_rate": max(sustained) if sustained else None,
+        "max_delivered_rate": max(step["delivered_rate"] for step in steps),
+        "overload": overload,
+    }
+
+
+def run(
+    paths=PATHS,
+    kinds=KINDS,
+    inbox_types=INBOX_TYPES,
+    rates=DEFAULT_RATES,
+    step_duration=1.0,
+    overload_messages=20000,
+):
+    """Run the benchmark for every combination of path, kind and inbox type.
+
+    :returns: A list of result dictionaries.
+    """
+    results = []
+    with FakeIoTHubProcess() as hub:
+        for path, kind, inbox_type in itertools.product(paths, kinds, inbox_types):
+            if path == "socket" and kind == "method":
+                continue
+            results.append(
+                measure(path, kind, inbox_type, hub, rates, step_duration, overload_messages)
+            )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure receive latency and saturation")
+    parser.add_argument("--paths", nargs="+", choices=PATHS, default=list(PATHS))
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    parser.add_argument("--inboxes", nargs="+", choices=INBOX_TYPES, default=list(INBOX_TYPES))
+    parser.add_argument("--rates", nargs="+", type=int, default=list(DEFAULT_RATES))
+    parser.add_argument("--step-duration", type=float, default=1.0, help="seconds per rate")
+    parser.add_argument("--overload-messages", type=int, default=20000)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(
+        args.paths, args.kinds, args.inboxes, args.rates, args.step_duration, args.overload_messages
+    )
+    if args.json:
+        parameters = {k: v for k, v in vars(args).items() if k != "json"}
+        print(json.dumps(_support.report("receive", parameters, results), indent=2))
+        return
+
+    row = "{:<10} {:<7} {:<6} {:>10} {:>10} {:>9} {:>9} {:>9} {:>10}"
+    print(
+        row.format(
+            "path",
+            "kind",
+            "inbox",
+            "offered/s",
+            "deliv/s",
+            "p50 ms",
+            "p99 ms",
+            "p999 ms",
+            "sustained",
+        )
+    )
+    for r in results:
+        for step in r["steps"]:
+            latency = step["latency_ms"]
+            print(
+                row.format(
+                    r["path"],
+                    r["kind"],
+                    r["inbox"],
+                    step["offered_rate"],
+                    step["delivered_rate"],
+                    latency["p50"],
+                    latency["p99"],
+                    latency["p999"],
+                    str(step["sustained"]),
+                )
+            )
+    print()
+    row = "{:<10} {:<7} {:<6} {:>12} {:>12} {:>10} {:>12} {:>12}"
+    print(
+        row.format(
+            "path",
+            "kind",
+            "inbox",
+            "saturation/s",
+            "max deliv/s",
+            "backlog",
+            "growth MiB",
+            "bytes/msg",
+        )
+    )
+    for r in results:
+        overload = r["overload"]
+        print(
+            row.format(
+                r["path"],
+                r["kind"],
+                r["inbox"],
+                str(r["saturation_rate"]),
+                r["max_delivered_rate"],
+                overload["backlog"],
+                str(overload["rss_growth_mb"]),
+                str(overload["bytes_per_backlog_msg"]),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a benchmark of the send path, from the client API to the acknowledgement
+of each message, over a TLS socket to a fake IoT Hub running in a child process.
+
+Three modes are measured:
+    sync       concurrent threads calling DeviceClient.send_event from sync_clients
+    async      concurrent tasks awaiting DeviceClient.send_event from aio.async_clients
+    pipelined  one thread keeping messages in flight with the transport's completion callbacks,
+               which shows the throughput available without a thread or task per message
+
+For every combination of payload size, custom property count, concurrency and QoS, it reports
+messages per second, acknowledgement latency percentiles, CPU time per message and the resident
+set size of the benchmark process.
+
+Usage:
+    python -m azure.iot.hub.devicesdk.benchmarks.send [--modes sync async pipelined]
+        [--payload-sizes 16 4096] [--property-counts 0 10] [--concurrency 1 8] [--qos 0 1]
+        [--messages N] [--puback-delay SECONDS] [--json]
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import threading
+import time
+from azure.iot.hub.devicesdk import sync_clients
+from azure.iot.hub.devicesdk.aio import async_clients
+from azure.iot.hub.devicesdk.common import Message
+from azure.iot.hub.devicesdk.auth.authentication_provider_factory import from_connection_string
+from azure.iot.hub.devicesdk.testing import FakeIoTHubProcess
+from . import _support
+
+MODES = ("sync", "async", "pipelined")
+WARMUP_MESSAGES = 20
+
+
+def make_messages(count, payload_size, property_count):
+    """Create messages with a payload of the given size and the given number of custom properties.
+
+    :returns: A list of Message objects, which share one payload.
+    """
+    payload = bytes(bytearray(i % 256 for i in range(payload_size)))
+    messages = []
+    for i in range(count):
+        message = Message(payload, message_id="msg-" + str(i))
+        for p in range(property_count):
+            message.custom_properties["property" + str(p)] = "value" + str(p)
+        messages.append(message)
+    return messages
+
+
+def _create_auth_provider(hub, device_id):
+    auth_provider = from_connection_string(hub.connection_string(device_id))
+    auth_provider.ca_cert = hub.ca_cert
+    return auth_provider
+
+
+def _send_sync(client, messages, concurrency):
+    latencies = []
+    next_index = itertools.count()
+
+    def producer():
+        # Producers share one itertools.count, which hands out each index exactly once
+        for index in next_index:
+            if index >= len(messages):
+                return
+            start = time.perf_counter()
+            client.send_event(messages[index])
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=producer) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def _send_pipelined(transport, messages, concurrency):
+    latencies = []
+    window = threading.Semaphore(concurrency)
+
+    def on_complete(start, error=None):
+        latencies.append(time.perf_counter() - start)
+        window.release()
+
+    for message in messages:
+        window.acquire()
+        start = time.perf_counter()
+        transport.send_event(message, lambda error=None, start=start: on_complete(start, error))
+    # Wait for the messages still in flight
+    for _ in range(concurrency):
+        window.acquire()
+    return latencies
+
+
+async def _send_async(client, messages, concurrency):
+    latencies = []
+    next_index = itertools.count()
+
+    async def producer():
+        for index in next_index:
+            if index >= len(messages):
+                return
+            start = time.perf_counter()
+            await client.send_event(messages[index])
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[producer() for _ in range(concurrency)])
+    return latencies
+
+
+async def _measure_async(auth_provider, port, messages, concurrency, qos):
+    client = async_clients.DeviceClient.from_authentication_provider(
+        auth_provider, "mqtt", port=port, telemetry_qos=qos
+    )
+    await client.connect()
+    await _send_async(client, messages[:WARMUP_MESSAGES], concurrency)
+    start_time = time.perf_counter()
+    start_cpu = time.process_time()
+    latencies = await _send_async(client, messages[WARMUP_MESSAGES:], concurrency)
+    elapsed = time.perf_counter() - start_time
+    cpu = time.process_time() - start_cpu
+    await client.disconnect()
+    return latencies, elapsed, cpu
+
+
+def measure(hub, mode, payload_size, property_count, concurrency, qos, message_count):
+    """Measure one combination of parameters with a newly connected client.
+
+    :param hub: The running FakeIoTHubProcess.
+    :param str mode: One of MODES.
+    :param int payload_size: The payload size in bytes.
+    :param int property_count: The number of custom properties on each message.
+    :param int concurrency: The number of producers, or the number of messages in flight.
+    :param int qos: The MQTT QoS level for telemetry.
+    :param int message_count: The number of messages to measure, after a short warmup.
+    :returns: A result dictionary.
+    """
+    device_id = "bench-{}-{}-{}-{}-{}".format(mode, payload_size, property_count, concurrency, qos)
+    auth_provider = _create_auth_provider(hub, device_id)
+    messages = make_messages(message_count + WARMUP_MESSAGES, payload_size, property_count)
+
+    if mode == "async":
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            latencies, elapsed, cpu = loop.run_until_complete(
+                _measure_async(auth_provider, hub.tls_port, messages, concurrency, qos)
+            )
+        finally:
+            loop.close()
+            asyncio.set_event_loop(None)
+    else:
+        client = sync_clients.DeviceClient.from_authentication_provider(
+            auth_provider, "mqtt", port=hub.tls_port, telemetry_qos=qos
+        )
+        client.connect()
+        if mode == "sync":
+            send = _send_sync
+            target = client
+        else:
+            send = _send_pipelined
+            target = client._transport
+        send(target, messages[:WARMUP_MESSAGES], concurrency)
+        start_time = time.perf_counter()
+        start_cpu = time.process_time()
+        latencies = send(target, messages[WARMUP_MESSAGES:], concurrency)
+        elapsed = time.perf_counter() - start_time
+        cpu = time.process_time() - start_cpu
+        client.disconnect()
+
+    return {
+        "mode": mode,
+        "payload_bytes": payload_size,
+        "properties": property_count,
+        "concurrency": concurrency,
+        "qos": qos,
+        "messages": len(latencies),
+        "msgs_per_sec": round(len(latencies) / elapsed, 1),
+        "ack_latency_ms": _support.latency_percentiles(latencies),
+        "cpu_us_per_msg": round(cpu * 1e6 / len(latencies), 1),
+        "rss_mb": _support.rss_mb(),
+    }
+
+
+def run(
+    modes=MODES,
+    payload_sizes=(16, 4096),
+    property_counts=(0, 10),
+    concurrencies=(1, 8),
+    qos_levels=(0, 1),
+    message_count=1000,
+    puback_delay=0,
+):
+    """Run the benchmark for every combination of parameters against one fake hub.
+
+    :returns: A list of result dictionaries.
+    """
+    results = []
+    with FakeIoTHubProcess(puback_delay=puback_delay) as hub:
+        for combination in itertools.product(
+            modes, payload_sizes, property_counts, concurrencies, qos_levels
+        ):
+            results.append(measure(hub, *(combination + (message_count,))))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure send throughput and latency")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--payload-sizes", nargs="+", type=int, default=[16, 4096])
+    parser.add_argument("--property-counts", nargs="+", type=int, default=[0, 10])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8])
+    parser.add_argument("--qos", nargs="+", type=int, choices=(0, 1), default=[0, 1])
+    parser.add_argument("--messages", type=int, default=1000, help="messages per measurement")
+    parser.add_argument("--puback-delay", type=float, default=0, help="seconds before each ack")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(
+        args.modes,
+        args.payload_sizes,
+        args.property_counts,
+        args.concurrency,
+        args.qos,
+        args.messages,
+        args.puback_delay,
+    )
+    if args.json:
+        parameters = {k: v for k, v in vars(args).items() if k != "json"}
+        print(json.dumps(_support.report("send", parameters, results), indent=2))
+    else:
+        row = "{:<10} {:>8} {:>5} {:>5} {:>4} {:>10} {:>9} {:>9} {:>9} {:>10} {:>8}"
+        print(
+            row.format(
+                "mode",
+                "bytes",
+                "props",
+                "conc",
+                "qos",
+                "msgs/s",
+                "p50 ms",
+                "p99 ms",
+                "p999 ms",
+                "cpu us/msg",
+                "rss MiB",
+            )
+        )
+        for r in results:
+            latency = r["ack_latency_ms"]
+            print(
+                row.format(
+                    r["mode"],
+                    r["payload_bytes"],
+                    r["properties"],
+                    r["concurrency"],
+                    r["qos"],
+                    r["msgs_per_sec"],
+                    latency["p50"],
+                    latency["p99"],
+                    latency["p999"],
+                    r["cpu_us_per_msg"],
+                    r["rss_mb"],
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
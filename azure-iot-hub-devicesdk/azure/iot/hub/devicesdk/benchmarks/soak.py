@@ -0,0 +1,309 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a soak test of SAS token renewal and reconnection, which runs days of a
+client's life in minutes.
+
+A sync DeviceClient connects over TLS to a FakeIoTHub running in this process. The client's
+authentication provider, its transport and the hub share a SimulatedClock, so that token renewals
+fall due as the clock is advanced rather than once an hour. The hub closes each connection when the
+token it connected with expires, as the service does, so a renewal which does not reconnect in
+time shows up as a dropped connection. Connections can also be dropped by the hub at intervals.
+
+The harness advances the clock by the telemetry interval and sends one message through the
+transport at each step, waiting up to a timeout for its acknowledgement. The network is real, so a
+step takes as long as a round trip to the hub. The harness reports:
+    lost        messages which were never acknowledged
+    late        messages acknowledged after the timeout
+    duplicates  messages received by the hub more than once, which QoS 1 allows after a dropped
+                connection
+    gaps        stretches of simulated time longer than 1.5 intervals without an acknowledged
+                message, with the simulated hour each started at
+    latency     acknowledgement latency percentiles for every message, and for the first message
+                after each renewal, which waits for the reconnection
+    resources   RSS, threads, open file descriptors and transport queue sizes, sampled after each
+                renewal, with the growth of each per renewal fitted by least squares over the
+                second half of the run
+
+Usage:
+    python -m azure.iot.hub.devicesdk.benchmarks.soak [--days N] [--interval SECONDS]
+        [--drop-every SECONDS] [--timeout SECONDS] [--check] [--json]
+
+With --check, the exit status is 1 if any message is lost, if there are any gaps, or if RSS,
+threads, file descriptors or transport queues grow across renewals. The check also runs under
+pytest, in tests/benchmarks/test_soak.py.
+"""
+
+import argparse
+import array
+import functools
+import json
+import sys
+import threading
+import time
+from azure.iot.hub.devicesdk import sync_clients
+from azure.iot.hub.devicesdk.common import Message
+from azure.iot.hub.devicesdk.common.clock import SimulatedClock
+from azure.iot.hub.devicesdk.auth.authentication_provider_factory import from_connection_string
+from azure.iot.hub.devicesdk.testing import FakeIoTHub
+from . import _support
+
+DEFAULT_DAYS = 7
+DEFAULT_INTERVAL = 60
+DEFAULT_TIMEOUT = 10
+# A stretch without acknowledged telemetry longer than this many intervals is reported as a gap
+GAP_INTERVALS = 1.5
+# Growth per renewal above which a check fails. Counts must not grow at all, and RSS is allowed to
+# grow by a page or so as allocator pools settle.
+COUNT_THRESHOLD = 0.05
+RSS_THRESHOLD = 8192
+
+_DEVICE_ID = "soak-device"
+_RESOURCES = ("rss_bytes", "threads", "open_fds", "in_progress_actions", "unknown_mid_responses")
+
+
+class _Sends(object):
+    """Records the send time and acknowledgement latency of every message in arrays allocated up
+    front, so that recording them does not add to the memory growth being measured."""
+
+    def __init__(self, count):
+        self.started = array.array("d", [0.0]) * count
+        self.latencies = array.array("d", [-1.0]) * count
+        self._acknowledged = threading.Condition()
+
+    def start(self, index):
+        self.started[index] = time.perf_counter()
+        return functools.partial(self._complete, index)
+
+    def _complete(self, index, error=None):
+        with self._acknowledged:
+            self.latencies[index] = time.perf_counter() - self.started[index]
+            self._acknowledged.notify_all()
+
+    def wait(self, indexes, timeout):
+        """Wait until every message in a range has been acknowledged.
+
+        :returns: True if they were all acknowledged within the timeout.
+        """
+        deadline = time.perf_counter() + timeout
+        with self._acknowledged:
+            for index in indexes:
+                while self.latencies[index] < 0:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        return False
+                    self._acknowledged.wait(remaining)
+        return True
+
+
+def _sample_resources(transport, clock, renewals):
+    stats = transport.get_stats()
+    return {
+        "renewals": renewals,
+        "hours": round(clock.monotonic() / 3600.0, 2),
+        "rss_bytes": _support.rss_bytes(),
+        "threads": threading.active_count(),
+        "open_fds": _support.open_fds(),
+        "in_progress_actions": stats["in_progress_actions"],
+        "unknown_mid_responses": stats["unknown_mid_responses"],
+    }
+
+
+def _growth(samples):
+    """Fit the growth per renewal of each resource over the second half of the samples, which
+    excludes caches and allocator pools filling up over the first renewals."""
+    growth = {}
+    for name in _RESOURCES:
+        points = [(s["renewals"], s[name]) for s in samples[len(samples) // 2 :]]
+        points = [(x, y) for x, y in points if y is not None]
+        fitted = _support.slope(points)
+        growth[name] = round(fitted, 3) if fitted is not None else None
+    return growth
+
+
+def _gaps(latencies, interval):
+    """Find the stretches of simulated time without an acknowledged message. Message i is sent
+    (i + 1) intervals into the run."""
+    gaps = []
+    previous = 0.0
+    for index, latency in enumerate(latencies):
+        if latency < 0:
+            continue
+        sent_at = (index + 1) * interval
+        if sent_at - previous > interval * GAP_INTERVALS:
+            gaps.append({"hour": round(previous / 3600.0, 2), "seconds": sent_at - previous})
+        previous = sent_at
+    return gaps
+
+
+def measure(days=DEFAULT_DAYS, interval=DEFAULT_INTERVAL, drop_every=None, timeout=DEFAULT_TIMEOUT):
+    """Run a client for a number of simulated days.
+
+    :param float days: The number of simulated days to run for.
+    :param float interval: Simulated seconds between telemetry messages.
+    :param float drop_every: Simulated seconds between connections dropped by the hub, if any.
+    :param float timeout: Seconds to wait for each acknowledgement before moving on.
+    :returns: A result dictionary.
+    :raises: RuntimeError if the hub's TLS certificate cannot be generated.
+    """
+    clock = SimulatedClock()
+    hub = FakeIoTHub(record_messages=False, clock=clock, enforce_token_expiry=True).start()
+    try:
+        auth_provider = from_connection_string(hub.connection_string(_DEVICE_ID))
+        auth_provider.ca_cert = hub.ca_cert
+        auth_provider.clock = clock
+        client = sync_clients.DeviceClient.from_authentication_provider(
+            auth_provider, "mqtt", port=hub.tls_port, clock=clock
+        )
+        transport = client._transport
+        wall_start = time.perf_counter()
+        client.connect()
+        try:
+            result = _soak(client, hub, clock, days, interval, drop_every, timeout)
+        finally:
+            client.disconnect()
+        result["wall_seconds"] = round(time.perf_counter() - wall_start, 1)
+        result["received"] = hub.message_count
+        result["duplicates"] = max(hub.message_count - result["sent"], 0)
+        result["expired_disconnects"] = hub.expired_disconnects
+        stats = transport.get_stats()
+        result["reconnects"] = stats["reconnects"]
+        result["disconnects"] = stats["disconnects"]
+    finally:
+        hub.stop()
+    return result
+
+
+def _soak(client, hub, clock, days, interval, drop_every, timeout):
+    transport = client._transport
+    auth_provider = transport._auth_provider
+    steps = int(days * 86400 / interval)
+    payload = b'{"temperature": 21.5}'
+    sends = _Sends(steps)
+    late = 0
+    drops = 0
+    after_renewal = []
+    samples = [_sample_resources(transport, clock, 0)]
+    next_drop = drop_every
+
+    for index in range(steps):
+        token = auth_provider.sas_token_str
+        clock.advance(interval)
+        if next_drop and clock.monotonic() >= next_drop:
+            drops += hub.disconnect_client(_DEVICE_ID)
+            next_drop += drop_every
+        transport.send_event(Message(payload), sends.start(index))
+        if not sends.wait((index,), timeout):
+            late += 1
+        if auth_provider.sas_token_str != token:
+            after_renewal.append(index)
+            samples.append(_sample_resources(transport, clock, len(after_renewal)))
+
+    # Wait for messages still in flight, then count those which never arrived as lost
+    sends.wait(range(steps), timeout)
+    latencies = [latency for latency in sends.latencies if latency >= 0]
+    lost = steps - len(latencies)
+    return {
+        "days": days,
+        "interval": interval,
+        "sent": steps,
+        "acknowledged": len(latencies),
+        "lost": lost,
+        "late": late - lost,
+        "renewals": len(after_renewal),
+        "drops": drops,
+        "gaps": _gaps(sends.latencies, interval),
+        "latency_ms": _support.latency_percentiles(latencies),
+        "latency_after_renewal_ms": _support.latency_percentiles(
+            [sends.latencies[index] for index in after_renewal if sends.latencies[index] >= 0]
+        ),
+        "resources": samples,
+        "growth_per_renewal": _growth(samples),
+    }
+
+
+def check(result, count_threshold=COUNT_THRESHOLD, rss_threshold=RSS_THRESHOLD):
+    """Find the problems in a result.
+
+    :param dict result: A result returned by measure. A "failures" key is added to it.
+    :param float count_threshold: The most threads, file descriptors or queued entries that may be
+    gained per renewal.
+    :param float rss_threshold: The most bytes of RSS that may be gained per renewal, or None to
+    leave RSS unchecked, as in runs too short for it to settle.
+    :returns: A list of descriptions of the problems found, which is empty if there are none.
+    """
+    failures = []
+    if result["lost"]:
+        failures.append("{} messages lost".format(result["lost"]))
+    if result["gaps"]:
+        failures.append("{} gaps in telemetry".format(len(result["gaps"])))
+    if result["received"] < result["sent"]:
+        failures.append("{} sent, {} received".format(result["sent"], result["received"]))
+    for name, growth in sorted(result["growth_per_renewal"].items()):
+        threshold = rss_threshold if name == "rss_bytes" else count_threshold
+        if growth is not None and threshold is not None and growth > threshold:
+            failures.append("{} grows by {} per renewal".format(name, growth))
+    result["failures"] = failures
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Soak test token renewal and reconnection")
+    parser.add_argument("--days", type=float, default=DEFAULT_DAYS, help="simulated days")
+    parser.add_argument(
+        "--interval", type=float, default=DEFAULT_INTERVAL, help="simulated seconds per message"
+    )
+    parser.add_argument(
+        "--drop-every", type=float, help="simulated seconds between dropped connections"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds to wait for each ack"
+    )
+    parser.add_argument("--check", action="store_true", help="exit with 1 if a check fails")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    result = measure(args.days, args.interval, args.drop_every, args.timeout)
+    failures = check(result)
+    if args.json:
+        parameters = {k: v for k, v in vars(args).items() if k != "json"}
+        print(json.dumps(_support.report("soak", parameters, [result]), indent=2))
+    else:
+        print(
+            "{} simulated days in {} s: {} sent, {} acknowledged, {} received by the hub".format(
+                result["days"],
+                result["wall_seconds"],
+                result["sent"],
+                result["acknowledged"],
+                result["received"],
+            )
+        )
+        print(
+            "  lost {}, late {}, duplicates {}, gaps {}, renewals {}, reconnects {}, drops {}, "
+            "expired disconnects {}".format(
+                result["lost"],
+                result["late"],
+                result["duplicates"],
+                len(result["gaps"]),
+                result["renewals"],
+                result["reconnects"],
+                result["drops"],
+                result["expired_disconnects"],
+            )
+        )
+        print("  latency ms: {}".format(result["latency_ms"]))
+        print("  latency after renewal ms: {}".format(result["latency_after_renewal_ms"]))
+        for gap in result["gaps"]:
+            print("  gap of {seconds} s at hour {hour}".format(**gap))
+        print("  growth per renewal: {}".format(result["growth_per_renewal"]))
+        for failure in failures:
+            print("  FAILED: " + failure)
+
+    if args.check and failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,3 +6,5 @@ INTERNAL USAGE ONLY
 
 from .message import Message
 from .method_request import MethodRequest
+from .message_template import MessageTemplate
+from .payload_codecs import CodecRegistry, PayloadCodec
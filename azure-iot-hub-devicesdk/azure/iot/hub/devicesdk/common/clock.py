@@ -0,0 +1,149 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains the clock used to tell the time and schedule timed calls, so that timing
+behavior such as SAS token renewal can be run on simulated time.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from threading import Timer
+
+logger = logging.getLogger(__name__)
+
+_monotonic = getattr(time, "monotonic", time.time)
+
+
+class Clock(object):
+    """A clock reading the system time, which schedules calls with threading.Timer."""
+
+    def time(self):
+        """Get the current time.
+
+        :returns: Seconds since the epoch, as a float.
+        """
+        return time.time()
+
+    def monotonic(self):
+        """Get the time from a clock which never goes backwards, for measuring intervals.
+
+        :returns: Seconds from an arbitrary starting point, as a float.
+        """
+        return _monotonic()
+
+    def call_later(self, delay, function, daemon=False):
+        """Call a function once a number of seconds has passed.
+
+        :param float delay: The number of seconds to wait.
+        :param function: The function to call, with no arguments.
+        :param bool daemon: Whether the call should be skipped if the process exits first.
+        Default False.
+        :returns: A handle whose cancel() method stops the call if it has not been made.
+        """
+        timer = Timer(delay, function)
+        timer.daemon = daemon
+        timer.start()
+        return timer
+
+
+SYSTEM_CLOCK = Clock()
+
+
+class _ScheduledCall(object):
+    __slots__ = ("due", "function", "cancelled")
+
+    def __init__(self, due, function):
+        self.due = due
+        self.function = function
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class SimulatedClock(Clock):
+    """A clock whose time only moves when it is advanced, for running hours of timed behavior in
+    moments.
+
+    Scheduled calls are made by advance(), on the thread calling it, in the order they are due. The
+    time reads as the due time of each call while it is made.
+
+    :ivar int calls_made: The number of scheduled calls which have been made.
+    """
+
+    def __init__(self, start=None):
+        """Initializer for SimulatedClock.
+
+        :param float start: The starting time in seconds since the epoch. Default the current time.
+        """
+        self._time = time.time() if start is None else float(start)
+        self._elapsed = 0.0
+        self._scheduled = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self.calls_made = 0
+
+    def time(self):
+        return self._time + self._elapsed
+
+    def monotonic(self):
+        return self._elapsed
+
+    def call_later(self, delay, function, daemon=False):
+        with self._lock:
+            call = _ScheduledCall(self._elapsed + max(delay, 0), function)
+            heapq.heappush(self._scheduled, (call.due, next(self._sequence), call))
+        return call
+
+    @property
+    def pending(self):
+        """The number of scheduled calls which have not been made or cancelled."""
+        with self._lock:
+            return sum(1 for _, _, call in self._scheduled if not call.cancelled)
+
+    def next_due(self):
+        """Get how long it is until the next scheduled call.
+
+        :returns: Seconds until the next call is due, or None if no calls are scheduled.
+        """
+        with self._lock:
+            self._discard_cancelled()
+            if not self._scheduled:
+                return None
+            return self._scheduled[0][0] - self._elapsed
+
+    def _discard_cancelled(self):
+        while self._scheduled and self._scheduled[0][2].cancelled:
+            heapq.heappop(self._scheduled)
+
+    def advance(self, seconds):
+        """Move time forward, making each scheduled call which falls due.
+
+        Calls scheduled by a call are made in the same advance if they fall due within it.
+        Exceptions raised by calls are logged.
+
+        :param float seconds: The number of seconds to move forward.
+        :returns: The number of calls made.
+        """
+        end = self._elapsed + seconds
+        made = 0
+        while True:
+            with self._lock:
+                self._discard_cancelled()
+                if not self._scheduled or self._scheduled[0][0] > end:
+                    self._elapsed = max(self._elapsed, end)
+                    break
+                due, _, call = heapq.heappop(self._scheduled)
+                self._elapsed = max(self._elapsed, due)
+            try:
+                call.function()
+            except Exception:
+                logger.exception("Unhandled exception in call scheduled on a SimulatedClock")
+            made += 1
+            self.calls_made += 1
+        return made
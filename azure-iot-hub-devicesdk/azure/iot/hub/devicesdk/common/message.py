@@ -27,8 +27,30 @@ class Message(object):
     :ivar ack: A feedback message generator. This property is used in C2D messages to request IoT Hub to generate feedback messages as a result of the consumption of the message by the device
     :ivar content_encoding: Content encoding of the message data. Can be 'utf-8', 'utf-16' or 'utf-32'
     :ivar content_type: Content type property used to route messages with the message-body. Can be 'application/json'
+    :ivar output_name: Name of the output that the message is being sent to
+    :ivar input_name: Name of the input that the message was received on
     """
 
+    # Messages are held in large numbers by inboxes and the transport's pending queue, so
+    # they use slots instead of a per-instance __dict__.
+    __slots__ = (
+        "data",
+        "_custom_properties",
+        "lock_token",
+        "message_id",
+        "sequence_number",
+        "to",
+        "expiry_time_utc",
+        "enqueued_time",
+        "correlation_id",
+        "user_id",
+        "ack",
+        "content_encoding",
+        "content_type",
+        "output_name",
+        "input_name",
+    )
+
     def __init__(self, data, message_id=None, content_encoding=None, content_type=None):
         """
         Initializer for Message
@@ -39,7 +61,7 @@ class Message(object):
         :param content_type: Content type property used to routes with the message body. Can be 'application/json'
         """
         self.data = data
-        self.custom_properties = {}
+        self._custom_properties = None
         self.lock_token = None
         self.message_id = message_id
         self.sequence_number = None
@@ -52,3 +74,28 @@ class Message(object):
         self.content_encoding = content_encoding
         self.content_type = content_type
         self.output_name = None
+        self.input_name = None
+
+    @property
+    def custom_properties(self):
+        """Dictionary of custom message properties.
+
+        Most messages have no custom properties, so the dictionary is only created the first
+        time it is accessed.
+        """
+        if self._custom_properties is None:
+            self._custom_properties = {}
+        return self._custom_properties
+
+    @custom_properties.setter
+    def custom_properties(self, value):
+        self._custom_properties = value
+
+    @property
+    def has_custom_properties(self):
+        """True if the message has at least one custom property.
+
+        Unlike custom_properties, this does not create the dictionary, so it is used on the send
+        and receive paths to skip the properties of messages which have none.
+        """
+        return bool(self._custom_properties)
@@ -0,0 +1,36 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a class representing the fixed properties of a stream of messages.
+"""
+
+
+class MessageTemplate(object):
+    """Represents the properties shared by many messages, encoded once by the transport.
+
+    Templates are created with the create_message_template method of a client, and used to send
+    payloads with send_event_from_template. Changing the message that a template was created
+    from has no effect on the template.
+
+    :ivar str output_name: The output that messages sent with this template are sent to, if any.
+    """
+
+    __slots__ = ("_encoded_topic", "_output_name")
+
+    def __init__(self, encoded_topic, output_name=None):
+        """Initializer for a MessageTemplate.
+
+        This initializer should not be called directly. Use the create_message_template method of
+        a client instead.
+
+        :param str encoded_topic: The transport-specific topic including the encoded properties.
+        :param str output_name: The output name of the message the template was created from.
+        """
+        self._encoded_topic = encoded_topic
+        self._output_name = output_name
+
+    @property
+    def output_name(self):
+        return self._output_name
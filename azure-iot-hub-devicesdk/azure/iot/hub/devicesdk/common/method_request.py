@@ -14,6 +14,8 @@ class MethodRequest(object):
     :ivar payload: The payload being sent with the request.
     """
 
+    __slots__ = ("_request_id", "_name", "_payload")
+
     def __init__(self, request_id, name, payload):
         """Initializer for a MethodRequest.
 
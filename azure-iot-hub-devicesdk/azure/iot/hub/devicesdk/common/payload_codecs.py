@@ -0,0 +1,256 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains codecs for serializing message payloads, and a registry
+for selecting between them based on content type.
+"""
+
+import abc
+import json
+import logging
+import six
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+logger = logging.getLogger(__name__)
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+CBOR_CONTENT_TYPE = "application/cbor"
+
+
+@six.add_metaclass(abc.ABCMeta)
+class PayloadCodec(object):
+    """Base class for codecs which convert payload objects to and from bytes.
+
+    :ivar str content_type: The content type stamped on messages encoded by this codec.
+    :ivar str content_encoding: The content encoding stamped on messages encoded by this codec.
+    """
+
+    content_type = None
+    content_encoding = None
+
+    @abc.abstractmethod
+    def encode(self, obj):
+        """Serialize an object.
+
+        :param obj: The object to serialize.
+        :returns: The serialized bytes.
+        """
+        pass
+
+    @abc.abstractmethod
+    def decode(self, payload, content_encoding=None):
+        """Deserialize a payload.
+
+        :param bytes payload: The payload to deserialize.
+        :param str content_encoding: The content encoding the payload was received with, if any.
+        :returns: The deserialized object.
+        """
+        pass
+
+
+class JsonCodec(PayloadCodec):
+    """Codec for JSON payloads using the json module from the standard library."""
+
+    content_type = JSON_CONTENT_TYPE
+    content_encoding = "utf-8"
+
+    def encode(self, obj):
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, payload, content_encoding=None):
+        if isinstance(payload, six.binary_type):
+            payload = payload.decode(content_encoding or self.content_encoding)
+        return json.loads(payload)
+
+
+class FastJsonCodec(JsonCodec):
+    """Codec for JSON payloads using orjson or ujson, whichever is installed.
+
+    Only available if one of those libraries is installed.
+    """
+
+    def __init__(self):
+        if orjson:
+            self._dumps = orjson.dumps
+            self._loads = orjson.loads
+        elif ujson:
+            self._dumps = lambda obj: ujson.dumps(obj).encode("utf-8")
+            self._loads = ujson.loads
+        else:
+            raise ImportError("FastJsonCodec requires orjson or ujson to be installed")
+
+    def encode(self, obj):
+        return self._dumps(obj)
+
+    def decode(self, payload, content_encoding=None):
+        if content_encoding and content_encoding.lower() not in ("utf-8", "utf8"):
+            payload = payload.decode(content_encoding)
+        return self._loads(payload)
+
+
+class MsgPackCodec(PayloadCodec):
+    """Codec for MessagePack payloads.
+
+    Only available if msgpack is installed.
+    """
+
+    content_type = MSGPACK_CONTENT_TYPE
+
+    def __init__(self):
+        if not msgpack:
+            raise ImportError("MsgPackCodec requires msgpack to be installed")
+
+    def encode(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, payload, content_encoding=None):
+        return msgpack.unpackb(payload, raw=False)
+
+
+class CborCodec(PayloadCodec):
+    """Codec for CBOR payloads.
+
+    Only available if cbor2 is installed.
+    """
+
+    content_type = CBOR_CONTENT_TYPE
+
+    def __init__(self):
+        if not cbor2:
+            raise ImportError("CborCodec requires cbor2 to be installed")
+
+    def encode(self, obj):
+        return cbor2.dumps(obj)
+
+    def decode(self, payload, content_encoding=None):
+        return cbor2.loads(payload)
+
+
+def available_codecs():
+    """Create an instance of every codec whose dependencies are installed.
+
+    :returns: A list of codecs, with the preferred JSON codec first.
+    """
+    codecs = []
+    if orjson or ujson:
+        codecs.append(FastJsonCodec())
+    else:
+        codecs.append(JsonCodec())
+    if msgpack:
+        codecs.append(MsgPackCodec())
+    if cbor2:
+        codecs.append(CborCodec())
+    return codecs
+
+
+class CodecRegistry(object):
+    """Selects codecs for encoding outgoing payloads and decoding incoming ones.
+
+    Payloads which are a dict or a list are encoded with the codec matching the message's
+    content_type, or the default codec if the message has no content_type. All other payloads
+    are sent as-is.
+
+    :ivar default_codec: The codec used for messages which do not specify a content_type.
+    :ivar bool decode_received_payloads: If True, received C2D and input message payloads are
+    decoded with the codec matching their content type. Default False.
+    """
+
+    def __init__(self):
+        """Initializer for CodecRegistry.
+
+        The registry starts with every codec whose dependencies are installed. The default codec
+        is JSON, using a fast JSON library if one is installed.
+        """
+        self._codecs = {}
+        self.default_codec = None
+        self.decode_received_payloads = False
+        for codec in available_codecs():
+            self.register(codec)
+        self.default_codec = self._codecs[JSON_CONTENT_TYPE]
+
+    def register(self, codec, default=False):
+        """Register a codec, replacing any codec previously registered for its content type.
+
+        :param codec: The PayloadCodec to register.
+        :param bool default: If True, make this codec the default codec.
+        """
+        self._codecs[_normalize(codec.content_type)] = codec
+        if default or (
+            self.default_codec and self.default_codec.content_type == codec.content_type
+        ):
+            self.default_codec = codec
+
+    def get(self, content_type):
+        """Get the codec registered for a content type.
+
+        :param str content_type: The content type.
+        :returns: The registered codec, or None if there is no codec for the content type.
+        """
+        return self._codecs.get(_normalize(content_type))
+
+    def encode(self, data, content_type=None):
+        """Encode a payload if it is a dict or a list.
+
+        :param data: The payload to encode.
+        :param str content_type: Optionally provide the content type to encode the payload as.
+        :returns: A tuple of (payload, codec) where codec is None if the payload was not encoded.
+        :raises: ValueError if no codec is registered for the given content type.
+        """
+        if not isinstance(data, (dict, list)):
+            return data, None
+        if content_type:
+            codec = self.get(content_type)
+            if not codec:
+                raise ValueError("No codec registered for content type " + content_type)
+        else:
+            codec = self.default_codec
+        return codec.encode(data), codec
+
+    def decode(self, payload, content_type, content_encoding=None):
+        """Decode a payload using the codec for its content type.
+
+        If there is no codec for the content type, or the payload cannot be decoded, the payload
+        is returned unchanged.
+
+        :param bytes payload: The payload to decode.
+        :param str content_type: The content type of the payload.
+        :param str content_encoding: The content encoding of the payload, if any.
+        :returns: The decoded payload.
+        """
+        if not content_type:
+            return payload
+        codec = self.get(content_type)
+        if not codec:
+            return payload
+        try:
+            return codec.decode(payload, content_encoding)
+        except Exception:
+            logger.warning("Unable to decode payload with content type %s", content_type)
+            return payload
+
+
+def _normalize(content_type):
+    """Strip parameters such as charset from a content type and convert it to lowercase."""
+    return content_type.split(";", 1)[0].strip().lower()
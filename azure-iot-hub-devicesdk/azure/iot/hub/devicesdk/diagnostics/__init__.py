@@ -0,0 +1,12 @@
+"""Azure IoT Hub Device SDK Diagnostics
+
+This package provides opt-in instrumentation for measuring the behavior of the Azure IoT Hub
+Device SDK at runtime.
+"""
+
+from .flight_recorder import FlightRecorder, FlightEvent
+from .histogram import LatencyHistogram
+from .latency import LatencyRecorder, SendTimings
+from .metrics import TransportMetrics, OpenMetricsExporter, MetricsReporter, format_openmetrics
+from .tracing import Tracer, Span, OpenTelemetryTracer
+from .watchdog import CallbackWatchdog, StallReport
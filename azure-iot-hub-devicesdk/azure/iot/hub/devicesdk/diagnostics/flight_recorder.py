@@ -0,0 +1,166 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a flight recorder, which keeps the most recent events of a transport and
+its MQTT provider in a ring buffer so that they can be examined after something goes wrong.
+
+The buffer is allocated in full when the recorder is created, and recording an event replaces one
+slot in it with a small tuple, which takes a few hundred nanoseconds, so a recorder can be left on
+where INFO logging would cost too much. Events
+are written to the log only when the recorder is dumped, either on demand or when an error is
+recorded.
+
+Each event has a name, a key and a value:
+    transition   the trigger and the state of the transport after it
+    publish      the MID and topic of a PUBLISH handed to the MQTT client
+    subscribe    the MID and topic of a SUBSCRIBE
+    unsubscribe  the MID and topic of an UNSUBSCRIBE
+    puback       the MID of a PUBACK (and suback and unsuback likewise)
+    connect      the MQTT client being asked to connect (reconnect likewise), with the hostname
+                 and port
+    connack      the CONNACK result code
+    disconnect   the disconnect result code, which is 0 when the disconnect was requested
+    token        the SAS token being renewed
+    expired      a queued message dropped because it expired, with its message id
+    error        an unexpected exception, with where it was raised and its repr
+"""
+
+import itertools
+import logging
+import time
+from collections import namedtuple
+from azure.iot.hub.devicesdk.common.clock import SYSTEM_CLOCK
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAPACITY = 1024
+
+TRANSITION = "transition"
+PUBLISH = "publish"
+SUBSCRIBE = "subscribe"
+UNSUBSCRIBE = "unsubscribe"
+PUBACK = "puback"
+SUBACK = "suback"
+UNSUBACK = "unsuback"
+CONNECT = "connect"
+RECONNECT = "reconnect"
+CONNACK = "connack"
+DISCONNECT = "disconnect"
+TOKEN = "token"
+EXPIRED = "expired"
+ERROR = "error"
+
+FlightEvent = namedtuple("FlightEvent", ["sequence", "time", "event", "key", "value"])
+
+
+class FlightRecorder(object):
+    """Records recent transport events in a fixed-size ring buffer.
+
+    Events may be recorded from any thread without a lock. Each event takes a sequence number from
+    a shared counter and is written to its slot in a single assignment, so a dump taken while events
+    are being recorded never sees half an event.
+
+    :ivar int capacity: The number of events kept. Older events are overwritten.
+    :ivar bool dump_on_error: Whether recording an error logs the events recorded since the last
+    dump.
+    :ivar clock: The Clock events are timestamped with. A transport given a recorder which uses the
+    system clock sets this to its own clock.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, dump_on_error=True, clock=None):
+        """Initializer for FlightRecorder.
+
+        :param int capacity: The number of events to keep. Default 1024.
+        :param bool dump_on_error: Whether recording an error logs the events recorded since the
+        last dump. Default True.
+        :param clock: The Clock events are timestamped with. Default the system clock.
+        :raises: ValueError if capacity is less than 1.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.dump_on_error = dump_on_error
+        self.clock = clock or SYSTEM_CLOCK
+        self._counter = itertools.count()
+        self._slots = [None] * capacity
+        self._dumped_through = -1
+
+    def record(self, event, key=None, value=None):
+        """Record an event, overwriting the oldest event if the buffer is full.
+
+        :param str event: The name of the event, one of the names in this module.
+        :param key: The MID, result code or trigger the event is about.
+        :param value: Further detail, such as a topic or a state.
+        """
+        sequence = next(self._counter)
+        self._slots[sequence % self.capacity] = (sequence, self.clock.time(), event, key, value)
+
+    def record_error(self, where, error):
+        """Record an unexpected exception, and dump the recent events if dump_on_error is set.
+
+        :param str where: What was running when the exception was raised.
+        :param error: The exception.
+        """
+        self.record(ERROR, where, repr(error))
+        if self.dump_on_error:
+            self.log_dump(logging.ERROR, "error in " + where, since_last_dump=True)
+
+    def dump(self):
+        """Get the events in the buffer.
+
+        :returns: A list of FlightEvent tuples, oldest first.
+        """
+        events = [FlightEvent._make(entry) for entry in list(self._slots) if entry is not None]
+        events.sort()
+        return events
+
+    def log_dump(self, level=logging.INFO, reason="requested", since_last_dump=False):
+        """Write the events in the buffer to the log, as one record.
+
+        :param int level: The level to log at. Default INFO.
+        :param str reason: Why the events are being dumped, for the first line of the record.
+        :param bool since_last_dump: Whether to leave out events written by an earlier dump, so
+        that repeated errors do not repeat the same events. Default False.
+        :returns: The number of events written.
+        """
+        if not logger.isEnabledFor(level):
+            return 0
+        events = self.dump()
+        if since_last_dump:
+            events = [e for e in events if e.sequence > self._dumped_through]
+        if events:
+            self._dumped_through = max(self._dumped_through, events[-1].sequence)
+        logger.log(
+            level,
+            "Flight recorder dump (%s), %d events:\n%s",
+            reason,
+            len(events),
+            format_events(events),
+        )
+        return len(events)
+
+    def clear(self):
+        """Discard every event in the buffer."""
+        self._slots = [None] * self.capacity
+
+
+def format_events(events):
+    """Format events as text, one line per event.
+
+    :param events: A list of FlightEvent tuples.
+    :returns: The formatted events.
+    """
+    lines = []
+    for event in events:
+        seconds = int(event.time)
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds))
+        microseconds = int((event.time - seconds) * 1e6)
+        line = "{}.{:06d}Z #{} {}".format(timestamp, microseconds, event.sequence, event.event)
+        if event.key is not None:
+            line += " " + str(event.key)
+        if event.value is not None:
+            line += " " + str(event.value)
+        lines.append(line)
+    return "\n".join(lines)
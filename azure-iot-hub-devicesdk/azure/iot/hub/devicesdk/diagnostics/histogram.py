@@ -0,0 +1,180 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a log-bucketed histogram for recording latencies in constant memory.
+"""
+
+DEFAULT_MAX_SECONDS = 3600
+DEFAULT_SUB_BUCKET_BITS = 7
+
+# Values are recorded as integer microseconds
+_UNITS_PER_SECOND = 1000000
+
+
+class LatencyHistogram(object):
+    """A histogram of latencies, in the style of HdrHistogram.
+
+    Values below 2**sub_bucket_bits microseconds are counted exactly. Above that, each power of two
+    range is split into 2**(sub_bucket_bits - 1) linear buckets, so every value is counted in a
+    bucket whose width is less than 2 / 2**sub_bucket_bits of the value: within 1.6% with the
+    default of 7 bits. The number of buckets depends only on the largest value tracked, so memory is
+    constant, and recording a value is a few integer operations.
+
+    Counts are incremented without a lock, so that recording can be done on the send and receive
+    paths. Recordings racing on two threads can occasionally lose one, which is acceptable for
+    monitoring.
+
+    :ivar float max_seconds: The largest value tracked. Larger values are counted as this value.
+    """
+
+    def __init__(self, max_seconds=DEFAULT_MAX_SECONDS, sub_bucket_bits=DEFAULT_SUB_BUCKET_BITS):
+        """Initializer for LatencyHistogram.
+
+        :param float max_seconds: The largest value tracked, in seconds. Default one hour.
+        :param int sub_bucket_bits: The number of bits of precision kept for each value. Default 7.
+        """
+        self.max_seconds = max_seconds
+        self._sub_bucket_bits = sub_bucket_bits
+        self._sub_bucket_count = 1 << sub_bucket_bits
+        self._half_count = self._sub_bucket_count >> 1
+        self._max_value = int(max_seconds * _UNITS_PER_SECOND)
+        self._bucket_count = self._index(self._max_value) + 1
+        self._reset()
+
+    def _reset(self):
+        self._counts = [0] * self._bucket_count
+        self._total = 0
+        self._sum = 0
+        self._min = None
+        self._max = None
+
+    def _index(self, value):
+        """The index of the bucket counting an integer value."""
+        if value < self._sub_bucket_count:
+            return value
+        shift = value.bit_length() - self._sub_bucket_bits
+        return (
+            self._sub_bucket_count
+            + (shift - 1) * self._half_count
+            + (value >> shift)
+            - (self._half_count)
+        )
+
+    def _highest_value(self, index):
+        """The highest integer value counted in the bucket at an index."""
+        if index < self._sub_bucket_count:
+            return index
+        shift, sub_bucket = divmod(index - self._sub_bucket_count, self._half_count)
+        shift += 1
+        return ((sub_bucket + self._half_count + 1) << shift) - 1
+
+    def record(self, seconds):
+        """Record a latency.
+
+        :param float seconds: The latency in seconds. Negative values are counted as 0.
+        """
+        value = min(max(int(seconds * _UNITS_PER_SECOND), 0), self._max_value)
+        self._counts[self._index(value)] += 1
+        self._total += 1
+        self._sum += value
+        if self._max is None or value > self._max:
+            self._max = value
+        if self._min is None or value < self._min:
+            self._min = value
+
+    @property
+    def count(self):
+        """The number of values recorded."""
+        return self._total
+
+    @property
+    def sum(self):
+        """The sum of the values recorded, in seconds."""
+        return float(self._sum) / _UNITS_PER_SECOND
+
+    @property
+    def mean(self):
+        """The mean of the values recorded in seconds, or None if there are none."""
+        if not self._total:
+            return None
+        return float(self._sum) / self._total / _UNITS_PER_SECOND
+
+    @property
+    def min(self):
+        """The smallest value recorded in seconds, or None if there are none."""
+        return None if self._min is None else float(self._min) / _UNITS_PER_SECOND
+
+    @property
+    def max(self):
+        """The largest value recorded in seconds, or None if there are none."""
+        return None if self._max is None else float(self._max) / _UNITS_PER_SECOND
+
+    def percentile(self, percentile):
+        """Compute a percentile of the values recorded.
+
+        :param float percentile: The percentile, from 0 to 100.
+        :returns: The highest value in the bucket holding the percentile, in seconds, which is
+        never more than the largest value recorded. None if there are no values.
+        """
+        counts = list(self._counts)
+        total = sum(counts)
+        if not total:
+            return None
+        # The rank of the value at the percentile, counting from 1
+        rank = max(1, int(round(percentile / 100.0 * total)))
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return float(min(self._highest_value(index), self._max)) / _UNITS_PER_SECOND
+        return self.max
+
+    def summary(self, percentiles=(50, 99, 99.9)):
+        """Summarize the values recorded.
+
+        :param percentiles: The percentiles to compute.
+        :returns: A dictionary with the count, mean, min and max, and each percentile keyed by its
+        value, with latencies in seconds.
+        """
+        result = {"count": self.count, "mean": self.mean, "min": self.min, "max": self.max}
+        for percentile in percentiles:
+            result[percentile] = self.percentile(percentile)
+        return result
+
+    def snapshot(self, reset=False):
+        """Copy the values recorded so far.
+
+        :param bool reset: If True, start a new interval, so that the next snapshot only holds
+        values recorded after this one.
+        :returns: A LatencyHistogram holding the values recorded.
+        """
+        copy = LatencyHistogram(self.max_seconds, self._sub_bucket_bits)
+        copy._total, copy._sum, copy._min, copy._max = self._total, self._sum, self._min, self._max
+        if reset:
+            # Swap in new counts rather than copying, so that values recorded during the snapshot
+            # go to the next interval
+            copy._counts = self._counts
+            self._reset()
+        else:
+            copy._counts = list(self._counts)
+        return copy
+
+    def merge(self, other):
+        """Add the values recorded by another histogram with the same configuration.
+
+        :param LatencyHistogram other: The histogram to add.
+        :raises: ValueError if the histograms are configured differently.
+        """
+        if (other.max_seconds, other._sub_bucket_bits) != (self.max_seconds, self._sub_bucket_bits):
+            raise ValueError("Cannot merge histograms with different configurations")
+        for index, count in enumerate(other._counts):
+            if count:
+                self._counts[index] += count
+        self._total += other._total
+        self._sum += other._sum
+        if other._min is not None and (self._min is None or other._min < self._min):
+            self._min = other._min
+        if other._max is not None and (self._max is None or other._max > self._max):
+            self._max = other._max
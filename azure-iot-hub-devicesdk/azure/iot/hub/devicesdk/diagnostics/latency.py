@@ -0,0 +1,258 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains classes for recording where time is spent while sending and receiving
+messages.
+"""
+
+import collections
+import datetime
+import logging
+import threading
+from azure.iot.hub.devicesdk.common.clock import SYSTEM_CLOCK
+from .histogram import LatencyHistogram, DEFAULT_MAX_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Custom property holding the time a message was handed to the network, if stamping is enabled.
+SEND_TIME_PROPERTY = "iothub-send-time"
+
+DEFAULT_RECENT_SAMPLE_COUNT = 1024
+
+# The stages recorded in a histogram by LatencyRecorder. The send stages are properties of
+# SendTimings. receive_time is from a PUBLISH arriving to the message being put in its inbox, and
+# inbox_wait_time from then until the message is taken from the inbox with get().
+SEND_STAGES = ("enqueue_time", "queue_time", "publish_time", "ack_time", "total_time")
+RECEIVE_STAGES = ("receive_time", "inbox_wait_time")
+STAGES = SEND_STAGES + RECEIVE_STAGES
+
+
+class SendTimings(object):
+    """The times at which a message passed through each stage of the transport.
+
+    Times are in seconds from the monotonic time of the recorder's clock, except for send_time_utc.
+    Stages which have not been reached are None.
+
+    :ivar float enqueued: When send was called.
+    :ivar float queued: When the message was added to the pending action queue.
+    :ivar float dequeued: When the message was taken from the pending action queue.
+    :ivar float published: When the message was handed to the MQTT client.
+    :ivar float acknowledged: When the PUBACK for the message was received.
+    :ivar send_time_utc: The wall-clock time at which the message was taken from the queue.
+    """
+
+    __slots__ = ("enqueued", "queued", "dequeued", "published", "acknowledged", "send_time_utc")
+
+    def __init__(self, enqueued):
+        self.enqueued = enqueued
+        self.queued = None
+        self.dequeued = None
+        self.published = None
+        self.acknowledged = None
+        self.send_time_utc = None
+
+    @property
+    def enqueue_time(self):
+        """Seconds between calling send and adding the message to the pending action queue."""
+        return _difference(self.queued, self.enqueued)
+
+    @property
+    def queue_time(self):
+        """Seconds spent waiting in the pending action queue, for example while connecting."""
+        return _difference(self.dequeued, self.enqueued if self.queued is None else self.queued)
+
+    @property
+    def publish_time(self):
+        """Seconds spent encoding the message and handing it to the MQTT client."""
+        return _difference(self.published, self.dequeued)
+
+    @property
+    def ack_time(self):
+        """Seconds between handing the message to the MQTT client and receiving the PUBACK.
+
+        This covers time spent in the network and in the hub.
+        """
+        return _difference(self.acknowledged, self.published)
+
+    @property
+    def total_time(self):
+        """Seconds between calling send and receiving the PUBACK."""
+        return _difference(self.acknowledged, self.enqueued)
+
+
+def _difference(end, start):
+    if end is None or start is None:
+        return None
+    return end - start
+
+
+class LatencyRecorder(object):
+    """Records SendTimings for every message sent by a transport, and the time received messages
+    spend in each stage before they are read.
+
+    Completed timings are passed to the on_timings callback, if one is set, and the most recent
+    ones are kept for computing percentiles with summary(). Every stage is also recorded in a
+    LatencyHistogram, which counts all messages in constant memory, and can be read and reset at
+    each reporting interval with snapshot_histograms().
+
+    :ivar on_timings: Function called with the SendTimings of each acknowledged message. It is
+    called on the network thread, and should return quickly.
+    :ivar bool stamp_properties: If True, the wall-clock send time is sent with each message as
+    the iothub-send-time custom property, so that it can be compared with the enqueued time
+    recorded by the hub. The property is added to the encoded properties as the message is
+    published, and the Message itself is not changed. Messages sent with a template cannot be
+    stamped.
+    :ivar clock: The Clock timings are read from. A transport given a recorder which uses the
+    system clock sets this to its own clock, so that timings follow simulated time.
+    """
+
+    def __init__(
+        self,
+        on_timings=None,
+        stamp_properties=False,
+        recent_sample_count=DEFAULT_RECENT_SAMPLE_COUNT,
+        histogram_max_seconds=DEFAULT_MAX_SECONDS,
+        clock=None,
+    ):
+        """Initializer for LatencyRecorder.
+
+        :param on_timings: Optional function called with the SendTimings of each acknowledged message.
+        :param bool stamp_properties: If True, stamp the send time on each message. Default False.
+        :param int recent_sample_count: The number of recent timings kept for summary(). Default 1024.
+        :param float histogram_max_seconds: The largest latency tracked by the histograms. Larger
+        latencies are counted as this value. Default one hour.
+        :param clock: The Clock timings are read from. Default the system clock.
+        """
+        self.clock = clock or SYSTEM_CLOCK
+        self.on_timings = on_timings
+        self.stamp_properties = stamp_properties
+        self._recent = collections.deque(maxlen=recent_sample_count)
+        self._lock = threading.Lock()
+        self.histograms = {stage: LatencyHistogram(histogram_max_seconds) for stage in STAGES}
+
+    def start(self, callback):
+        """Start recording the timings of a message as it is enqueued.
+
+        :param callback: The callback which is called when the message is acknowledged.
+        :returns: A tuple of (timings, callback) where callback records the acknowledgement time
+        before calling the original callback. Messages which fail are not recorded.
+        """
+        timings = SendTimings(self.clock.monotonic())
+
+        def on_acknowledged(error=None):
+            if error:
+                if callback:
+                    callback(error=error)
+                return
+            timings.acknowledged = self.clock.monotonic()
+            self._complete(timings)
+            if callback:
+                callback()
+
+        return timings, on_acknowledged
+
+    def mark_queued(self, timings):
+        """Record that a message has been added to the pending action queue.
+
+        :param SendTimings timings: The timings of the message.
+        """
+        timings.queued = self.clock.monotonic()
+
+    def mark_dequeued(self, timings):
+        """Record that a message has been taken from the pending action queue.
+
+        :param SendTimings timings: The timings of the message.
+        """
+        timings.dequeued = self.clock.monotonic()
+        timings.send_time_utc = datetime.datetime.utcfromtimestamp(self.clock.time())
+
+    def send_time_properties(self, timings):
+        """Get the custom properties to stamp on a message as it is published.
+
+        :param SendTimings timings: The timings of the message, marked as dequeued.
+        :returns: A dictionary holding the iothub-send-time property, or None if stamping is not
+        enabled.
+        """
+        if not self.stamp_properties or timings.send_time_utc is None:
+            return None
+        return {SEND_TIME_PROPERTY: timings.send_time_utc.isoformat() + "Z"}
+
+    def mark_published(self, timings):
+        """Record that a message has been handed to the MQTT client.
+
+        :param SendTimings timings: The timings of the message.
+        """
+        if timings.published is None:
+            timings.published = self.clock.monotonic()
+
+    def mark_received(self):
+        """Get the time at which a message was received, to be passed to mark_delivered.
+
+        :returns: The current monotonic time of the clock.
+        """
+        return self.clock.monotonic()
+
+    def mark_delivered(self, received):
+        """Record that a received message has been put in its inbox.
+
+        :param float received: The time returned by mark_received when the message arrived.
+        """
+        self.histograms["receive_time"].record(self.clock.monotonic() - received)
+
+    def record(self, stage, seconds):
+        """Record a latency in the histogram of a stage.
+
+        :param str stage: One of STAGES.
+        :param float seconds: The latency.
+        """
+        self.histograms[stage].record(seconds)
+
+    def snapshot_histograms(self, reset=False):
+        """Copy the histogram of every stage.
+
+        :param bool reset: If True, start a new interval in every histogram, so that the next
+        snapshot only holds latencies recorded after this one. Default False.
+        :returns: A dictionary mapping each stage to a LatencyHistogram.
+        """
+        return {stage: h.snapshot(reset=reset) for stage, h in self.histograms.items()}
+
+    def _complete(self, timings):
+        with self._lock:
+            self._recent.append(timings)
+        for stage in SEND_STAGES:
+            value = getattr(timings, stage)
+            if value is not None:
+                self.histograms[stage].record(value)
+        if self.on_timings:
+            try:
+                self.on_timings(timings)
+            except Exception:
+                logger.exception("Unhandled exception in on_timings callback")
+
+    def summary(self, percentiles=(50, 99, 99.9)):
+        """Compute percentiles of each stage over the recent timings.
+
+        :param percentiles: The percentiles to compute.
+        :returns: A dictionary mapping each stage in SEND_STAGES to a dictionary mapping each
+        percentile to a number of seconds, or None if there are no samples.
+        """
+        with self._lock:
+            recent = list(self._recent)
+
+        result = {}
+        for stage in SEND_STAGES:
+            samples = sorted(
+                value for value in (getattr(t, stage) for t in recent) if value is not None
+            )
+            result[stage] = {p: _percentile(samples, p) for p in percentiles}
+        return result
+
+
+def _percentile(sorted_samples, percentile):
+    """Nearest-rank percentile of a sorted list."""
+    if not sorted_samples:
+        return None
+    index = int(round(percentile / 100.0 * (len(sorted_samples) - 1)))
+    return sorted_samples[index]
@@ -0,0 +1,110 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains the logging of per-message events on the send and receive paths.
+
+Per-message events are logged at DEBUG, and their arguments are only formatted if a record is
+emitted, so with logging at INFO or above each event costs a level check.
+
+DEBUG logs every event, which is too much in production at high message rates. Sampling logs one
+in every N occurrences of each event at INFO instead, which shows the flow of messages through the
+client at a bounded rate::
+
+    from azure.iot.hub.devicesdk.diagnostics import message_log
+    message_log.enable_sampling(every=1000)
+
+Sampled records have a ``sample_every`` attribute holding N, so that log processors can scale
+counts back up.
+"""
+
+import logging
+
+DEFAULT_SAMPLE_EVERY = 1000
+
+_sampling = None
+
+
+class _Sampling(object):
+    __slots__ = ("every", "level", "extra")
+
+    def __init__(self, every, level):
+        self.every = every
+        self.level = level
+        self.extra = {"sample_every": every}
+
+
+def enable_sampling(every=DEFAULT_SAMPLE_EVERY, level=logging.INFO):
+    """Log one in every N occurrences of each per-message event.
+
+    Sampling only applies while DEBUG is disabled for the logger of the event, since all events are
+    logged at DEBUG. Each call starts counting occurrences afresh, so the next occurrence of each
+    event is logged.
+
+    :param int every: Log the first occurrence of each event, then every Nth. Default 1000.
+    :param int level: The level to log sampled events at. Default INFO.
+    :raises: ValueError if every is less than 1.
+    """
+    global _sampling
+    if every < 1:
+        raise ValueError("every must be at least 1")
+    _sampling = _Sampling(every, level)
+
+
+def disable_sampling():
+    """Stop sampling per-message events, so that they are only logged at DEBUG."""
+    global _sampling
+    _sampling = None
+
+
+def sampling_enabled():
+    """Get whether per-message events are being sampled.
+
+    :returns: True if enable_sampling has been called since the last disable_sampling.
+    """
+    return _sampling is not None
+
+
+class MessageLogger(object):
+    """Logs the per-message events of one module.
+
+    Occurrences are counted for each message format string, so each event is sampled on its own
+    rather than in proportion to the other events. Counts are incremented without a lock, and
+    events racing on two threads can occasionally be counted once. Counts are kept for one call to
+    enable_sampling, and start again from zero at the next.
+    """
+
+    __slots__ = ("logger", "_counts", "_sampling")
+
+    def __init__(self, logger):
+        """Initializer for MessageLogger.
+
+        :param logger: The logging.Logger to log events to.
+        """
+        self.logger = logger
+        self._counts = {}
+        # The sampling the counts were made for
+        self._sampling = None
+
+    def log(self, msg, *args):
+        """Log a per-message event.
+
+        :param str msg: The format string of the event, which identifies it for sampling.
+        :param args: Arguments for the format string. They are only formatted if the event is
+        logged.
+        """
+        logger = self.logger
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(msg, *args)
+            return
+        sampling = _sampling
+        if sampling is None:
+            return
+        if sampling is not self._sampling:
+            self._sampling = sampling
+            self._counts = {}
+        count = self._counts.get(msg, 0)
+        self._counts[msg] = count + 1
+        if count % sampling.every == 0 and logger.isEnabledFor(sampling.level):
+            logger.log(sampling.level, msg, *args, extra=sampling.extra)
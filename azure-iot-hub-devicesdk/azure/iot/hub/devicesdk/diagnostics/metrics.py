@@ -0,0 +1,266 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains the counters kept by a transport, and exporters for the statistics returned
+by a client's get_stats().
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRIC_PREFIX = "azure_iot_hub_devicesdk"
+DEFAULT_REPORT_INTERVAL = 60
+
+# Statistics which only ever increase. All other numeric statistics are gauges.
+COUNTERS = (
+    "messages_sent",
+    "bytes_sent",
+    "messages_received",
+    "bytes_received",
+    "connects",
+    "reconnects",
+    "disconnects",
+    "unknown_mid_responses_discarded",
+    "expired_messages",
+    "duplicates_suppressed",
+    "subscriber_discards",
+    "network_loop_busy_seconds",
+    "callback_stalls",
+)
+
+_HELP = {
+    "messages_sent": "PUBLISH packets handed to the MQTT client, including chunks.",
+    "bytes_sent": "Topic and payload bytes of the PUBLISH packets sent.",
+    "messages_received": "PUBLISH packets received from the MQTT client.",
+    "bytes_received": "Topic and payload bytes of the PUBLISH packets received.",
+    "connects": "Connection attempts.",
+    "reconnects": "Reconnections made to renew the SAS token.",
+    "disconnects": "Disconnections, whether requested or not.",
+    "expired_messages": "Queued messages dropped because they expired before being sent.",
+    "duplicates_suppressed": "Received messages suppressed as duplicates.",
+    "subscriber_discards": "Messages discarded from full subscriber inboxes.",
+    "pending_actions": "Actions waiting in the pending action queue.",
+    "in_progress_actions": "Actions handed to the MQTT client and waiting for a response.",
+    "unknown_mid_responses": "Responses received for a MID which was not in progress.",
+    "unknown_mid_responses_discarded": "Responses with an unknown MID which were never claimed.",
+    "state": "The state of the transport.",
+    "inbox_depth": "Items waiting to be read from each inbox.",
+    "latency_seconds": "Latency of each stage of sending and receiving messages.",
+    "network_loop_busy_seconds": "Time the network thread spent running callback handlers.",
+    "callback_stalls": "Callbacks which ran for longer than the watchdog threshold.",
+    "callback_seconds": "Time taken by each callback made on the network thread.",
+}
+
+# Quantiles written for latency histograms
+LATENCY_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class TransportMetrics(object):
+    """Counters updated by a transport as it runs.
+
+    The counters are plain integers incremented without a lock, so that keeping them costs no more
+    than an attribute update on the send and receive paths. Increments of the same counter racing
+    on two threads can occasionally lose one, which is acceptable for monitoring.
+
+    :ivar int messages_sent: PUBLISH packets handed to the MQTT client, including chunks.
+    :ivar int bytes_sent: Topic and payload bytes of the PUBLISH packets sent.
+    :ivar int messages_received: PUBLISH packets received from the MQTT client.
+    :ivar int bytes_received: Topic and payload bytes of the PUBLISH packets received.
+    :ivar int connects: Connection attempts.
+    :ivar int reconnects: Reconnections made to renew the SAS token.
+    :ivar int disconnects: Disconnections, whether requested or not.
+    :ivar int unknown_mid_responses_discarded: Responses with a MID which was not in progress, and
+    which no action claimed before they were discarded.
+    """
+
+    __slots__ = (
+        "messages_sent",
+        "bytes_sent",
+        "messages_received",
+        "bytes_received",
+        "connects",
+        "reconnects",
+        "disconnects",
+        "unknown_mid_responses_discarded",
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def snapshot(self):
+        """Return the current value of every counter.
+
+        :returns: A dictionary mapping counter names to values.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def format_openmetrics(stats, prefix=DEFAULT_METRIC_PREFIX, labels=None, openmetrics=False):
+    """Format statistics as text in the Prometheus exposition format.
+
+    Counters are suffixed with _total. The state is written as a gauge with the state as a label
+    and the value 1, and inbox depths as a gauge labelled with the name of each inbox. Latency
+    histograms are written as a summary labelled with the stage, and callback duration histograms as
+    a summary labelled with the callback, with the quantiles in LATENCY_QUANTILES.
+
+    :param dict stats: Statistics returned by get_stats().
+    :param str prefix: The prefix of every metric name.
+    :param dict labels: Optional labels added to every sample, such as the device id.
+    :param bool openmetrics: If True, follow the OpenMetrics format, which ends with # EOF.
+    Default False.
+    :returns: The formatted text.
+    """
+    base_labels = sorted((labels or {}).items())
+    lines = []
+
+    def write(name, metric_type, samples):
+        metric = prefix + "_" + name
+        lines.append("# HELP {} {}".format(metric, _HELP.get(name, name)))
+        lines.append("# TYPE {} {}".format(metric, metric_type))
+        default_suffix = "_total" if metric_type == "counter" else ""
+        for sample in samples:
+            sample_labels, value = sample[:2]
+            suffix = sample[2] if len(sample) > 2 else default_suffix
+            lines.append(
+                "{}{}{} {}".format(
+                    metric, suffix, _format_labels(base_labels + sample_labels), value
+                )
+            )
+
+    for name in sorted(stats):
+        value = stats[name]
+        if name == "state":
+            write(name, "gauge", [([("state", value)], 1)])
+        elif name == "inbox_depth":
+            samples = [([("inbox", inbox)], depth) for inbox, depth in sorted(value.items())]
+            write(name, "gauge", samples)
+        elif name == "latency_seconds":
+            write(name, "summary", _latency_samples(value, "stage"))
+        elif name == "callback_seconds":
+            write(name, "summary", _latency_samples(value, "callback"))
+        elif isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        else:
+            write(name, "counter" if name in COUNTERS else "gauge", [([], value)])
+
+    if openmetrics:
+        lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def _latency_samples(histograms, label):
+    samples = []
+    for key, histogram in sorted(histograms.items()):
+        if not histogram.count:
+            continue
+        for quantile in LATENCY_QUANTILES:
+            labels = [(label, key), ("quantile", str(quantile))]
+            samples.append((labels, histogram.percentile(quantile * 100)))
+        samples.append(([(label, key)], histogram.sum, "_sum"))
+        samples.append(([(label, key)], histogram.count, "_count"))
+    return samples
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join('{}="{}"'.format(key, _escape_label_value(value)) for key, value in labels)
+        + "}"
+    )
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class OpenMetricsExporter(object):
+    """An exporter which formats statistics in the Prometheus exposition format.
+
+    Any object with an export(stats) method can be used as an exporter with MetricsReporter. This
+    one keeps the most recent text, to be served from a scrape endpoint, and optionally passes it
+    to a write function.
+
+    :ivar str last_text: The text produced by the most recent export, or None.
+    """
+
+    def __init__(self, prefix=DEFAULT_METRIC_PREFIX, labels=None, openmetrics=False, write=None):
+        """Initializer for OpenMetricsExporter.
+
+        :param str prefix: The prefix of every metric name.
+        :param dict labels: Optional labels added to every sample, such as the device id.
+        :param bool openmetrics: If True, follow the OpenMetrics format. Default False.
+        :param write: Optional function called with the text of each export.
+        """
+        self.prefix = prefix
+        self.labels = labels
+        self.openmetrics = openmetrics
+        self.write = write
+        self.last_text = None
+
+    def export(self, stats):
+        """Format statistics, keeping the text and passing it to the write function.
+
+        :param dict stats: Statistics returned by get_stats().
+        :returns: The formatted text.
+        """
+        text = format_openmetrics(stats, self.prefix, self.labels, self.openmetrics)
+        self.last_text = text
+        if self.write:
+            self.write(text)
+        return text
+
+
+class MetricsReporter(object):
+    """Periodically passes statistics to an exporter, on a daemon thread.
+
+    Errors raised by the exporter are logged, and do not stop the reporter.
+    """
+
+    def __init__(self, get_stats, exporter, interval=DEFAULT_REPORT_INTERVAL):
+        """Initializer for MetricsReporter.
+
+        :param get_stats: Function returning the statistics to export, such as client.get_stats.
+        :param exporter: An object with an export(stats) method, such as OpenMetricsExporter.
+        :param float interval: The number of seconds between exports. Default 60.
+        """
+        self.get_stats = get_stats
+        self.exporter = exporter
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start exporting statistics every interval."""
+        if self._thread:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="MetricsReporter")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop exporting, after a final export of the current statistics."""
+        if not self._thread:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def report(self):
+        """Export the current statistics immediately."""
+        try:
+            self.exporter.export(self.get_stats())
+        except Exception:
+            logger.exception("Unhandled exception exporting metrics")
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.report()
+        self.report()
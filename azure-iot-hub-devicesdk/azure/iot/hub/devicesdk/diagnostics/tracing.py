@@ -0,0 +1,284 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains hooks for tracing messages through the client, the transport and the MQTT
+provider.
+
+Tracing is disabled unless a Tracer is given to the transport, in which case every layer checks for
+it before doing any work, so that the disabled path costs one attribute test per stage.
+
+Spans are created for:
+- sending: the client call, the transport send (from the call until the PUBACK, with the MID and
+  topic as attributes and queued/dequeued/published events), and each publish to the MQTT client
+- receiving: the MQTT message callback, the transport routing the message to its inbox, and the
+  time the message waited in its inbox before the consumer took it
+"""
+
+import logging
+import threading
+import time
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def current_span():
+    """Get the span which is active on this thread.
+
+    :returns: The Span made current by activate, or None.
+    """
+    return getattr(_local, "span", None)
+
+
+class _Activation(object):
+    __slots__ = ("_span", "_previous")
+
+    def __init__(self, span):
+        self._span = span
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = getattr(_local, "span", None)
+        _local.span = self._span
+        return self._span
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _local.span = self._previous
+
+
+class _NoActivation(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+_NO_ACTIVATION = _NoActivation()
+
+
+def activate(span):
+    """Make a span the current span of this thread for the duration of a with statement, so that
+    spans started inside it are its children.
+
+    :param Span span: The span to activate. If None, nothing is changed.
+    :returns: A context manager.
+    """
+    if span is None:
+        return _NO_ACTIVATION
+    return _Activation(span)
+
+
+def bind(span, function):
+    """Wrap a function so that a span is active while it runs, on whichever thread calls it.
+
+    This carries a span into functions run on an executor, where the current span of the calling
+    thread is not visible.
+
+    :param Span span: The span to activate. If None, the function is returned unchanged.
+    :param function: The function to wrap.
+    :returns: The wrapped function.
+    """
+    if span is None:
+        return function
+
+    def run_in_span(*args, **kwargs):
+        with _Activation(span):
+            return function(*args, **kwargs)
+
+    return run_in_span
+
+
+def message_attributes(message):
+    """Get the span attributes describing a message.
+
+    :param Message message: The message.
+    :returns: A dictionary holding the message id, output name and input name of the message, for
+    those which are set.
+    """
+    attributes = {}
+    if message.message_id is not None:
+        attributes["message_id"] = message.message_id
+    if message.output_name is not None:
+        attributes["output_name"] = message.output_name
+    if message.input_name is not None:
+        attributes["input_name"] = message.input_name
+    return attributes
+
+
+class Span(object):
+    """A timed operation, with attributes describing it.
+
+    :ivar str name: The name of the operation.
+    :ivar dict attributes: Attributes of the operation, such as the MID, topic and payload size.
+    :ivar Span parent: The span this one was started in, or None.
+    :ivar float start_time: When the span started, in seconds since the epoch.
+    :ivar float end_time: When the span ended, or None if it has not ended.
+    :ivar list events: A list of (name, time, attributes) tuples for events during the span.
+    :ivar error: The error the operation failed with, or None.
+    """
+
+    def __init__(self, tracer, name, attributes=None, parent=None, start_time=None):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = dict(attributes) if attributes else {}
+        self.parent = parent
+        self.start_time = time.time() if start_time is None else start_time
+        self.end_time = None
+        self.events = []
+        self.error = None
+
+    @property
+    def duration(self):
+        """Seconds between the start and end of the span, or None if it has not ended."""
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def set_attribute(self, key, value):
+        """Set an attribute of the span.
+
+        :param str key: The name of the attribute.
+        :param value: The value of the attribute.
+        """
+        self.attributes[key] = value
+
+    def add_event(self, name, attributes=None):
+        """Record an event during the span.
+
+        :param str name: The name of the event.
+        :param dict attributes: Optional attributes of the event.
+        """
+        self.events.append((name, time.time(), attributes))
+
+    def end(self, error=None, end_time=None):
+        """End the span. Only the first call has any effect.
+
+        :param error: The error the operation failed with, if any.
+        :param float end_time: When the span ended, in seconds since the epoch. Default now.
+        """
+        if self.end_time is not None:
+            return
+        self.end_time = time.time() if end_time is None else end_time
+        self.error = error
+        self.tracer._span_ended(self)
+
+
+class Tracer(object):
+    """Creates spans, and calls hooks as they start and end.
+
+    The hooks are plain functions, so spans can be logged, counted or forwarded to any tracing
+    system without a dependency on it. Hooks are called on the thread starting or ending the span,
+    which may be the network thread, and should return quickly. Exceptions they raise are logged.
+
+    :ivar on_start: Function called with each span as it starts, or None.
+    :ivar on_end: Function called with each span as it ends, or None.
+    """
+
+    def __init__(self, on_start=None, on_end=None):
+        """Initializer for Tracer.
+
+        :param on_start: Optional function called with each Span as it starts.
+        :param on_end: Optional function called with each Span as it ends.
+        """
+        self.on_start = on_start
+        self.on_end = on_end
+
+    def start_span(self, name, attributes=None, parent=None, start_time=None):
+        """Start a span.
+
+        :param str name: The name of the operation.
+        :param dict attributes: Optional attributes of the operation.
+        :param Span parent: The parent span. Default the current span of this thread.
+        :param float start_time: When the span started, in seconds since the epoch. Default now.
+        :returns: The Span, which must be ended with end().
+        """
+        if parent is None:
+            parent = current_span()
+        span = self._create_span(name, attributes, parent, start_time)
+        if self.on_start:
+            try:
+                self.on_start(span)
+            except Exception:
+                logger.exception("Unhandled exception in on_start tracing hook")
+        return span
+
+    def _create_span(self, name, attributes, parent, start_time):
+        return Span(self, name, attributes, parent, start_time)
+
+    def _span_ended(self, span):
+        if self.on_end:
+            try:
+                self.on_end(span)
+            except Exception:
+                logger.exception("Unhandled exception in on_end tracing hook")
+
+
+class _OpenTelemetrySpan(Span):
+    def __init__(self, tracer, name, attributes, parent, start_time, otel_span):
+        super(_OpenTelemetrySpan, self).__init__(tracer, name, attributes, parent, start_time)
+        self.otel_span = otel_span
+
+    def set_attribute(self, key, value):
+        super(_OpenTelemetrySpan, self).set_attribute(key, value)
+        self.otel_span.set_attribute(key, value)
+
+    def add_event(self, name, attributes=None):
+        super(_OpenTelemetrySpan, self).add_event(name, attributes)
+        self.otel_span.add_event(name, attributes=attributes)
+
+    def end(self, error=None, end_time=None):
+        if self.end_time is not None:
+            return
+        if error is not None:
+            self.otel_span.record_exception(error)
+            self.otel_span.set_status(trace.Status(trace.StatusCode.ERROR, str(error)))
+        super(_OpenTelemetrySpan, self).end(error, end_time)
+        self.otel_span.end(end_time=_to_ns(self.end_time))
+
+
+def _to_ns(seconds):
+    return int(seconds * 1e9)
+
+
+class OpenTelemetryTracer(Tracer):
+    """A Tracer which forwards every span to OpenTelemetry.
+
+    Spans started inside another span of this tracer are children of it in OpenTelemetry too. The
+    on_start and on_end hooks are still called.
+
+    Only available if opentelemetry-api is installed.
+    """
+
+    def __init__(self, tracer=None, on_start=None, on_end=None):
+        """Initializer for OpenTelemetryTracer.
+
+        :param tracer: Optional OpenTelemetry tracer. Default the tracer for this package from the
+        global tracer provider.
+        :param on_start: Optional function called with each Span as it starts.
+        :param on_end: Optional function called with each Span as it ends.
+        """
+        if not trace:
+            raise ImportError("OpenTelemetryTracer requires opentelemetry-api to be installed")
+        super(OpenTelemetryTracer, self).__init__(on_start, on_end)
+        self.otel_tracer = tracer or trace.get_tracer("azure.iot.hub.devicesdk")
+
+    def _create_span(self, name, attributes, parent, start_time):
+        context = None
+        if isinstance(parent, _OpenTelemetrySpan):
+            context = trace.set_span_in_context(parent.otel_span)
+        span = _OpenTelemetrySpan(self, name, attributes, parent, start_time, None)
+        span.otel_span = self.otel_tracer.start_span(
+            name, context=context, attributes=span.attributes, start_time=_to_ns(span.start_time),
+        )
+        return span
@@ -0,0 +1,256 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a watchdog for the callbacks an MQTT provider makes on paho's network
+thread.
+
+Paho reads packets, sends keepalives and processes acknowledgements on one thread, and the
+provider calls the transport's handlers on that thread, so a handler which blocks, such as one
+putting a message into a full inbox, stalls the whole connection. The watchdog times every
+callback, and reports each one which runs for longer than a threshold, with the handler and the
+stack of the network thread.
+
+A callback is only caught while it is still running if the watchdog has been started, which runs
+a monitor thread. Otherwise it is reported when it returns, without a stack.
+"""
+
+import logging
+import sys
+import threading
+import traceback
+from collections import namedtuple
+from six.moves import _thread
+from azure.iot.hub.devicesdk.common.clock import SYSTEM_CLOCK
+from .histogram import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STALL_THRESHOLD = 1.0
+
+StallReport = namedtuple("StallReport", ["callback", "handler", "seconds", "thread", "stack"])
+StallReport.__doc__ = """A callback which ran for longer than the threshold.
+
+The stack is a list of formatted frames of the network thread, taken while the callback was
+running, or None if the callback was only reported when it returned.
+"""
+
+
+def handler_name(handler):
+    """Get a readable name for a callback handler, such as MQTTTransport._on_provider_connect_complete.
+
+    :param handler: The handler, usually a bound method.
+    :returns: The name.
+    """
+    owner = getattr(handler, "__self__", None)
+    name = getattr(handler, "__name__", None)
+    if name is None:
+        return repr(handler)
+    if owner is not None:
+        return type(owner).__name__ + "." + name
+    return getattr(handler, "__module__", "?") + "." + name
+
+
+class _RunningCallback(object):
+    __slots__ = ("callback", "handler", "started", "reported", "previous")
+
+    def __init__(self, callback, handler, started, previous):
+        self.callback = callback
+        self.handler = handler
+        self.started = started
+        self.reported = False
+        # The callback this one was called from on the same thread, if any
+        self.previous = previous
+
+
+class CallbackWatchdog(object):
+    """Times the callbacks made on the network thread, and reports those which stall it.
+
+    One watchdog can be shared by the providers of many transports.
+
+    Callbacks are timed without a lock, so that the watchdog adds little to the time each one
+    takes. The lock is only taken to report a callback, so that it is reported once, and by a
+    snapshot. The busy time of two network threads finishing callbacks at once can occasionally
+    lose one of them, which is acceptable for monitoring.
+
+    :ivar float threshold: Seconds a callback may run before it is reported.
+    :ivar on_stall: Optional function called with a StallReport for each callback reported.
+    :ivar int stall_count: The number of callbacks reported.
+    :ivar clock: The Clock callbacks are timed with. A transport given a watchdog which uses the
+    system clock sets this to its own clock.
+    """
+
+    def __init__(
+        self, threshold=DEFAULT_STALL_THRESHOLD, on_stall=None, poll_interval=None, clock=None
+    ):
+        """Initializer for CallbackWatchdog.
+
+        :param float threshold: Seconds a callback may run before it is reported. Default 1.
+        :param on_stall: Optional function called with a StallReport for each callback reported,
+        on the monitor thread or the network thread.
+        :param float poll_interval: Seconds between checks made by the monitor thread. Default a
+        quarter of the threshold.
+        :param clock: The Clock callbacks are timed with. Default the system clock.
+        """
+        self.threshold = threshold
+        self.on_stall = on_stall
+        self.poll_interval = poll_interval or threshold / 4.0
+        self.stall_count = 0
+        self.clock = clock or SYSTEM_CLOCK
+        self._lock = threading.Lock()
+        # Maps the ident of each thread running a callback to its innermost _RunningCallback
+        self._running = {}
+        self._busy_seconds = 0.0
+        self._histograms = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def call(self, callback, handler, *args):
+        """Call a handler, timing it.
+
+        :param str callback: The name of the callback, such as on_mqtt_message_received.
+        :param handler: The function to call.
+        :param args: The arguments to call it with.
+        :returns: What the handler returns. Exceptions it raises are passed on.
+        """
+        ident = _thread.get_ident()
+        running = _RunningCallback(
+            callback, handler, self.clock.monotonic(), self._running.get(ident)
+        )
+        self._running[ident] = running
+        try:
+            return handler(*args)
+        finally:
+            elapsed = self.clock.monotonic() - running.started
+            if running.previous is None:
+                del self._running[ident]
+                self._busy_seconds += elapsed
+            else:
+                # Time spent in a nested callback is counted by the one it was called from
+                self._running[ident] = running.previous
+            histogram = self._histograms.get(callback)
+            if histogram is None:
+                with self._lock:
+                    histogram = self._histograms.setdefault(callback, LatencyHistogram())
+            histogram.record(elapsed)
+            if elapsed >= self.threshold:
+                # check() may be reporting this callback, in which case it holds the lock
+                with self._lock:
+                    report = not running.reported
+                    running.reported = True
+                    if report:
+                        self.stall_count += 1
+                if report:
+                    self._report(StallReport(callback, handler, elapsed, ident, None))
+
+    def check(self):
+        """Report every callback which has been running for longer than the threshold and has not
+        been reported yet. This is called by the monitor thread.
+
+        :returns: The number of callbacks reported.
+        """
+        now = self.clock.monotonic()
+        reports = []
+        with self._lock:
+            stalled = [
+                (ident, running)
+                for ident, running in list(self._running.items())
+                if not running.reported and now - running.started >= self.threshold
+            ]
+            if stalled:
+                # Take the stacks while holding the lock, which a stalled callback takes before
+                # it returns, so that they show where each callback is stuck
+                frames = sys._current_frames()
+                for ident, running in stalled:
+                    running.reported = True
+                    self.stall_count += 1
+                    frame = frames.get(ident)
+                    stack = traceback.format_stack(frame) if frame is not None else None
+                    reports.append(
+                        StallReport(
+                            running.callback, running.handler, now - running.started, ident, stack
+                        )
+                    )
+        for report in reports:
+            self._report(report)
+        return len(reports)
+
+    def _report(self, report):
+        if report.stack is None:
+            logger.warning(
+                "%s (%s) ran for %.3f s on thread %s, stalling the network loop",
+                report.callback,
+                handler_name(report.handler),
+                report.seconds,
+                report.thread,
+            )
+        else:
+            logger.warning(
+                "%s (%s) has been running for %.3f s on thread %s, stalling the network loop:\n%s",
+                report.callback,
+                handler_name(report.handler),
+                report.seconds,
+                report.thread,
+                "".join(report.stack),
+            )
+        if self.on_stall:
+            try:
+                self.on_stall(report)
+            except Exception:
+                logger.exception("Unhandled exception in on_stall")
+
+    def busy_seconds(self):
+        """Get the total time spent in callbacks, including those still running.
+
+        The rate at which this grows is the fraction of time the network thread is busy running
+        handlers rather than processing packets.
+
+        :returns: The number of seconds.
+        """
+        now = self.clock.monotonic()
+        busy = self._busy_seconds
+        for running in list(self._running.values()):
+            while running.previous is not None:
+                running = running.previous
+            busy += now - running.started
+        return busy
+
+    def snapshot(self):
+        """Take a snapshot of the watchdog's metrics, for a transport's get_stats().
+
+        :returns: A dictionary holding network_loop_busy_seconds, callback_stalls, and
+        callback_seconds, which maps the name of each callback to a LatencyHistogram.
+        """
+        busy = self.busy_seconds()
+        with self._lock:
+            histograms = {name: h.snapshot() for name, h in self._histograms.items()}
+        return {
+            "network_loop_busy_seconds": busy,
+            "callback_stalls": self.stall_count,
+            "callback_seconds": histograms,
+        }
+
+    def start(self):
+        """Start the monitor thread, which reports callbacks while they are still running."""
+        if self._thread:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="CallbackWatchdog")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the monitor thread."""
+        if not self._thread:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Unhandled exception checking callbacks")
@@ -0,0 +1,21 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains the errors raised by the Azure IoT Hub Device SDK when an operation fails.
+"""
+
+
+class MessageExpiredError(Exception):
+    """Raised when a message is not sent because its expiry time passed while it was waiting to
+    be sent, for example while the client was disconnected.
+
+    :ivar message: The message which expired.
+    """
+
+    def __init__(self, message):
+        super(MessageExpiredError, self).__init__(
+            "Message expired at {} before it could be sent".format(message.expiry_time_utc)
+        )
+        self.message = message
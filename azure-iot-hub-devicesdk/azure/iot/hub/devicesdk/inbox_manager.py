@@ -6,8 +6,13 @@
 """This module contains a manager for inboxes."""
 
 import logging
+from .diagnostics.message_log import MessageLogger
 
 logger = logging.getLogger(__name__)
+message_logger = MessageLogger(logger)
+
+# Default maximum number of messages held by a subscriber Inbox before the oldest are discarded.
+DEFAULT_SUBSCRIBER_INBOX_SIZE = 1000
 
 
 class InboxManager(object):
@@ -17,18 +22,38 @@ class InboxManager(object):
     :ivar input_message_inboxes: A dictionary mapping input names to input message Inboxes.
     :ivar generic_method_request_inbox: The generic method request Inbox.
     :ivar named_method_request_inboxes: A dictionary mapping method names to method request Inboxes.
+    :ivar c2d_message_subscribers: A list of subscriber Inboxes that receive every C2D message.
+    :ivar input_message_subscribers: A dictionary mapping input names to lists of subscriber
+    Inboxes that receive every message on that input.
+    :ivar subscriber_discard_count: The number of messages discarded from full subscriber Inboxes.
     """
 
-    def __init__(self, inbox_type):
+    def __init__(self, inbox_type, latency_recorder=None, tracer=None):
         """Initializer for the InboxManager.
 
         :param inbox_type: An Inbox class that the manager will use to create Inboxes.
+        :param latency_recorder: Optional LatencyRecorder passed to every Inbox, which records the
+        time each message waits in its Inbox.
+        :param tracer: Optional Tracer passed to every Inbox, which traces the time each message
+        waits in its Inbox.
         """
-        self._create_inbox = inbox_type
+        self._inbox_type = inbox_type
+        self._latency_recorder = latency_recorder
+        self._tracer = tracer
         self.c2d_message_inbox = self._create_inbox()
         self.input_message_inboxes = {}
         self.generic_method_request_inbox = self._create_inbox()
         self.named_method_request_inboxes = {}
+        self.c2d_message_subscribers = []
+        self.input_message_subscribers = {}
+        self.subscriber_discard_count = 0
+
+    def _create_inbox(self, **kwargs):
+        if self._latency_recorder:
+            kwargs["latency_recorder"] = self._latency_recorder
+        if self._tracer:
+            kwargs["tracer"] = self._tracer
+        return self._inbox_type(**kwargs)
 
     def get_input_message_inbox(self, input_name):
         """Retrieve the input message Inbox for a given input.
@@ -76,6 +101,84 @@ class InboxManager(object):
 
         return inbox
 
+    def subscribe_to_input_messages(self, input_name, maxsize=DEFAULT_SUBSCRIBER_INBOX_SIZE):
+        """Register a new subscriber for all messages arriving on a given input.
+
+        Every message routed to the input is delivered to every subscriber in addition to the
+        input message Inbox, without copying. The same Message object is shared by all consumers
+        and must be treated as read-only.
+
+        Each subscriber gets its own bounded Inbox. When a subscriber falls behind and its Inbox
+        is full, the oldest message in that Inbox is discarded, so a slow subscriber never blocks
+        delivery to the others.
+
+        :param str input_name: The name of the input to subscribe to.
+        :param int maxsize: The maximum number of messages held for this subscriber.
+        :returns: An Inbox that will receive every message on the selected input.
+        """
+        inbox = self._create_inbox(maxsize=maxsize)
+        # Lists are replaced rather than mutated so that routing never iterates a changing list
+        subscribers = self.input_message_subscribers.get(input_name, [])
+        self.input_message_subscribers[input_name] = subscribers + [inbox]
+        return inbox
+
+    def subscribe_to_c2d_messages(self, maxsize=DEFAULT_SUBSCRIBER_INBOX_SIZE):
+        """Register a new subscriber for all C2D messages.
+
+        See subscribe_to_input_messages for the delivery semantics.
+
+        :param int maxsize: The maximum number of messages held for this subscriber.
+        :returns: An Inbox that will receive every C2D message.
+        """
+        inbox = self._create_inbox(maxsize=maxsize)
+        self.c2d_message_subscribers = self.c2d_message_subscribers + [inbox]
+        return inbox
+
+    def unsubscribe(self, inbox):
+        """Remove a subscriber Inbox so that it no longer receives messages.
+
+        :param inbox: An Inbox previously returned by one of the subscribe methods.
+        :returns: Boolean indicating if the Inbox was found and removed.
+        """
+        if inbox in self.c2d_message_subscribers:
+            self.c2d_message_subscribers = [
+                i for i in self.c2d_message_subscribers if i is not inbox
+            ]
+            return True
+        for input_name, subscribers in list(self.input_message_subscribers.items()):
+            if inbox in subscribers:
+                remaining = [i for i in subscribers if i is not inbox]
+                if remaining:
+                    self.input_message_subscribers[input_name] = remaining
+                else:
+                    del self.input_message_subscribers[input_name]
+                return True
+        return False
+
+    def get_inbox_depths(self):
+        """Count the items waiting in each Inbox.
+
+        Inboxes are named "c2d" and "method" for the C2D message and generic method request
+        Inboxes, "input/<name>" and "method/<name>" for input and named method request Inboxes, and
+        "c2d_subscriber/<n>" and "input_subscriber/<name>/<n>" for subscriber Inboxes.
+
+        :returns: A dictionary mapping Inbox names to the number of items they hold.
+        """
+        depths = {
+            "c2d": self.c2d_message_inbox.qsize(),
+            "method": self.generic_method_request_inbox.qsize(),
+        }
+        for input_name, inbox in list(self.input_message_inboxes.items()):
+            depths["input/" + input_name] = inbox.qsize()
+        for method_name, inbox in list(self.named_method_request_inboxes.items()):
+            depths["method/" + method_name] = inbox.qsize()
+        for index, inbox in enumerate(self.c2d_message_subscribers):
+            depths["c2d_subscriber/" + str(index)] = inbox.qsize()
+        for input_name, subscribers in list(self.input_message_subscribers.items()):
+            for index, inbox in enumerate(subscribers):
+                depths["input_subscriber/{}/{}".format(input_name, index)] = inbox.qsize()
+        return depths
+
     def clear_all_method_requests(self):
         """Delete all method requests currently in inboxes.
         """
@@ -86,21 +189,28 @@ class InboxManager(object):
     def route_input_message(self, input_name, incoming_message):
         """Route an incoming input message to the correct input message Inbox.
 
-        If the input is unknown, the message will be dropped.
+        The message is also delivered to every subscriber of the input.
+        If the input is unknown and has no subscribers, the message will be dropped.
 
         :param str input_name: The name of the input to route the message to.
         :param incoming_message: The message to be routed.
 
         :returns: Boolean indicating if message was successfuly routed or not.
         """
+        subscribers = self.input_message_subscribers.get(input_name)
+        if subscribers:
+            self._deliver_to_subscribers(subscribers, incoming_message)
+
         try:
             inbox = self.input_message_inboxes[input_name]
         except KeyError:
-            logger.warning("No input message inbox for {} - dropping message".format(input_name))
+            if subscribers:
+                return True
+            logger.warning("No input message inbox for %s - dropping message", input_name)
             return False
         else:
             inbox._put(incoming_message)
-            logger.info("Input message sent to {} inbox".format(input_name))
+            message_logger.log("Input message sent to %s inbox", input_name)
             return True
 
     def route_c2d_message(self, incoming_message):
@@ -110,8 +220,11 @@ class InboxManager(object):
 
         :returns: Boolean indicating if message was successfully routed or not.
         """
+        subscribers = self.c2d_message_subscribers
+        if subscribers:
+            self._deliver_to_subscribers(subscribers, incoming_message)
         self.c2d_message_inbox._put(incoming_message)
-        logger.info("C2D message sent to inbox")
+        message_logger.log("C2D message sent to inbox")
         return True
 
     def route_method_request(self, incoming_method_request):
@@ -130,3 +243,14 @@ class InboxManager(object):
             inbox = self.generic_method_request_inbox
         inbox._put(incoming_method_request)
         return True
+
+    def _deliver_to_subscribers(self, subscribers, incoming_message):
+        """Deliver a message to each subscriber Inbox without blocking.
+
+        :param subscribers: The list of subscriber Inboxes.
+        :param incoming_message: The message to be delivered.
+        """
+        for inbox in subscribers:
+            if inbox._put_discarding_oldest(incoming_message):
+                self.subscriber_discard_count += 1
+                logger.warning("Subscriber inbox full - discarded oldest message")
@@ -0,0 +1,550 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module simulates a fleet of devices sending telemetry, to load-test an IoT Hub or the
+services behind it.
+
+The devices are spread round-robin across worker processes. In each worker, every device has an
+MQTTTransport of its own, and they all share one MqttMultiplexer, so a worker runs thousands of
+devices on a few threads. Once every device in every worker has connected, each device sends
+telemetry at the configured rate for the configured duration, and the workers report what they
+sent and the latency of each send, from the call to send until the hub acknowledged it.
+
+Usage:
+    python -m azure.iot.hub.devicesdk.simulate
+        (--connection-string TEMPLATE | --connection-strings-file FILE | --fake-hub)
+        [--devices N] [--processes P] [--rate PER_DEVICE_PER_SECOND] [--duration SECONDS]
+        [--arrival uniform|poisson] [--payload json|binary] [--payload-size BYTES]
+        [--max-in-flight PER_DEVICE] [--port PORT] [--ca-cert FILE] [--json]
+
+A connection string template is formatted with the index of each device, for example
+"HostName=hub.azure-devices.net;DeviceId=sim-{index};SharedAccessKey=...". A connection strings
+file holds one connection string per line. With --fake-hub, the devices connect to a FakeIoTHub
+run in a child process, which needs no network access or provisioned devices, for CI.
+
+A device only has --max-in-flight sends waiting for an acknowledgement at a time. A send which is
+due while the device is at the limit, or while it is disconnected, is counted as skipped rather
+than queued, so that a slow hub shows up as skipped sends rather than as latency which grows for
+as long as the simulation runs. A device whose connection is lost is reconnected by the
+multiplexer, and counted in disconnects. The MQTT provider does not yet report a refused CONNACK as
+a failure to connect, so a device the hub does not authenticate shows up as disconnects and skipped
+sends rather than as a connect failure.
+"""
+
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import threading
+import time
+from azure.iot.hub.devicesdk.auth.authentication_provider_factory import from_connection_string
+from azure.iot.hub.devicesdk.common import Message
+from azure.iot.hub.devicesdk.diagnostics.histogram import LatencyHistogram
+from azure.iot.hub.devicesdk.transport.mqtt.mqtt_transport import MQTTTransport
+from azure.iot.hub.devicesdk.transport.mqtt.multiplexer import MqttMultiplexer
+
+logger = logging.getLogger(__name__)
+
+ARRIVALS = ("uniform", "poisson")
+PAYLOADS = ("json", "binary")
+DEFAULT_DEVICES = 10
+DEFAULT_RATE = 1.0
+DEFAULT_DURATION = 10.0
+DEFAULT_PAYLOAD_SIZE = 256
+DEFAULT_MAX_IN_FLIGHT = 10
+DEFAULT_CONNECT_TIMEOUT = 60.0
+DEFAULT_DRAIN_TIMEOUT = 10.0
+REPORTED_PERCENTILES = (50, 90, 99, 99.9)
+
+# Devices connect this many at a time, so that a large fleet does not flood the hub with handshakes
+_CONNECT_BATCH = 50
+_WORKER_START_TIMEOUT = 60
+
+
+class Profile(object):
+    """What each simulated device sends, and how often.
+
+    :ivar float rate: Messages sent by each device per second.
+    :ivar float duration: Seconds to send for.
+    :ivar str arrival: One of ARRIVALS. "uniform" sends at a fixed interval, and "poisson" at
+    exponentially distributed intervals with the same mean.
+    :ivar str payload: One of PAYLOADS. "json" sends a telemetry reading padded to at least
+    payload_size bytes, and "binary" sends payload_size random bytes.
+    :ivar int payload_size: The size of each payload in bytes.
+    :ivar int max_in_flight: The number of sends each device may have waiting for an
+    acknowledgement.
+    :ivar int port: The port to connect to.
+    :ivar str ca_cert: The certificate to trust when connecting, or None for the system's.
+    :ivar float connect_timeout: Seconds each batch of devices has to connect.
+    :ivar float drain_timeout: Seconds to wait for sends to be acknowledged after the duration.
+    """
+
+    def __init__(
+        self,
+        rate=DEFAULT_RATE,
+        duration=DEFAULT_DURATION,
+        arrival="uniform",
+        payload="json",
+        payload_size=DEFAULT_PAYLOAD_SIZE,
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+        port=8883,
+        ca_cert=None,
+        connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+        drain_timeout=DEFAULT_DRAIN_TIMEOUT,
+    ):
+        """Initializer for Profile.
+
+        :raises: ValueError if the rate, duration or max_in_flight is not positive, or the arrival
+        or payload is unknown.
+        """
+        if rate <= 0 or duration <= 0 or max_in_flight < 1:
+            raise ValueError("rate, duration and max_in_flight must be positive")
+        if arrival not in ARRIVALS:
+            raise ValueError("Unknown arrival: {}".format(arrival))
+        if payload not in PAYLOADS:
+            raise ValueError("Unknown payload: {}".format(payload))
+        self.rate = rate
+        self.duration = duration
+        self.arrival = arrival
+        self.payload = payload
+        self.payload_size = payload_size
+        self.max_in_flight = max_in_flight
+        self.port = port
+        self.ca_cert = ca_cert
+        self.connect_timeout = connect_timeout
+        self.drain_timeout = drain_timeout
+
+    def interval(self):
+        """Get the number of seconds until a device's next send."""
+        if self.arrival == "poisson":
+            return random.expovariate(self.rate)
+        return 1.0 / self.rate
+
+    def make_payload(self, device_id, sequence):
+        """Build the payload of a device's next message.
+
+        :returns: A tuple of (payload bytes, content type or None).
+        """
+        if self.payload == "binary":
+            return os.urandom(self.payload_size), None
+        reading = {
+            "deviceId": device_id,
+            "sequence": sequence,
+            "timestamp": time.time(),
+            "temperature": round(random.uniform(15.0, 30.0), 2),
+            "humidity": round(random.uniform(20.0, 80.0), 2),
+        }
+        data = json.dumps(reading)
+        if len(data) < self.payload_size:
+            reading["padding"] = "x" * (self.payload_size - len(data) - len(', "padding": ""'))
+            data = json.dumps(reading)
+        return data.encode("utf-8"), "application/json"
+
+
+class _SimulatedDevice(object):
+    def __init__(self, device_id, transport):
+        self.device_id = device_id
+        self.transport = transport
+        self.connected = threading.Event()
+        self.sequence = itertools.count()
+        self.in_flight = 0
+        # Seconds taken by the first connect, set by the connected handler on the I/O thread
+        self.connect_seconds = None
+
+
+class _Worker(object):
+    """Runs a share of the fleet in one process, and counts what it sends."""
+
+    def __init__(self, connection_strings, profile):
+        self.profile = profile
+        self.connection_strings = connection_strings
+        self.multiplexer = MqttMultiplexer()
+        self.devices = []
+        self.latency = LatencyHistogram()
+        self.connect_latency = LatencyHistogram()
+        # Counters are updated by the scheduler thread and by completions on the I/O thread
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(
+            ("sent", "completed", "errors", "skipped", "bytes_sent", "disconnects"), 0
+        )
+        self.connect_failures = 0
+        self.send_seconds = 0.0
+
+    def connect(self):
+        """Connect every device, a batch at a time. Devices which fail to connect are left out."""
+        self.multiplexer.start()
+        for start in range(0, len(self.connection_strings), _CONNECT_BATCH):
+            batch = []
+            for connection_string in self.connection_strings[start : start + _CONNECT_BATCH]:
+                try:
+                    batch.append(self._create_device(connection_string))
+                except Exception as e:
+                    logger.warning("Could not create a device: %s", e)
+                    self.connect_failures += 1
+            deadline = time.time() + self.profile.connect_timeout
+            for device in batch:
+                # The wait only bounds the batch, as the devices are waited for one after another
+                if device.connected.wait(max(0, deadline - time.time())):
+                    self.connect_latency.record(device.connect_seconds)
+                    self.devices.append(device)
+                else:
+                    logger.warning("%s did not connect in time", device.device_id)
+                    self.connect_failures += 1
+                    self._disconnect(device)
+
+    def _create_device(self, connection_string):
+        auth_provider = from_connection_string(connection_string)
+        if self.profile.ca_cert:
+            auth_provider.ca_cert = self.profile.ca_cert
+        transport = MQTTTransport(
+            auth_provider, port=self.profile.port, multiplexer=self.multiplexer
+        )
+        device = _SimulatedDevice(auth_provider.device_id, transport)
+        started = time.time()
+
+        def on_connected(new_state):
+            # Only the first connect is timed. Devices reconnected by the multiplexer after losing
+            # their connection resume sending
+            if device.connect_seconds is None:
+                device.connect_seconds = time.time() - started
+            device.connected.set()
+
+        transport.on_transport_connected = on_connected
+        transport.on_transport_disconnected = lambda new_state: self._on_disconnected(device)
+        try:
+            transport.connect()
+        except Exception:
+            # Stop the multiplexer from retrying the connection
+            self._disconnect(device)
+            raise
+        return device
+
+    def _on_disconnected(self, device):
+        if device.connected.is_set():
+            device.connected.clear()
+            with self._lock:
+                self.counts["disconnects"] += 1
+
+    def send(self):
+        """Send from every connected device until the duration has passed, then wait for the sends
+        still in flight."""
+        if not self.devices:
+            return
+        started = time.time()
+        end = started + self.profile.duration
+        # Spread the first sends over one interval, so that the devices do not send in step
+        due = [
+            (started + random.uniform(0, 1.0 / self.profile.rate), i)
+            for i in range(len(self.devices))
+        ]
+        heapq.heapify(due)
+        while due:
+            when, index = heapq.heappop(due)
+            if when >= end:
+                break
+            delay = when - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self._send_one(self.devices[index])
+            heapq.heappush(due, (when + self.profile.interval(), index))
+        self.send_seconds = time.time() - started
+
+        deadline = time.time() + self.profile.drain_timeout
+        while time.time() < deadline and any(d.in_flight for d in self.devices):
+            time.sleep(0.05)
+
+    def _send_one(self, device):
+        with self._lock:
+            if not device.connected.is_set() or device.in_flight >= self.profile.max_in_flight:
+                self.counts["skipped"] += 1
+                return
+            device.in_flight += 1
+        payload, content_type = self.profile.make_payload(device.device_id, next(device.sequence))
+        message = Message(payload, content_type=content_type)
+        sent = time.time()
+
+        def on_complete(error=None):
+            elapsed = time.time() - sent
+            with self._lock:
+                device.in_flight -= 1
+                if error:
+                    self.counts["errors"] += 1
+                else:
+                    self.counts["completed"] += 1
+            if not error:
+                self.latency.record(elapsed)
+
+        with self._lock:
+            self.counts["sent"] += 1
+            self.counts["bytes_sent"] += len(payload)
+        device.transport.send_event(message, on_complete)
+
+    def _disconnect(self, device):
+        try:
+            device.transport.disconnect()
+        except Exception as e:
+            # A device which never connected cannot always be disconnected cleanly
+            logger.debug("Could not disconnect %s: %s", device.device_id, e)
+
+    def close(self):
+        """Disconnect every device and stop the multiplexer."""
+        for device in self.devices:
+            self._disconnect(device)
+        self.multiplexer.stop()
+
+    def result(self):
+        """Get what this worker did, to be combined with the other workers' by aggregate().
+
+        :returns: A dictionary of counts, with the latency histograms.
+        """
+        with self._lock:
+            result = dict(self.counts)
+        result.update(
+            {
+                "devices": len(self.connection_strings),
+                "connected": len(self.devices),
+                "connect_failures": self.connect_failures,
+                "send_seconds": self.send_seconds,
+                "latency": self.latency.snapshot(),
+                "connect_latency": self.connect_latency.snapshot(),
+            }
+        )
+        return result
+
+
+def _run_worker(connection, connection_strings, profile):
+    """Entry point of a worker process. Connects its devices, waits to be told to start sending,
+    then sends its result."""
+    worker = _Worker(connection_strings, profile)
+    try:
+        worker.connect()
+        connection.send(("connected", len(worker.devices)))
+        if connection.recv() == "start":
+            worker.send()
+        connection.send(("result", worker.result()))
+    except Exception as e:
+        logger.exception("Worker failed")
+        connection.send(("error", repr(e)))
+    finally:
+        worker.close()
+        connection.close()
+
+
+def aggregate(results):
+    """Combine the results of the workers into a report.
+
+    :param results: The result of each worker.
+    :returns: A dictionary with the totals, throughput in messages and bytes per second, and the
+    latency percentiles of the sends and connects in milliseconds.
+    """
+    keys = ("devices", "connected", "connect_failures", "disconnects", "sent", "completed")
+    keys += ("errors", "skipped", "bytes_sent")
+    report = {key: sum(r[key] for r in results) for key in keys}
+    latency = LatencyHistogram()
+    connect_latency = LatencyHistogram()
+    for r in results:
+        latency.merge(r["latency"])
+        connect_latency.merge(r["connect_latency"])
+    # Workers send over the same period, so the longest one is the length of the run
+    seconds = max([r["send_seconds"] for r in results] or [0])
+    report["send_seconds"] = round(seconds, 3)
+    report["messages_per_second"] = round(report["completed"] / seconds, 1) if seconds else 0.0
+    report["bytes_per_second"] = round(report["bytes_sent"] / seconds, 1) if seconds else 0.0
+    report["latency_ms"] = _percentiles_ms(latency)
+    report["connect_latency_ms"] = _percentiles_ms(connect_latency)
+    return report
+
+
+def _percentiles_ms(histogram):
+    summary = {}
+    for percentile in REPORTED_PERCENTILES:
+        key = "p" + str(percentile).replace(".", "")
+        value = histogram.percentile(percentile) if histogram.count else None
+        summary[key] = round(value * 1000, 3) if value is not None else None
+    summary["max"] = round(histogram.max * 1000, 3) if histogram.count else None
+    return summary
+
+
+def run(connection_strings, profile, processes=1):
+    """Simulate a fleet of devices.
+
+    :param connection_strings: The connection string of each device.
+    :param Profile profile: What each device sends, and how often.
+    :param int processes: The number of worker processes to spread the devices across. With 1,
+    the devices run in this process.
+    :returns: The report made by aggregate().
+    :raises: RuntimeError if a worker process failed.
+    """
+    processes = max(1, min(processes, len(connection_strings)))
+    if processes == 1:
+        worker = _Worker(list(connection_strings), profile)
+        try:
+            worker.connect()
+            worker.send()
+            return aggregate([worker.result()])
+        finally:
+            worker.close()
+
+    if hasattr(multiprocessing, "get_context"):
+        # Spawn rather than fork, so the workers do not inherit the threads of this process
+        context = multiprocessing.get_context("spawn")
+    else:
+        context = multiprocessing
+    workers = []
+    try:
+        for index in range(processes):
+            connection, child_connection = context.Pipe()
+            process = context.Process(
+                target=_run_worker,
+                args=(child_connection, list(connection_strings[index::processes]), profile),
+            )
+            process.daemon = True
+            process.start()
+            workers.append((process, connection))
+
+        # Every worker connects its devices before any starts sending, so that they all send over
+        # the same period
+        batches = -(-len(connection_strings) // (processes * _CONNECT_BATCH))
+        timeout = _WORKER_START_TIMEOUT + profile.connect_timeout * batches
+        for process, connection in workers:
+            if not connection.poll(timeout):
+                raise RuntimeError("Timed out waiting for a worker to connect its devices")
+            status, value = _receive(process, connection)
+            if status != "connected":
+                raise RuntimeError("Worker failed: {}".format(value))
+        for _, connection in workers:
+            connection.send("start")
+
+        results = []
+        for process, connection in workers:
+            status, value = _receive(process, connection)
+            if status != "result":
+                raise RuntimeError("Worker failed: {}".format(value))
+            results.append(value)
+        return aggregate(results)
+    finally:
+        for process, connection in workers:
+            connection.close()
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+
+
+def _receive(process, connection):
+    try:
+        return connection.recv()
+    except EOFError:
+        process.join(1)
+        return "error", "exit code {}".format(process.exitcode)
+
+
+def _read_connection_strings(path):
+    with open(path) as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith("#")]
+
+
+def _print_report(report):
+    print(
+        "{connected}/{devices} devices connected ({connect_failures} failed), "
+        "{disconnects} disconnects".format(**report)
+    )
+    print(
+        "{sent} sent, {completed} completed, {errors} errors, {skipped} skipped "
+        "in {send_seconds} s".format(**report)
+    )
+    print("{messages_per_second} msgs/s, {bytes_per_second} bytes/s".format(**report))
+    for name, key in (("send latency", "latency_ms"), ("connect latency", "connect_latency_ms")):
+        print(
+            "{} (ms): p50 {p50}, p90 {p90}, p99 {p99}, p999 {p999}, max {max}".format(
+                name, **report[key]
+            )
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a fleet of devices sending telemetry")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--connection-string", help="connection string template, formatted with {index}"
+    )
+    source.add_argument(
+        "--connection-strings-file", help="file of connection strings, one per line"
+    )
+    source.add_argument("--fake-hub", action="store_true", help="run a local fake IoT Hub")
+    parser.add_argument(
+        "--devices",
+        type=int,
+        help="number of devices, default {} or every line of the file".format(DEFAULT_DEVICES),
+    )
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument(
+        "--rate", type=float, default=DEFAULT_RATE, help="messages per second per device"
+    )
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="seconds")
+    parser.add_argument("--arrival", choices=ARRIVALS, default="uniform")
+    parser.add_argument("--payload", choices=PAYLOADS, default="json")
+    parser.add_argument("--payload-size", type=int, default=DEFAULT_PAYLOAD_SIZE)
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT)
+    parser.add_argument("--port", type=int, default=8883)
+    parser.add_argument("--ca-cert", help="file of the certificate to trust, in PEM format")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    ca_cert = None
+    if args.ca_cert:
+        with open(args.ca_cert) as f:
+            ca_cert = f.read()
+    hub = None
+    if args.connection_strings_file:
+        connection_strings = _read_connection_strings(args.connection_strings_file)
+        if args.devices is not None:
+            connection_strings = connection_strings[: args.devices]
+    else:
+        devices = DEFAULT_DEVICES if args.devices is None else args.devices
+        if args.fake_hub:
+            # Imported here, as the fake hub needs packages a simulation of a real hub does not
+            from azure.iot.hub.devicesdk.testing import FakeIoTHubProcess
+
+            hub = FakeIoTHubProcess().start()
+            template = hub.connection_string("sim-device-{index}")
+            ca_cert, args.port = hub.ca_cert, hub.tls_port
+        else:
+            template = args.connection_string
+        connection_strings = [template.format(index=index) for index in range(devices)]
+    if not connection_strings:
+        parser.error("no devices to simulate")
+
+    try:
+        profile = Profile(
+            rate=args.rate,
+            duration=args.duration,
+            arrival=args.arrival,
+            payload=args.payload,
+            payload_size=args.payload_size,
+            max_in_flight=args.max_in_flight,
+            port=args.port,
+            ca_cert=ca_cert,
+        )
+        report = run(connection_strings, profile, args.processes)
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        if hub:
+            hub.stop()
+
+    if args.json:
+        parameters = {k: v for k, v in vars(args).items() if k not in ("json", "connection_string")}
+        print(json.dumps({"parameters": parameters, "report": report}, indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,10 +12,13 @@ from threading import Event
 from .abstract_clients import AbstractClient, AbstractDeviceClient, AbstractModuleClient
 from .transport import constant
 from .common import Message
-from .inbox_manager import InboxManager
+from .inbox_manager import InboxManager, DEFAULT_SUBSCRIBER_INBOX_SIZE
 from .sync_inbox import SyncClientInbox
+from .diagnostics import tracing
+from .diagnostics.message_log import MessageLogger
 
 logger = logging.getLogger(__name__)
+message_logger = MessageLogger(logger)
 
 __all__ = ["DeviceClient", "ModuleClient"]
 
@@ -34,7 +37,11 @@ class GenericClient(AbstractClient):
         :param transport: The transport that the client will use.
         """
         super(GenericClient, self).__init__(transport)
-        self._inbox_manager = InboxManager(inbox_type=SyncClientInbox)
+        self._inbox_manager = InboxManager(
+            inbox_type=SyncClientInbox,
+            latency_recorder=transport.latency_recorder,
+            tracer=transport.tracer,
+        )
         self._transport.on_transport_connected = self._on_state_change
         self._transport.on_transport_disconnected = self._on_state_change
         self._transport.on_transport_method_request_received = (
@@ -43,7 +50,7 @@ class GenericClient(AbstractClient):
 
     def _on_state_change(self, new_state):
         """Handler to be called by the transport upon a connection state change."""
-        logger.info("Connection State - {}".format(new_state))
+        logger.info("Connection State - %s", new_state)
 
         if new_state == "disconnected":
             self._on_disconnected()
@@ -96,23 +103,63 @@ class GenericClient(AbstractClient):
         This is a synchronous event, meaning that this function will not return until the event
         has been sent to the service and the service has acknowledged receipt of the event.
 
+        If the client was created with a batch_policy, the event is only sent once its batch is
+        full or has waited for the policy's max_linger_time, so each call blocks for up to
+        max_linger_time longer. Send from several threads, or use the asyncio client, to fill
+        batches.
+
         If the connection to the service has not previously been opened by a call to connect, this
         function will open the connection before sending the event.
 
         :param message: The actual message to send. Anything passed that is not an instance of the
         Message class will be converted to Message object.
+
+        :raises: MessageExpiredError if the expiry time of the message passed before it was sent.
         """
         if not isinstance(message, Message):
             message = Message(message)
 
-        logger.info("Sending message to Hub...")
+        message_logger.log("Sending message to Hub...")
+        span = self._start_span("client.send_event", message)
+        send_complete = Event()
+        send_errors = []
+
+        def callback(error=None):
+            if error:
+                send_errors.append(error)
+            else:
+                message_logger.log("Successfully sent message to Hub")
+            if span:
+                span.end(error=error)
+            send_complete.set()
+
+        tracing.bind(span, self._transport.send_event)(message, callback=callback)
+        send_complete.wait()
+        if send_errors:
+            raise send_errors[0]
+
+    def send_event_from_template(self, template, payload):
+        """Sends a payload with the properties of a message template.
+
+        This is a synchronous event, meaning that this function will not return until the event
+        has been sent to the service and the service has acknowledged receipt of the event.
+
+        If the connection to the service has not previously been opened by a call to connect, this
+        function will open the connection before sending the event.
+
+        :param template: The MessageTemplate created by create_message_template.
+        :param payload: The payload to send, as bytes or a string.
+        """
+        span = self._start_span("client.send_event_from_template")
         send_complete = Event()
 
         def callback():
+            if span:
+                span.end()
             send_complete.set()
-            logger.info("Successfully sent message to Hub")
 
-        self._transport.send_event(message, callback=callback)
+        send_event_from_template = tracing.bind(span, self._transport.send_event_from_template)
+        send_event_from_template(template, payload, callback=callback)
         send_complete.wait()
 
     def receive_method_request(self, method_name=None, block=True, timeout=None):
@@ -135,9 +182,9 @@ class GenericClient(AbstractClient):
 
         method_inbox = self._inbox_manager.get_method_request_inbox(method_name)
 
-        logger.info("Waiting for method request...")
+        message_logger.log("Waiting for method request...")
         method_call = method_inbox.get(block=block, timeout=timeout)
-        logger.info("Received method request")
+        message_logger.log("Received method request")
         return method_call
 
     def send_method_response(self, method_request, payload, status):
@@ -148,12 +195,12 @@ class GenericClient(AbstractClient):
         :param payload: The desired payload for the method response.
         :param int status: The desired return status code for the method response.
         """
-        logger.info("Sending method response to Hub...")
+        message_logger.log("Sending method response to Hub...")
         send_complete = Event()
 
         def callback():
             send_complete.set()
-            logger.info("Successfully sent method response to Hub")
+            message_logger.log("Successfully sent method response to Hub")
 
         # TODO: maybe consolidate method_request, result and status into a new object
         self._transport.send_method_response(method_request, payload, status, callback=callback)
@@ -168,12 +215,12 @@ class GenericClient(AbstractClient):
         :param feature_name: The name of the feature to enable.
         See azure.iot.hub.devicesdk.transport.constant for possible values
         """
-        logger.info("Enabling feature:" + feature_name + "...")
+        logger.info("Enabling feature: %s...", feature_name)
         enable_complete = Event()
 
         def callback():
             enable_complete.set()
-            logger.info("Successfully enabled feature:" + feature_name)
+            logger.info("Successfully enabled feature: %s", feature_name)
 
         self._transport.enable_feature(feature_name, callback=callback)
         enable_complete.wait()
@@ -212,11 +259,30 @@ class DeviceClient(GenericClient, AbstractDeviceClient):
             self._enable_feature(constant.C2D_MSG)
         c2d_inbox = self._inbox_manager.get_c2d_message_inbox()
 
-        logger.info("Waiting for C2D message...")
+        message_logger.log("Waiting for C2D message...")
         message = c2d_inbox.get(block=block, timeout=timeout)
-        logger.info("C2D message received")
+        message_logger.log("C2D message received")
         return message
 
+    def subscribe_to_c2d_messages(self, maxsize=DEFAULT_SUBSCRIBER_INBOX_SIZE):
+        """Subscribe to every C2D message sent from the Azure IoT Hub.
+
+        Every C2D message is delivered to every subscriber, as well as to receive_c2d_message.
+        Each subscriber has its own inbox, which discards its oldest message when full so that a
+        slow subscriber does not hold up the others. The same Message object is delivered to
+        every consumer, so it must be treated as read-only.
+
+        :param int maxsize: The maximum number of messages held for this subscriber. Default 1000.
+
+        :returns: An inbox receiving every C2D message. Messages are taken from it with get, and
+        it is removed with unsubscribe.
+        """
+        # Subscribe before enabling the feature, so that no message is missed
+        inbox = self._inbox_manager.subscribe_to_c2d_messages(maxsize=maxsize)
+        if not self._transport.feature_enabled[constant.C2D_MSG]:
+            self._enable_feature(constant.C2D_MSG)
+        return inbox
+
 
 class ModuleClient(GenericClient, AbstractModuleClient):
     """A synchronous module client that connects to an Azure IoT Hub or Azure IoT Edge instance.
@@ -251,20 +317,31 @@ class ModuleClient(GenericClient, AbstractModuleClient):
         :param message: message to send to the given output. Anything passed that is not an instance of the
         Message class will be converted to Message object.
         :param output_name: Name of the output to send the event to.
+
+        :raises: MessageExpiredError if the expiry time of the message passed before it was sent.
         """
         if not isinstance(message, Message):
             message = Message(message)
         message.output_name = output_name
 
-        logger.info("Sending message to output:" + output_name + "...")
+        message_logger.log("Sending message to output: %s...", output_name)
+        span = self._start_span("client.send_to_output", message)
         send_complete = Event()
-
-        def callback():
-            logger.info("Successfully sent message to output: " + output_name)
+        send_errors = []
+
+        def callback(error=None):
+            if error:
+                send_errors.append(error)
+            else:
+                message_logger.log("Successfully sent message to output: %s", output_name)
+            if span:
+                span.end(error=error)
             send_complete.set()
 
-        self._transport.send_output_event(message, callback)
+        tracing.bind(span, self._transport.send_output_event)(message, callback)
         send_complete.wait()
+        if send_errors:
+            raise send_errors[0]
 
     def receive_input_message(self, input_name, block=True, timeout=None):
         """Receive an input message that has been sent from another Module to a specific input.
@@ -279,11 +356,33 @@ class ModuleClient(GenericClient, AbstractModuleClient):
 
         :returns: Message that was sent to the specified input.
         """
+        # Create the inbox before subscribing, so that messages which arrive as soon as the
+        # subscription completes are not dropped for want of an inbox
+        input_inbox = self._inbox_manager.get_input_message_inbox(input_name)
         if not self._transport.feature_enabled[constant.INPUT_MSG]:
             self._enable_feature(constant.INPUT_MSG)
-        input_inbox = self._inbox_manager.get_input_message_inbox(input_name)
 
-        logger.info("Waiting for input message on: " + input_name + "...")
+        message_logger.log("Waiting for input message on: %s...", input_name)
         message = input_inbox.get(block=block, timeout=timeout)
-        logger.info("Input message received on: " + input_name)
+        message_logger.log("Input message received on: %s", input_name)
         return message
+
+    def subscribe_to_input_messages(self, input_name, maxsize=DEFAULT_SUBSCRIBER_INBOX_SIZE):
+        """Subscribe to every message sent from another Module to a specific input.
+
+        Every message on the input is delivered to every subscriber, as well as to
+        receive_input_message. Each subscriber has its own inbox, which discards its oldest message
+        when full so that a slow subscriber does not hold up the others. The same Message object is
+        delivered to every consumer, so it must be treated as read-only.
+
+        :param str input_name: The input name to subscribe to.
+        :param int maxsize: The maximum number of messages held for this subscriber. Default 1000.
+
+        :returns: An inbox receiving every message on the input. Messages are taken from it with
+        get, and it is removed with unsubscribe.
+        """
+        # Subscribe before enabling the feature, so that no message is missed
+        inbox = self._inbox_manager.subscribe_to_input_messages(input_name, maxsize=maxsize)
+        if not self._transport.feature_enabled[constant.INPUT_MSG]:
+            self._enable_feature(constant.INPUT_MSG)
+        return inbox
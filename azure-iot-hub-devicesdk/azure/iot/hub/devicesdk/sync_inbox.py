@@ -7,13 +7,27 @@
 
 from six.moves import queue
 import six
+import time
 from abc import ABCMeta, abstractmethod
+from .common.clock import SYSTEM_CLOCK
+from .diagnostics import tracing
 
 
 class InboxEmpty(Exception):
     pass
 
 
+class _InboxItem(object):
+    """An item put in an inbox, with the time it was put there and the span it was put in."""
+
+    __slots__ = ("item", "put_time", "span")
+
+    def __init__(self, item, put_time, span):
+        self.item = item
+        self.put_time = put_time
+        self.span = span
+
+
 @six.add_metaclass(ABCMeta)
 class AbstractInbox:
     """Abstract Base Class for Inbox.
@@ -23,6 +37,39 @@ class AbstractInbox:
     All methods, when implemented, should be threadsafe.
     """
 
+    _latency_recorder = None
+    _tracer = None
+
+    def _monotonic(self):
+        """Read the clock of the latency recorder, so that wait times follow simulated time."""
+        clock = self._latency_recorder.clock if self._latency_recorder else SYSTEM_CLOCK
+        return clock.monotonic()
+
+    def _wrap_item(self, item):
+        """Wrap an item being put in the inbox with the time and the current span, if latency
+        recording or tracing is enabled.
+        """
+        if not (self._latency_recorder or self._tracer):
+            return item
+        span = tracing.current_span() if self._tracer else None
+        return _InboxItem(item, self._monotonic(), span)
+
+    def _unwrap_item(self, item):
+        """Record the time an item spent in the inbox, and return the item originally put there.
+
+        Items which were not wrapped are returned unchanged.
+        """
+        if not isinstance(item, _InboxItem):
+            return item
+        wait_time = self._monotonic() - item.put_time
+        if self._latency_recorder:
+            self._latency_recorder.record("inbox_wait_time", wait_time)
+        if self._tracer:
+            self._tracer.start_span(
+                "inbox.wait", parent=item.span, start_time=time.time() - wait_time
+            ).end()
+        return item.item
+
     @abstractmethod
     def _put(self, item):
         """Put an item into the Inbox.
@@ -35,6 +82,19 @@ class AbstractInbox:
         """
         pass
 
+    @abstractmethod
+    def _put_discarding_oldest(self, item):
+        """Put an item into the Inbox without blocking.
+
+        If the Inbox is full, the oldest item is discarded to make room for the new one.
+        Implementation MUST be a synchronous function.
+        Only to be used by the InboxManager.
+
+        :param item: The item to put in the Inbox.
+        :returns: Boolean indicating if an item was discarded.
+        """
+        pass
+
     @abstractmethod
     def get(self):
         """Remove and return an item from the inbox.
@@ -54,6 +114,14 @@ class AbstractInbox:
         """
         pass
 
+    @abstractmethod
+    def qsize(self):
+        """Returns the approximate number of items in the inbox
+
+        :returns: The number of items in the inbox
+        """
+        pass
+
     @abstractmethod
     def clear(self):
         """Remove all items from the inbox.
@@ -67,9 +135,19 @@ class SyncClientInbox(AbstractInbox):
     All methods implemented in this class are threadsafe.
     """
 
-    def __init__(self):
-        """Initializer for SyncClientInbox"""
-        self._queue = queue.Queue()
+    def __init__(self, maxsize=0, latency_recorder=None, tracer=None):
+        """Initializer for SyncClientInbox
+
+        :param int maxsize: Optionally provide the maximum number of items the inbox can hold.
+        Default 0, meaning the inbox is unbounded.
+        :param latency_recorder: Optional LatencyRecorder which records the time each item waits in
+        the inbox.
+        :param tracer: Optional Tracer which traces the time each item waits in the inbox, as a
+        child of the span active when the item was put in it.
+        """
+        self._latency_recorder = latency_recorder
+        self._tracer = tracer
+        self._queue = queue.Queue(maxsize=maxsize)
 
     def _put(self, item):
         """Put an item into the inbox.
@@ -79,8 +157,31 @@ class SyncClientInbox(AbstractInbox):
 
         :param item: The item to put in the inbox.
         """
+        item = self._wrap_item(item)
         self._queue.put(item)
 
+    def _put_discarding_oldest(self, item):
+        """Put an item into the inbox without blocking.
+
+        If the inbox is full, the oldest item is discarded to make room for the new one.
+        Only to be used by the InboxManager.
+
+        :param item: The item to put in the inbox.
+        :returns: Boolean indicating if an item was discarded.
+        """
+        item = self._wrap_item(item)
+        discarded = False
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return discarded
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    discarded = True
+                except queue.Empty:
+                    pass
+
     def get(self, block=True, timeout=None):
         """Remove and return an item from the inbox.
 
@@ -94,9 +195,10 @@ class SyncClientInbox(AbstractInbox):
         :returns: An item from the Inbox
         """
         try:
-            return self._queue.get(block=block, timeout=timeout)
+            item = self._queue.get(block=block, timeout=timeout)
         except queue.Empty:
             raise InboxEmpty("Inbox is empty")
+        return self._unwrap_item(item)
 
     def empty(self):
         """Returns True if the inbox is empty, False otherwise
@@ -105,6 +207,13 @@ class SyncClientInbox(AbstractInbox):
         """
         return self._queue.empty()
 
+    def qsize(self):
+        """Returns the approximate number of items in the inbox
+
+        :returns: The number of items in the inbox
+        """
+        return self._queue.qsize()
+
     def clear(self):
         """Remove all items from the inbox.
         """
@@ -0,0 +1,10 @@
+"""Azure IoT Hub Device SDK Testing
+
+This package provides an in-process fake of the IoT Hub MQTT endpoint, for testing and
+benchmarking the Azure IoT Hub Device SDK without a real IoT Hub.
+INTERNAL USAGE ONLY
+"""
+
+from .fake_hub import FakeIoTHub, ReceivedMessage, MethodResponse
+from .hub_process import FakeIoTHubProcess
+from .loopback import LoopbackMqttClient, use_loopback
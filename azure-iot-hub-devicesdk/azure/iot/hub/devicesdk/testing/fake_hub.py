@@ -0,0 +1,782 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains an in-process MQTT broker which behaves like the MQTT endpoint of IoT Hub.
+"""
+
+import base64
+import functools
+import hashlib
+import heapq
+import hmac
+import itertools
+import logging
+import os
+import select
+import shutil
+import socket
+import ssl
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import six
+import six.moves.urllib as urllib
+from six.moves import queue
+from azure.iot.hub.devicesdk.common.clock import SYSTEM_CLOCK
+from azure.iot.hub.devicesdk.transport import constant
+from . import mqtt_packets
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOSTNAME = "localhost"
+DEFAULT_SHARED_ACCESS_KEY = base64.b64encode(b"fake-iothub-shared-access-key").decode("utf-8")
+
+_connection_string_format = "HostName={};DeviceId={};SharedAccessKey={}"
+_method_request_topic_format = "$iothub/methods/POST/{}/?$rid={}"
+_method_response_topic_prefix = "$iothub/methods/res/"
+
+# Payloads sent by send_timed_messages start with their send time, from time.time()
+TIMESTAMP_FORMAT = "!d"
+TIMESTAMP_SIZE = struct.calcsize(TIMESTAMP_FORMAT)
+
+_monotonic = getattr(time, "monotonic", time.time)
+# Not available on Windows
+_poll = getattr(select, "poll", None)
+
+
+class ReceivedMessage(object):
+    """A message published to the fake hub by a device or module.
+
+    :ivar str device_id: The id of the sending device.
+    :ivar str module_id: The id of the sending module, or None.
+    :ivar str topic: The topic the message was published on.
+    :ivar bytes payload: The payload of the message.
+    :ivar dict properties: The system and custom properties encoded on the topic.
+    :ivar int qos: The QoS the message was published with.
+    """
+
+    __slots__ = ("device_id", "module_id", "topic", "payload", "properties", "qos")
+
+    def __init__(self, device_id, module_id, topic, payload, properties, qos):
+        self.device_id = device_id
+        self.module_id = module_id
+        self.topic = topic
+        self.payload = payload
+        self.properties = properties
+        self.qos = qos
+
+
+class MethodResponse(object):
+    """A response to a method invoked with FakeIoTHub.invoke_method.
+
+    :ivar str request_id: The request id returned by invoke_method.
+    :ivar int status: The status code sent by the device.
+    :ivar bytes payload: The response payload.
+    """
+
+    __slots__ = ("request_id", "status", "payload")
+
+    def __init__(self, request_id, status, payload):
+        self.request_id = request_id
+        self.status = status
+        self.payload = payload
+
+
+class FakeIoTHub(object):
+    """An MQTT 3.1.1 broker which runs in the current process and implements the parts of the IoT
+    Hub MQTT endpoint used by the device SDK.
+
+    The fake hub listens on loopback ports for plain TCP and, optionally, TLS connections. Clients
+    authenticate with SAS tokens signed with the hub's shared access key, which is shared by
+    every device. Telemetry published by clients is recorded, and C2D messages, input messages and
+    method requests can be injected into connected clients. Acknowledgements of published
+    messages can be delayed to simulate a slow service.
+
+    The TLS certificate is a self-signed certificate generated with the openssl command line
+    tool, which must be on the PATH when tls is True. Clients must trust ca_cert to connect.
+
+    :ivar str hostname: The hostname clients must use, which the TLS certificate is issued for.
+    :ivar str shared_access_key: The key SAS tokens must be signed with.
+    :ivar float puback_delay: The number of seconds to wait before acknowledging each PUBLISH.
+    :ivar bool record_messages: Whether received telemetry is added to received_messages.
+    :ivar received_messages: A Queue of ReceivedMessage objects, one per received telemetry message.
+    :ivar method_responses: A Queue of MethodResponse objects.
+    :ivar on_message_received: Optional callback which is called with each ReceivedMessage, on the
+    thread of the connection it arrived on.
+    :ivar int message_count: The number of telemetry messages received.
+    :ivar int byte_count: The number of telemetry payload bytes received.
+    :ivar int expired_disconnects: The number of connections closed because their token expired.
+    """
+
+    def __init__(
+        self,
+        hostname=DEFAULT_HOSTNAME,
+        shared_access_key=DEFAULT_SHARED_ACCESS_KEY,
+        tls=True,
+        puback_delay=0,
+        record_messages=True,
+        clock=None,
+        enforce_token_expiry=False,
+    ):
+        """Initializer for FakeIoTHub.
+
+        :param str hostname: The hostname clients must use. Default localhost.
+        :param str shared_access_key: The base64-encoded key SAS tokens must be signed with.
+        :param bool tls: Whether to listen for TLS connections as well as plain TCP connections.
+        :param float puback_delay: The number of seconds to wait before acknowledging each PUBLISH.
+        :param bool record_messages: Whether to add received telemetry to received_messages. Turn
+        this off for long running benchmarks. Default True.
+        :param clock: The Clock SAS token expiry is checked against. Default the system clock.
+        :param bool enforce_token_expiry: Whether to close connections when the SAS token they
+        connected with expires, as the service does. The close is scheduled on the clock. Default
+        False.
+        """
+        self.hostname = hostname
+        self.shared_access_key = shared_access_key
+        self.puback_delay = puback_delay
+        self.record_messages = record_messages
+        self.received_messages = queue.Queue()
+        self.method_responses = queue.Queue()
+        self.on_message_received = None
+        self.message_count = 0
+        self.byte_count = 0
+        self.expired_disconnects = 0
+        self.ca_cert = None
+        self.clock = clock or SYSTEM_CLOCK
+        self.enforce_token_expiry = enforce_token_expiry
+
+        self._tls = tls
+        self._ssl_context = None
+        self._cert_dir = None
+        self._listeners = []
+        self._threads = []
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._subscription_changed = threading.Condition(self._lock)
+        self._running = False
+
+    @property
+    def tcp_port(self):
+        """The port listening for plain TCP connections."""
+        return self._listeners[0].getsockname()[1] if self._listeners else None
+
+    @property
+    def tls_port(self):
+        """The port listening for TLS connections, or None if TLS is disabled."""
+        return self._listeners[1].getsockname()[1] if len(self._listeners) > 1 else None
+
+    def start(self):
+        """Start listening for connections.
+
+        :returns: This FakeIoTHub.
+        :raises: RuntimeError if tls is enabled and the certificate cannot be generated.
+        """
+        if self._running:
+            return self
+        if self._tls:
+            self._create_ssl_context()
+        self._running = True
+        self._listeners.append(self._listen(self._accept_tcp))
+        if self._tls:
+            self._listeners.append(self._listen(self._accept_tls))
+        logger.info("Fake IoT Hub listening on port %s (TLS %s)", self.tcp_port, self.tls_port)
+        return self
+
+    def stop(self):
+        """Disconnect every client and stop listening."""
+        if not self._running:
+            return
+        self._running = False
+        for listener in self._listeners:
+            try:
+                # Shutting down wakes the thread blocked in accept
+                listener.shutdown(socket.SHUT_RDWR)
+            except (OSError, socket.error):
+                pass
+            listener.close()
+        with self._lock:
+            connections = list(self._connections.values())
+        for connection in connections:
+            connection.close()
+        for thread in self._threads:
+            thread.join(5)
+        self._listeners = []
+        self._threads = []
+        if self._cert_dir:
+            shutil.rmtree(self._cert_dir, ignore_errors=True)
+            self._cert_dir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def connection_string(self, device_id, module_id=None):
+        """Build a connection string for a device or module on this hub.
+
+        :param str device_id: The id of the device.
+        :param str module_id: The id of the module, if any.
+        :returns: The connection string.
+        """
+        connection_string = _connection_string_format.format(
+            self.hostname, device_id, self.shared_access_key
+        )
+        if module_id:
+            connection_string += ";ModuleId=" + module_id
+        return connection_string
+
+    @property
+    def connected_clients(self):
+        """The client ids of the currently connected clients."""
+        with self._lock:
+            return sorted(self._connections)
+
+    def wait_for_connection(self, client_id, timeout=10):
+        """Wait until a client is connected.
+
+        :param str client_id: The device id, or "{device_id}/{module_id}" for a module.
+        :param float timeout: The maximum number of seconds to wait.
+        :returns: True if the client is connected.
+        """
+        deadline = _monotonic() + timeout
+        with self._lock:
+            while client_id not in self._connections:
+                remaining = deadline - _monotonic()
+                if remaining <= 0:
+                    return False
+                self._subscription_changed.wait(remaining)
+            return True
+
+    def wait_for_subscription(self, client_id, feature_name, timeout=10):
+        """Wait until a client has subscribed to the topics of a feature.
+
+        :param str client_id: The device id, or "{device_id}/{module_id}" for a module.
+        :param str feature_name: One of the feature names in transport.constant.
+        :param float timeout: The maximum number of seconds to wait.
+        :returns: True if the client is subscribed.
+        """
+        topic = self._feature_topic(client_id, feature_name)
+        deadline = _monotonic() + timeout
+        with self._lock:
+            while True:
+                connection = self._connections.get(client_id)
+                if connection and connection.is_subscribed(topic):
+                    return True
+                remaining = deadline - _monotonic()
+                if remaining <= 0:
+                    return False
+                self._subscription_changed.wait(remaining)
+
+    def disconnect_client(self, client_id):
+        """Drop the connection of a client, as the service does when it closes a connection.
+
+        :returns: True if the client was connected.
+        """
+        with self._lock:
+            connection = self._connections.get(client_id)
+        if connection:
+            connection.close()
+        return connection is not None
+
+    def send_c2d_message(self, device_id, payload, properties=None):
+        """Send a cloud to device message.
+
+        :param str device_id: The id of the receiving device.
+        :param payload: The payload, as bytes or str.
+        :param dict properties: System properties such as "$.mid" and custom properties.
+        :returns: True if the message was delivered to a subscribed client.
+        """
+        topic = "devices/{}/messages/devicebound/".format(device_id)
+        to = "/devices/{}/messages/deviceBound".format(device_id)
+        return self._deliver(device_id, topic + _encode_topic_properties(to, properties), payload)
+
+    def send_input_message(self, device_id, module_id, input_name, payload, properties=None):
+        """Send a message to an input of a module.
+
+        :param str device_id: The id of the device hosting the module.
+        :param str module_id: The id of the receiving module.
+        :param str input_name: The name of the input.
+        :param payload: The payload, as bytes or str.
+        :param dict properties: System properties such as "$.mid" and custom properties.
+        :returns: True if the message was delivered to a subscribed client.
+        """
+        topic = "devices/{}/modules/{}/inputs/{}/".format(device_id, module_id, input_name)
+        to = "/devices/{}/modules/{}/inputs/{}".format(device_id, module_id, input_name)
+        client_id = device_id + "/" + module_id
+        return self._deliver(client_id, topic + _encode_topic_properties(to, properties), payload)
+
+    def invoke_method(self, device_id, method_name, payload, module_id=None):
+        """Invoke a direct method on a device or module. The response is added to method_responses.
+
+        :param str device_id: The id of the device.
+        :param str method_name: The name of the method.
+        :param payload: The payload, as bytes or str.
+        :param str module_id: The id of the module, if the method is invoked on a module.
+        :returns: The request id of the invocation, or None if no subscribed client received it.
+        """
+        client_id = device_id + "/" + module_id if module_id else device_id
+        request_id = uuid.uuid4().hex
+        topic = _method_request_topic_format.format(method_name, request_id)
+        return request_id if self._deliver(client_id, topic, payload) else None
+
+    def send_timed_messages(
+        self, device_id, count, rate=0, payload_size=64, module_id=None, input_name=None
+    ):
+        """Send a stream of C2D messages, or of input messages if a module and input are given, for
+        measuring delivery latency.
+
+        Each payload starts with the time it was sent, from time.time(), packed with
+        TIMESTAMP_FORMAT and padded to payload_size bytes. Messages are paced to the given rate.
+        This call blocks until every message has been sent.
+
+        :param str device_id: The id of the receiving device.
+        :param int count: The number of messages to send.
+        :param float rate: The number of messages per second, or 0 to send as fast as possible.
+        :param int payload_size: The size of each payload in bytes.
+        :param str module_id: The id of the receiving module, for input messages.
+        :param str input_name: The name of the input, for input messages.
+        :returns: The number of messages delivered to a subscribed client.
+        """
+        if module_id:
+            topic = "devices/{}/modules/{}/inputs/{}/".format(device_id, module_id, input_name)
+            to = "/devices/{}/modules/{}/inputs/{}".format(device_id, module_id, input_name)
+            client_id = device_id + "/" + module_id
+        else:
+            topic = "devices/{}/messages/devicebound/".format(device_id)
+            to = "/devices/{}/messages/deviceBound".format(device_id)
+            client_id = device_id
+        topic += _encode_topic_properties(to, None)
+        padding = b"\0" * max(0, payload_size - TIMESTAMP_SIZE)
+
+        delivered = 0
+        start = _monotonic()
+        for i in six.moves.range(count):
+            if rate:
+                delay = start + float(i) / rate - _monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            payload = struct.pack(TIMESTAMP_FORMAT, time.time()) + padding
+            if self._deliver(client_id, topic, payload):
+                delivered += 1
+        return delivered
+
+    def _deliver(self, client_id, topic, payload):
+        if isinstance(payload, six.text_type):
+            payload = payload.encode("utf-8")
+        with self._lock:
+            connection = self._connections.get(client_id)
+        if not connection or not connection.is_subscribed(topic):
+            logger.warning("No subscriber for %s on %s", client_id, topic)
+            return False
+        connection.send_publish(topic, payload)
+        return True
+
+    def _feature_topic(self, client_id, feature_name):
+        if feature_name == constant.C2D_MSG:
+            return "devices/{}/messages/devicebound/".format(client_id)
+        elif feature_name == constant.INPUT_MSG:
+            device_id, _, module_id = client_id.partition("/")
+            return "devices/{}/modules/{}/inputs/".format(device_id, module_id)
+        elif feature_name == constant.METHODS:
+            return "$iothub/methods/POST/"
+        raise ValueError("Invalid feature name {}".format(feature_name))
+
+    def _create_ssl_context(self):
+        self._cert_dir = tempfile.mkdtemp(prefix="fake-iothub-")
+        certfile, keyfile = _generate_self_signed_certificate(self.hostname, self._cert_dir)
+        with open(certfile) as f:
+            self.ca_cert = f.read()
+        self._ssl_context = ssl.SSLContext(getattr(ssl, "PROTOCOL_TLS", ssl.PROTOCOL_SSLv23))
+        self._ssl_context.load_cert_chain(certfile, keyfile)
+
+    def _listen(self, accept):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(128)
+        self._start_thread(accept, listener)
+        return listener
+
+    def _start_thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def _accept_tcp(self, listener):
+        self._accept(listener, None)
+
+    def _accept_tls(self, listener):
+        self._accept(listener, self._ssl_context)
+
+    def _accept(self, listener, ssl_context):
+        while self._running:
+            try:
+                sock, _ = listener.accept()
+            except (OSError, socket.error):
+                break
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = _ClientConnection(self, sock, ssl_context)
+            thread = threading.Thread(target=connection.run)
+            thread.daemon = True
+            thread.start()
+
+    def _authenticate(self, packet):
+        """Validate the credentials in a CONNECT packet.
+
+        :returns: A CONNACK return code.
+        """
+        if packet.level != 4:
+            return mqtt_packets.CONNACK_UNACCEPTABLE_PROTOCOL_VERSION
+        if not packet.client_id or packet.client_id.count("/") > 1:
+            return mqtt_packets.CONNACK_IDENTIFIER_REJECTED
+        expected_username = "{}/{}/".format(self.hostname, packet.client_id)
+        if not packet.username or not packet.username.startswith(expected_username):
+            return mqtt_packets.CONNACK_BAD_USERNAME_OR_PASSWORD
+        token = _parse_sas_token(packet.password)
+        if not token or not all(key in token for key in ("sr", "sig", "se")):
+            return mqtt_packets.CONNACK_BAD_USERNAME_OR_PASSWORD
+
+        device_id, _, module_id = packet.client_id.partition("/")
+        resource_uri = self.hostname + "/devices/" + device_id
+        if module_id:
+            resource_uri += "/modules/" + module_id
+        if urllib.parse.unquote_plus(token["sr"]) != resource_uri:
+            return mqtt_packets.CONNACK_NOT_AUTHORIZED
+
+        message = (token["sr"] + "\n" + token["se"]).encode("utf-8")
+        key = base64.b64decode(self.shared_access_key.encode("utf-8"))
+        expected_signature = base64.b64encode(hmac.HMAC(key, message, hashlib.sha256).digest())
+        signature = urllib.parse.unquote(token["sig"]).encode("utf-8")
+        if not hmac.compare_digest(signature, expected_signature):
+            return mqtt_packets.CONNACK_BAD_USERNAME_OR_PASSWORD
+        try:
+            expired = int(token["se"]) < self.clock.time()
+        except ValueError:
+            return mqtt_packets.CONNACK_BAD_USERNAME_OR_PASSWORD
+        if expired:
+            return mqtt_packets.CONNACK_NOT_AUTHORIZED
+        return mqtt_packets.CONNACK_ACCEPTED
+
+    def _register(self, connection):
+        with self._lock:
+            previous = self._connections.get(connection.client_id)
+            self._connections[connection.client_id] = connection
+            self._subscription_changed.notify_all()
+        if previous:
+            # As with the service, a second connection with the same client id replaces the first
+            previous.close()
+
+    def _unregister(self, connection):
+        with self._lock:
+            if self._connections.get(connection.client_id) is connection:
+                del self._connections[connection.client_id]
+
+    def _close_expired(self, connection):
+        if not connection._closed:
+            logger.info("Closing connection from %s: SAS token expired", connection.client_id)
+            with self._lock:
+                self.expired_disconnects += 1
+            connection.close()
+
+    def _subscriptions_updated(self):
+        with self._lock:
+            self._subscription_changed.notify_all()
+
+    def _on_publish(self, connection, packet):
+        """Handle a PUBLISH from a client.
+
+        :returns: False if the topic is not allowed for the client and it must be disconnected.
+        """
+        topic = packet.topic
+        if topic.startswith(_method_response_topic_prefix):
+            status, _, query = topic[len(_method_response_topic_prefix) :].partition("/")
+            rid = dict(urllib.parse.parse_qsl(query.lstrip("?"))).get("$rid")
+            self.method_responses.put(MethodResponse(rid, int(status), packet.payload))
+            return True
+
+        events_topic = connection.topic_base + "/messages/events/"
+        if not topic.startswith(events_topic):
+            logger.warning("Client %s published on forbidden topic %s", connection.client_id, topic)
+            return False
+
+        with self._lock:
+            self.message_count += 1
+            self.byte_count += len(packet.payload)
+        if self.record_messages or self.on_message_received:
+            properties = dict(urllib.parse.parse_qsl(topic[len(events_topic) :]))
+            message = ReceivedMessage(
+                connection.device_id,
+                connection.module_id,
+                topic,
+                packet.payload,
+                properties,
+                packet.qos,
+            )
+            if self.record_messages:
+                self.received_messages.put(message)
+            if self.on_message_received:
+                self.on_message_received(message)
+        return True
+
+
+class _ClientConnection(object):
+    """A connection from one client, served by a single thread which both reads and writes so
+    that TLS sockets are never used from two threads at once."""
+
+    def __init__(self, hub, sock, ssl_context):
+        self.hub = hub
+        self.client_id = None
+        self.device_id = None
+        self.module_id = None
+        self.topic_base = None
+        self._sock = sock
+        self._ssl_context = ssl_context
+        self._subscriptions = {}
+        self._mids = itertools.cycle(six.moves.range(1, 65536))
+        # Outgoing packets are held in a heap of (due, sequence, packet) so that acknowledgements
+        # can be delayed without holding up other traffic
+        self._outgoing = []
+        self._sequence = itertools.count()
+        self._outgoing_lock = threading.Lock()
+        self._wake_reader, self._wake_writer = socket.socketpair()
+        self._poller = None
+        self._expiry_call = None
+        self._closed = False
+
+    def is_subscribed(self, topic):
+        return any(mqtt_packets.topic_matches(f, topic) for f in self._subscriptions)
+
+    def send_publish(self, topic, payload):
+        mid = next(self._mids)
+        self._queue(mqtt_packets.publish(topic, payload, qos=1, mid=mid))
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_writer.send(b"\0")
+        except (OSError, socket.error):
+            pass
+
+    def _queue(self, packet, delay=0):
+        with self._outgoing_lock:
+            heapq.heappush(self._outgoing, (_monotonic() + delay, next(self._sequence), packet))
+        self._wake()
+
+    def run(self):
+        try:
+            if self._ssl_context:
+                self._sock.settimeout(10)
+                self._sock = self._ssl_context.wrap_socket(self._sock, server_side=True)
+                self._sock.settimeout(None)
+            self._serve()
+        except (OSError, socket.error, ssl.SSLError, mqtt_packets.MQTTProtocolError) as e:
+            logger.info("Connection from %s closed: %s", self.client_id, e)
+        finally:
+            self._closed = True
+            if self._expiry_call:
+                self._expiry_call.cancel()
+            if self.client_id:
+                self.hub._unregister(self)
+            for sock in (self._sock, self._wake_reader, self._wake_writer):
+                sock.close()
+
+    def _wait_readable(self, timeout):
+        """Wait for the socket or the wake socket to be readable.
+
+        poll() is used where it is available, as select() cannot watch file descriptors above
+        1024, which a hub serving a few hundred clients uses.
+
+        :returns: Whether the socket is readable.
+        """
+        if _poll is None:
+            readable, _, _ = select.select([self._sock, self._wake_reader], [], [], timeout)
+            wake = self._wake_reader in readable
+            sock_readable = self._sock in readable
+        else:
+            if self._poller is None:
+                self._poller = _poll()
+                self._poller.register(self._sock, select.POLLIN)
+                self._poller.register(self._wake_reader, select.POLLIN)
+            events = dict(self._poller.poll(None if timeout is None else timeout * 1000))
+            wake = self._wake_reader.fileno() in events
+            sock_readable = self._sock.fileno() in events
+        if wake:
+            self._wake_reader.recv(4096)
+        return sock_readable
+
+    def _serve(self):
+        buffer = bytearray()
+        while not self._closed:
+            timeout = self._send_due_packets()
+            pending = self._ssl_context is not None and self._sock.pending()
+            if not pending and not self._wait_readable(timeout):
+                continue
+            data = self._sock.recv(65536)
+            if not data:
+                return
+            buffer.extend(data)
+            while True:
+                packet = mqtt_packets.split_packet(buffer)
+                if packet is None:
+                    break
+                if not self._handle_packet(*packet):
+                    return
+
+    def _send_due_packets(self):
+        """Send every packet which is due.
+
+        :returns: The number of seconds until the next packet is due, or None.
+        """
+        while True:
+            with self._outgoing_lock:
+                if not self._outgoing:
+                    return None
+                due = self._outgoing[0][0] - _monotonic()
+                if due > 0:
+                    return due
+                packet = heapq.heappop(self._outgoing)[2]
+            self._sock.sendall(packet)
+
+    def _handle_packet(self, packet_type, flags, body):
+        """Handle one packet from the client.
+
+        :returns: False if the connection must be closed.
+        """
+        if self.client_id is None:
+            if packet_type != mqtt_packets.CONNECT:
+                raise mqtt_packets.MQTTProtocolError("First packet was not CONNECT")
+            return self._handle_connect(mqtt_packets.parse_connect(body))
+
+        if packet_type == mqtt_packets.PUBLISH:
+            packet = mqtt_packets.parse_publish(flags, body)
+            if packet.qos > 1:
+                logger.warning("Client %s published with unsupported QoS 2", self.client_id)
+                return False
+            if not self.hub._on_publish(self, packet):
+                return False
+            if packet.qos:
+                self._queue(mqtt_packets.puback(packet.mid), self.hub.puback_delay)
+        elif packet_type == mqtt_packets.PUBACK:
+            mqtt_packets.parse_mid(body)
+        elif packet_type == mqtt_packets.SUBSCRIBE:
+            mid, subscriptions = mqtt_packets.parse_subscribe(body)
+            return_codes = [self._subscribe(f, qos) for f, qos in subscriptions]
+            self._queue(mqtt_packets.suback(mid, return_codes))
+            self.hub._subscriptions_updated()
+        elif packet_type == mqtt_packets.UNSUBSCRIBE:
+            mid, topic_filters = mqtt_packets.parse_unsubscribe(body)
+            subscriptions = dict(self._subscriptions)
+            for topic_filter in topic_filters:
+                subscriptions.pop(topic_filter, None)
+            self._subscriptions = subscriptions
+            self._queue(mqtt_packets.unsuback(mid))
+        elif packet_type == mqtt_packets.PINGREQ:
+            self._queue(mqtt_packets.pingresp())
+        elif packet_type == mqtt_packets.DISCONNECT:
+            return False
+        else:
+            raise mqtt_packets.MQTTProtocolError("Unexpected packet type {}".format(packet_type))
+        return True
+
+    def _handle_connect(self, packet):
+        return_code = self.hub._authenticate(packet)
+        self._sock.sendall(mqtt_packets.connack(return_code))
+        if return_code != mqtt_packets.CONNACK_ACCEPTED:
+            logger.info("Rejected connection from %s: %d", packet.client_id, return_code)
+            return False
+
+        self.client_id = packet.client_id
+        self.device_id, _, module_id = packet.client_id.partition("/")
+        self.module_id = module_id or None
+        self.topic_base = "devices/" + self.device_id
+        if self.module_id:
+            self.topic_base += "/modules/" + self.module_id
+        if self.hub.enforce_token_expiry:
+            clock = self.hub.clock
+            expiry = int(_parse_sas_token(packet.password)["se"])
+            self._expiry_call = clock.call_later(
+                expiry - clock.time(), functools.partial(self.hub._close_expired, self), daemon=True
+            )
+        self.hub._register(self)
+        return True
+
+    def _subscribe(self, topic_filter, qos):
+        allowed_prefixes = ("$iothub/methods/POST/", "$iothub/twin/", self.topic_base + "/")
+        if not topic_filter.startswith(allowed_prefixes):
+            logger.warning("Client %s subscribed to forbidden %s", self.client_id, topic_filter)
+            return mqtt_packets.SUBACK_FAILURE
+        granted_qos = min(qos, 1)
+        # Subscriptions are replaced rather than modified, as other threads read them
+        subscriptions = dict(self._subscriptions)
+        subscriptions[topic_filter] = granted_qos
+        self._subscriptions = subscriptions
+        return granted_qos
+
+
+def _encode_topic_properties(to, properties):
+    # Like the service, always include $.to so that the property segment is never empty
+    encoded = [("$.to", to)]
+    if properties:
+        encoded.extend(sorted(properties.items()))
+    return urllib.parse.urlencode(encoded)
+
+
+def _parse_sas_token(password):
+    prefix = "SharedAccessSignature "
+    if not password or not password.startswith(prefix):
+        return None
+    fields = {}
+    for field in password[len(prefix) :].split("&"):
+        key, sep, value = field.partition("=")
+        if not sep:
+            return None
+        fields[key] = value
+    return fields
+
+
+def _generate_self_signed_certificate(hostname, directory):
+    """Generate a self-signed certificate and key for a hostname with the openssl command line tool.
+
+    :returns: A tuple of the paths of the certificate and key PEM files.
+    :raises: RuntimeError if the certificate could not be generated.
+    """
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    alt_names = "DNS:{},DNS:localhost,IP:127.0.0.1".format(hostname)
+    command = [
+        "openssl",
+        "req",
+        "-x509",
+        "-newkey",
+        "rsa:2048",
+        "-nodes",
+        "-days",
+        "1",
+        "-keyout",
+        keyfile,
+        "-out",
+        certfile,
+        "-subj",
+        "/CN=" + hostname,
+        "-addext",
+        "subjectAltName=" + alt_names,
+    ]
+    try:
+        subprocess.check_output(command, stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise RuntimeError(
+            "Unable to generate a certificate for the fake IoT Hub. TLS requires OpenSSL 1.1.1 or "
+            "later on the PATH; use tls=False to run without it. ({})".format(e)
+        )
+    return certfile, keyfile
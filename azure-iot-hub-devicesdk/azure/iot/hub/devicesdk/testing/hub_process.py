@@ -0,0 +1,158 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module runs a FakeIoTHub in a child process, so that the CPU time and memory used by the
+broker are not attributed to the process being measured.
+"""
+
+import multiprocessing
+import traceback
+from .fake_hub import (
+    FakeIoTHub,
+    DEFAULT_HOSTNAME,
+    DEFAULT_SHARED_ACCESS_KEY,
+    _connection_string_format,
+)
+
+_START_TIMEOUT = 30
+
+
+def _serve(connection, hostname, shared_access_key, tls, puback_delay):
+    """Entry point of the child process. Runs the hub and answers calls until told to stop."""
+    try:
+        hub = FakeIoTHub(hostname, shared_access_key, tls, puback_delay, record_messages=False)
+        hub.start()
+    except Exception as e:
+        connection.send(("error", str(e)))
+        return
+    connection.send(("started", (hub.tcp_port, hub.tls_port, hub.ca_cert)))
+
+    try:
+        while True:
+            request = connection.recv()
+            if request is None:
+                break
+            name, args, kwargs = request
+            try:
+                attribute = getattr(hub, name)
+                result = attribute(*args, **kwargs) if callable(attribute) else attribute
+                connection.send(("result", result))
+            except Exception:
+                connection.send(("error", traceback.format_exc()))
+    except EOFError:
+        pass
+    finally:
+        hub.stop()
+
+
+class FakeIoTHubProcess(object):
+    """A FakeIoTHub running in a child process.
+
+    Methods and attributes of the hub are reached through call(). Received messages are not
+    recorded, but message_count and byte_count are kept.
+
+    :ivar str hostname: The hostname clients must use.
+    :ivar str shared_access_key: The key SAS tokens must be signed with.
+    :ivar int tcp_port: The port listening for plain TCP connections, once started.
+    :ivar int tls_port: The port listening for TLS connections, once started.
+    :ivar str ca_cert: The certificate clients must trust to connect with TLS, once started.
+    """
+
+    def __init__(
+        self,
+        hostname=DEFAULT_HOSTNAME,
+        shared_access_key=DEFAULT_SHARED_ACCESS_KEY,
+        tls=True,
+        puback_delay=0,
+    ):
+        """Initializer for FakeIoTHubProcess.
+
+        :param str hostname: The hostname clients must use. Default localhost.
+        :param str shared_access_key: The base64-encoded key SAS tokens must be signed with.
+        :param bool tls: Whether to listen for TLS connections as well as plain TCP connections.
+        :param float puback_delay: The number of seconds to wait before acknowledging each PUBLISH.
+        """
+        self.hostname = hostname
+        self.shared_access_key = shared_access_key
+        self.tcp_port = None
+        self.tls_port = None
+        self.ca_cert = None
+        self._args = (hostname, shared_access_key, tls, puback_delay)
+        self._process = None
+        self._connection = None
+
+    def start(self):
+        """Start the child process and wait for the hub to listen.
+
+        :returns: This FakeIoTHubProcess.
+        :raises: RuntimeError if the hub could not be started.
+        """
+        if hasattr(multiprocessing, "get_context"):
+            # Spawn rather than fork, so the child does not inherit the threads of the parent
+            context = multiprocessing.get_context("spawn")
+        else:
+            context = multiprocessing
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(target=_serve, args=(child_connection,) + self._args)
+        self._process.daemon = True
+        self._process.start()
+
+        if not self._connection.poll(_START_TIMEOUT):
+            self.stop()
+            raise RuntimeError("Timed out starting the fake IoT Hub process")
+        status, value = self._connection.recv()
+        if status != "started":
+            self.stop()
+            raise RuntimeError(value)
+        self.tcp_port, self.tls_port, self.ca_cert = value
+        return self
+
+    def stop(self):
+        """Stop the hub and wait for the child process to exit."""
+        if self._process is None:
+            return
+        try:
+            self._connection.send(None)
+        except (IOError, OSError):
+            pass
+        self._process.join(10)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._connection.close()
+        self._process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def connection_string(self, device_id, module_id=None):
+        """Build a connection string for a device or module on this hub.
+
+        :param str device_id: The id of the device.
+        :param str module_id: The id of the module, if any.
+        :returns: The connection string.
+        """
+        connection_string = _connection_string_format.format(
+            self.hostname, device_id, self.shared_access_key
+        )
+        if module_id:
+            connection_string += ";ModuleId=" + module_id
+        return connection_string
+
+    def call(self, name, *args, **kwargs):
+        """Call a method of the hub, or read an attribute if name is not callable.
+
+        :param str name: The name of a FakeIoTHub method or attribute, such as "send_c2d_message"
+        or "message_count".
+        :returns: The result of the call.
+        :raises: RuntimeError if the call raised an exception in the child process.
+        """
+        self._connection.send((name, args, kwargs))
+        status, value = self._connection.recv()
+        if status != "result":
+            raise RuntimeError(value)
+        return value
@@ -0,0 +1,120 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains an in-process stand-in for the paho MQTT client, for exercising a client,
+its transport and its MQTT provider without a network or a broker.
+"""
+
+import collections
+import paho.mqtt.client as mqtt
+
+_CALLBACKS = ("on_connect", "on_disconnect", "on_publish", "on_subscribe", "on_unsubscribe")
+
+
+class LoopbackMqttClient(object):
+    """Stands in for a paho client, completing each operation on the calling thread.
+
+    Connecting calls the connect callback at once, and each publish, subscribe and unsubscribe is
+    acknowledged before the call returns, as can happen with paho when the response arrives quickly.
+    Publishes can instead be left unacknowledged until acknowledge_publishes() is called, by the
+    thread standing in for the network thread. Messages are received by calling deliver().
+
+    :ivar int published: The number of messages published.
+    """
+
+    def __init__(self, client, acknowledge=True):
+        """Initializer for LoopbackMqttClient.
+
+        :param client: The paho client being replaced, whose callbacks are taken over.
+        :param bool acknowledge: Whether to acknowledge each publish before it returns. Default
+        True.
+        """
+        for name in _CALLBACKS + ("on_message",):
+            setattr(self, name, getattr(client, name))
+        self.published = 0
+        self._mid = 0
+        self._acknowledge = acknowledge
+        self._unacknowledged = collections.deque()
+
+    def _next_mid(self):
+        # paho MIDs wrap around after 65535
+        self._mid = self._mid % 65535 + 1
+        return self._mid
+
+    def tls_set_context(self, context):
+        pass
+
+    def tls_insecure_set(self, value):
+        pass
+
+    def username_pw_set(self, username, password):
+        pass
+
+    def connect(self, host, port):
+        self.on_connect(self, None, {}, mqtt.CONNACK_ACCEPTED)
+
+    def reconnect(self):
+        self.on_connect(self, None, {}, mqtt.CONNACK_ACCEPTED)
+
+    def loop_start(self):
+        pass
+
+    def disconnect(self):
+        self.on_disconnect(self, None, mqtt.MQTT_ERR_SUCCESS)
+
+    def publish(self, topic, payload, qos):
+        info = mqtt.MQTTMessageInfo(self._next_mid())
+        info.rc = mqtt.MQTT_ERR_SUCCESS
+        self.published += 1
+        if self._acknowledge:
+            self.on_publish(self, None, info.mid)
+        else:
+            self._unacknowledged.append(info.mid)
+        return info
+
+    def acknowledge_publishes(self):
+        """Acknowledge the publishes left unacknowledged, in the order they were made.
+
+        :returns: The number of publishes acknowledged.
+        """
+        count = 0
+        while self._unacknowledged:
+            self.on_publish(self, None, self._unacknowledged.popleft())
+            count += 1
+        return count
+
+    def subscribe(self, topic, qos):
+        mid = self._next_mid()
+        self.on_subscribe(self, None, mid, (qos,))
+        return mqtt.MQTT_ERR_SUCCESS, mid
+
+    def unsubscribe(self, topic):
+        mid = self._next_mid()
+        self.on_unsubscribe(self, None, mid)
+        return mqtt.MQTT_ERR_SUCCESS, mid
+
+    def deliver(self, topic, payload):
+        """Deliver a message to the MQTT provider, as the network thread would.
+
+        :param bytes topic: The topic of the message.
+        :param bytes payload: The payload of the message.
+        """
+        mqtt_message = mqtt.MQTTMessage(self._next_mid(), topic)
+        mqtt_message.payload = payload
+        self.on_message(self, None, mqtt_message)
+
+
+def use_loopback(client):
+    """Replace the paho client of a client's MQTT provider with a LoopbackMqttClient.
+
+    Must be called before the client connects.
+
+    :param client: A sync or async DeviceClient or ModuleClient using the MQTT transport.
+    :returns: The LoopbackMqttClient.
+    """
+    provider = client._transport._mqtt_provider
+    loopback = LoopbackMqttClient(provider._mqtt_client)
+    provider._mqtt_client = loopback
+    return loopback
@@ -0,0 +1,307 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module encodes and decodes the subset of MQTT 3.1.1 control packets used by IoT Hub.
+"""
+
+import struct
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+# CONNACK return codes
+CONNACK_ACCEPTED = 0
+CONNACK_UNACCEPTABLE_PROTOCOL_VERSION = 1
+CONNACK_IDENTIFIER_REJECTED = 2
+CONNACK_BAD_USERNAME_OR_PASSWORD = 4
+CONNACK_NOT_AUTHORIZED = 5
+
+# SUBACK return code for a rejected topic filter
+SUBACK_FAILURE = 0x80
+
+_MAX_REMAINING_LENGTH = 268435455
+
+
+class MQTTProtocolError(Exception):
+    """Raised when a received packet is not a valid MQTT 3.1.1 packet."""
+
+    pass
+
+
+class ConnectPacket(object):
+    """The contents of a CONNECT packet."""
+
+    __slots__ = ("client_id", "username", "password", "keep_alive", "clean_session", "level")
+
+    def __init__(self, client_id, username, password, keep_alive, clean_session, level):
+        self.client_id = client_id
+        self.username = username
+        self.password = password
+        self.keep_alive = keep_alive
+        self.clean_session = clean_session
+        self.level = level
+
+
+class PublishPacket(object):
+    """The contents of a PUBLISH packet."""
+
+    __slots__ = ("topic", "payload", "qos", "mid", "retain", "dup")
+
+    def __init__(self, topic, payload, qos=0, mid=None, retain=False, dup=False):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.mid = mid
+        self.retain = retain
+        self.dup = dup
+
+
+def split_packet(buffer):
+    """Split the first complete packet off the front of a buffer of received bytes.
+
+    :param bytearray buffer: The received bytes. The packet is removed from the buffer.
+    :returns: A tuple of (packet_type, flags, body), or None if the buffer does not hold a
+    complete packet yet.
+    :raises: MQTTProtocolError if the remaining length is malformed.
+    """
+    if len(buffer) < 2:
+        return None
+    remaining_length = 0
+    multiplier = 1
+    offset = 1
+    while True:
+        if offset >= len(buffer):
+            return None
+        byte = buffer[offset]
+        remaining_length += (byte & 0x7F) * multiplier
+        offset += 1
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+        if offset > 4:
+            raise MQTTProtocolError("Malformed remaining length")
+
+    end = offset + remaining_length
+    if len(buffer) < end:
+        return None
+    packet_type = buffer[0] >> 4
+    flags = buffer[0] & 0x0F
+    body = bytes(buffer[offset:end])
+    del buffer[:end]
+    return packet_type, flags, body
+
+
+def _encode_remaining_length(length):
+    if length > _MAX_REMAINING_LENGTH:
+        raise ValueError("Packet too large")
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        encoded.append(byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _encode_string(value):
+    if not isinstance(value, bytes):
+        value = value.encode("utf-8")
+    return struct.pack("!H", len(value)) + value
+
+
+def _decode_string(body, offset):
+    if offset + 2 > len(body):
+        raise MQTTProtocolError("Truncated string")
+    (length,) = struct.unpack_from("!H", body, offset)
+    offset += 2
+    if offset + length > len(body):
+        raise MQTTProtocolError("Truncated string")
+    return body[offset : offset + length].decode("utf-8"), offset + length
+
+
+def _packet(packet_type, flags, body):
+    return (
+        bytes(bytearray([(packet_type << 4) | flags])) + _encode_remaining_length(len(body)) + body
+    )
+
+
+def parse_connect(body):
+    """Parse the body of a CONNECT packet.
+
+    :returns: A ConnectPacket.
+    :raises: MQTTProtocolError if the packet is malformed.
+    """
+    protocol_name, offset = _decode_string(body, 0)
+    if protocol_name != "MQTT":
+        raise MQTTProtocolError("Unsupported protocol name {}".format(protocol_name))
+    if offset + 4 > len(body):
+        raise MQTTProtocolError("Truncated CONNECT")
+    level, connect_flags, keep_alive = struct.unpack_from("!BBH", body, offset)
+    offset += 4
+
+    client_id, offset = _decode_string(body, offset)
+    if connect_flags & 0x04:
+        # IoT Hub does not support will messages, but skip them so the rest can be parsed
+        _, offset = _decode_string(body, offset)
+        _, offset = _decode_string(body, offset)
+    username = None
+    password = None
+    if connect_flags & 0x80:
+        username, offset = _decode_string(body, offset)
+    if connect_flags & 0x40:
+        password, offset = _decode_string(body, offset)
+    return ConnectPacket(
+        client_id, username, password, keep_alive, bool(connect_flags & 0x02), level
+    )
+
+
+def parse_publish(flags, body):
+    """Parse the body of a PUBLISH packet.
+
+    :returns: A PublishPacket.
+    :raises: MQTTProtocolError if the packet is malformed.
+    """
+    qos = (flags >> 1) & 0x03
+    topic, offset = _decode_string(body, 0)
+    mid = None
+    if qos:
+        if offset + 2 > len(body):
+            raise MQTTProtocolError("Truncated PUBLISH")
+        (mid,) = struct.unpack_from("!H", body, offset)
+        offset += 2
+    return PublishPacket(topic, body[offset:], qos, mid, bool(flags & 0x01), bool(flags & 0x08))
+
+
+def parse_subscribe(body):
+    """Parse the body of a SUBSCRIBE packet.
+
+    :returns: A tuple of (mid, [(topic_filter, qos)]).
+    """
+    (mid,) = struct.unpack_from("!H", body, 0)
+    offset = 2
+    subscriptions = []
+    while offset < len(body):
+        topic_filter, offset = _decode_string(body, offset)
+        if offset >= len(body):
+            raise MQTTProtocolError("Truncated SUBSCRIBE")
+        subscriptions.append((topic_filter, bytearray(body)[offset] & 0x03))
+        offset += 1
+    return mid, subscriptions
+
+
+def parse_unsubscribe(body):
+    """Parse the body of an UNSUBSCRIBE packet.
+
+    :returns: A tuple of (mid, [topic_filter]).
+    """
+    (mid,) = struct.unpack_from("!H", body, 0)
+    offset = 2
+    topic_filters = []
+    while offset < len(body):
+        topic_filter, offset = _decode_string(body, offset)
+        topic_filters.append(topic_filter)
+    return mid, topic_filters
+
+
+def parse_mid(body):
+    """Parse the message id from the body of a PUBACK, SUBACK or UNSUBACK packet."""
+    if len(body) < 2:
+        raise MQTTProtocolError("Truncated packet")
+    return struct.unpack_from("!H", body, 0)[0]
+
+
+def connect(client_id, username=None, password=None, keep_alive=60, clean_session=True):
+    """Encode a CONNECT packet."""
+    connect_flags = 0x02 if clean_session else 0
+    payload = _encode_string(client_id)
+    if username is not None:
+        connect_flags |= 0x80
+        payload += _encode_string(username)
+    if password is not None:
+        connect_flags |= 0x40
+        payload += _encode_string(password)
+    header = _encode_string("MQTT") + struct.pack("!BBH", 4, connect_flags, keep_alive)
+    return _packet(CONNECT, 0, header + payload)
+
+
+def connack(return_code, session_present=False):
+    """Encode a CONNACK packet."""
+    return _packet(CONNACK, 0, struct.pack("!BB", 1 if session_present else 0, return_code))
+
+
+def publish(topic, payload, qos=0, mid=None):
+    """Encode a PUBLISH packet."""
+    body = _encode_string(topic)
+    if qos:
+        body += struct.pack("!H", mid)
+    return _packet(PUBLISH, qos << 1, body + payload)
+
+
+def puback(mid):
+    """Encode a PUBACK packet."""
+    return _packet(PUBACK, 0, struct.pack("!H", mid))
+
+
+def subscribe(mid, subscriptions):
+    """Encode a SUBSCRIBE packet from a list of (topic_filter, qos)."""
+    body = struct.pack("!H", mid)
+    for topic_filter, qos in subscriptions:
+        body += _encode_string(topic_filter) + struct.pack("!B", qos)
+    return _packet(SUBSCRIBE, 0x02, body)
+
+
+def suback(mid, return_codes):
+    """Encode a SUBACK packet."""
+    return _packet(SUBACK, 0, struct.pack("!H", mid) + bytes(bytearray(return_codes)))
+
+
+def unsuback(mid):
+    """Encode an UNSUBACK packet."""
+    return _packet(UNSUBACK, 0, struct.pack("!H", mid))
+
+
+def pingreq():
+    """Encode a PINGREQ packet."""
+    return _packet(PINGREQ, 0, b"")
+
+
+def pingresp():
+    """Encode a PINGRESP packet."""
+    return _packet(PINGRESP, 0, b"")
+
+
+def disconnect():
+    """Encode a DISCONNECT packet."""
+    return _packet(DISCONNECT, 0, b"")
+
+
+def topic_matches(topic_filter, topic):
+    """Check whether a topic matches a topic filter, which may contain + and # wildcards.
+
+    :param str topic_filter: The topic filter from a subscription.
+    :param str topic: The topic a message is published on.
+    :returns: True if the topic matches the filter.
+    """
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level != "+" and level != topic_levels[index]:
+            return False
+    return len(filter_levels) == len(topic_levels)
@@ -7,6 +7,7 @@
 import abc
 import six
 from . import constant
+from azure.iot.hub.devicesdk.common import CodecRegistry
 
 
 @six.add_metaclass(abc.ABCMeta)
@@ -19,6 +20,17 @@ class AbstractTransport:
         self._auth_provider = auth_provider
         self.feature_enabled = {constant.C2D_MSG: False, constant.INPUT_MSG: False}
 
+        # Codecs used to encode dict and list payloads, and optionally decode received payloads
+        self.codec_registry = CodecRegistry()
+
+        # LatencyRecorder used by the transport, if latency recording is enabled.  Clients pass it to
+        # their inboxes, so that time spent waiting to be read is recorded too.
+        self.latency_recorder = None
+
+        # Tracer used by the transport, if tracing is enabled.  Clients use it to trace their own
+        # calls and pass it to their inboxes.
+        self.tracer = None
+
         # Event Handlers - Will be set by Client after instantiation of Transport
         self.on_transport_connected = None
         self.on_transport_disconnected = None
@@ -68,6 +80,27 @@ class AbstractTransport:
         """
         pass
 
+    @abc.abstractmethod
+    def create_message_template(self, message):
+        """
+        Encode the properties of a message once, for sending many payloads with them.
+        """
+        pass
+
+    @abc.abstractmethod
+    def send_event_from_template(self, template, payload, callback):
+        """
+        Send a payload with the properties of a message template
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_stats(self):
+        """
+        Take a snapshot of the transport's counters and queue sizes.
+        """
+        pass
+
     # TODO: consider changing this signature (should the response already be packaged?)
     @abc.abstractmethod
     def send_method_response(self, method, payload, status, callback=None):
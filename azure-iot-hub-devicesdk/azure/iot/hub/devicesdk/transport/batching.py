@@ -0,0 +1,251 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains an opt-in batching stage which coalesces telemetry messages into a
+single envelope message.
+"""
+
+import base64
+import logging
+import threading
+from datetime import datetime
+import six
+from azure.iot.hub.devicesdk.common import Message
+from azure.iot.hub.devicesdk.common.clock import SYSTEM_CLOCK
+from azure.iot.hub.devicesdk.common.payload_codecs import JSON_CONTENT_TYPE
+
+logger = logging.getLogger(__name__)
+
+# Custom property set on envelope messages, holding the number of messages in the batch.
+BATCH_COUNT_PROPERTY = "iothub-batch-count"
+
+DEFAULT_BATCH_MAX_COUNT = 100
+DEFAULT_BATCH_MAX_BYTES = 128 * 1024
+DEFAULT_BATCH_LINGER_TIME = 0.1
+
+
+class BatchPolicy(object):
+    """Configuration for coalescing telemetry messages into envelope messages.
+
+    An envelope message holds an array with one item per message. Each item is an object with a
+    "body" and, if the message has any, "properties" (custom properties) and "systemProperties"
+    (message id, correlation id, user id, to, content type and content encoding). Bodies which are
+    bytes are sent as UTF-8 strings, or as base64 with "bodyEncoding" set to "base64" if they are
+    not valid UTF-8.
+
+    A batch is sent when it holds max_count messages, when adding a message would make it larger
+    than max_bytes, or max_linger_time seconds after its first message was added, whichever
+    comes first. A client which waits for each send to complete, such as the synchronous
+    DeviceClient, therefore waits up to max_linger_time longer for each message it sends.
+
+    The envelope expires when the first of its messages with an expiry time does, so that a batch
+    which waits in the queue past that time is failed with MessageExpiredError, as each of its
+    messages would have been.
+
+    :ivar int max_count: The maximum number of messages in a batch.
+    :ivar int max_bytes: The maximum size of the envelope payload, in bytes.
+    :ivar float max_linger_time: The maximum number of seconds a message waits for a batch to fill.
+    :ivar str content_type: The content type of the envelope, which selects the codec used to
+    serialize it. None to use the default codec.
+    """
+
+    def __init__(
+        self,
+        max_count=DEFAULT_BATCH_MAX_COUNT,
+        max_bytes=DEFAULT_BATCH_MAX_BYTES,
+        max_linger_time=DEFAULT_BATCH_LINGER_TIME,
+        content_type=None,
+    ):
+        """Initializer for BatchPolicy.
+
+        :param int max_count: The maximum number of messages in a batch. Default 100.
+        :param int max_bytes: The maximum size of the envelope payload, in bytes. Default 128 KiB.
+        :param float max_linger_time: The maximum number of seconds a message waits for a batch
+        to fill. Default 0.1.
+        :param str content_type: The content type of the envelope. Default None, which uses the
+        default codec of the transport.
+
+        :raises: ValueError if max_count or max_bytes is less than 1, or max_linger_time is negative.
+        """
+        if max_count < 1 or max_bytes < 1:
+            raise ValueError("max_count and max_bytes must be at least 1")
+        if max_linger_time < 0:
+            raise ValueError("max_linger_time cannot be negative")
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_linger_time = max_linger_time
+        self.content_type = content_type
+
+
+class MessageBatcher(object):
+    """Accumulates messages according to a BatchPolicy and hands each full batch over as a single
+    envelope message, along with a callback which completes every message in the batch.
+
+    :ivar policy: The BatchPolicy.
+    :ivar on_batch_ready: Function called with (envelope_message, callback) when a batch is sent.
+    """
+
+    def __init__(self, policy, codec, on_batch_ready, clock=None):
+        """Initializer for MessageBatcher.
+
+        :param policy: The BatchPolicy to apply.
+        :param codec: The PayloadCodec used to serialize envelopes.
+        :param on_batch_ready: Function called with (envelope_message, callback) for each batch.
+        :param clock: Optional Clock the linger timer is scheduled on. Default the system clock.
+        """
+        self.policy = policy
+        self.clock = clock or SYSTEM_CLOCK
+        self.on_batch_ready = on_batch_ready
+        self._codec = codec
+        # JSON envelopes can be assembled by joining the items, which are serialized once as they
+        # are added. Other codecs serialize the whole envelope again when the batch is sent.
+        self._join_items = codec.content_type == JSON_CONTENT_TYPE
+        self._lock = threading.RLock()
+        self._items = []
+        self._callbacks = []
+        self._size = 0
+        self._expiry = None
+        self._timer = None
+
+    def __len__(self):
+        return len(self._callbacks)
+
+    def add(self, message, callback=None):
+        """Add a message to the current batch, sending the batch if it is full.
+
+        :param Message message: The message to add.
+        :param callback: Callback which is called once the envelope holding the message has been
+        acknowledged by the service.
+        """
+        item = _to_batch_item(message)
+        encoded_item = self._codec.encode(item)
+        # Each item adds its size and a separator to the envelope
+        item_size = len(encoded_item) + 1
+
+        # Batches are built under the lock, but sent after it is released, so that a slow publish
+        # does not hold up the other producers or the linger timer
+        batches = []
+        with self._lock:
+            if self._callbacks and self._size + item_size > self.policy.max_bytes:
+                batches.append(self._take_batch())
+
+            self._items.append(encoded_item if self._join_items else item)
+            self._callbacks.append(callback)
+            self._size += item_size
+            expiry = message.expiry_time_utc
+            if isinstance(expiry, datetime) and (
+                self._expiry is None or _utc(expiry) < _utc(self._expiry)
+            ):
+                self._expiry = expiry
+
+            if len(self._callbacks) >= self.policy.max_count or self._size >= self.policy.max_bytes:
+                batches.append(self._take_batch())
+            elif len(self._callbacks) == 1:
+                self._start_linger_timer()
+
+        for envelope, on_batch_complete in batches:
+            self.on_batch_ready(envelope, on_batch_complete)
+
+    def flush(self):
+        """Send the current batch immediately, if it holds any messages."""
+        with self._lock:
+            batch = self._take_batch() if self._callbacks else None
+        if batch:
+            self.on_batch_ready(*batch)
+
+    def _start_linger_timer(self):
+        self._timer = self.clock.call_later(
+            self.policy.max_linger_time, self._on_linger_timer_expired, daemon=True
+        )
+
+    def _on_linger_timer_expired(self):
+        logger.debug("Batch linger time expired")
+        self.flush()
+
+    def _take_batch(self):
+        """Build the envelope for the current batch and start a new batch. Must be called with the
+        lock held.
+
+        :returns: A tuple of (envelope_message, callback) to pass to on_batch_ready.
+        """
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        items = self._items
+        callbacks = self._callbacks
+        self._items = []
+        self._callbacks = []
+        self._size = 0
+        expiry = self._expiry
+        self._expiry = None
+
+        if self._join_items:
+            payload = b"[" + b",".join(items) + b"]"
+        else:
+            payload = self._codec.encode(items)
+
+        envelope = Message(payload)
+        envelope.content_type = self._codec.content_type
+        envelope.content_encoding = self._codec.content_encoding
+        envelope.expiry_time_utc = expiry
+        envelope.custom_properties[BATCH_COUNT_PROPERTY] = str(len(callbacks))
+
+        def on_batch_complete(error=None):
+            for callback in callbacks:
+                if callback:
+                    if error:
+                        callback(error=error)
+                    else:
+                        callback()
+
+        logger.debug("Sending batch of %d messages (%d bytes)", len(callbacks), len(payload))
+        return envelope, on_batch_complete
+
+
+def _utc(expiry):
+    """Convert an expiry time to a naive UTC datetime, so that naive and aware times compare."""
+    if expiry.tzinfo is not None:
+        return (expiry - expiry.utcoffset()).replace(tzinfo=None)
+    return expiry
+
+
+def _to_batch_item(message):
+    """
+    Convert a message into an envelope item.
+
+    :param Message message: The message to convert.
+    :returns: A dictionary containing the body and properties of the message.
+    """
+    item = {}
+    body = message.data
+    if isinstance(body, six.binary_type):
+        try:
+            body = body.decode("utf-8")
+        except UnicodeDecodeError:
+            body = base64.b64encode(body).decode("ascii")
+            item["bodyEncoding"] = "base64"
+    item["body"] = body
+
+    if message.has_custom_properties:
+        item["properties"] = dict(message.custom_properties)
+
+    system_properties = {}
+    if message.message_id:
+        system_properties["messageId"] = message.message_id
+    if message.correlation_id:
+        system_properties["correlationId"] = message.correlation_id
+    if message.user_id:
+        system_properties["userId"] = message.user_id
+    if message.to:
+        system_properties["to"] = message.to
+    if message.content_type:
+        system_properties["contentType"] = message.content_type
+    if message.content_encoding:
+        system_properties["contentEncoding"] = message.content_encoding
+    if system_properties:
+        item["systemProperties"] = system_properties
+
+    return item
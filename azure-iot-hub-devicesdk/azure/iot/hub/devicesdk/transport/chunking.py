@@ -0,0 +1,259 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains an opt-in stage which splits payloads that are too large to send as a
+single message into chunks, and reassembles received chunks.
+"""
+
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+import six
+from azure.iot.hub.devicesdk.common.clock import SYSTEM_CLOCK
+
+logger = logging.getLogger(__name__)
+
+# Custom properties set on every chunk
+CHUNK_ID_PROPERTY = "iothub-chunk-id"
+CHUNK_INDEX_PROPERTY = "iothub-chunk-index"
+CHUNK_COUNT_PROPERTY = "iothub-chunk-count"
+CHUNK_PROPERTIES = (CHUNK_ID_PROPERTY, CHUNK_INDEX_PROPERTY, CHUNK_COUNT_PROPERTY)
+
+# IoT Hub rejects messages over 256 KiB, including properties.
+DEFAULT_MAX_CHUNK_SIZE = 250 * 1024
+DEFAULT_MAX_IN_FLIGHT_CHUNKS = 4
+DEFAULT_REASSEMBLY_TIMEOUT = 60
+DEFAULT_MAX_REASSEMBLY_BYTES = 16 * 1024 * 1024
+DEFAULT_MAX_CHUNK_COUNT = 1024
+
+
+class ChunkingPolicy(object):
+    """Configuration for splitting large outgoing payloads and reassembling received ones.
+
+    Payloads larger than max_chunk_size bytes, after encoding and compression, are split into
+    chunks which are sent as separate messages. Every chunk carries the properties of the original
+    message, along with the iothub-chunk-id, iothub-chunk-index and iothub-chunk-count custom
+    properties. At most max_in_flight chunks of a payload are awaiting acknowledgement at a time.
+
+    Received C2D and input messages carrying chunk properties are buffered until every chunk has
+    arrived, and then delivered as a single message. Chunks claiming more than max_chunk_count
+    chunks, or a different count from the earlier chunks of their payload, are discarded.
+
+    :ivar int max_chunk_size: The maximum payload size of each chunk, in bytes.
+    :ivar int max_in_flight: The maximum number of unacknowledged chunks per payload.
+    :ivar float reassembly_timeout: The number of seconds to wait for the remaining chunks of a
+    received payload before discarding it.
+    :ivar int max_reassembly_bytes: The maximum number of bytes buffered for incomplete received
+    payloads. The oldest incomplete payloads are discarded to stay within this limit.
+    :ivar int max_chunk_count: The maximum number of chunks in a received payload.
+    """
+
+    def __init__(
+        self,
+        max_chunk_size=DEFAULT_MAX_CHUNK_SIZE,
+        max_in_flight=DEFAULT_MAX_IN_FLIGHT_CHUNKS,
+        reassembly_timeout=DEFAULT_REASSEMBLY_TIMEOUT,
+        max_reassembly_bytes=DEFAULT_MAX_REASSEMBLY_BYTES,
+        max_chunk_count=DEFAULT_MAX_CHUNK_COUNT,
+    ):
+        """Initializer for ChunkingPolicy.
+
+        :param int max_chunk_size: The maximum payload size of each chunk, in bytes. Default 250 KiB.
+        :param int max_in_flight: The maximum number of unacknowledged chunks per payload. Default 4.
+        :param float reassembly_timeout: The number of seconds to wait for the remaining chunks of
+        a received payload. Default 60.
+        :param int max_reassembly_bytes: The maximum number of bytes buffered for incomplete
+        received payloads. Default 16 MiB.
+        :param int max_chunk_count: The maximum number of chunks in a received payload.
+        Default 1024.
+
+        :raises: ValueError if any of the limits is less than 1.
+        """
+        limits = (max_chunk_size, max_in_flight, max_reassembly_bytes, max_chunk_count)
+        if min(limits) < 1 or reassembly_timeout <= 0:
+            raise ValueError("Chunking limits must be positive")
+        self.max_chunk_size = max_chunk_size
+        self.max_in_flight = max_in_flight
+        self.reassembly_timeout = reassembly_timeout
+        self.max_reassembly_bytes = max_reassembly_bytes
+        self.max_chunk_count = max_chunk_count
+
+
+class ChunkedSend(object):
+    """Tracks the chunks of a single payload as they are published and acknowledged.
+
+    :ivar callback: Callback which is called once every chunk has been acknowledged.
+    """
+
+    def __init__(self, topic, payload, max_chunk_size, callback):
+        """Initializer for ChunkedSend.
+
+        :param str topic: The encoded topic of the original message.
+        :param bytes payload: The payload to split.
+        :param int max_chunk_size: The maximum size of each chunk, in bytes.
+        :param callback: Callback which is called once every chunk has been acknowledged.
+        """
+        self.callback = callback
+        self._topic = topic if topic.endswith("/") else topic + "&"
+        self._chunk_id = str(uuid.uuid4())
+        self._chunks = [
+            payload[i : i + max_chunk_size] for i in range(0, len(payload), max_chunk_size)
+        ]
+        self._next_index = 0
+        self._acknowledged_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def chunk_count(self):
+        return len(self._chunks)
+
+    def next_chunk(self):
+        """Take the next chunk to publish.
+
+        :returns: A tuple of (topic, chunk), or None if every chunk has already been taken.
+        """
+        with self._lock:
+            index = self._next_index
+            if index >= len(self._chunks):
+                return None
+            self._next_index += 1
+
+        topic = self._topic + six.moves.urllib.parse.urlencode(
+            [
+                (CHUNK_ID_PROPERTY, self._chunk_id),
+                (CHUNK_INDEX_PROPERTY, index),
+                (CHUNK_COUNT_PROPERTY, len(self._chunks)),
+            ]
+        )
+        return topic, self._chunks[index]
+
+    def chunk_acknowledged(self):
+        """Record the acknowledgement of a chunk.
+
+        :returns: A tuple of (complete, send_next) where complete is True if every chunk has been
+        acknowledged, and send_next is True if there are chunks left to publish.
+        """
+        with self._lock:
+            self._acknowledged_count += 1
+            complete = self._acknowledged_count == len(self._chunks)
+            send_next = self._next_index < len(self._chunks)
+        return complete, send_next
+
+
+class _PartialPayload(object):
+    __slots__ = ("first_message", "chunks", "received_count", "size", "started")
+
+    def __init__(self, first_message, count, started):
+        self.first_message = first_message
+        self.chunks = [None] * count
+        self.received_count = 0
+        self.size = 0
+        self.started = started
+
+
+class ChunkReassembler(object):
+    """Buffers received chunks until every chunk of a payload has arrived.
+
+    Incomplete payloads are discarded when they are older than the reassembly timeout, which is
+    checked whenever a chunk is received, or when the buffered bytes exceed the configured limit.
+
+    :ivar int discarded_count: The number of incomplete payloads which have been discarded.
+    """
+
+    def __init__(self, policy, clock=None):
+        """Initializer for ChunkReassembler.
+
+        :param policy: The ChunkingPolicy providing the timeout and buffering limit.
+        :param clock: The Clock the reassembly timeout is measured with. Default the system clock.
+        """
+        self._monotonic = (clock or SYSTEM_CLOCK).monotonic
+        self._timeout = policy.reassembly_timeout
+        self._max_bytes = policy.max_reassembly_bytes
+        self._max_count = policy.max_chunk_count
+        self._partial_payloads = OrderedDict()
+        self._buffered_bytes = 0
+        self._lock = threading.Lock()
+        self.discarded_count = 0
+
+    @staticmethod
+    def is_chunk(message):
+        """Returns True if a received message is a chunk of a larger payload."""
+        return message.has_custom_properties and CHUNK_ID_PROPERTY in message.custom_properties
+
+    def add(self, message):
+        """Add a received chunk.
+
+        :param Message message: The received chunk, with its properties already extracted.
+        :returns: The reassembled message if this was the last missing chunk, otherwise None.
+        """
+        try:
+            chunk_id = message.custom_properties[CHUNK_ID_PROPERTY]
+            index = int(message.custom_properties[CHUNK_INDEX_PROPERTY])
+            count = int(message.custom_properties[CHUNK_COUNT_PROPERTY])
+        except (KeyError, ValueError):
+            logger.warning("Discarding chunk with invalid chunk properties")
+            return None
+        if count > self._max_count:
+            # Checked before the chunk list of the payload is allocated
+            logger.warning("Discarding chunk %s of a payload with %d chunks", chunk_id, count)
+            return None
+        if not 0 <= index < count:
+            logger.warning("Discarding chunk %s with invalid index %d", chunk_id, index)
+            return None
+
+        with self._lock:
+            self._discard_expired()
+
+            partial = self._partial_payloads.get(chunk_id)
+            if partial is None:
+                partial = _PartialPayload(message, count, self._monotonic())
+                self._partial_payloads[chunk_id] = partial
+            elif len(partial.chunks) != count:
+                logger.warning("Discarding chunk %s with changed count %d", chunk_id, count)
+                return None
+            if partial.chunks[index] is not None:
+                logger.debug("Ignoring duplicate chunk %d of %s", index, chunk_id)
+                return None
+
+            partial.chunks[index] = message.data
+            partial.received_count += 1
+            partial.size += len(message.data)
+            self._buffered_bytes += len(message.data)
+
+            if partial.received_count == count:
+                del self._partial_payloads[chunk_id]
+                self._buffered_bytes -= partial.size
+                return self._reassemble(partial)
+
+            self._discard_oldest_over_limit()
+            return None
+
+    def _reassemble(self, partial):
+        message = partial.first_message
+        message.data = b"".join(partial.chunks)
+        for key in CHUNK_PROPERTIES:
+            del message.custom_properties[key]
+        return message
+
+    def _discard_expired(self):
+        deadline = self._monotonic() - self._timeout
+        while self._partial_payloads:
+            chunk_id, partial = next(iter(self._partial_payloads.items()))
+            if partial.started > deadline:
+                break
+            logger.warning("Timed out waiting for the chunks of %s", chunk_id)
+            self._discard(chunk_id)
+
+    def _discard_oldest_over_limit(self):
+        while self._buffered_bytes > self._max_bytes and self._partial_payloads:
+            chunk_id = next(iter(self._partial_payloads))
+            logger.warning("Reassembly buffer full, discarding incomplete payload %s", chunk_id)
+            self._discard(chunk_id)
+
+    def _discard(self, chunk_id):
+        partial = self._partial_payloads.pop(chunk_id)
+        self._buffered_bytes -= partial.size
+        self.discarded_count += 1
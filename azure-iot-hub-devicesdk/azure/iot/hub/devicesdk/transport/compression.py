@@ -0,0 +1,110 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains an opt-in compression stage for message payloads.
+"""
+
+import logging
+import zlib
+import six
+
+logger = logging.getLogger(__name__)
+
+GZIP_ENCODING = "gzip"
+DEFLATE_ENCODING = "deflate"
+
+# Payloads smaller than this number of bytes are not compressed by default.
+DEFAULT_COMPRESSION_THRESHOLD = 1024
+
+
+class PayloadCompressor(object):
+    """Compresses outgoing payloads above a size threshold and decompresses received payloads.
+
+    Compressed payloads are marked by setting the content encoding of the message to "gzip" or
+    "deflate". "deflate" payloads use the zlib format, and may use a preset dictionary (zdict).
+    A preset dictionary holding content that is common to most messages (such as JSON keys)
+    makes it worthwhile to compress even very small messages, but the receiving side must be
+    configured with the same dictionary.
+
+    :ivar str encoding: The compression format used for outgoing payloads.
+    :ivar int threshold: The minimum payload size, in bytes, that will be compressed.
+    :ivar int level: The zlib compression level, from 1 (fastest) to 9 (smallest).
+    :ivar bytes zdict: The preset dictionary used for "deflate" payloads, if any.
+    """
+
+    def __init__(
+        self, encoding=GZIP_ENCODING, threshold=DEFAULT_COMPRESSION_THRESHOLD, level=6, zdict=None
+    ):
+        """Initializer for PayloadCompressor.
+
+        :param str encoding: The compression format. Either "gzip" or "deflate". Default "gzip".
+        :param int threshold: The minimum payload size, in bytes, that will be compressed.
+        :param int level: The zlib compression level, from 1 (fastest) to 9 (smallest). Default 6.
+        :param bytes zdict: Optional preset dictionary. Only supported with "deflate" encoding.
+
+        :raises: ValueError if given an invalid encoding, or a zdict with "gzip" encoding.
+        """
+        if encoding not in (GZIP_ENCODING, DEFLATE_ENCODING):
+            raise ValueError("Invalid compression encoding: {}".format(encoding))
+        if zdict and encoding != DEFLATE_ENCODING:
+            raise ValueError("A preset dictionary can only be used with deflate encoding")
+        self.encoding = encoding
+        self.threshold = threshold
+        self.level = level
+        self.zdict = zdict
+
+    def compress(self, payload):
+        """Compress a payload if it is at least threshold bytes long, and compression makes it smaller.
+
+        :param payload: The payload to compress, as bytes or a string.
+        :returns: A tuple of (payload, encoding) where encoding is None if the payload was not
+        compressed.
+        """
+        original = payload
+        if isinstance(payload, six.text_type):
+            payload = payload.encode("utf-8")
+        if not isinstance(payload, six.binary_type) or len(payload) < self.threshold:
+            return original, None
+
+        if self.encoding == GZIP_ENCODING:
+            # Offsetting wbits by 16 makes zlib write a gzip header and trailer
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif self.zdict:
+            compressor = zlib.compressobj(
+                self.level, zlib.DEFLATED, zlib.MAX_WBITS, zdict=self.zdict
+            )
+        else:
+            compressor = zlib.compressobj(self.level)
+        compressed = compressor.compress(payload) + compressor.flush()
+
+        if len(compressed) >= len(payload):
+            return original, None
+        return compressed, self.encoding
+
+    def decompress(self, payload, encoding):
+        """Decompress a payload that was compressed with the given encoding.
+
+        :param bytes payload: The payload to decompress.
+        :param str encoding: The content encoding of the payload.
+        :returns: The decompressed payload, or the payload unchanged if the encoding is not a
+        compression format.
+        :raises: zlib.error if the payload cannot be decompressed.
+        """
+        if encoding == GZIP_ENCODING:
+            return zlib.decompress(payload, 16 + zlib.MAX_WBITS)
+        elif encoding == DEFLATE_ENCODING:
+            if self.zdict:
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS, zdict=self.zdict)
+                return decompressor.decompress(payload) + decompressor.flush()
+            return zlib.decompress(payload)
+        return payload
+
+    @staticmethod
+    def is_compressed(encoding):
+        """Returns True if the content encoding is a compression format handled by this class.
+
+        :param str encoding: The content encoding of a message.
+        """
+        return encoding in (GZIP_ENCODING, DEFLATE_ENCODING)
@@ -0,0 +1,172 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains an opt-in stage which suppresses redelivered C2D and input messages.
+"""
+
+import hashlib
+import logging
+import math
+import struct
+import threading
+from collections import OrderedDict
+from azure.iot.hub.devicesdk.common.clock import SYSTEM_CLOCK
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEDUPE_LRU_SIZE = 1024
+DEFAULT_DEDUPE_WINDOW = 3600
+DEFAULT_DEDUPE_WINDOW_CAPACITY = 100000
+DEFAULT_DEDUPE_FALSE_POSITIVE_RATE = 1e-6
+
+
+class DedupePolicy(object):
+    """Configuration for suppressing duplicate received messages, keyed on their message id.
+
+    The message ids of the most recent lru_size messages are remembered exactly. Older message ids
+    are remembered by a Bloom filter for between one and two windows of window seconds. A Bloom
+    filter never misses a duplicate, but may mistake a new message for a duplicate with a
+    probability of false_positive_rate, as long as no more than window_capacity messages are
+    received per window. Memory use is fixed by these settings. Messages without a message id are
+    never suppressed.
+
+    :ivar int lru_size: The number of recent message ids remembered exactly.
+    :ivar float window: The number of seconds covered by each Bloom filter.
+    :ivar int window_capacity: The number of messages each Bloom filter is sized for.
+    :ivar float false_positive_rate: The target false positive rate of the Bloom filters.
+    """
+
+    def __init__(
+        self,
+        lru_size=DEFAULT_DEDUPE_LRU_SIZE,
+        window=DEFAULT_DEDUPE_WINDOW,
+        window_capacity=DEFAULT_DEDUPE_WINDOW_CAPACITY,
+        false_positive_rate=DEFAULT_DEDUPE_FALSE_POSITIVE_RATE,
+    ):
+        """Initializer for DedupePolicy.
+
+        :param int lru_size: The number of recent message ids remembered exactly. Default 1024.
+        :param float window: The number of seconds covered by each Bloom filter. Default 3600.
+        :param int window_capacity: The number of messages each Bloom filter is sized for.
+        Default 100000.
+        :param float false_positive_rate: The target false positive rate. Default 1e-6.
+
+        :raises: ValueError if any setting is out of range.
+        """
+        if lru_size < 1 or window <= 0 or window_capacity < 1:
+            raise ValueError("lru_size, window and window_capacity must be positive")
+        if not 0 < false_positive_rate < 1:
+            raise ValueError("false_positive_rate must be between 0 and 1")
+        self.lru_size = lru_size
+        self.window = window
+        self.window_capacity = window_capacity
+        self.false_positive_rate = false_positive_rate
+
+
+class BloomFilter(object):
+    """A fixed-size Bloom filter of strings.
+
+    :ivar int bit_count: The number of bits in the filter.
+    :ivar int hash_count: The number of bits set for each item.
+    """
+
+    def __init__(self, capacity, false_positive_rate):
+        """Initializer for BloomFilter.
+
+        :param int capacity: The number of items the filter is sized for.
+        :param float false_positive_rate: The false positive rate at capacity.
+        """
+        self.bit_count = max(8, int(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(float(self.bit_count) / capacity * math.log(2))))
+        self._bits = bytearray((self.bit_count + 7) // 8)
+
+    def _positions(self, item):
+        # Derive every position from two halves of one digest (Kirsch-Mitzenmacher double hashing)
+        digest = hashlib.sha256(item.encode("utf-8")).digest()
+        h1, h2 = struct.unpack("<QQ", digest[:16])
+        return [(h1 + i * h2) % self.bit_count for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        bits = self._bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item)
+        )
+
+    def clear(self):
+        self._bits[:] = bytearray(len(self._bits))
+
+
+class MessageDeduplicator(object):
+    """Detects received messages whose message id has been seen recently.
+
+    :ivar int duplicate_count: The number of duplicate messages which have been detected.
+    """
+
+    def __init__(self, policy, clock=None):
+        """Initializer for MessageDeduplicator.
+
+        :param policy: The DedupePolicy to apply.
+        :param clock: The Clock windows are timed with. Default the system clock.
+        """
+        self._monotonic = (clock or SYSTEM_CLOCK).monotonic
+        self._lru_size = policy.lru_size
+        self._window = policy.window
+        self._recent = OrderedDict()
+        self._current_filter = BloomFilter(policy.window_capacity, policy.false_positive_rate)
+        self._previous_filter = BloomFilter(policy.window_capacity, policy.false_positive_rate)
+        self._window_started = self._monotonic()
+        self._lock = threading.Lock()
+        self.duplicate_count = 0
+
+    def is_duplicate(self, message):
+        """Check whether a message is a duplicate, and remember its message id if it is not.
+
+        :param Message message: The received message.
+        :returns: True if a message with the same message id has been seen recently.
+        """
+        message_id = message.message_id
+        if not message_id:
+            return False
+
+        with self._lock:
+            self._rotate_filters()
+
+            if message_id in self._recent:
+                # Refresh the entry so that frequently redelivered ids stay in the LRU
+                del self._recent[message_id]
+                self._recent[message_id] = None
+                duplicate = True
+            else:
+                duplicate = (
+                    message_id in self._current_filter or message_id in self._previous_filter
+                )
+                self._recent[message_id] = None
+                if len(self._recent) > self._lru_size:
+                    self._recent.popitem(last=False)
+                if not duplicate:
+                    self._current_filter.add(message_id)
+
+            if duplicate:
+                self.duplicate_count += 1
+        if duplicate:
+            logger.debug("Suppressing duplicate message %s", message_id)
+        return duplicate
+
+    def _rotate_filters(self):
+        """Start a new window if the current one has ended. Must be called with the lock held."""
+        now = self._monotonic()
+        elapsed = now - self._window_started
+        if elapsed < self._window:
+            return
+        if elapsed >= 2 * self._window:
+            # Nothing seen in the current filter is recent enough to keep
+            self._current_filter.clear()
+        self._previous_filter, self._current_filter = self._current_filter, self._previous_filter
+        self._current_filter.clear()
+        self._window_started = now
@@ -0,0 +1,178 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains opt-in dispatchers which run a transport's callbacks off the network thread.
+
+Without a dispatcher, completion callbacks and the delivery of received messages to inboxes run on
+paho's network thread, so application code which is slow to return delays reading and writing the
+socket. With one, the network thread only parses packets and hands the work to the dispatcher.
+
+Each piece of work is dispatched with a key, and work with the same key always runs in the order
+it was dispatched. The transport uses one key per inbox, one per MID and one for connection state
+changes, so messages reach each inbox in the order they arrived.
+"""
+
+import collections
+import logging
+import threading
+import six.moves.queue as queue
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_WORKERS = 4
+
+# Put on a dispatcher's queue to stop a worker thread
+_STOP = object()
+
+
+def _run(function, args):
+    try:
+        function(*args)
+    except Exception:
+        logger.exception("Unhandled exception in dispatched callback %s", function)
+
+
+class ThreadDispatcher(object):
+    """Runs callbacks one at a time on a single worker thread, in the order they were dispatched.
+
+    Ordering is kept across all keys, so a callback which blocks holds up every callback after it,
+    but never the network thread. One dispatcher can be shared by many transports.
+    """
+
+    def __init__(self, name="CallbackDispatcher"):
+        """Initializer for ThreadDispatcher.
+
+        :param str name: The name of the worker thread.
+        """
+        self._queue = queue.Queue()
+        self._shut_down = False
+        self._thread = threading.Thread(target=self._work, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def pending(self):
+        """The number of callbacks waiting to run."""
+        return self._queue.qsize()
+
+    def dispatch(self, key, function, *args):
+        """Run a function on the worker thread.
+
+        :param key: Identifies the work which must run in order. Ignored, as all work runs in order.
+        :param function: The function to run. Exceptions it raises are logged.
+        :param args: The arguments to call it with.
+        :raises: RuntimeError if the dispatcher has been shut down.
+        """
+        if self._shut_down:
+            raise RuntimeError("Dispatcher has been shut down")
+        self._queue.put((function, args))
+
+    def shutdown(self, wait=True):
+        """Stop the worker thread once the callbacks already dispatched have run.
+
+        :param bool wait: Whether to wait for them to run. Default True.
+        """
+        self._shut_down = True
+        self._queue.put(_STOP)
+        if wait:
+            self._thread.join()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            _run(*item)
+
+
+class PoolDispatcher(object):
+    """Runs callbacks on a pool of worker threads, keeping callbacks with the same key in order.
+
+    Callbacks with different keys run concurrently, so a slow consumer of one inbox does not hold
+    up acknowledgements or the other inboxes while there are workers free. A key's callbacks wait
+    in a queue of their own while one of them is running, so they take no worker.
+    """
+
+    def __init__(self, workers=DEFAULT_POOL_WORKERS, name="CallbackDispatcher"):
+        """Initializer for PoolDispatcher.
+
+        :param int workers: The number of worker threads. Default 4.
+        :param str name: The prefix of the names of the worker threads.
+        :raises: ValueError if workers is less than 1.
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        # Keys whose callback is running or waiting for a worker, mapped to the callbacks behind it
+        self._waiting = {}
+        self._lock = threading.Lock()
+        self._ready = queue.Queue()
+        self._shut_down = False
+        self._threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._work, name="{}-{}".format(name, index))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def pending(self):
+        """The number of callbacks waiting to run."""
+        with self._lock:
+            waiting = sum(len(callbacks) for callbacks in self._waiting.values())
+        return waiting + self._ready.qsize()
+
+    def dispatch(self, key, function, *args):
+        """Run a function on a worker thread, after any earlier functions dispatched with its key.
+
+        :param key: Identifies the work which must run in order. Must be hashable.
+        :param function: The function to run. Exceptions it raises are logged.
+        :param args: The arguments to call it with.
+        :raises: RuntimeError if the dispatcher has been shut down.
+        """
+        with self._lock:
+            if self._shut_down:
+                raise RuntimeError("Dispatcher has been shut down")
+            waiting = self._waiting.get(key)
+            if waiting is not None:
+                waiting.append((function, args))
+                return
+            self._waiting[key] = collections.deque()
+        self._ready.put((key, function, args))
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads once the callbacks already dispatched have run.
+
+        :param bool wait: Whether to wait for them to run. Default True.
+        """
+        with self._lock:
+            self._shut_down = True
+            # Callbacks queued behind a key are only made ready as the one before them finishes,
+            # so the workers are stopped by whichever finishes the last key
+            if not self._waiting:
+                self._stop_workers()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _stop_workers(self):
+        for _ in self._threads:
+            self._ready.put(_STOP)
+
+    def _work(self):
+        while True:
+            item = self._ready.get()
+            if item is _STOP:
+                return
+            key, function, args = item
+            _run(function, args)
+            with self._lock:
+                waiting = self._waiting[key]
+                if waiting:
+                    function, args = waiting.popleft()
+                    self._ready.put((key, function, args))
+                else:
+                    del self._waiting[key]
+                    if self._shut_down and not self._waiting:
+                        self._stop_workers()
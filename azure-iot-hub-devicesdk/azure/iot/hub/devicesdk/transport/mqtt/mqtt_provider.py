@@ -7,9 +7,42 @@
 import paho.mqtt.client as mqtt
 import logging
 import ssl
+import sys
 import traceback
+from azure.iot.hub.devicesdk.diagnostics import tracing
+from azure.iot.hub.devicesdk.diagnostics.flight_recorder import (
+    CONNACK,
+    CONNECT,
+    DISCONNECT,
+    PUBACK,
+    RECONNECT,
+    SUBACK,
+    UNSUBACK,
+)
+from azure.iot.hub.devicesdk.diagnostics.message_log import MessageLogger
 
 logger = logging.getLogger(__name__)
+message_logger = MessageLogger(logger)
+
+# The port used by Azure IoT Hub for MQTT over TLS
+DEFAULT_MQTT_PORT = 8883
+
+
+def _create_ssl_context(ca_cert):
+    """
+    Create the SSL context used to validate the server's certificate.
+
+    :param ca_cert: Certificate to trust, or None to trust the system's default certificates.
+    :returns: The SSLContext.
+    """
+    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+    if ca_cert:
+        ssl_context.load_verify_locations(cadata=ca_cert)
+    else:
+        ssl_context.load_default_certs()
+    ssl_context.verify_mode = ssl.CERT_REQUIRED
+    ssl_context.check_hostname = True
+    return ssl_context
 
 
 class MQTTProvider(object):
@@ -18,18 +51,37 @@ class MQTTProvider(object):
     to publish/subscribe messages.
     """
 
-    def __init__(self, client_id, hostname, username, ca_cert=None):
+    def __init__(
+        self, client_id, hostname, username, ca_cert=None, port=DEFAULT_MQTT_PORT, multiplexer=None
+    ):
         """
         Constructor to instantiate a mqtt provider.
         :param client_id: The id of the client connecting to the broker.
         :param hostname: hostname or IP address of the remote broker.
         :param ca_cert: Certificate which can be used to validate a server-side TLS connection.
+        :param port: The port of the remote broker.  Defaults to 8883.
+        :param multiplexer: Optional MqttMultiplexer which runs the client's network loop, instead
+            of a thread of its own.
         """
         self._client_id = client_id
         self._hostname = hostname
+        self._port = port
         self._username = username
         self._mqtt_client = None
         self._ca_cert = ca_cert
+        self._multiplexer = multiplexer
+        # Channel through which the client is called while it is attached to the multiplexer
+        self._channel = None
+
+        # Tracer used to trace publishes and received messages, if tracing is enabled.  Set by the
+        # transport.
+        self.tracer = None
+        # FlightRecorder which records connection result codes and acknowledged MIDs, if enabled.
+        # Set by the transport.
+        self.flight_recorder = None
+        # CallbackWatchdog which times the callbacks below and reports those which stall the
+        # network thread, if enabled.  Set by the transport.
+        self.watchdog = None
 
         self.on_mqtt_connected = None
         self.on_mqtt_disconnected = None
@@ -49,56 +101,57 @@ class MQTTProvider(object):
         self._mqtt_client = mqtt.Client(self._client_id, False, protocol=mqtt.MQTTv311)
 
         def on_connect_callback(client, userdata, flags, result_code):
-            logger.info("connected with result code: %s", str(result_code))
+            logger.info("connected with result code: %s", result_code)
+            if self.flight_recorder:
+                self.flight_recorder.record(CONNACK, result_code)
+            if result_code == mqtt.CONNACK_ACCEPTED and self._channel:
+                self._channel.connection_established()
             # TODO: how to do failed connection?
-            try:
-                self.on_mqtt_connected()
-            except:  # noqa: E722 do not use bare 'except'
-                logger.error("Unexpected error calling on_mqtt_connected")
-                logger.error(traceback.format_exc())
+            self._call("on_mqtt_connected")
 
         def on_disconnect_callback(client, userdata, result_code):
-            logger.info("disconnected with result code: %s", str(result_code))
-            try:
-                self.on_mqtt_disconnected()
-            except:  # noqa: E722 do not use bare 'except'
-                logger.error("Unexpected error calling on_mqtt_disconnected")
-                logger.error(traceback.format_exc())
+            logger.info("disconnected with result code: %s", result_code)
+            if self.flight_recorder:
+                self.flight_recorder.record(DISCONNECT, result_code)
+            self._call("on_mqtt_disconnected")
 
         def on_publish_callback(client, userdata, mid):
-            logger.info("payload published for %s", str(mid))
+            message_logger.log("payload published for %s", mid)
+            if self.flight_recorder:
+                self.flight_recorder.record(PUBACK, mid)
             # TODO: how to do failed publish
-            try:
-                self.on_mqtt_published(mid)
-            except:  # noqa: E722 do not use bare 'except'
-                logger.error("Unexpected error calling on_mqtt_published")
-                logger.error(traceback.format_exc())
+            self._call("on_mqtt_published", mid)
 
         def on_subscribe_callback(client, userdata, mid, granted_qos):
-            logger.info("suback received for %s", str(mid))
+            logger.info("suback received for %s", mid)
+            if self.flight_recorder:
+                self.flight_recorder.record(SUBACK, mid)
             # TODO: how to do failure?
-            try:
-                self.on_mqtt_subscribed(mid)
-            except:  # noqa: E722 do not use bare 'except'
-                logger.error("Unexpected error calling on_mqtt_subscribed")
-                logger.error(traceback.format_exc())
+            self._call("on_mqtt_subscribed", mid)
 
         def on_message_callback(client, userdata, mqtt_message):
-            logger.info("message received on %s", mqtt_message.topic)
-            try:
-                self.on_mqtt_message_received(mqtt_message._topic, mqtt_message.payload)
-            except:  # noqa: E722 do not use bare 'except'
-                logger.error("Unexpected error calling on_mqtt_message_received")
-                logger.error(traceback.format_exc())
+            message_logger.log("message received on %s", mqtt_message.topic)
+            span = None
+            if self.tracer:
+                span = self.tracer.start_span(
+                    "mqtt.receive",
+                    {
+                        "topic": mqtt_message.topic,
+                        "payload_size": len(mqtt_message.payload),
+                        "mid": mqtt_message.mid,
+                    },
+                )
+            with tracing.activate(span):
+                self._call("on_mqtt_message_received", mqtt_message._topic, mqtt_message.payload)
+            if span:
+                span.end()
 
         def on_unsubscribe_callback(client, userdata, mid):
-            logger.info("UNSUBACK received for %s", str(mid))
+            logger.info("UNSUBACK received for %s", mid)
+            if self.flight_recorder:
+                self.flight_recorder.record(UNSUBACK, mid)
             # TODO: how to do failure?
-            try:
-                self.on_mqtt_unsubscribed(mid)
-            except:  # noqa: E722 do not use bare 'except'
-                logger.error("Unexpected error calling on_mqtt_unsubscribed")
-                logger.error(traceback.format_exc())
+            self._call("on_mqtt_unsubscribed", mid)
 
         self._mqtt_client.on_connect = on_connect_callback
         self._mqtt_client.on_disconnect = on_disconnect_callback
@@ -109,6 +162,46 @@ class MQTTProvider(object):
 
         logger.info("Created MQTT provider, assigned callbacks")
 
+    def _call(self, name, *args):
+        """
+        Call one of the callbacks set by the transport, timing it with the watchdog if there is
+        one, and log any exception it raises rather than letting it reach paho.
+
+        :param str name: The name of the callback attribute, such as on_mqtt_published.
+        :param args: The arguments to call it with.
+        """
+        try:
+            if self.watchdog:
+                self.watchdog.call(name, getattr(self, name), *args)
+            else:
+                getattr(self, name)(*args)
+        except:  # noqa: E722 do not use bare 'except'
+            self._callback_failed(name)
+
+    def _callback_failed(self, name):
+        """
+        Log the exception being handled, which was raised by one of the callbacks set by the
+        transport, and record it in the flight recorder if there is one.
+
+        :param str name: The name of the callback.
+        """
+        logger.error("Unexpected error calling %s", name)
+        logger.error(traceback.format_exc())
+        if self.flight_recorder:
+            self.flight_recorder.record_error(name, sys.exc_info()[1])
+
+    def _client_call(self, function, *args, **kwargs):
+        """
+        Call a method of the MQTT client which may write to its socket, through the multiplexer's
+        channel if there is one.
+
+        :param function: The method, such as self._mqtt_client.publish.
+        :returns: What the method returns.
+        """
+        if self._channel:
+            return self._channel.call(function, *args, **kwargs)
+        return function(*args, **kwargs)
+
     def connect(self, password):
         """
         This method connects the upper transport layer to the mqtt broker.
@@ -116,19 +209,26 @@ class MQTTProvider(object):
         """
         logger.info("connecting to mqtt broker")
 
-        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-        if self._ca_cert:
-            ssl_context.load_verify_locations(cadata=self._ca_cert)
+        if self._multiplexer:
+            # The clients sharing a multiplexer share a context too, as it holds a copy of the
+            # trusted certificates
+            ssl_context = self._multiplexer.shared_ssl_context(self._ca_cert, _create_ssl_context)
         else:
-            ssl_context.load_default_certs()
-        ssl_context.verify_mode = ssl.CERT_REQUIRED
-        ssl_context.check_hostname = True
+            ssl_context = _create_ssl_context(self._ca_cert)
         self._mqtt_client.tls_set_context(ssl_context)
         self._mqtt_client.tls_insecure_set(False)
         self._mqtt_client.username_pw_set(username=self._username, password=password)
 
-        self._mqtt_client.connect(host=self._hostname, port=8883)
-        self._mqtt_client.loop_start()
+        if self.flight_recorder:
+            self.flight_recorder.record(CONNECT, self._hostname, self._port)
+        if self._multiplexer:
+            if not self._channel:
+                self._channel = self._multiplexer.attach(self._mqtt_client)
+            self._channel.keep_connected = True
+            self._channel.call(self._mqtt_client.connect, host=self._hostname, port=self._port)
+        else:
+            self._mqtt_client.connect(host=self._hostname, port=self._port)
+            self._mqtt_client.loop_start()
 
     def reconnect(self, password):
         """
@@ -137,7 +237,9 @@ class MQTTProvider(object):
         """
         logger.info("reconnecting transport")
         self._mqtt_client.username_pw_set(username=self._username, password=password)
-        self._mqtt_client.reconnect()
+        if self.flight_recorder:
+            self.flight_recorder.record(RECONNECT, self._hostname, self._port)
+        self._client_call(self._mqtt_client.reconnect)
 
     def disconnect(self):
         """
@@ -145,18 +247,43 @@ class MQTTProvider(object):
         when it wants to disconnect from the mqtt provider.
         """
         logger.info("disconnecting transport")
-        self._mqtt_client.disconnect()
+        channel = self._channel
+        if channel:
+            self._channel = None
+            channel.keep_connected = False
+            channel.call(self._mqtt_client.disconnect)
+            channel.close()
+        else:
+            self._mqtt_client.disconnect()
 
-    def publish(self, topic, message_payload):
+    def publish(self, topic, message_payload, qos=1):
         """
         This method enables the transport to send a message to the message broker.
         By default the the quality of service level to use is set to 1.
         :param topic: topic: The topic that the message should be published on.
         :param message_payload: The actual message to send.
+        :param qos: the quality of service level for the publish. Defaults to 1.
         :return message ID for the publish request.
         """
-        logger.info("sending")
-        message_info = self._mqtt_client.publish(topic=topic, payload=message_payload, qos=1)
+        message_logger.log("sending")
+        if self.tracer:
+            span = self.tracer.start_span(
+                "mqtt.publish", {"topic": topic, "payload_size": len(message_payload), "qos": qos}
+            )
+            try:
+                message_info = self._client_call(
+                    self._mqtt_client.publish, topic=topic, payload=message_payload, qos=qos
+                )
+            except Exception as e:
+                span.end(error=e)
+                raise
+            span.set_attribute("mid", message_info.mid)
+            span.set_attribute("rc", message_info.rc)
+            span.end()
+        else:
+            message_info = self._client_call(
+                self._mqtt_client.publish, topic=topic, payload=message_payload, qos=qos
+            )
         return message_info.mid
 
     def subscribe(self, topic, qos=0):
@@ -167,8 +294,8 @@ class MQTTProvider(object):
         :return: message ID for the subscribe request
         Raises a ValueError if qos is not 0, 1 or 2, or if topic is None or has zero string length,
         """
-        logger.info("subscribing to %s with qos %s", topic, str(qos))
-        (result, mid) = self._mqtt_client.subscribe(topic, qos)
+        logger.info("subscribing to %s with qos %s", topic, qos)
+        (result, mid) = self._client_call(self._mqtt_client.subscribe, topic, qos)
         return mid
 
     def unsubscribe(self, topic):
@@ -179,5 +306,5 @@ class MQTTProvider(object):
         Raises a ValueError if topic is None or has zero string length, or is not a string.
         """
         logger.info("unsubscribing from %s", topic)
-        (result, mid) = self._mqtt_client.unsubscribe(topic)
+        (result, mid) = self._client_call(self._mqtt_client.unsubscribe, topic)
         return mid
@@ -4,15 +4,36 @@
 # license information.
 # --------------------------------------------------------------------------
 
+import functools
 import logging
-from datetime import date
+import threading
+import zlib
+import six
+from collections import OrderedDict
+from datetime import date, datetime
 import six.moves.urllib as urllib
 import six.moves.queue as queue
-from .mqtt_provider import MQTTProvider
+from .mqtt_provider import MQTTProvider, DEFAULT_MQTT_PORT
 from transitions import Machine
 from azure.iot.hub.devicesdk.transport.abstract_transport import AbstractTransport
 from azure.iot.hub.devicesdk.transport import constant
-from azure.iot.hub.devicesdk.common import Message
+from azure.iot.hub.devicesdk.transport.batching import MessageBatcher
+from azure.iot.hub.devicesdk.transport.chunking import ChunkedSend, ChunkReassembler
+from azure.iot.hub.devicesdk.transport.dedupe import MessageDeduplicator
+from azure.iot.hub.devicesdk.common import Message, MessageTemplate
+from azure.iot.hub.devicesdk.common.clock import SYSTEM_CLOCK
+from azure.iot.hub.devicesdk.errors import MessageExpiredError
+from azure.iot.hub.devicesdk.diagnostics.metrics import TransportMetrics
+from azure.iot.hub.devicesdk.diagnostics import tracing
+from azure.iot.hub.devicesdk.diagnostics.flight_recorder import (
+    EXPIRED,
+    PUBLISH,
+    SUBSCRIBE,
+    TOKEN,
+    TRANSITION,
+    UNSUBSCRIBE,
+)
+from azure.iot.hub.devicesdk.diagnostics.message_log import MessageLogger
 
 
 """
@@ -21,6 +42,13 @@ The below import is for generating the state machine graph.
 # from transitions.extensions import LockedGraphMachine as Machine
 
 logger = logging.getLogger(__name__)
+message_logger = MessageLogger(logger)
+
+# Seconds a response with an unknown MID is kept for the action it belongs to.  The action is
+# tracked as soon as the call to the provider returns, so anything older is a response to an action
+# which will never be tracked, such as a duplicate PUBACK.  Keeping those forever would leak memory
+# and, once MIDs wrap around, complete a later action before its own response arrives.
+UNKNOWN_MID_TIMEOUT = 60
 
 """
 A note on names, design, and code flow:
@@ -91,6 +119,10 @@ class TransportAction(object):
 
     def __init__(self, callback):
         self.callback = callback
+        # SendTimings for the action, if latency recording is enabled
+        self.timings = None
+        # Span tracing the action, if tracing is enabled
+        self.span = None
 
 
 class SendMessageAction(TransportAction):
@@ -104,6 +136,29 @@ class SendMessageAction(TransportAction):
         self.message = message
 
 
+class SendTemplatedMessageAction(TransportAction):
+    """
+    TransportAction object used to publish a payload on a topic which was
+    encoded ahead of time by a message template
+    """
+
+    def __init__(self, topic, payload, callback):
+        TransportAction.__init__(self, callback)
+        self.topic = topic
+        self.payload = payload
+
+
+class SendChunkAction(TransportAction):
+    """
+    TransportAction object used to send the next chunk of a payload which
+    has been split into chunks
+    """
+
+    def __init__(self, chunked_send):
+        TransportAction.__init__(self, chunked_send.callback)
+        self.chunked_send = chunked_send
+
+
 class SubscribeAction(TransportAction):
     """
     TransportAction object used to subscribe to a specific MQTT topic
@@ -135,15 +190,154 @@ class MethodReponseAction(TransportAction):
         self.method_response = method_response
 
 
+def _trace_published(span, topic, payload, mid):
+    """
+    Record that a traced message has been handed to the provider.
+
+    :param Span span: The span of the send
+    :param str topic: The topic the message was published on
+    :param payload: The payload published
+    :param mid: The MID of the publish, or None if the payload was split into chunks
+    """
+    span.set_attribute("topic", topic)
+    span.set_attribute("payload_size", len(payload))
+    if mid is not None:
+        span.set_attribute("mid", mid)
+    span.add_event("published")
+
+
+def _notify_connection_state(handler, new_state, callback):
+    """
+    Tell the client about a change of connection state, then call the callback of the connect or
+    disconnect which caused it, if any.
+    """
+    if handler:
+        handler(new_state)
+    if callback:
+        callback()
+
+
 class MQTTTransport(AbstractTransport):
-    def __init__(self, auth_provider):
+    def __init__(
+        self,
+        auth_provider,
+        payload_compressor=None,
+        batch_policy=None,
+        chunking_policy=None,
+        dedupe_policy=None,
+        latency_recorder=None,
+        tracer=None,
+        port=DEFAULT_MQTT_PORT,
+        telemetry_qos=1,
+        clock=None,
+        flight_recorder=None,
+        watchdog=None,
+        dispatcher=None,
+        multiplexer=None,
+    ):
         """
         Constructor for instantiating a transport
         :param auth_provider: The authentication provider
+        :param payload_compressor: Optional PayloadCompressor used to compress outgoing payloads and
+            decompress received payloads.  Compression is disabled if this is not provided.
+        :param batch_policy: Optional BatchPolicy used to coalesce telemetry messages sent with
+            send_event into envelope messages.  Batching is disabled if this is not provided.
+        :param chunking_policy: Optional ChunkingPolicy used to split payloads that are too large to
+            send as one message into chunks, and to reassemble received chunks.  Chunking is
+            disabled if this is not provided.
+        :param dedupe_policy: Optional DedupePolicy used to suppress redelivered C2D and input
+            messages, based on their message id.  Duplicates are delivered if this is not provided.
+        :param latency_recorder: Optional LatencyRecorder which records the time each sent message
+            spends in each stage of the transport, and the time each received message takes to
+            reach its inbox.
+        :param tracer: Optional Tracer which traces each sent message from the call to send until
+            the PUBACK, and each received message until it is put in its inbox.
+        :param port: The port to connect to.  Defaults to 8883, the MQTT over TLS port of the hub.
+        :param telemetry_qos: The MQTT QoS level used to publish telemetry and output messages,
+            either 0 or 1.  With QoS 0, a send completes once the message has been written to the
+            socket rather than when the service acknowledges it.  Chunks are always sent with
+            QoS 1.  Defaults to 1.
+        :param clock: Optional Clock used to read the time and schedule timed calls, such as the
+            batch linger timer.  Defaults to the system clock.  Pass the same SimulatedClock as the
+            authentication provider to run the transport on simulated time.
+        :param flight_recorder: Optional FlightRecorder which records recent state transitions,
+            MIDs published and acknowledged, connection result codes and token renewals of the
+            transport and its MQTT provider, to be dumped on demand or when an error occurs.
+        :param watchdog: Optional CallbackWatchdog which times the handlers the MQTT provider calls
+            on paho's network thread, reports those which run for longer than its threshold, and
+            adds the time the network thread spends in them to get_stats.
+        :param dispatcher: Optional dispatcher, such as a ThreadDispatcher or PoolDispatcher, which
+            runs completion callbacks, connection state callbacks and the decoding and delivery of
+            received messages, so that they do not hold up paho's network thread.  Work for each
+            inbox, for each MID and for connection state changes stays in order.  Callbacks run on
+            the network thread if this is not provided.
+        :param multiplexer: Optional MqttMultiplexer, shared by many transports, which runs the
+            network loop of this transport's MQTT client on its I/O thread rather than a thread of
+            the transport's own.  Unless a clock is given, the transport and its authentication
+            provider schedule their timed calls, such as SAS token renewals, on the multiplexer's
+            timer thread.
+        :raises: ValueError if the batch policy has a content type with no registered codec.
+        :raises: ValueError if telemetry_qos is not 0 or 1.
         """
+        if telemetry_qos not in (0, 1):
+            raise ValueError("telemetry_qos must be 0 or 1")
         AbstractTransport.__init__(self, auth_provider)
         self.topic = self._get_telemetry_topic_for_publish()
         self._mqtt_provider = None
+        self._port = port
+        self._telemetry_qos = telemetry_qos
+        self.multiplexer = multiplexer
+        if clock is None and multiplexer:
+            clock = multiplexer.clock
+        self.clock = clock or SYSTEM_CLOCK
+        if multiplexer and getattr(auth_provider, "clock", None) is SYSTEM_CLOCK:
+            # Renew the SAS token on the multiplexer's timer thread rather than a thread per renewal
+            auth_provider.clock = self.clock
+        self.payload_compressor = payload_compressor
+
+        self.chunking_policy = chunking_policy
+        self._chunk_reassembler = (
+            ChunkReassembler(chunking_policy, clock=self.clock) if chunking_policy else None
+        )
+
+        # Exposed so that callers can read the number of suppressed duplicates
+        self.deduplicator = (
+            MessageDeduplicator(dedupe_policy, clock=self.clock) if dedupe_policy else None
+        )
+
+        self.latency_recorder = latency_recorder
+        self.tracer = tracer
+        self.flight_recorder = flight_recorder
+        self.watchdog = watchdog
+        # Diagnostics left on the system clock take the transport's, so that their times line up
+        for timed in (latency_recorder, flight_recorder, watchdog):
+            if timed and timed.clock is SYSTEM_CLOCK:
+                timed.clock = self.clock
+        self.dispatcher = dispatcher
+        # Keys of the work handed to the dispatcher, which are unique to this transport so that a
+        # dispatcher shared by many transports keeps each one's work in order separately
+        self._connection_key = (id(self), "connection")
+        self._c2d_key = (id(self), "c2d")
+
+        # Number of queued messages which were dropped because they expired before being sent
+        self.expired_message_count = 0
+
+        # Counters read by get_stats
+        self.metrics = TransportMetrics()
+
+        self._batcher = None
+        if batch_policy:
+            if batch_policy.content_type:
+                codec = self.codec_registry.get(batch_policy.content_type)
+                if not codec:
+                    raise ValueError(
+                        "No codec registered for content type " + batch_policy.content_type
+                    )
+            else:
+                codec = self.codec_registry.default_codec
+            self._batcher = MessageBatcher(
+                batch_policy, codec, self._on_batch_ready, clock=self.clock
+            )
 
         # Queue of actions that will be executed once the transport is connected.
         # Currently, we use a queue, which is FIFO, but the actual order doesn't matter
@@ -156,8 +350,14 @@ class MQTTTransport(AbstractTransport):
 
         # Map of responses we receive with a MID that is not in the _in_progress_actions map.
         # We need this because sometimes a SUBSCRIBE or a PUBLISH will complete before the call
-        # to subscribe() or publish() returns.
-        self._responses_with_unknown_mid = {}
+        # to subscribe() or publish() returns.  Maps each MID to the time it arrived, in the order
+        # they arrived, so that responses which are never claimed can be discarded.
+        self._responses_with_unknown_mid = OrderedDict()
+
+        # Guards the two maps above.  Responses arrive on the provider's network thread while
+        # actions are executed on the caller's thread, so checking one map and adding to the other
+        # must be atomic or a response can be missed.
+        self._mid_lock = threading.Lock()
 
         self._connect_callback = None
         self._disconnect_callback = None
@@ -231,16 +431,21 @@ class MQTTTransport(AbstractTransport):
         ]
 
         def _on_transition_complete(event_data):
+            recorder = self.flight_recorder
+            if recorder:
+                recorder.record(TRANSITION, event_data.event.name, self.state)
+                if event_data.error is not None:
+                    recorder.record_error(event_data.event.name, event_data.error)
             if not event_data.transition:
                 dest = "[no transition]"
             else:
                 dest = event_data.transition.dest
-            logger.info(
+            message_logger.log(
                 "Transition complete.  Trigger=%s, Dest=%s, result=%s, error=%s",
                 event_data.event.name,
                 dest,
-                str(event_data.result),
-                str(event_data.error),
+                event_data.result,
+                event_data.error,
             )
 
         self._state_machine = Machine(
@@ -272,6 +477,7 @@ class MQTTTransport(AbstractTransport):
         :param EventData event_data:  Object created by the Transitions library with information about the state transition
         """
         logger.info("Calling provider connect")
+        self.metrics.connects += 1
         password = self._auth_provider.get_current_sas_token()
         self._mqtt_provider.connect(password)
 
@@ -298,6 +504,7 @@ class MQTTTransport(AbstractTransport):
 
         :param EventData event_data:  Object created by the Transitions library with information about the state transition
         """
+        self.metrics.reconnects += 1
         password = self._auth_provider.get_current_sas_token()
         self._mqtt_provider.reconnect(password)
 
@@ -308,26 +515,33 @@ class MQTTTransport(AbstractTransport):
         logger.info("_on_provider_connect_complete")
         self._trig_provider_connect_complete()
 
-        if self.on_transport_connected:
-            self.on_transport_connected("connected")
         callback = self._connect_callback
-        if callback:
-            self._connect_callback = None
-            callback()
+        self._connect_callback = None
+        self._dispatch(
+            self._connection_key,
+            _notify_connection_state,
+            self.on_transport_connected,
+            "connected",
+            callback,
+        )
 
     def _on_provider_disconnect_complete(self):
         """
         Callback that is called by the provider when the connection has been disconnected
         """
         logger.info("_on_provider_disconnect_complete")
+        self.metrics.disconnects += 1
         self._trig_provider_disconnect_complete()
 
-        if self.on_transport_disconnected:
-            self.on_transport_disconnected("disconnected")
         callback = self._disconnect_callback
-        if callback:
-            self._disconnect_callback = None
-            callback()
+        self._disconnect_callback = None
+        self._dispatch(
+            self._connection_key,
+            _notify_connection_state,
+            self.on_transport_disconnected,
+            "disconnected",
+            callback,
+        )
 
     def _on_provider_publish_complete(self, mid):
         """
@@ -336,15 +550,7 @@ class MQTTTransport(AbstractTransport):
         :param mid: message id that was returned by the provider when `publish` was called.  This is used to tie the
             PUBLISH to the PUBACK.
         """
-        if mid in self._in_progress_actions:
-            callback = self._in_progress_actions[mid]
-            del self._in_progress_actions[mid]
-            callback()
-        else:
-            logger.warning("PUBACK received with unknown MID: %s", str(mid))
-            self._responses_with_unknown_mid[
-                mid
-            ] = mid  # storing MID for now.  will probably store result code later.
+        self._complete_in_progress(mid, "PUBACK")
 
     def _on_provider_subscribe_complete(self, mid):
         """
@@ -353,15 +559,7 @@ class MQTTTransport(AbstractTransport):
         :param mid: message id that was returned by the provider when `subscribe` was called.  This is used to tie the
             SUBSCRIBE to the SUBACK.
         """
-        if mid in self._in_progress_actions:
-            callback = self._in_progress_actions[mid]
-            del self._in_progress_actions[mid]
-            callback()
-        else:
-            logger.warning("SUBACK received with unknown MID: %s", str(mid))
-            self._responses_with_unknown_mid[
-                mid
-            ] = mid  # storing MID for now.  will probably store result code later.
+        self._complete_in_progress(mid, "SUBACK")
 
     def _on_provider_message_received_callback(self, topic, payload):
         """
@@ -373,7 +571,34 @@ class MQTTTransport(AbstractTransport):
         :param topic: MQTT topic name that the message arrived on
         :param payload: Payload of the message
         """
-        logger.info("Message received on topic %s", topic)
+        message_logger.log("Message received on topic %s", topic)
+        self.metrics.messages_received += 1
+        self.metrics.bytes_received += len(topic) + len(payload)
+        if self.tracer:
+            span = self.tracer.start_span(
+                "transport.receive", {"topic": topic.decode("utf-8"), "payload_size": len(payload)},
+            )
+            try:
+                with tracing.activate(span):
+                    delivered = self._receive_message(topic, payload)
+            except Exception as e:
+                span.end(error=e)
+                raise
+            span.set_attribute("delivered", delivered)
+            span.end()
+        else:
+            self._receive_message(topic, payload)
+
+    def _receive_message(self, topic, payload):
+        """
+        Decode a received message and deliver it, if it is a C2D or input message.
+
+        :param topic: MQTT topic name that the message arrived on
+        :param payload: Payload of the message
+        :returns: True if the message was delivered, or False if it was not, because it is a chunk
+            of an incomplete payload, a duplicate, or on a topic which is not handled
+        """
+        received = self.latency_recorder.mark_received() if self.latency_recorder else None
         message_received = Message(payload)
         # TODO : Discuss everything in bytes , need to be changed, specially the topic
         topic_str = topic.decode("utf-8")
@@ -383,12 +608,90 @@ class MQTTTransport(AbstractTransport):
             input_name = topic_parts[TOPIC_POS_INPUT_NAME]
             message_received.input_name = input_name
             _extract_properties(topic_parts[TOPIC_POS_MODULE], message_received)
-            self.on_transport_input_message_received(input_name, message_received)
+            message_received = self._reassemble_chunks(message_received)
+            if not message_received or self._is_duplicate(message_received):
+                return False
+            key = (id(self), "input", input_name)
+            deliver = functools.partial(self.on_transport_input_message_received, input_name)
         elif _is_c2d_topic(topic_str):
             _extract_properties(topic_parts[TOPIC_POS_DEVICE], message_received)
-            self.on_transport_c2d_message_received(message_received)
+            message_received = self._reassemble_chunks(message_received)
+            if not message_received or self._is_duplicate(message_received):
+                return False
+            key = self._c2d_key
+            deliver = self.on_transport_c2d_message_received
         else:
-            pass  # is there any other case
+            return False  # is there any other case
+
+        self._dispatch(key, self._deliver_message, deliver, message_received, received)
+        return True
+
+    def _deliver_message(self, deliver, message_received, received):
+        """
+        Decode a received message and hand it to the client.  This runs on the dispatcher, if
+        there is one.
+
+        :param deliver: The handler which puts the message in its inbox
+        :param Message message_received: The received message, with properties already extracted
+        :param float received: The time returned by the latency recorder when the message arrived,
+            or None if latency recording is disabled
+        """
+        self._decode_received_payload(message_received)
+        deliver(message_received)
+        if received is not None:
+            self.latency_recorder.mark_delivered(received)
+
+    def _reassemble_chunks(self, message_received):
+        """
+        Pass a received message through the chunk reassembler if chunking is enabled and the message
+        is a chunk of a larger payload.
+
+        :param Message message_received: The received message, with properties already extracted
+        :returns: The message to deliver, or None if the message is a chunk and the payload is not
+            complete yet
+        """
+        if self._chunk_reassembler and self._chunk_reassembler.is_chunk(message_received):
+            return self._chunk_reassembler.add(message_received)
+        return message_received
+
+    def _is_duplicate(self, message_received):
+        """
+        Check whether a received message is a redelivery of a recent message, if duplicate
+        suppression is enabled.
+
+        :param Message message_received: The received message, with properties already extracted
+        :returns: True if the message should be dropped
+        """
+        if self.deduplicator:
+            return self.deduplicator.is_duplicate(message_received)
+        return False
+
+    def _decode_received_payload(self, message_received):
+        """
+        Decompress the payload of a received message if it is marked as compressed and compression is
+        enabled, then decode it using the codec for its content type if decoding of received payloads has
+        been enabled in the codec registry.
+
+        :param Message message_received: The received message, with properties already extracted
+        """
+        if self.payload_compressor and self.payload_compressor.is_compressed(
+            message_received.content_encoding
+        ):
+            try:
+                message_received.data = self.payload_compressor.decompress(
+                    message_received.data, message_received.content_encoding
+                )
+                message_received.content_encoding = None
+            except zlib.error:
+                logger.error("Unable to decompress received payload")
+                return
+
+        if self.codec_registry.decode_received_payloads:
+            message_received.data = self.codec_registry.decode(
+                message_received.data,
+                message_received.content_type,
+                message_received.content_encoding,
+            )
 
     def _on_provider_unsubscribe_complete(self, mid):
         """
@@ -397,15 +700,79 @@ class MQTTTransport(AbstractTransport):
         :param mid: message id that was returned by the provider when `unsubscribe` was called.  This is used to tie the
             UNSUBSCRIBE to the UNSUBACK.
         """
-        if mid in self._in_progress_actions:
-            callback = self._in_progress_actions[mid]
-            del self._in_progress_actions[mid]
-            callback()
+        self._complete_in_progress(mid, "UNSUBACK")
+
+    def _track_in_progress(self, mid, callback):
+        """
+        Track an action which has been handed to the provider, so that its callback is called when
+        the response with the same MID arrives.  If the response has already arrived, the callback
+        is called immediately.
+
+        :param mid: message id that was returned by the provider
+        :param callback: callback to call once the response arrives
+        """
+        with self._mid_lock:
+            arrived = self._responses_with_unknown_mid.pop(mid, None)
+            completed = (
+                arrived is not None and arrived > self.clock.monotonic() - UNKNOWN_MID_TIMEOUT
+            )
+            if not completed:
+                self._in_progress_actions[mid] = callback
+        if completed:
+            self._dispatch((id(self), "mid", mid), callback)
+
+    def _complete_in_progress(self, mid, packet_name):
+        """
+        Complete the in-progress action with the given MID.  If the action is not known yet, because
+        the response arrived before the call to the provider returned, the MID is remembered so that
+        _track_in_progress can complete it.
+
+        :param mid: message id of the response
+        :param str packet_name: name of the response packet, for logging
+        """
+        with self._mid_lock:
+            callback = self._in_progress_actions.pop(mid, None)
+            if callback is None:
+                # storing MID for now.  will probably store result code later.
+                now = self.clock.monotonic()
+                self._responses_with_unknown_mid.pop(mid, None)
+                self._responses_with_unknown_mid[mid] = now
+                self._discard_unknown_mid_responses(now - UNKNOWN_MID_TIMEOUT)
+        if callback is not None:
+            self._dispatch((id(self), "mid", mid), callback)
+        else:
+            logger.debug("%s received with unknown MID: %s", packet_name, mid)
+
+    def _dispatch(self, key, function, *args):
+        """
+        Run a callback on the dispatcher, or straight away if there is no dispatcher.  The span
+        active on this thread, if any, is carried to the dispatcher.
+
+        :param key: Identifies the callbacks which must run in order
+        :param function: The callback
+        :param args: The arguments to call it with
+        """
+        if self.dispatcher:
+            if self.tracer:
+                function = tracing.bind(tracing.current_span(), function)
+            self.dispatcher.dispatch(key, function, *args)
         else:
-            logger.warning("UNSUBACK received with unknown MID: %s", str(mid))
-            self._responses_with_unknown_mid[
-                mid
-            ] = mid  # storing MID for now.  will probably store result code later.
+            function(*args)
+
+    def _discard_unknown_mid_responses(self, deadline):
+        """
+        Discard responses with an unknown MID which arrived before a deadline.  Must be called with
+        _mid_lock held.
+
+        :param float deadline: The monotonic time before which responses are discarded
+        """
+        unknown = self._responses_with_unknown_mid
+        while unknown:
+            mid, arrived = next(iter(unknown.items()))
+            if arrived > deadline:
+                break
+            del unknown[mid]
+            self.metrics.unknown_mid_responses_discarded += 1
 
     def _add_action_to_queue(self, event_data):
         """
@@ -416,7 +783,12 @@ class MQTTTransport(AbstractTransport):
 
         :param EventData event_data:  Object created by the Transitions library with information about the state transition
         """
-        self._pending_action_queue.put_nowait(event_data.args[0])
+        action = event_data.args[0]
+        if action.timings is not None:
+            self.latency_recorder.mark_queued(action.timings)
+        if action.span is not None:
+            action.span.add_event("queued", {"state": self.state})
+        self._pending_action_queue.put_nowait(action)
 
     def _execute_action(self, action):
         """
@@ -427,50 +799,153 @@ class MQTTTransport(AbstractTransport):
         """
 
         if isinstance(action, SendMessageAction):
-            logger.info("running SendMessageAction")
-            message_to_send = action.message
-            encoded_topic = _encode_properties(
-                message_to_send, self._get_telemetry_topic_for_publish()
-            )
-            mid = self._mqtt_provider.publish(encoded_topic, message_to_send.data)
-            if mid in self._responses_with_unknown_mid:
-                del self._responses_with_unknown_mid[mid]
-                action.callback()
-            else:
-                self._in_progress_actions[mid] = action.callback
+            message_logger.log("running SendMessageAction")
+            encoded_topic, payload = self._encode_message(action.message)
+            if action.timings is not None:
+                # Stamped on the topic rather than the message, which belongs to the caller
+                stamp = self.latency_recorder.send_time_properties(action.timings)
+                if stamp:
+                    if not encoded_topic.endswith("/"):
+                        encoded_topic += "&"
+                    encoded_topic += urllib.parse.urlencode(stamp)
+            if self.chunking_policy:
+                if isinstance(payload, six.text_type):
+                    payload = payload.encode("utf-8")
+                if len(payload) > self.chunking_policy.max_chunk_size:
+                    self._send_chunked(encoded_topic, payload, action.callback)
+                    if action.timings is not None:
+                        self.latency_recorder.mark_published(action.timings)
+                    if action.span is not None:
+                        _trace_published(action.span, encoded_topic, payload, None)
+                    return
+            mid = self._publish(encoded_topic, payload, qos=self._telemetry_qos)
+            if action.timings is not None:
+                self.latency_recorder.mark_published(action.timings)
+            if action.span is not None:
+                _trace_published(action.span, encoded_topic, payload, mid)
+            self._track_in_progress(mid, action.callback)
+
+        elif isinstance(action, SendChunkAction):
+            self._publish_next_chunk(action.chunked_send)
+
+        elif isinstance(action, SendTemplatedMessageAction):
+            mid = self._publish(action.topic, action.payload, qos=self._telemetry_qos)
+            if action.timings is not None:
+                self.latency_recorder.mark_published(action.timings)
+            if action.span is not None:
+                _trace_published(action.span, action.topic, action.payload, mid)
+            self._track_in_progress(mid, action.callback)
 
         elif isinstance(action, SubscribeAction):
             logger.info("running SubscribeAction topic=%s qos=%s", action.topic, action.qos)
             mid = self._mqtt_provider.subscribe(action.topic, action.qos)
             logger.info("subscribe mid = %s", mid)
-            if mid in self._responses_with_unknown_mid:
-                del self._responses_with_unknown_mid[mid]
-                action.callback()
-            else:
-                self._in_progress_actions[mid] = action.callback
+            if self.flight_recorder:
+                self.flight_recorder.record(SUBSCRIBE, mid, action.topic)
+            self._track_in_progress(mid, action.callback)
 
         elif isinstance(action, UnsubscribeAction):
             logger.info("running UnsubscribeAction")
             mid = self._mqtt_provider.unsubscribe(action.topic)
-            if mid in self._responses_with_unknown_mid:
-                del self._responses_with_unknown_mid[mid]
-                action.callback()
-            else:
-                self._in_progress_actions[mid] = action.callback
+            if self.flight_recorder:
+                self.flight_recorder.record(UNSUBSCRIBE, mid, action.topic)
+            self._track_in_progress(mid, action.callback)
 
         elif isinstance(action, MethodReponseAction):
-            logger.info("running MethodResponseAction")
+            message_logger.log("running MethodResponseAction")
             topic = "TODO"
-            mid = self._mqtt_provider.publish(topic, action.method_response)
-            if mid in self._responses_with_unknown_mid:
-                del self._responses_with_unknown_mid[mid]
-                action.callback()
-            else:
-                self._in_progress_actions[mid] = action.callback
+            mid = self._publish(topic, action.method_response)
+            self._track_in_progress(mid, action.callback)
 
         else:
             logger.error("Removed unknown action type from queue.")
 
+    def _publish(self, topic, payload, qos=1):
+        """
+        Publish a payload with the provider, counting it in the transport metrics.
+
+        :param str topic: The topic to publish on
+        :param payload: The payload to publish
+        :param int qos: The MQTT QoS level
+        :returns: The MID returned by the provider
+        """
+        self.metrics.messages_sent += 1
+        self.metrics.bytes_sent += len(topic) + len(payload)
+        mid = self._mqtt_provider.publish(topic, payload, qos=qos)
+        if self.flight_recorder:
+            self.flight_recorder.record(PUBLISH, mid, topic)
+        return mid
+
+    def _send_chunked(self, encoded_topic, payload, callback):
+        """
+        Split a payload into chunks and publish as many chunks as the in-flight window allows.  The
+        remaining chunks are published as earlier chunks are acknowledged.
+
+        :param str encoded_topic: The topic of the message, including its encoded properties
+        :param bytes payload: The encoded payload
+        :param callback: callback which is called once every chunk has been acknowledged
+        """
+        chunked_send = ChunkedSend(
+            encoded_topic, payload, self.chunking_policy.max_chunk_size, callback
+        )
+        message_logger.log(
+            "Sending payload of %d bytes in %d chunks", len(payload), chunked_send.chunk_count
+        )
+        for _ in range(min(self.chunking_policy.max_in_flight, chunked_send.chunk_count)):
+            self._publish_next_chunk(chunked_send)
+
+    def _publish_next_chunk(self, chunked_send):
+        """
+        Publish the next chunk of a chunked payload, if there are any left.
+
+        :param ChunkedSend chunked_send: The chunked payload
+        """
+        next_chunk = chunked_send.next_chunk()
+        if not next_chunk:
+            return
+        topic, chunk = next_chunk
+
+        def on_chunk_published():
+            complete, send_next = chunked_send.chunk_acknowledged()
+            if complete:
+                if chunked_send.callback:
+                    chunked_send.callback()
+            elif send_next:
+                self._trig_add_action_to_pending_queue(SendChunkAction(chunked_send))
+
+        mid = self._publish(topic, chunk)
+        self._track_in_progress(mid, on_chunk_published)
+
+    def _encode_message(self, message_to_send):
+        """
+        Run a message through the payload encoding stages (codec, then compression) and build the
+        topic that it will be published on.
+
+        :param Message message_to_send: The message to encode
+        :returns: A tuple of (topic, payload)
+        """
+        payload, codec = self.codec_registry.encode(
+            message_to_send.data, message_to_send.content_type
+        )
+        if codec:
+            content_type = codec.content_type
+            content_encoding = codec.content_encoding
+        else:
+            content_type = content_encoding = None
+
+        if self.payload_compressor:
+            payload, compression = self.payload_compressor.compress(payload)
+            if compression:
+                content_encoding = compression
+
+        encoded_topic = _encode_properties(
+            message_to_send,
+            self._get_telemetry_topic_for_publish(),
+            content_type=content_type,
+            content_encoding=content_encoding,
+        )
+        return encoded_topic, payload
+
     def _execute_actions_in_queue(self, event_data):
         """
         Execute any actions that are waiting in the action queue.
@@ -479,15 +954,44 @@ class MQTTTransport(AbstractTransport):
 
         :param EventData event_data:  Object created by the Transitions library with information about the state transition
         """
-        logger.info("checking _pending_action_queue")
+        message_logger.log("checking _pending_action_queue")
         while True:
             try:
                 action = self._pending_action_queue.get_nowait()
             except queue.Empty:
-                logger.info("done checking queue")
+                message_logger.log("done checking queue")
                 return
 
-            self._execute_action(action)
+            if isinstance(action, SendMessageAction) and _is_expired(action.message, self.clock):
+                self._fail_expired_action(action)
+                continue
+
+            if action.timings is not None:
+                self.latency_recorder.mark_dequeued(action.timings)
+
+            if action.span is not None:
+                action.span.add_event("dequeued")
+                with tracing.activate(action.span):
+                    self._execute_action(action)
+            else:
+                self._execute_action(action)
+
+    def _fail_expired_action(self, action):
+        """
+        Drop a send action whose message expired while it was waiting in the queue, and fail its
+        callback with a MessageExpiredError.
+
+        :param SendMessageAction action: The expired action
+        """
+        logger.warning("Dropping message which expired at %s", action.message.expiry_time_utc)
+        self.expired_message_count += 1
+        if self.flight_recorder:
+            self.flight_recorder.record(EXPIRED, action.message.message_id)
+        if action.callback:
+            self._dispatch(
+                (id(self), "expired"),
+                functools.partial(action.callback, error=MessageExpiredError(action.message)),
+            )
 
     def _create_mqtt_provider(self):
         """
@@ -512,8 +1016,18 @@ class MQTTTransport(AbstractTransport):
         else:
             ca_cert = None
 
-        self._mqtt_provider = MQTTProvider(client_id, hostname, username, ca_cert=ca_cert)
+        self._mqtt_provider = MQTTProvider(
+            client_id,
+            hostname,
+            username,
+            ca_cert=ca_cert,
+            port=self._port,
+            multiplexer=self.multiplexer,
+        )
 
+        self._mqtt_provider.tracer = self.tracer
+        self._mqtt_provider.flight_recorder = self.flight_recorder
+        self._mqtt_provider.watchdog = self.watchdog
         self._mqtt_provider.on_mqtt_connected = self._on_provider_connect_complete
         self._mqtt_provider.on_mqtt_disconnected = self._on_provider_disconnect_complete
         self._mqtt_provider.on_mqtt_published = self._on_provider_publish_complete
@@ -557,6 +1071,31 @@ class MQTTTransport(AbstractTransport):
         """
         return self._get_topic_base() + "/inputs/#"
 
+    def get_stats(self):
+        """
+        Take a snapshot of the transport's counters and of the size of its queues.  The queue sizes
+        are read when this is called, so keeping them costs nothing while sending and receiving.
+
+        :returns: A dictionary mapping the names of statistics to their values.  See
+            diagnostics.metrics for their meaning.
+        """
+        stats = self.metrics.snapshot()
+        stats["state"] = self.state
+        stats["pending_actions"] = self._pending_action_queue.qsize()
+        with self._mid_lock:
+            stats["in_progress_actions"] = len(self._in_progress_actions)
+            stats["unknown_mid_responses"] = len(self._responses_with_unknown_mid)
+        stats["expired_messages"] = self.expired_message_count
+        if self.deduplicator:
+            stats["duplicates_suppressed"] = self.deduplicator.duplicate_count
+        if self.latency_recorder:
+            stats["latency_seconds"] = self.latency_recorder.snapshot_histograms()
+        if self.watchdog:
+            stats.update(self.watchdog.snapshot())
+        if self.dispatcher:
+            stats["dispatch_backlog"] = self.dispatcher.pending
+        return stats
+
     def connect(self, callback=None):
         """
         Connect to the service.
@@ -574,6 +1113,8 @@ class MQTTTransport(AbstractTransport):
         :param callback: callback which is called when the connection to the service has been disconnected
         """
         logger.info("disconnect called")
+        if self._batcher is not None:
+            self._batcher.flush()
         self._disconnect_callback = callback
         self._trig_disconnect()
 
@@ -581,20 +1122,128 @@ class MQTTTransport(AbstractTransport):
         """
         Send a telemetry message to the service.
 
+        If batching is enabled, the message is added to the current batch instead of being sent
+        on its own, unless it has already expired.  Messages with an output name are never batched.
+
+        :param callback: callback which is called when the message publish has been acknowledged by the
+            service, or with an error if the message expired before it could be sent.
+        """
+        span = None
+        if self.tracer:
+            span, callback = self._start_send_span(
+                "transport.send_event", callback, tracing.message_attributes(message)
+            )
+        if self._batcher is not None and not message.output_name:
+            if _is_expired(message, self.clock):
+                # The expiry of a batch is only checked when it is dequeued
+                self._fail_expired_action(SendMessageAction(message, callback))
+                return
+            if span is not None:
+                span.add_event("batched")
+            self._batcher.add(message, callback)
+        else:
+            action = SendMessageAction(message, callback)
+            action.span = span
+            self._start_send_timings(action)
+            self._trig_add_action_to_pending_queue(action)
+
+    def create_message_template(self, message):
+        """
+        Encode the topic for a message, including its system and custom properties, so that it can
+        be reused to send many payloads.  The payload of the message is ignored.
+
+        :param Message message: The message whose properties will be sent with each payload.
+        :returns: A MessageTemplate holding the encoded topic.
+        """
+        encoded_topic = _encode_properties(message, self._get_telemetry_topic_for_publish())
+        return MessageTemplate(encoded_topic, message.output_name)
+
+    def send_event_from_template(self, template, payload, callback=None):
+        """
+        Send a payload to the service with the properties of a message template.  The payload is
+        published as-is, without going through the codec, compression or batching stages.
+
+        :param MessageTemplate template: The template created with create_message_template.
+        :param payload: The payload to send, as bytes or a string.
         :param callback: callback which is called when the message publish has been acknowledged by the service.
         """
-        action = SendMessageAction(message, callback)
+        action = SendTemplatedMessageAction(template._encoded_topic, payload, callback)
+        if self.tracer:
+            action.span, action.callback = self._start_send_span(
+                "transport.send_event_from_template", callback
+            )
+        self._start_send_timings(action)
+        self._trig_add_action_to_pending_queue(action)
+
+    def flush_batch(self):
+        """
+        Send the current batch of telemetry messages immediately, if batching is enabled and the
+        batch holds any messages.
+        """
+        if self._batcher is not None:
+            self._batcher.flush()
+
+    def _on_batch_ready(self, envelope, callback):
+        """
+        Callback that is called by the batcher when a batch of telemetry messages is ready to be sent.
+
+        :param Message envelope: The envelope message holding the batch
+        :param callback: callback which completes every message in the batch
+        """
+        action = SendMessageAction(envelope, callback)
+        if self.tracer:
+            action.span, action.callback = self._start_send_span("transport.send_batch", callback)
+        self._start_send_timings(action)
         self._trig_add_action_to_pending_queue(action)
 
     def send_output_event(self, message, callback=None):
         """
         Send an output message to the service.
 
-        :param callback: callback which is called when the message publish has been acknowledged by the service.
+        :param callback: callback which is called when the message publish has been acknowledged by the
+            service, or with an error if the message expired before it could be sent.
         """
         action = SendMessageAction(message, callback)
+        if self.tracer:
+            action.span, action.callback = self._start_send_span(
+                "transport.send_output_event", callback, tracing.message_attributes(message)
+            )
+        self._start_send_timings(action)
         self._trig_add_action_to_pending_queue(action)
 
+    def _start_send_span(self, name, callback, attributes=None):
+        """
+        Start tracing a send.  The span is a child of the span active on the calling thread, such as
+        the span of the client call, and ends when the send completes.
+
+        :param str name: The name of the span
+        :param callback: The callback which is called when the send completes
+        :param dict attributes: Optional attributes of the span
+        :returns: A tuple of (span, callback) where callback ends the span before calling the
+            original callback
+        """
+        span = self.tracer.start_span(name, attributes)
+
+        def on_complete(error=None):
+            span.end(error=error)
+            if callback:
+                if error:
+                    callback(error=error)
+                else:
+                    callback()
+
+        return span, on_complete
+
+    def _start_send_timings(self, action):
+        """
+        Start recording the timings of a send action, if latency recording is enabled.  The action's
+        callback is replaced with one which records the time of the PUBACK.
+
+        :param TransportAction action: The send action which is about to be queued
+        """
+        if self.latency_recorder:
+            action.timings, action.callback = self.latency_recorder.start(action.callback)
+
     def send_method_response(self, method, payload, status, callback=None):
         raise NotImplementedError
 
@@ -602,6 +1251,8 @@ class MQTTTransport(AbstractTransport):
         """
         Callback which is called by the authentication provider when the shared access string has been updated.
         """
+        if self.flight_recorder:
+            self.flight_recorder.record(TOKEN)
         self._trig_on_shared_access_string_updated()
 
     def enable_feature(self, feature_name, callback=None):
@@ -619,7 +1270,7 @@ class MQTTTransport(AbstractTransport):
         elif feature_name == constant.METHODS:
             self._enable_methods(callback)
         else:
-            logger.error("Feature name {} is unknown".format(feature_name))
+            logger.error("Feature name %s is unknown", feature_name)
             raise ValueError("Invalid feature name")
 
     def disable_feature(self, feature_name, callback=None):
@@ -637,7 +1288,7 @@ class MQTTTransport(AbstractTransport):
         elif feature_name == constant.METHODS:
             self._disable_methods(callback)
         else:
-            logger.error("Feature name {} is unknown".format(feature_name))
+            logger.error("Feature name %s is unknown", feature_name)
             raise ValueError("Invalid feature name")
 
     def _enable_input_messages(self, callback=None):
@@ -706,6 +1357,23 @@ class MQTTTransport(AbstractTransport):
         self.feature_enabled[constant.METHODS] = False
 
 
+def _is_expired(message, clock):
+    """
+    Check whether the expiry time of a message has passed.  Only expiry times given as datetime
+    objects are checked.  Naive datetimes are treated as UTC.
+
+    :param Message message: The message to check
+    :param Clock clock: The clock to read the current time from
+    :return: True if the message has expired
+    """
+    expiry_time = message.expiry_time_utc
+    if not isinstance(expiry_time, datetime):
+        return False
+    if expiry_time.tzinfo is not None:
+        expiry_time = (expiry_time - expiry_time.utcoffset()).replace(tzinfo=None)
+    return expiry_time <= datetime.utcfromtimestamp(clock.time())
+
+
 def _is_c2d_topic(split_topic_str):
     """
     Topics for c2d message are of the following format:
@@ -757,7 +1425,7 @@ def _extract_properties(properties, message_received):
             message_received.custom_properties[key] = value
 
 
-def _encode_properties(message_to_send, topic):
+def _encode_properties(message_to_send, topic, content_type=None, content_encoding=None):
     """
     uri-encode the system properties of a message as key-value pairs on the topic with defined keys.
     Additionally if the message has user defined properties, the property keys and values shall be
@@ -767,6 +1435,9 @@ def _encode_properties(message_to_send, topic):
     :param topic: The topic which has not been encoded yet. For a device it looks like
     "devices/<deviceId>/messages/events/" and for a module it looks like
     "devices/<deviceId>/modules/<moduleId>/messages/events/
+    :param content_type: Optional content type which overrides the content type of the message,
+    used when the payload has been encoded by a codec.
+    :param content_encoding: Optional content encoding which overrides the content encoding of the message.
     :return: The topic which has been uri-encoded
     """
     system_properties = {}
@@ -784,11 +1455,13 @@ def _encode_properties(message_to_send, topic):
     if message_to_send.to:
         system_properties["$.to"] = message_to_send.to
 
-    if message_to_send.content_type:
-        system_properties["$.ct"] = message_to_send.content_type
+    content_type = content_type or message_to_send.content_type
+    if content_type:
+        system_properties["$.ct"] = content_type
 
-    if message_to_send.content_encoding:
-        system_properties["$.ce"] = message_to_send.content_encoding
+    content_encoding = content_encoding or message_to_send.content_encoding
+    if content_encoding:
+        system_properties["$.ce"] = content_encoding
 
     if message_to_send.expiry_time_utc:
         system_properties["$.exp"] = (
@@ -800,7 +1473,8 @@ def _encode_properties(message_to_send, topic):
     system_properties_encoded = urllib.parse.urlencode(system_properties)
     topic += system_properties_encoded
 
-    if message_to_send.custom_properties and len(message_to_send.custom_properties) > 0:
+    # Check first so that encoding does not allocate an empty dictionary
+    if message_to_send.has_custom_properties:
         topic += "&"
         user_properties_encoded = urllib.parse.urlencode(message_to_send.custom_properties)
         topic += user_properties_encoded
@@ -0,0 +1,453 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""This module contains a multiplexer which runs the MQTT connections of many transports on one I/O
+thread.
+
+Without a multiplexer, each MQTT provider runs paho's network loop on a thread of its own, and each
+renewable authentication provider renews its SAS token on a threading.Timer thread, so a process
+with thousands of devices runs thousands of threads. A transport given a multiplexer registers its
+paho client's socket with the multiplexer's selector instead, and schedules its timed calls, such as
+token renewals and batch linger timers, on the multiplexer's clock. One I/O thread reads, writes and
+keeps alive every connection, and one timer thread makes every timed call, so each device costs
+its sockets and a small amount of state. The clients also share an SSL context.
+
+Callbacks from paho, such as PUBACKs and received messages, run on the I/O thread and hold up every
+connection while they run, so transports sharing a multiplexer should also share a dispatcher if
+their handlers can be slow.
+"""
+
+import functools
+import heapq
+import itertools
+import logging
+import socket
+import threading
+from collections import deque
+from azure.iot.hub.devicesdk.common.clock import Clock
+from azure.iot.hub.devicesdk.transport.dispatch import ThreadDispatcher
+
+try:
+    import selectors
+except ImportError:
+    try:
+        # Backport for Python 2.7
+        import selectors2 as selectors
+    except ImportError:
+        selectors = None
+
+logger = logging.getLogger(__name__)
+
+# Seconds between the checks of each connection's keepalive and retry timers
+DEFAULT_MISC_INTERVAL = 1.0
+# Bounds of the delay before reconnecting a connection which was lost, as used by paho's own loop
+MIN_RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 120
+
+
+class _Timer(object):
+    __slots__ = ("due", "function", "cancelled")
+
+    def __init__(self, due, function):
+        self.due = due
+        self.function = function
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _MultiplexerClock(Clock):
+    """A clock reading the system time, which schedules calls on a multiplexer's timer thread."""
+
+    def __init__(self, multiplexer):
+        self._multiplexer = multiplexer
+
+    def call_later(self, delay, function, daemon=False):
+        # The timer thread never keeps the process alive, so daemon is ignored
+        return self._multiplexer.call_later(delay, function)
+
+
+class Channel(object):
+    """A paho client attached to a multiplexer.
+
+    Calls into the client which can write to its socket must be made with call(), so that the
+    I/O thread never reads the socket while another thread is writing to it, and picks up the
+    writes which could not be finished at once.
+
+    :ivar client: The paho client.
+    :ivar lock: The RLock held by the thread calling into the client.
+    :ivar bool keep_connected: Whether a lost connection is reconnected, as paho's own loop does.
+    Set while the provider wants to be connected.
+    """
+
+    __slots__ = (
+        "client",
+        "lock",
+        "keep_connected",
+        "closed",
+        "sock",
+        "events",
+        "reconnect_delay",
+        "_multiplexer",
+    )
+
+    def __init__(self, multiplexer, client):
+        self.client = client
+        self.lock = threading.RLock()
+        self.keep_connected = False
+        self.closed = False
+        # The socket registered with the selector, and the events it is registered for.  Only
+        # used by the I/O thread.
+        self.sock = None
+        self.events = 0
+        self.reconnect_delay = MIN_RECONNECT_DELAY
+        self._multiplexer = multiplexer
+
+    def call(self, function, *args, **kwargs):
+        """Call a method of the client, then have the I/O thread register any new socket and any
+        writes left waiting.
+
+        :param function: The method, such as client.publish.
+        :returns: What the method returns.  Exceptions it raises are passed on.
+        """
+        with self.lock:
+            result = function(*args, **kwargs)
+        self._multiplexer._refresh(self)
+        return result
+
+    def connection_established(self):
+        """Note that the connection was accepted, so that the next one lost is retried quickly."""
+        self.reconnect_delay = MIN_RECONNECT_DELAY
+
+    def close(self):
+        """Detach the client from the multiplexer once its socket has been closed."""
+        self.keep_connected = False
+        self.closed = True
+        self._multiplexer._refresh(self)
+
+
+class MqttMultiplexer(object):
+    """Runs the network loops of many paho clients on one I/O thread, and their timed calls on one
+    timer thread.
+
+    Pass the same multiplexer to each transport with the multiplexer keyword argument.  Its threads
+    are started when the first client is attached or the first call is scheduled, and are daemon
+    threads, so they do not keep the process alive.
+
+    :ivar float misc_interval: Seconds between checks of each connection's keepalive.
+    :ivar clock: A Clock whose call_later schedules calls on the timer thread, for the transports
+    and authentication providers which use this multiplexer.
+    :ivar int reconnect_count: The number of attempts made to reconnect lost connections.
+    """
+
+    def __init__(self, misc_interval=DEFAULT_MISC_INTERVAL, name="MqttMultiplexer"):
+        """Initializer for MqttMultiplexer.
+
+        :param float misc_interval: Seconds between checks of each connection's keepalive.
+        Default 1, as in paho's own loop.
+        :param str name: The name of the I/O thread, and the prefix of the timer thread's name.
+        :raises: RuntimeError if the selectors module is not available.
+        """
+        if selectors is None:
+            raise RuntimeError("MqttMultiplexer requires the selectors module (or selectors2)")
+        self.misc_interval = misc_interval
+        self.name = name
+        self.clock = _MultiplexerClock(self)
+        self.reconnect_count = 0
+        self._monotonic = self.clock.monotonic
+        self._lock = threading.Lock()
+        self._channels = set()
+        # Channels to be updated by the I/O thread, put here by other threads
+        self._refreshes = deque()
+        self._timers = []
+        self._sequence = itertools.count()
+        self._selector = None
+        self._wake_reader = None
+        self._wake_writer = None
+        self._woken = False
+        self._stopping = False
+        self._thread = None
+        self._timer_worker = None
+        self._ssl_contexts = {}
+
+    @property
+    def connection_count(self):
+        """The number of clients attached."""
+        return len(self._channels)
+
+    @property
+    def timer_count(self):
+        """The number of scheduled calls which have not been made or cancelled."""
+        with self._lock:
+            return sum(1 for _, _, timer in self._timers if not timer.cancelled)
+
+    def start(self):
+        """Start the I/O and timer threads, if they are not running."""
+        with self._lock:
+            if self._thread:
+                return
+            self._selector = selectors.DefaultSelector()
+            self._wake_reader, self._wake_writer = socket.socketpair()
+            self._wake_reader.setblocking(False)
+            self._wake_writer.setblocking(False)
+            self._selector.register(self._wake_reader, selectors.EVENT_READ, None)
+            self._woken = False
+            self._stopping = False
+            # Channels attached before a restart are registered again by the new I/O thread
+            for channel in self._channels:
+                channel.sock = None
+                channel.events = 0
+                self._refreshes.append(channel)
+            self._timer_worker = ThreadDispatcher(name=self.name + "-timers")
+            self._thread = threading.Thread(target=self._run, name=self.name)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """Stop the I/O and timer threads.  Connections are left open, and are not serviced until
+        the multiplexer is started again.  Must not be called from a callback or a timed call.
+        """
+        with self._lock:
+            thread = self._thread
+            if not thread:
+                return
+            self._stopping = True
+        self._wake()
+        thread.join()
+        self._timer_worker.shutdown()
+        self._selector.close()
+        self._wake_reader.close()
+        self._wake_writer.close()
+        with self._lock:
+            self._thread = None
+            self._timer_worker = None
+
+    def attach(self, client):
+        """Attach a paho client, whose network loop will be run by the I/O thread.
+
+        The client must not run a loop of its own, with loop_start() or otherwise.
+
+        :param client: The paho client.
+        :returns: The Channel through which the client must be called.
+        """
+        channel = Channel(self, client)
+        with self._lock:
+            self._channels.add(channel)
+        self.start()
+        return channel
+
+    def shared_ssl_context(self, ca_cert, create):
+        """Get the SSL context shared by the clients which trust a certificate.
+
+        :param ca_cert: The certificate, or None for the system's default certificates.
+        :param create: Function which creates the context from ca_cert, the first time it is needed.
+        :returns: The SSLContext.
+        """
+        with self._lock:
+            context = self._ssl_contexts.get(ca_cert)
+            if context is None:
+                context = self._ssl_contexts[ca_cert] = create(ca_cert)
+        return context
+
+    def call_later(self, delay, function):
+        """Call a function on the timer thread once a number of seconds has passed.
+
+        :param float delay: The number of seconds to wait.
+        :param function: The function to call, with no arguments.  Exceptions it raises are logged.
+        :returns: A handle whose cancel() method stops the call if it has not been made.
+        """
+        timer = _Timer(self._monotonic() + max(delay, 0), function)
+        with self._lock:
+            heapq.heappush(self._timers, (timer.due, next(self._sequence), timer))
+            earliest = self._timers[0][2] is timer
+            started = self._thread is not None
+        if not started:
+            self.start()
+        elif earliest:
+            self._wake()
+        return timer
+
+    def _wake(self):
+        # A flag rather than a lock keeps this cheap.  The I/O thread clears it before taking the
+        # refreshes, so a refresh is never left behind.
+        if self._woken:
+            return
+        self._woken = True
+        try:
+            self._wake_writer.send(b"\0")
+        except (socket.error, AttributeError):
+            # Full, or closed by stop(), either of which means the I/O thread will look anyway
+            pass
+
+    def _refresh(self, channel):
+        if threading.current_thread() is self._thread:
+            self._update(channel)
+            return
+        client = channel.client
+        if client.socket() is channel.sock and not client.want_write() and not channel.closed:
+            return
+        self._refreshes.append(channel)
+        self._wake()
+
+    def _run(self):
+        next_misc = self._monotonic() + self.misc_interval
+        # Channels whose TLS socket holds decrypted data, which the selector cannot see
+        buffered = set()
+        while not self._stopping:
+            timeout = next_misc - self._monotonic()
+            with self._lock:
+                if self._timers:
+                    timeout = min(timeout, self._timers[0][0] - self._monotonic())
+            if buffered:
+                timeout = 0
+            try:
+                events = self._selector.select(max(timeout, 0))
+            except Exception:
+                logger.exception("Unexpected error selecting sockets")
+                continue
+
+            ready = dict.fromkeys(buffered, selectors.EVENT_READ)
+            buffered.clear()
+            for key, mask in events:
+                if key.data is None:
+                    self._drain_wake_socket()
+                else:
+                    ready[key.data] = ready.get(key.data, 0) | mask
+            for channel, mask in ready.items():
+                if self._service(channel, mask):
+                    buffered.add(channel)
+
+            while self._refreshes:
+                self._update(self._refreshes.popleft())
+            self._run_due_timers()
+            if self._monotonic() >= next_misc:
+                self._check_keepalives()
+                next_misc = self._monotonic() + self.misc_interval
+
+    def _drain_wake_socket(self):
+        self._woken = False
+        try:
+            while self._wake_reader.recv(4096):
+                pass
+        except socket.error:
+            pass
+
+    def _service(self, channel, mask):
+        """Read and write a client's socket.
+
+        :returns: Whether the socket has decrypted data buffered, which must be read without
+        waiting for the selector.
+        """
+        client = channel.client
+        buffered = False
+        try:
+            with channel.lock:
+                if mask & selectors.EVENT_READ:
+                    client.loop_read()
+                if mask & selectors.EVENT_WRITE:
+                    client.loop_write()
+                sock = client.socket()
+                pending = getattr(sock, "pending", None)
+                buffered = bool(pending and pending())
+        except Exception:
+            logger.exception("Unexpected error in the network loop of %s", client)
+        self._update(channel)
+        return buffered
+
+    def _check_keepalives(self):
+        with self._lock:
+            channels = list(self._channels)
+        for channel in channels:
+            if channel.sock is None:
+                continue
+            # A client being connected on another thread holds its lock through the handshake,
+            # so it is checked next time rather than holding up every other connection
+            if not channel.lock.acquire(False):
+                continue
+            try:
+                channel.client.loop_misc()
+            except Exception:
+                logger.exception("Unexpected error in the network loop of %s", channel.client)
+            finally:
+                channel.lock.release()
+            self._update(channel)
+
+    def _update(self, channel):
+        """Register the client's current socket with the selector, for reading, and for writing
+        when the client has data waiting to be written.  Runs on the I/O thread.
+        """
+        client = channel.client
+        sock = client.socket()
+        if sock is not channel.sock:
+            if channel.sock is not None:
+                self._unregister(channel.sock)
+            channel.sock = sock
+            channel.events = 0
+            if sock is None:
+                if channel.closed:
+                    with self._lock:
+                        self._channels.discard(channel)
+                elif channel.keep_connected:
+                    self._schedule_reconnect(channel)
+                return
+        if sock is None:
+            if channel.closed:
+                with self._lock:
+                    self._channels.discard(channel)
+            return
+        events = selectors.EVENT_READ
+        if client.want_write():
+            events |= selectors.EVENT_WRITE
+        if events == channel.events:
+            return
+        try:
+            if channel.events:
+                self._selector.modify(sock, events, channel)
+            else:
+                self._selector.register(sock, events, channel)
+            channel.events = events
+        except (KeyError, ValueError, OSError) as e:
+            # The socket was closed by another thread, which will refresh the channel again
+            logger.debug("Could not register socket of %s: %s", client, e)
+
+    def _unregister(self, sock):
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def _schedule_reconnect(self, channel):
+        delay = channel.reconnect_delay
+        channel.reconnect_delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        logger.info("Connection of %s lost, reconnecting in %s s", channel.client, delay)
+        self.call_later(delay, functools.partial(self._reconnect, channel))
+
+    def _reconnect(self, channel):
+        # Runs on the timer thread, as connecting blocks for the TCP and TLS handshakes
+        if channel.closed or not channel.keep_connected or channel.client.socket() is not None:
+            return
+        self.reconnect_count += 1
+        try:
+            channel.call(channel.client.reconnect)
+        except Exception as e:
+            logger.info("Reconnecting %s failed: %s", channel.client, e)
+            self._schedule_reconnect(channel)
+
+    def _run_due_timers(self):
+        now = self._monotonic()
+        due = []
+        with self._lock:
+            while self._timers and self._timers[0][0] <= now:
+                due.append(heapq.heappop(self._timers)[2])
+        for timer in due:
+            if not timer.cancelled:
+                self._timer_worker.dispatch(None, _run_timer, timer)
+
+
+def _run_timer(timer):
+    # A timer cancelled while it waited for the timer thread is not run
+    if not timer.cancelled:
+        timer.function()
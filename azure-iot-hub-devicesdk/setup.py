@@ -44,4 +44,5 @@ setup(
     ],
     python_requires=">=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3*, <4",
     packages=find_packages(exclude=["tests", "samples"]),
+    package_data={"azure.iot.hub.devicesdk.benchmarks": ["hot_paths_baseline.json"]},
 )
@@ -11,6 +11,9 @@ import six
 from azure.iot.hub.devicesdk.aio import DeviceClient, ModuleClient
 from azure.iot.hub.devicesdk.transport.mqtt import MQTTTransport
 from azure.iot.hub.devicesdk import Message
+from azure.iot.hub.devicesdk.errors import MessageExpiredError
+from azure.iot.hub.devicesdk.diagnostics import Tracer, tracing
+from azure.iot.hub.devicesdk.common import MethodRequest
 from azure.iot.hub.devicesdk.aio.async_inbox import AsyncClientInbox
 from azure.iot.hub.devicesdk.transport import constant
 
@@ -67,6 +70,14 @@ class ClientSharedTests(object):
         with pytest.raises(ValueError):
             self.client_class.from_authentication_provider(auth_provider, "bad input")
 
+    async def test_get_stats_adds_inbox_depths_to_transport_stats(self, client):
+        client._inbox_manager.route_method_request(MethodRequest("1", "some_method", "payload"))
+        stats = client.get_stats()
+        assert stats["messages_sent"] == 0
+        assert stats["state"] == "disconnected"
+        assert stats["inbox_depth"]["method"] == 1
+        assert stats["subscriber_discards"] == 0
+
     async def test_instantiation_sets_on_connected_handler_in_transport(self, client):
         assert client._transport.on_transport_connected is not None
         assert client._transport.on_transport_connected == client._on_state_change
@@ -103,6 +114,28 @@ class ClientSharedTests(object):
         assert transport.send_event.call_count == 1
         assert transport.send_event.call_args[0][0] == message
 
+    async def test_send_event_raises_error_from_transport(self, client, transport):
+        transport.send_event.side_effect = lambda message, callback: callback(
+            error=MessageExpiredError(message)
+        )
+        with pytest.raises(MessageExpiredError):
+            await client.send_event(Message("this is a message"))
+
+    async def test_send_event_is_traced_if_tracer_set(self, client, transport):
+        ended = []
+        transport.tracer = Tracer(on_end=ended.append)
+        active_spans = []
+        # The transport is called on an executor thread, which the span is carried to
+        transport.send_event.side_effect = lambda message, callback: (
+            active_spans.append(tracing.current_span()) or callback()
+        )
+        await client.send_event(Message("this is a message", message_id="m1"))
+
+        span = ended[0]
+        assert span.name == "client.send_event"
+        assert span.attributes == {"message_id": "m1"}
+        assert active_spans == [span]
+
     async def test_send_event_calls_transport_wraps_data_in_message(self, client, transport):
         naked_string = "this is a message"
         await client.send_event(naked_string)
@@ -111,6 +144,13 @@ class ClientSharedTests(object):
         assert isinstance(sent_message, Message)
         assert sent_message.data == naked_string
 
+    async def test_send_event_from_template_calls_transport(self, client, transport):
+        template = client.create_message_template(Message("this is a message"))
+        await client.send_event_from_template(template, b"payload")
+        assert transport.send_event_from_template.call_count == 1
+        assert transport.send_event_from_template.call_args[0][0] == template
+        assert transport.send_event_from_template.call_args[0][1] == b"payload"
+
     @pytest.mark.skip(reason="Not Implemented")
     async def test_receive_method_request_enables_methods_only_if_not_already_enabled(
         self, client, transport
@@ -156,6 +196,13 @@ class TestModuleClient(ClientSharedTests):
         assert transport.send_output_event.call_args[0][0] == message
         assert message.output_name == output_name
 
+    async def test_send_to_output_raises_error_from_transport(self, client, transport):
+        transport.send_output_event.side_effect = lambda message, callback: callback(
+            error=MessageExpiredError(message)
+        )
+        with pytest.raises(MessageExpiredError):
+            await client.send_to_output(Message("this is a message"), "some_output")
+
     async def test_send_to_output_calls_transport_wraps_data_in_message(self, client, transport):
         naked_string = "this is a message"
         output_name = "some_output"
@@ -191,6 +238,71 @@ class TestModuleClient(ClientSharedTests):
         await client.receive_input_message(input_name)
         assert transport.enable_feature.call_count == 0
 
+    async def test_receive_input_message_creates_inbox_before_enabling_input_messaging(
+        self, mocker, client, transport
+    ):
+        # patch this receive_input_message won't block
+        mocker.patch.object(
+            AsyncClientInbox, "get", return_value=(await create_completed_future(None))
+        )
+        inbox_names = []
+
+        def enable_feature(feature_name, callback=None):
+            inbox_names.extend(client._inbox_manager.input_message_inboxes)
+            callback()
+
+        transport.feature_enabled.__getitem__.return_value = False
+        transport.enable_feature.side_effect = enable_feature
+        await client.receive_input_message("some_input")
+        assert inbox_names == ["some_input"]
+
+    async def test_receive_input_message_returns_message_which_arrives_as_subscription_completes(
+        self, client, transport
+    ):
+        message = Message("arrived with the SUBACK")
+
+        def enable_feature(feature_name, callback=None):
+            # The hub can deliver a message before the subscribe call has returned
+            transport.on_transport_input_message_received("some_input", message)
+            callback()
+
+        transport.feature_enabled.__getitem__.return_value = False
+        transport.enable_feature.side_effect = enable_feature
+        received = await asyncio.wait_for(client.receive_input_message("some_input"), 5)
+        assert received is message
+
+    async def test_subscribe_to_input_messages_enables_input_messaging_only_if_not_already_enabled(
+        self, client, transport
+    ):
+        transport.feature_enabled.__getitem__.return_value = False
+        await client.subscribe_to_input_messages("some_input")
+        assert transport.enable_feature.call_count == 1
+        assert transport.enable_feature.call_args[0][0] == constant.INPUT_MSG
+
+        transport.enable_feature.reset_mock()
+        transport.feature_enabled.__getitem__.return_value = True
+        await client.subscribe_to_input_messages("some_input")
+        assert transport.enable_feature.call_count == 0
+
+    async def test_subscribers_receive_every_input_message_until_unsubscribed(
+        self, client, transport
+    ):
+        message = Message("arrived with the SUBACK")
+
+        def enable_feature(feature_name, callback=None):
+            # The hub can deliver a message before the subscribe call has returned
+            transport.on_transport_input_message_received("some_input", message)
+            callback()
+
+        transport.feature_enabled.__getitem__.return_value = False
+        transport.enable_feature.side_effect = enable_feature
+        inbox = await client.subscribe_to_input_messages("some_input", maxsize=10)
+        assert await asyncio.wait_for(inbox.get(), 5) is message
+
+        assert client.unsubscribe(inbox)
+        transport.on_transport_input_message_received("some_input", message)
+        assert inbox.empty()
+
     async def test_receive_input_message_returns_message_from_input_inbox(self, mocker, client):
         message = Message("this is a message")
         inbox_mock = mocker.MagicMock(autospec=AsyncClientInbox)
@@ -242,6 +354,35 @@ class TestDeviceClient(ClientSharedTests):
         await client.receive_c2d_message()
         assert transport.enable_feature.call_count == 0
 
+    async def test_subscribe_to_c2d_messages_enables_c2d_messaging_only_if_not_already_enabled(
+        self, client, transport
+    ):
+        transport.feature_enabled.__getitem__.return_value = False
+        await client.subscribe_to_c2d_messages()
+        assert transport.enable_feature.call_count == 1
+        assert transport.enable_feature.call_args[0][0] == constant.C2D_MSG
+
+        transport.enable_feature.reset_mock()
+        transport.feature_enabled.__getitem__.return_value = True
+        await client.subscribe_to_c2d_messages()
+        assert transport.enable_feature.call_count == 0
+
+    async def test_every_subscriber_receives_c2d_messages_until_unsubscribed(
+        self, client, transport
+    ):
+        message = Message("this is a message")
+        transport.feature_enabled.__getitem__.return_value = True
+        inboxes = [await client.subscribe_to_c2d_messages() for _ in range(2)]
+
+        transport.on_transport_c2d_message_received(message)
+        for inbox in inboxes:
+            assert await asyncio.wait_for(inbox.get(), 5) is message
+
+        assert client.unsubscribe(inboxes[0])
+        transport.on_transport_c2d_message_received(message)
+        assert inboxes[0].empty()
+        assert await asyncio.wait_for(inboxes[1].get(), 5) is message
+
     async def test_receive_c2d_message_returns_message_from_c2d_inbox(self, mocker, client):
         message = Message("this is a message")
         inbox_mock = mocker.MagicMock(autospec=AsyncClientInbox)
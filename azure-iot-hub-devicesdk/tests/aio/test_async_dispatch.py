@@ -0,0 +1,44 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import asyncio
+import logging
+import threading
+import pytest
+from mock import MagicMock
+from azure.iot.hub.devicesdk.aio import AsyncioDispatcher
+
+
+class TestAsyncioDispatcher(object):
+    @pytest.mark.asyncio
+    async def test_runs_callbacks_on_the_loop_in_order(self):
+        loop = asyncio.get_event_loop()
+        dispatcher = AsyncioDispatcher(loop)
+        calls = []
+
+        def dispatch_from_network_thread():
+            for index in range(50):
+                dispatcher.dispatch("key-{}".format(index % 2), calls.append, index)
+
+        thread = threading.Thread(target=dispatch_from_network_thread)
+        thread.start()
+        thread.join()
+        assert dispatcher.pending == 50
+
+        await asyncio.sleep(0)
+        assert calls == list(range(50))
+        assert dispatcher.pending == 0
+
+    @pytest.mark.asyncio
+    async def test_logs_exceptions_and_carries_on(self, caplog):
+        dispatcher = AsyncioDispatcher(asyncio.get_event_loop())
+        callback = MagicMock()
+        dispatcher.dispatch("key", MagicMock(side_effect=ValueError("Alohomora")))
+        dispatcher.dispatch("key", callback)
+
+        await asyncio.sleep(0)
+        callback.assert_called_once_with()
+        assert any(r.levelno == logging.ERROR for r in caplog.records)
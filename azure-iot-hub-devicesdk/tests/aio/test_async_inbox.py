@@ -7,6 +7,7 @@
 import pytest
 import asyncio
 from azure.iot.hub.devicesdk.aio.async_inbox import AsyncClientInbox
+from azure.iot.hub.devicesdk.diagnostics import LatencyRecorder
 
 # Note that the async tests are currently raising runtime warnings for some reason.
 # I suspect it is a bug in janus.Queue.
@@ -67,6 +68,19 @@ class TestAsyncClientInbox(object):
         assert await inbox.get() is item2
         assert await inbox.get() is item3
 
+    @pytest.mark.asyncio
+    async def test__put_discarding_oldest_discards_oldest_item_when_full(self, mocker):
+        inbox = AsyncClientInbox(maxsize=2)
+        item1 = mocker.MagicMock()
+        item2 = mocker.MagicMock()
+        item3 = mocker.MagicMock()
+        assert not inbox._put_discarding_oldest(item1)
+        assert not inbox._put_discarding_oldest(item2)
+        assert inbox._put_discarding_oldest(item3)
+
+        assert await inbox.get() is item2
+        assert await inbox.get() is item3
+
     @pytest.mark.asyncio
     async def test_can_check_if_empty(self, mocker):
         inbox = AsyncClientInbox()
@@ -76,6 +90,27 @@ class TestAsyncClientInbox(object):
         await inbox.get()
         assert inbox.empty()
 
+    @pytest.mark.asyncio
+    async def test_qsize_counts_items(self, mocker):
+        inbox = AsyncClientInbox()
+        assert inbox.qsize() == 0
+        inbox._put(mocker.MagicMock())
+        inbox._put(mocker.MagicMock())
+        assert inbox.qsize() == 2
+        await inbox.get()
+        assert inbox.qsize() == 1
+
+    @pytest.mark.asyncio
+    async def test_records_wait_time_if_latency_recorder_given(self, mocker):
+        recorder = LatencyRecorder()
+        inbox = AsyncClientInbox(maxsize=1, latency_recorder=recorder)
+        item1 = mocker.MagicMock()
+        item2 = mocker.MagicMock()
+        inbox._put(item1)
+        assert inbox._put_discarding_oldest(item2)
+        assert await inbox.get() is item2
+        assert recorder.histograms["inbox_wait_time"].count == 1
+
     def test_can_clear_all_items(self, mocker):
         inbox = AsyncClientInbox()
         item1 = mocker.MagicMock()
@@ -6,6 +6,7 @@
 import pytest
 from mock import MagicMock, patch
 from threading import Timer
+from azure.iot.hub.devicesdk.common.clock import SimulatedClock
 from azure.iot.hub.devicesdk.auth.base_renewable_token_authentication_provider import (
     BaseRenewableTokenAuthenticationProvider,
     DEFAULT_TOKEN_VALIDITY_PERIOD,
@@ -60,8 +61,7 @@ def module_auth_provider():
 @pytest.fixture(scope="function")
 def fake_get_current_time_function():
     with patch(
-        "azure.iot.hub.devicesdk.auth.base_renewable_token_authentication_provider.time.time",
-        MagicMock(return_value=fake_current_time),
+        "azure.iot.hub.devicesdk.common.clock.time.time", MagicMock(return_value=fake_current_time),
     ):
         yield
 
@@ -69,8 +69,7 @@ def fake_get_current_time_function():
 @pytest.fixture(scope="function")
 def fake_timer_object():
     with patch(
-        "azure.iot.hub.devicesdk.auth.base_renewable_token_authentication_provider.Timer",
-        MagicMock(spec=Timer),
+        "azure.iot.hub.devicesdk.common.clock.Timer", MagicMock(spec=Timer),
     ) as PatchedTimer:
         yield PatchedTimer
 
@@ -171,3 +170,20 @@ def test_disconnect_cancels_update_timer(device_auth_provider, fake_timer_object
     device_auth_provider.generate_new_sas_token()
     device_auth_provider.disconnect()
     fake_timer_object.return_value.cancel.assert_called_once_with()
+
+
+def test_renews_token_on_simulated_clock(device_auth_provider):
+    clock = SimulatedClock(start=fake_current_time)
+    device_auth_provider.clock = clock
+    update_callback = MagicMock()
+    device_auth_provider.token_update_callback = update_callback
+    device_auth_provider.get_current_sas_token()
+
+    days = 3
+    clock.advance(days * 86400)
+
+    renewals = days * 86400 // (DEFAULT_TOKEN_VALIDITY_PERIOD - DEFAULT_TOKEN_RENEWAL_MARGIN)
+    assert update_callback.call_count == renewals + 1
+    expiry = int(device_auth_provider.sas_token_str.rpartition("se=")[2])
+    assert expiry > clock.time()
+    assert clock.pending == 1
@@ -0,0 +1,33 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+import sys
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 6), reason="Requires Python 3.6+")
+
+
+class TestDispatchBenchmark(object):
+    def test_run_keeps_every_message_in_order(self):
+        from azure.iot.hub.devicesdk.benchmarks import dispatch
+
+        results = dispatch.run(duration=0.3, rate=400, consumer_delay=0.005)
+
+        assert [r["dispatcher"] for r in results] == list(dispatch.DISPATCHERS)
+        for result in results:
+            assert result["failures"] == []
+            assert result["received"] > 0
+            assert result["sent"] > 0
+        by_name = {r["dispatcher"]: r for r in results}
+        # Slow consumers stall the network thread unless their callbacks are dispatched
+        assert by_name["pool"]["max_stall_ms"] < by_name["inline"]["max_stall_ms"]
+        assert by_name["inline"]["max_backlog"] == 0
+
+    def test_measure_rejects_unknown_dispatcher(self):
+        from azure.iot.hub.devicesdk.benchmarks import dispatch
+
+        with pytest.raises(ValueError):
+            dispatch.measure("fibers")
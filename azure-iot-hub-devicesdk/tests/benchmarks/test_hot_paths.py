@@ -0,0 +1,72 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import os
+import pytest
+import sys
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 6), reason="Requires Python 3.6+")
+
+# Shared test machines are noisy, so by default only a large slowdown fails. Set
+# AZURE_IOT_BENCHMARK_TOLERANCE to a smaller fraction on a quiet machine.
+TOLERANCE = float(os.environ.get("AZURE_IOT_BENCHMARK_TOLERANCE", "2.0"))
+DURATION = 0.05
+
+
+def _case_names():
+    if sys.version_info < (3, 6):
+        return []
+    from azure.iot.hub.devicesdk.benchmarks import hot_paths
+
+    return list(hot_paths.CASES)
+
+
+class TestHotPaths(object):
+    @pytest.mark.parametrize("name", _case_names())
+    def test_no_regression_from_baseline(self, name):
+        from azure.iot.hub.devicesdk.benchmarks import hot_paths
+
+        baseline = hot_paths.load_baseline()
+        result = hot_paths.measure(name, DURATION)
+        if hot_paths.compare(result, baseline, TOLERANCE):
+            # Measure again, so that a burst of load from elsewhere does not fail the test
+            result = hot_paths.measure(name, DURATION)
+            hot_paths.compare(result, baseline, TOLERANCE)
+        assert not result["regressed"], "{} is {:.0%} slower than its baseline".format(
+            name, result["change"]
+        )
+
+    def test_baseline_covers_every_case(self):
+        from azure.iot.hub.devicesdk.benchmarks import hot_paths
+
+        assert set(hot_paths.load_baseline()) == set(hot_paths.CASES)
+
+    def test_compare_flags_slowdowns_beyond_tolerance(self):
+        from azure.iot.hub.devicesdk.benchmarks import hot_paths
+
+        baseline = {"case": 1.0}
+        assert hot_paths.compare({"case": "case", "relative": 1.4}, baseline, 0.5) is False
+        assert hot_paths.compare({"case": "case", "relative": 1.6}, baseline, 0.5) is True
+        assert hot_paths.compare({"case": "new", "relative": 9.0}, baseline, 0.5) is False
+
+    def test_missing_baseline_is_reported(self, mocker, tmpdir, capsys):
+        from azure.iot.hub.devicesdk.benchmarks import hot_paths
+
+        path = str(tmpdir.join("missing.json"))
+        with pytest.raises(IOError, match="--update-baseline"):
+            hot_paths.load_baseline(path)
+        mocker.patch.object(hot_paths, "BASELINE_PATH", path)
+        with pytest.raises(SystemExit):
+            hot_paths.main(["--check"])
+        assert "No hot path baseline" in capsys.readouterr().err
+
+        from azure.iot.hub.devicesdk.benchmarks import hot_paths
+
+        path = str(tmpdir.join("baseline.json"))
+        assert hot_paths.load_baseline(path, required=False) == {}
+        hot_paths.write_baseline([{"case": "a", "relative": 1.0}], path)
+        hot_paths.write_baseline([{"case": "b", "relative": 2.0}], path)
+        assert hot_paths.load_baseline(path) == {"a": 1.0, "b": 2.0}
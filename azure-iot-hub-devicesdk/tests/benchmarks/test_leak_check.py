@@ -0,0 +1,55 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import os
+import pytest
+import sys
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 6), reason="Requires Python 3.6+")
+
+# A short run by default. Set AZURE_IOT_LEAK_CYCLES to millions for a soak run, and
+# AZURE_IOT_LEAK_THRESHOLD to the steady-state growth allowed, in bytes per message.
+CYCLES = int(os.environ.get("AZURE_IOT_LEAK_CYCLES", "5000"))
+THRESHOLD = os.environ.get("AZURE_IOT_LEAK_THRESHOLD")
+
+
+class TestLeakCheck(object):
+    @pytest.mark.parametrize("client_type", ["sync", "async"])
+    def test_steady_state_growth_is_below_threshold(self, client_type):
+        from azure.iot.hub.devicesdk.benchmarks import leak_check
+
+        threshold = float(THRESHOLD) if THRESHOLD else leak_check.DEFAULT_THRESHOLD
+        result = leak_check.measure(client_type, cycles=CYCLES, warmup=CYCLES // 10, samples=10)
+        leaking = leak_check.check(result, threshold)
+
+        sites = "\n".join(
+            "{size_diff:+} B in {count_diff:+} blocks at {file}:{line}".format(**site)
+            for site in result["top_sites"]
+        )
+        assert not leaking, "{} client grows by {} bytes per message. Top sites:\n{}".format(
+            client_type, result["steady_bytes_per_message"], sites
+        )
+        assert result["inbox_depth"] == 0
+        assert result["in_progress_actions"] == 0
+        assert result["unknown_mid_responses"] == 0
+
+    def test_detects_messages_accumulating_in_an_inbox(self):
+        from azure.iot.hub.devicesdk.benchmarks import leak_check
+
+        result = leak_check.measure("sync", cycles=500, warmup=50, samples=5, consume=False)
+
+        assert leak_check.check(result)
+        assert result["leaking"]
+        assert result["inbox_depth"] == 550
+        assert result["steady_bytes_per_message"] > 100
+        assert [sample["cycles"] for sample in result["samples"]] == [0, 100, 200, 300, 400, 500]
+        assert result["top_sites"][0]["count_diff"] >= 500
+
+    def test_measure_rejects_unknown_client_types(self):
+        from azure.iot.hub.devicesdk.benchmarks import leak_check
+
+        with pytest.raises(ValueError):
+            leak_check.measure("threaded")
@@ -0,0 +1,59 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import logging
+import pytest
+import sys
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 6), reason="Requires Python 3.6+")
+
+
+class TestLoggingOverheadBenchmark(object):
+    def test_run_reports_each_mode(self):
+        from azure.iot.hub.devicesdk.benchmarks import logging_overhead
+
+        results = logging_overhead.run(rate=1000, messages=20, duration=0.05)
+
+        assert [r["mode"] for r in results] == list(logging_overhead.MODES)
+        by_mode = {r["mode"]: r for r in results}
+        assert by_mode["off"]["overhead_us_per_message"] == 0
+        # Per-message events are only written at DEBUG, or when sampled
+        assert by_mode["off"]["records_per_message"] == 0
+        assert by_mode["warning"]["records_per_message"] == 0
+        assert by_mode["info"]["records_per_message"] == 0
+        assert 0 < by_mode["sampled"]["records_per_message"] < 1
+        assert by_mode["debug"]["records_per_message"] > 1
+        for result in results:
+            assert result["achieved_rate"] > 0
+            assert result["cpu_fraction"] >= 0
+
+    def test_sampled_runs_do_not_depend_on_earlier_runs(self):
+        from azure.iot.hub.devicesdk.benchmarks import logging_overhead
+
+        for _ in range(2):
+            result = logging_overhead.measure("sampled", rate=1000, messages=20, duration=0.05)
+            assert result["records_per_message"] > 0
+
+    def test_restores_logging_configuration(self):
+        from azure.iot.hub.devicesdk.benchmarks import logging_overhead
+        from azure.iot.hub.devicesdk.diagnostics import message_log
+
+        package_logger = logging.getLogger(logging_overhead.PACKAGE_LOGGER)
+        handlers = list(package_logger.handlers)
+        level = package_logger.level
+
+        logging_overhead.measure("sampled", rate=1000, messages=5, duration=0.01)
+
+        assert package_logger.handlers == handlers
+        assert package_logger.level == level
+        assert package_logger.propagate
+        assert not message_log.sampling_enabled()
+
+    def test_measure_rejects_unknown_modes(self):
+        from azure.iot.hub.devicesdk.benchmarks import logging_overhead
+
+        with pytest.raises(ValueError):
+            logging_overhead.measure("verbose")
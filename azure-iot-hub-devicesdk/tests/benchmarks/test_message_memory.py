@@ -0,0 +1,26 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+import sys
+from azure.iot.hub.devicesdk.common import Message
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 4), reason="Requires tracemalloc")
+
+
+class TestMessageMemoryBenchmark(object):
+    def test_slots_message_uses_less_memory_than_dict_message(self):
+        from azure.iot.hub.devicesdk.benchmarks import message_memory
+
+        original = message_memory.measure_bytes_per_message(message_memory.DictMessage, 2000)
+        current = message_memory.measure_bytes_per_message(Message, 2000)
+        assert current < original
+
+    def test_run_reports_each_custom_property_count(self):
+        from azure.iot.hub.devicesdk.benchmarks import message_memory
+
+        results = message_memory.run(100, [0, 2])
+        assert [r["custom_properties"] for r in results] == [0, 2]
@@ -0,0 +1,34 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+import sys
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 6), reason="Requires Python 3.6+")
+
+
+class TestMultiplexBenchmark(object):
+    def test_run_reports_each_mode(self):
+        from azure.iot.hub.devicesdk.benchmarks import multiplex
+
+        try:
+            results = multiplex.run(devices=10, messages=2)
+        except RuntimeError as e:
+            pytest.skip(str(e))
+
+        assert [r["mode"] for r in results] == list(multiplex.MODES)
+        by_mode = {r["mode"]: r for r in results}
+        # A network thread and a token renewal timer per device, against two shared threads
+        assert by_mode["threaded"]["threads"] == 20
+        assert by_mode["multiplexed"]["threads"] == 2
+        for result in results:
+            assert result["sends_per_second"] > 0
+
+    def test_measure_rejects_unknown_mode(self):
+        from azure.iot.hub.devicesdk.benchmarks import multiplex
+
+        with pytest.raises(ValueError):
+            multiplex.measure("forked", hub=None)
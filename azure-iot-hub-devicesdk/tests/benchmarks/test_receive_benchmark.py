@@ -0,0 +1,53 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+import sys
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 6), reason="Requires Python 3.6+")
+
+
+class TestReceiveBenchmark(object):
+    def test_run_reports_each_combination(self):
+        from azure.iot.hub.devicesdk.benchmarks import receive
+
+        try:
+            results = receive.run(
+                paths=receive.PATHS,
+                kinds=receive.KINDS,
+                inbox_types=receive.INBOX_TYPES,
+                rates=[500],
+                step_duration=0.1,
+                overload_messages=50,
+            )
+        except RuntimeError as e:
+            pytest.skip(str(e))
+
+        # Method requests are only injected in-process
+        assert [(r["path"], r["kind"], r["inbox"]) for r in results] == [
+            ("inprocess", "c2d", "sync"),
+            ("inprocess", "c2d", "async"),
+            ("inprocess", "input", "sync"),
+            ("inprocess", "input", "async"),
+            ("inprocess", "method", "sync"),
+            ("inprocess", "method", "async"),
+            ("socket", "c2d", "sync"),
+            ("socket", "c2d", "async"),
+            ("socket", "input", "sync"),
+            ("socket", "input", "async"),
+        ]
+        for result in results:
+            step = result["steps"][0]
+            assert step["messages"] == 100
+            assert step["delivered"] == 100
+            assert set(step["latency_ms"]) == {"p50", "p99", "p999"}
+            assert result["overload"]["messages"] == 50
+
+    def test_measure_rejects_socket_method_requests(self):
+        from azure.iot.hub.devicesdk.benchmarks import receive
+
+        with pytest.raises(ValueError):
+            receive.measure("socket", "method", "sync", hub=None)
@@ -0,0 +1,48 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+import sys
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 6), reason="Requires Python 3.6+")
+
+
+class TestSendBenchmark(object):
+    def test_run_reports_each_combination(self):
+        from azure.iot.hub.devicesdk.benchmarks import send
+
+        try:
+            results = send.run(
+                modes=send.MODES,
+                payload_sizes=[16],
+                property_counts=[2],
+                concurrencies=[2],
+                qos_levels=[0, 1],
+                message_count=10,
+            )
+        except RuntimeError as e:
+            pytest.skip(str(e))
+
+        assert [(r["mode"], r["qos"]) for r in results] == [
+            ("sync", 0),
+            ("sync", 1),
+            ("async", 0),
+            ("async", 1),
+            ("pipelined", 0),
+            ("pipelined", 1),
+        ]
+        for result in results:
+            assert result["messages"] == 10
+            assert result["msgs_per_sec"] > 0
+            assert set(result["ack_latency_ms"]) == {"p50", "p99", "p999"}
+
+    def test_make_messages(self):
+        from azure.iot.hub.devicesdk.benchmarks import send
+
+        messages = send.make_messages(3, 100, 5)
+        assert len(messages) == 3
+        assert len(messages[0].data) == 100
+        assert len(messages[2].custom_properties) == 5
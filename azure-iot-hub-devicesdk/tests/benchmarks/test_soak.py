@@ -0,0 +1,61 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import os
+import pytest
+import sys
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 6), reason="Requires Python 3.6+")
+
+# A few simulated hours by default. Set AZURE_IOT_SOAK_DAYS for a longer run, and
+# AZURE_IOT_SOAK_RSS_THRESHOLD to check RSS growth, in bytes per renewal, which takes a few dozen
+# renewals to settle.
+DAYS = float(os.environ.get("AZURE_IOT_SOAK_DAYS", "0.25"))
+RSS_THRESHOLD = os.environ.get("AZURE_IOT_SOAK_RSS_THRESHOLD")
+
+
+class TestSoak(object):
+    def test_renewals_do_not_lose_telemetry_or_grow_resources(self):
+        from azure.iot.hub.devicesdk.benchmarks import soak
+
+        try:
+            result = soak.measure(days=DAYS)
+        except RuntimeError as e:
+            pytest.skip(str(e))
+        failures = soak.check(result, rss_threshold=float(RSS_THRESHOLD) if RSS_THRESHOLD else None)
+
+        assert not failures, "\n".join(failures)
+        assert result["renewals"] == int(DAYS * 86400 // 3480)
+        assert result["reconnects"] == result["renewals"]
+        assert result["expired_disconnects"] == 0
+        assert result["sent"] == result["received"] == int(DAYS * 86400 / soak.DEFAULT_INTERVAL)
+
+    def test_reports_gaps_and_lost_messages(self):
+        from azure.iot.hub.devicesdk.benchmarks import soak
+
+        latencies = [0.001, -1.0, -1.0, 0.001, 0.001]
+        assert soak._gaps(latencies, 60) == [{"hour": 0.02, "seconds": 180}]
+
+        result = {
+            "lost": 2,
+            "gaps": soak._gaps(latencies, 60),
+            "sent": 5,
+            "received": 3,
+            "growth_per_renewal": {"threads": 1.0, "rss_bytes": 100.0, "open_fds": None},
+        }
+        assert soak.check(result) == [
+            "2 messages lost",
+            "1 gaps in telemetry",
+            "5 sent, 3 received",
+            "threads grows by 1.0 per renewal",
+        ]
+
+    def test_slope_fits_samples(self):
+        from azure.iot.hub.devicesdk.benchmarks import _support
+
+        assert _support.slope([(0, 10), (10, 30), (20, 50)]) == 2
+        assert _support.slope([(0, 10)]) is None
+        assert _support.slope([(5, 10), (5, 20)]) is None
@@ -7,6 +7,7 @@
 import pytest
 from azure.iot.hub.devicesdk.transport.abstract_transport import AbstractTransport
 from azure.iot.hub.devicesdk.transport import constant
+from azure.iot.hub.devicesdk.common import MessageTemplate
 
 """----Shared auth_provider fixture----"""
 
@@ -59,10 +60,22 @@ class FakeTransport(AbstractTransport):
     def send_output_event(self, event, callback):
         callback()
 
+    def create_message_template(self, message):
+        return MessageTemplate("fake/topic", message.output_name)
+
+    def send_event_from_template(self, template, payload, callback):
+        callback()
+
     def send_method_response(self, method, payload, status, callback=None):
         callback()
 
+    def get_stats(self):
+        return {"messages_sent": 0, "state": "disconnected"}
+
 
 @pytest.fixture
 def transport(mocker):
-    return mocker.MagicMock(wraps=FakeTransport(mocker.MagicMock()))
+    transport = mocker.MagicMock(wraps=FakeTransport(mocker.MagicMock()))
+    transport.latency_recorder = None
+    transport.tracer = None
+    return transport
@@ -0,0 +1,88 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import threading
+import pytest
+from mock import MagicMock
+from azure.iot.hub.devicesdk.common.clock import Clock, SimulatedClock, SYSTEM_CLOCK
+
+
+class TestClock(object):
+    def test_call_later_calls_function_after_delay(self):
+        called = threading.Event()
+        timer = SYSTEM_CLOCK.call_later(0.01, called.set, daemon=True)
+        assert called.wait(5)
+        assert timer.daemon
+
+    def test_call_later_can_be_cancelled(self):
+        function = MagicMock()
+        SYSTEM_CLOCK.call_later(60, function).cancel()
+        function.assert_not_called()
+
+    def test_monotonic_does_not_go_backwards(self):
+        clock = Clock()
+        first = clock.monotonic()
+        assert clock.monotonic() >= first
+
+
+class TestSimulatedClock(object):
+    def test_time_only_moves_when_advanced(self):
+        clock = SimulatedClock(start=1000)
+        assert clock.time() == 1000
+        assert clock.monotonic() == 0
+        clock.advance(86400)
+        assert clock.time() == 87400
+        assert clock.monotonic() == 86400
+
+    def test_makes_calls_in_order_at_their_due_time(self):
+        clock = SimulatedClock(start=0)
+        calls = []
+        clock.call_later(20, lambda: calls.append(("b", clock.time())))
+        clock.call_later(10, lambda: calls.append(("a", clock.time())))
+        clock.call_later(40, lambda: calls.append(("c", clock.time())))
+
+        assert clock.advance(30) == 2
+        assert calls == [("a", 10), ("b", 20)]
+        assert clock.time() == 30
+        assert clock.next_due() == 10
+
+    def test_makes_calls_scheduled_by_calls_within_the_same_advance(self):
+        clock = SimulatedClock(start=0)
+        times = []
+
+        def repeat():
+            times.append(clock.time())
+            clock.call_later(100, repeat)
+
+        clock.call_later(100, repeat)
+        assert clock.advance(1000) == 10
+        assert times == [100 * i for i in range(1, 11)]
+        assert clock.calls_made == 10
+
+    def test_skips_cancelled_calls(self):
+        clock = SimulatedClock()
+        function = MagicMock()
+        clock.call_later(10, function).cancel()
+        assert clock.pending == 0
+        assert clock.next_due() is None
+        assert clock.advance(20) == 0
+        function.assert_not_called()
+
+    def test_logs_exceptions_raised_by_calls(self):
+        clock = SimulatedClock()
+        later = MagicMock()
+        clock.call_later(1, MagicMock(side_effect=ValueError("boom")))
+        clock.call_later(2, later)
+        assert clock.advance(5) == 2
+        later.assert_called_once_with()
+
+    @pytest.mark.parametrize("delay", [0, -5])
+    def test_calls_due_now_are_made_on_next_advance(self, delay):
+        clock = SimulatedClock()
+        function = MagicMock()
+        clock.call_later(delay, function)
+        clock.advance(0)
+        function.assert_called_once_with()
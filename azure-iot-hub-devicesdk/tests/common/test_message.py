@@ -34,3 +34,32 @@ class TestMessage(object):
         msg = Message(s, None, encoding, type)
         assert msg.content_encoding == encoding
         assert msg.content_type == type
+
+    def test_does_not_have_instance_dict(self):
+        msg = Message("some data")
+        assert not hasattr(msg, "__dict__")
+        with pytest.raises(AttributeError):
+            msg.not_a_message_attribute = "value"
+
+    def test_custom_properties_not_allocated_until_accessed(self):
+        msg = Message("some data")
+        assert msg._custom_properties is None
+        assert msg.custom_properties == {}
+        assert msg._custom_properties is msg.custom_properties
+
+    def test_has_custom_properties_does_not_allocate(self):
+        msg = Message("some data")
+        assert not msg.has_custom_properties
+        assert msg._custom_properties is None
+        msg.custom_properties["key"] = "value"
+        assert msg.has_custom_properties
+
+    def test_custom_properties_persist_after_first_write(self):
+        msg = Message("some data")
+        msg.custom_properties["key"] = "value"
+        assert msg.custom_properties == {"key": "value"}
+
+    def test_custom_properties_can_be_replaced(self):
+        msg = Message("some data")
+        msg.custom_properties = {"key": "value"}
+        assert msg.custom_properties == {"key": "value"}
@@ -20,3 +20,7 @@ class TestMethodRequest(object):
     @pytest.mark.skip(reason="Not implemented")
     def test_payload_property_is_read_only(self):
         pass
+
+    def test_does_not_have_instance_dict(self):
+        method_request = MethodRequest("1", "some_method", "payload")
+        assert not hasattr(method_request, "__dict__")
@@ -0,0 +1,124 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+from azure.iot.hub.devicesdk.common import payload_codecs
+from azure.iot.hub.devicesdk.common.payload_codecs import (
+    CodecRegistry,
+    JsonCodec,
+    FastJsonCodec,
+    PayloadCodec,
+)
+
+fake_payload = {"temperature": 21.5, "humidity": [40, 41], "location": "Gryffindor Tower"}
+
+requires_fast_json = pytest.mark.skipif(
+    not (payload_codecs.orjson or payload_codecs.ujson), reason="Requires orjson or ujson"
+)
+
+
+class FakeCodec(PayloadCodec):
+    content_type = "application/x-fake"
+
+    def encode(self, obj):
+        return b"fake"
+
+    def decode(self, payload, content_encoding=None):
+        return "decoded"
+
+
+class TestJsonCodec(object):
+    def test_encodes_to_utf8_bytes(self):
+        encoded = JsonCodec().encode(fake_payload)
+        assert isinstance(encoded, bytes)
+
+    def test_round_trips_payload(self):
+        codec = JsonCodec()
+        assert codec.decode(codec.encode(fake_payload)) == fake_payload
+
+    def test_decodes_using_content_encoding(self):
+        payload = u'{"spell": "Lumos"}'.encode("utf-16")
+        assert JsonCodec().decode(payload, "utf-16") == {"spell": "Lumos"}
+
+
+@requires_fast_json
+class TestFastJsonCodec(object):
+    def test_round_trips_payload(self):
+        codec = FastJsonCodec()
+        assert codec.decode(codec.encode(fake_payload)) == fake_payload
+
+    def test_is_compatible_with_json_codec(self):
+        assert JsonCodec().decode(FastJsonCodec().encode(fake_payload)) == fake_payload
+
+    def test_uses_json_content_type(self):
+        assert FastJsonCodec().content_type == JsonCodec.content_type
+
+
+class TestCodecRegistry(object):
+    def test_default_codec_is_json(self):
+        registry = CodecRegistry()
+        assert registry.default_codec.content_type == "application/json"
+
+    def test_does_not_decode_received_payloads_by_default(self):
+        assert not CodecRegistry().decode_received_payloads
+
+    @pytest.mark.parametrize(
+        "data", ["some string", b"some bytes", 42], ids=["String", "Bytes", "Integer"]
+    )
+    def test_encode_passes_through_data_that_is_not_dict_or_list(self, data):
+        payload, codec = CodecRegistry().encode(data)
+        assert payload is data
+        assert codec is None
+
+    @pytest.mark.parametrize("data", [fake_payload, [1, 2, 3]], ids=["Dict", "List"])
+    def test_encode_encodes_dict_or_list_with_default_codec(self, data):
+        registry = CodecRegistry()
+        payload, codec = registry.encode(data)
+        assert codec is registry.default_codec
+        assert codec.decode(payload) == data
+
+    def test_encode_uses_codec_for_content_type(self):
+        registry = CodecRegistry()
+        fake_codec = FakeCodec()
+        registry.register(fake_codec)
+        payload, codec = registry.encode(fake_payload, "application/x-fake")
+        assert codec is fake_codec
+        assert payload == b"fake"
+
+    def test_encode_raises_for_unknown_content_type(self):
+        with pytest.raises(ValueError):
+            CodecRegistry().encode(fake_payload, "application/x-unknown")
+
+    def test_register_can_set_default_codec(self):
+        registry = CodecRegistry()
+        fake_codec = FakeCodec()
+        registry.register(fake_codec, default=True)
+        assert registry.default_codec is fake_codec
+
+    def test_registering_codec_for_default_content_type_replaces_default(self):
+        registry = CodecRegistry()
+        json_codec = JsonCodec()
+        registry.register(json_codec)
+        assert registry.default_codec is json_codec
+
+    def test_get_ignores_content_type_parameters_and_case(self):
+        registry = CodecRegistry()
+        assert registry.get("Application/JSON; charset=utf-8") is registry.default_codec
+
+    def test_decode_uses_codec_for_content_type(self):
+        registry = CodecRegistry()
+        assert registry.decode(b'{"a": 1}', "application/json") == {"a": 1}
+
+    @pytest.mark.parametrize(
+        "content_type", [None, "application/x-unknown"], ids=["No content type", "Unknown"]
+    )
+    def test_decode_returns_payload_unchanged_without_codec(self, content_type):
+        payload = b"some bytes"
+        assert CodecRegistry().decode(payload, content_type) is payload
+
+    def test_decode_returns_payload_unchanged_if_decoding_fails(self):
+        payload = b"not json"
+        assert CodecRegistry().decode(payload, "application/json") is payload
@@ -0,0 +1,107 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import logging
+import threading
+import pytest
+from azure.iot.hub.devicesdk.common.clock import SimulatedClock
+from azure.iot.hub.devicesdk.diagnostics import flight_recorder
+from azure.iot.hub.devicesdk.diagnostics.flight_recorder import FlightRecorder, format_events
+
+
+@pytest.fixture
+def clock():
+    return SimulatedClock(start=1546300800)
+
+
+@pytest.fixture
+def logs(caplog):
+    caplog.set_level(logging.INFO, logger=flight_recorder.__name__)
+    return caplog
+
+
+class TestFlightRecorder(object):
+    def test_keeps_most_recent_events_in_order(self, clock):
+        recorder = FlightRecorder(capacity=3, clock=clock)
+        for mid in range(5):
+            clock.advance(1)
+            recorder.record(flight_recorder.PUBLISH, mid, "topic")
+
+        events = recorder.dump()
+        assert [(e.sequence, e.key) for e in events] == [(2, 2), (3, 3), (4, 4)]
+        assert [e.time for e in events] == [1546300803, 1546300804, 1546300805]
+        assert all(e.event == flight_recorder.PUBLISH and e.value == "topic" for e in events)
+
+    def test_rejects_invalid_capacity(self):
+        with pytest.raises(ValueError):
+            FlightRecorder(capacity=0)
+
+    def test_clear_discards_events(self):
+        recorder = FlightRecorder(capacity=4)
+        recorder.record(flight_recorder.TOKEN)
+        recorder.clear()
+        assert recorder.dump() == []
+        recorder.record(flight_recorder.CONNACK, 0)
+        assert [e.sequence for e in recorder.dump()] == [1]
+
+    def test_error_dumps_events_since_last_dump(self, logs):
+        recorder = FlightRecorder(capacity=8)
+        recorder.record(flight_recorder.CONNACK, 0)
+        recorder.record_error("on_mqtt_connected", ValueError("first"))
+        recorder.record(flight_recorder.DISCONNECT, 7)
+        recorder.record_error("on_mqtt_disconnected", ValueError("second"))
+
+        assert [r.levelno for r in logs.records] == [logging.ERROR, logging.ERROR]
+        first, second = [r.getMessage() for r in logs.records]
+        assert "error in on_mqtt_connected), 2 events" in first
+        assert "connack 0" in first and "ValueError('first')" in first
+        assert "connack" not in second
+        assert "disconnect 7" in second and "ValueError('second')" in second
+
+    def test_error_does_not_dump_if_disabled(self, logs):
+        recorder = FlightRecorder(dump_on_error=False)
+        recorder.record_error("on_mqtt_published", ValueError())
+        assert logs.records == []
+        assert recorder.dump()[0].event == flight_recorder.ERROR
+
+    def test_log_dump_writes_every_event_on_demand(self, logs):
+        recorder = FlightRecorder()
+        recorder.record(flight_recorder.PUBACK, 3)
+        recorder.log_dump()
+        assert recorder.log_dump() == 1
+        assert len(logs.records) == 2
+        assert logs.records[0].levelno == logging.INFO
+
+    def test_log_dump_does_nothing_if_level_is_disabled(self, logs):
+        recorder = FlightRecorder()
+        recorder.record(flight_recorder.PUBACK, 3)
+        assert recorder.log_dump(logging.DEBUG) == 0
+        assert logs.records == []
+
+    def test_format_events(self, clock):
+        recorder = FlightRecorder(clock=clock)
+        clock.advance(0.25)
+        recorder.record(flight_recorder.TRANSITION, "_trig_connect", "connecting")
+        recorder.record(flight_recorder.TOKEN)
+        assert format_events(recorder.dump()) == (
+            "2019-01-01T00:00:00.250000Z #0 transition _trig_connect connecting\n"
+            "2019-01-01T00:00:00.250000Z #1 token"
+        )
+
+    def test_records_from_many_threads(self):
+        recorder = FlightRecorder(capacity=64)
+
+        def record():
+            for mid in range(1000):
+                recorder.record(flight_recorder.PUBACK, mid)
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert [e.sequence for e in recorder.dump()] == list(range(4000 - 64, 4000))
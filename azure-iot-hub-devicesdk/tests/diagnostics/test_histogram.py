@@ -0,0 +1,100 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+from azure.iot.hub.devicesdk.diagnostics.histogram import LatencyHistogram
+
+
+class TestLatencyHistogram(object):
+    def test_every_value_is_counted_in_one_bucket_within_precision(self):
+        histogram = LatencyHistogram(max_seconds=1)
+        previous_index = 0
+        for value in range(0, 1000001, 7):
+            index = histogram._index(value)
+            assert index >= previous_index
+            assert histogram._highest_value(index) >= value
+            assert index == 0 or histogram._highest_value(index - 1) < value
+            # Buckets are never wider than 1/64 of their values
+            assert histogram._highest_value(index) - value <= max(value // 64, 0)
+            previous_index = index
+
+    def test_memory_is_fixed_by_the_largest_value_tracked(self):
+        histogram = LatencyHistogram(max_seconds=10)
+        bucket_count = len(histogram._counts)
+        for value in (0.001, 5, 10, 1000, 1e9):
+            histogram.record(value)
+        assert len(histogram._counts) == bucket_count
+        assert histogram.max == 10
+
+    def test_empty_histogram_has_no_percentiles(self):
+        histogram = LatencyHistogram()
+        assert histogram.count == 0
+        assert histogram.percentile(50) is None
+        assert histogram.mean is None
+        assert histogram.summary(percentiles=(50,)) == {
+            "count": 0,
+            "mean": None,
+            "min": None,
+            "max": None,
+            50: None,
+        }
+
+    def test_percentiles_are_within_precision(self):
+        histogram = LatencyHistogram()
+        values = [i / 1000.0 for i in range(1, 1001)]
+        for value in values:
+            histogram.record(value)
+        assert histogram.count == 1000
+        assert histogram.min == 0.001
+        assert histogram.max == 1.0
+        assert histogram.mean == pytest.approx(0.5005)
+        for percentile, expected in ((50, 0.5), (90, 0.9), (99, 0.99), (100, 1.0)):
+            assert histogram.percentile(percentile) == pytest.approx(expected, rel=1 / 64.0)
+        assert histogram.percentile(100) == 1.0
+
+    def test_negative_values_are_counted_as_zero(self):
+        histogram = LatencyHistogram()
+        histogram.record(-1)
+        assert histogram.min == 0
+        assert histogram.percentile(50) == 0
+
+    def test_snapshot_copies_values(self):
+        histogram = LatencyHistogram()
+        histogram.record(0.5)
+        snapshot = histogram.snapshot()
+        histogram.record(0.25)
+        assert snapshot.count == 1
+        assert histogram.count == 2
+
+    def test_snapshot_with_reset_starts_a_new_interval(self):
+        histogram = LatencyHistogram()
+        histogram.record(0.5)
+        histogram.record(1.5)
+        first = histogram.snapshot(reset=True)
+        histogram.record(0.25)
+        second = histogram.snapshot(reset=True)
+
+        assert first.count == 2
+        assert first.max == 1.5
+        assert second.count == 1
+        assert second.max == 0.25
+        assert histogram.count == 0
+
+    def test_merge_adds_values(self):
+        a = LatencyHistogram()
+        b = LatencyHistogram()
+        a.record(0.1)
+        b.record(0.2)
+        b.record(0.3)
+        a.merge(b)
+        assert a.count == 3
+        assert a.min == 0.1
+        assert a.max == 0.3
+        assert a.sum == pytest.approx(0.6)
+
+    def test_merge_rejects_different_configurations(self):
+        with pytest.raises(ValueError):
+            LatencyHistogram(max_seconds=1).merge(LatencyHistogram(max_seconds=2))
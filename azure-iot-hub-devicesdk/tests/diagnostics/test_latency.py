@@ -0,0 +1,133 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+from mock import MagicMock
+from azure.iot.hub.devicesdk.common.clock import SimulatedClock
+from azure.iot.hub.devicesdk.diagnostics import latency
+from azure.iot.hub.devicesdk.diagnostics.latency import LatencyRecorder, SEND_TIME_PROPERTY
+
+
+@pytest.fixture
+def fake_clock():
+    return SimulatedClock()
+
+
+class TestLatencyRecorder(object):
+    def test_records_each_stage(self, fake_clock):
+        on_timings = MagicMock()
+        callback = MagicMock()
+        recorder = LatencyRecorder(clock=fake_clock, on_timings=on_timings)
+
+        timings, wrapped_callback = recorder.start(callback)
+        fake_clock.advance(1)
+        recorder.mark_dequeued(timings)
+        fake_clock.advance(0.5)
+        recorder.mark_published(timings)
+        fake_clock.advance(2)
+        wrapped_callback()
+
+        callback.assert_called_once_with()
+        on_timings.assert_called_once_with(timings)
+        assert timings.queue_time == 1
+        assert timings.publish_time == 0.5
+        assert timings.ack_time == 2
+        assert timings.total_time == 3.5
+        assert timings.send_time_utc is not None
+
+    def test_incomplete_stages_are_none(self, fake_clock):
+        timings, _ = LatencyRecorder(clock=fake_clock).start(None)
+        assert timings.queue_time is None
+        assert timings.total_time is None
+
+    def test_stamps_send_time_if_enabled(self, fake_clock):
+        recorder = LatencyRecorder(clock=fake_clock, stamp_properties=True)
+        timings, _ = recorder.start(None)
+        recorder.mark_dequeued(timings)
+        assert recorder.send_time_properties(timings)[SEND_TIME_PROPERTY].endswith("Z")
+
+    def test_send_time_is_read_from_clock(self):
+        recorder = LatencyRecorder(clock=SimulatedClock(start=0), stamp_properties=True)
+        timings, _ = recorder.start(None)
+        recorder.mark_dequeued(timings)
+        assert recorder.send_time_properties(timings) == {
+            SEND_TIME_PROPERTY: "1970-01-01T00:00:00Z"
+        }
+
+    def test_does_not_stamp_send_time_by_default(self, fake_clock):
+        recorder = LatencyRecorder(clock=fake_clock)
+        timings, _ = recorder.start(None)
+        recorder.mark_dequeued(timings)
+        assert recorder.send_time_properties(timings) is None
+
+    def test_exception_in_on_timings_does_not_prevent_callback(self, fake_clock):
+        callback = MagicMock()
+        recorder = LatencyRecorder(clock=fake_clock, on_timings=MagicMock(side_effect=RuntimeError))
+        _, wrapped_callback = recorder.start(callback)
+        wrapped_callback()
+        callback.assert_called_once_with()
+
+    def test_summary_computes_percentiles_over_recent_timings(self, fake_clock):
+        recorder = LatencyRecorder(clock=fake_clock, recent_sample_count=100)
+        for i in range(200):
+            timings, wrapped_callback = recorder.start(None)
+            recorder.mark_dequeued(timings)
+            recorder.mark_published(timings)
+            fake_clock.advance(i)
+            wrapped_callback()
+
+        summary = recorder.summary(percentiles=(0, 50, 100))
+        assert summary["ack_time"] == {0: 100, 50: 150, 100: 199}
+        assert summary["queue_time"][50] == 0
+
+    def test_summary_without_samples(self):
+        assert LatencyRecorder().summary()["total_time"] == {50: None, 99: None, 99.9: None}
+
+    def test_queue_time_starts_when_queued_if_marked(self, fake_clock):
+        recorder = LatencyRecorder(clock=fake_clock)
+        timings, _ = recorder.start(None)
+        fake_clock.advance(1)
+        recorder.mark_queued(timings)
+        fake_clock.advance(2)
+        recorder.mark_dequeued(timings)
+        assert timings.enqueue_time == 1
+        assert timings.queue_time == 2
+
+    def test_completed_stages_are_recorded_in_histograms(self, fake_clock):
+        recorder = LatencyRecorder(clock=fake_clock)
+        timings, wrapped_callback = recorder.start(None)
+        recorder.mark_queued(timings)
+        fake_clock.advance(1)
+        recorder.mark_dequeued(timings)
+        recorder.mark_published(timings)
+        fake_clock.advance(2)
+        wrapped_callback()
+
+        histograms = recorder.snapshot_histograms()
+        assert set(histograms) == set(latency.STAGES)
+        assert histograms["queue_time"].percentile(50) == 1
+        assert histograms["ack_time"].percentile(50) == 2
+        assert histograms["total_time"].percentile(50) == 3
+        assert histograms["receive_time"].count == 0
+
+    def test_failed_sends_are_not_recorded_in_histograms(self, fake_clock):
+        recorder = LatencyRecorder(clock=fake_clock)
+        _, wrapped_callback = recorder.start(None)
+        wrapped_callback(error=RuntimeError())
+        assert recorder.histograms["total_time"].count == 0
+
+    def test_snapshot_histograms_with_reset_starts_a_new_interval(self, fake_clock):
+        recorder = LatencyRecorder(clock=fake_clock)
+        recorder.record("queue_time", 0.5)
+        assert recorder.snapshot_histograms(reset=True)["queue_time"].count == 1
+        assert recorder.snapshot_histograms()["queue_time"].count == 0
+
+    def test_records_receive_time(self, fake_clock):
+        recorder = LatencyRecorder(clock=fake_clock)
+        received = recorder.mark_received()
+        fake_clock.advance(0.25)
+        recorder.mark_delivered(received)
+        assert recorder.histograms["receive_time"].percentile(50) == 0.25
@@ -0,0 +1,108 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import logging
+import pytest
+from azure.iot.hub.devicesdk.diagnostics import message_log
+from azure.iot.hub.devicesdk.diagnostics.message_log import MessageLogger
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super(_Records, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class _FormatCounter(object):
+    def __init__(self):
+        self.count = 0
+
+    def __str__(self):
+        self.count += 1
+        return "formatted"
+
+
+@pytest.fixture
+def records():
+    handler = _Records()
+    logger = logging.getLogger("test_message_log")
+    logger.addHandler(handler)
+    logger.propagate = False
+    yield handler.records
+    logger.removeHandler(handler)
+    logger.setLevel(logging.NOTSET)
+    message_log.disable_sampling()
+
+
+@pytest.fixture
+def message_logger():
+    return MessageLogger(logging.getLogger("test_message_log"))
+
+
+class TestMessageLogger(object):
+    def test_logs_every_event_at_debug(self, records, message_logger):
+        message_logger.logger.setLevel(logging.DEBUG)
+        message_log.enable_sampling(every=10)
+        for i in range(3):
+            message_logger.log("sent %s", i)
+        assert [r.getMessage() for r in records] == ["sent 0", "sent 1", "sent 2"]
+        assert all(r.levelno == logging.DEBUG for r in records)
+
+    def test_does_not_format_arguments_when_disabled(self, records, message_logger):
+        message_logger.logger.setLevel(logging.INFO)
+        argument = _FormatCounter()
+        message_logger.log("sent %s", argument)
+        assert records == []
+        assert argument.count == 0
+        assert not message_log.sampling_enabled()
+
+    def test_samples_each_event_separately(self, records, message_logger):
+        message_logger.logger.setLevel(logging.INFO)
+        message_log.enable_sampling(every=3)
+        for i in range(7):
+            message_logger.log("sent %s", i)
+            message_logger.log("received")
+        assert [r.getMessage() for r in records] == [
+            "sent 0",
+            "received",
+            "sent 3",
+            "received",
+            "sent 6",
+            "received",
+        ]
+        assert all(r.levelno == logging.INFO for r in records)
+        assert all(r.sample_every == 3 for r in records)
+
+    def test_enable_sampling_starts_counting_afresh(self, records, message_logger):
+        message_logger.logger.setLevel(logging.INFO)
+        message_log.enable_sampling(every=10)
+        for i in range(3):
+            message_logger.log("sent %s", i)
+        message_log.disable_sampling()
+        message_logger.log("sent %s", "unsampled")
+        message_log.enable_sampling(every=10)
+        message_logger.log("sent %s", "again")
+        assert [r.getMessage() for r in records] == ["sent 0", "sent again"]
+
+    def test_sampled_level_must_be_enabled(self, records, message_logger):
+        message_logger.logger.setLevel(logging.WARNING)
+        message_log.enable_sampling(every=1, level=logging.INFO)
+        message_logger.log("sent")
+        assert records == []
+
+    def test_disable_sampling(self, records, message_logger):
+        message_logger.logger.setLevel(logging.INFO)
+        message_log.enable_sampling(every=1)
+        message_log.disable_sampling()
+        message_logger.log("sent")
+        assert records == []
+
+    def test_sampling_rejects_invalid_rates(self):
+        with pytest.raises(ValueError):
+            message_log.enable_sampling(every=0)
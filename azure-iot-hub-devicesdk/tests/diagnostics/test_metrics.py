@@ -0,0 +1,122 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+import threading
+from mock import MagicMock
+from azure.iot.hub.devicesdk.diagnostics.histogram import LatencyHistogram
+from azure.iot.hub.devicesdk.diagnostics.metrics import (
+    TransportMetrics,
+    OpenMetricsExporter,
+    MetricsReporter,
+    format_openmetrics,
+)
+
+fake_stats = {
+    "messages_sent": 12,
+    "pending_actions": 3,
+    "state": "connected",
+    "inbox_depth": {"c2d": 2, "input/in1": 5},
+}
+
+
+class TestTransportMetrics(object):
+    def test_snapshot_returns_every_counter(self):
+        metrics = TransportMetrics()
+        metrics.messages_sent += 2
+        metrics.bytes_sent += 100
+        snapshot = metrics.snapshot()
+        assert snapshot["messages_sent"] == 2
+        assert snapshot["bytes_sent"] == 100
+        assert snapshot["reconnects"] == 0
+        assert set(snapshot) == set(TransportMetrics.__slots__)
+
+
+class TestFormatOpenMetrics(object):
+    def test_formats_counters_gauges_state_and_inboxes(self):
+        text = format_openmetrics(fake_stats, prefix="iot", labels={"device": "d1"})
+        lines = text.splitlines()
+        assert "# TYPE iot_messages_sent counter" in lines
+        assert 'iot_messages_sent_total{device="d1"} 12' in lines
+        assert "# TYPE iot_pending_actions gauge" in lines
+        assert 'iot_pending_actions{device="d1"} 3' in lines
+        assert 'iot_state{device="d1",state="connected"} 1' in lines
+        assert 'iot_inbox_depth{device="d1",inbox="c2d"} 2' in lines
+        assert 'iot_inbox_depth{device="d1",inbox="input/in1"} 5' in lines
+        assert text.endswith("\n")
+        assert "# EOF" not in text
+
+    def test_openmetrics_ends_with_eof(self):
+        text = format_openmetrics(fake_stats, openmetrics=True)
+        assert text.endswith("# EOF\n")
+
+    def test_escapes_label_values(self):
+        text = format_openmetrics({"state": 'a"b\\c'}, prefix="iot")
+        assert 'iot_state{state="a\\"b\\\\c"} 1' in text.splitlines()
+
+
+class TestOpenMetricsExporter(object):
+    def test_export_keeps_text_and_writes_it(self):
+        write = MagicMock()
+        exporter = OpenMetricsExporter(prefix="iot", write=write)
+        text = exporter.export(fake_stats)
+        assert exporter.last_text == text
+        write.assert_called_once_with(text)
+
+
+class TestMetricsReporter(object):
+    def test_exports_periodically_and_on_stop(self):
+        exported = threading.Event()
+        exporter = MagicMock()
+        exporter.export.side_effect = lambda stats: exported.set()
+        reporter = MetricsReporter(lambda: fake_stats, exporter, interval=0.01)
+
+        reporter.start()
+        assert exported.wait(5)
+        reporter.stop()
+        count = exporter.export.call_count
+        assert count >= 2
+        exporter.export.assert_called_with(fake_stats)
+
+    def test_exporter_errors_do_not_propagate(self):
+        exporter = MagicMock()
+        exporter.export.side_effect = ValueError()
+        reporter = MetricsReporter(lambda: fake_stats, exporter)
+        reporter.report()
+        exporter.export.assert_called_once_with(fake_stats)
+
+
+class TestFormatLatencyHistograms(object):
+    def test_formats_latency_histograms_as_summaries(self):
+        histogram = LatencyHistogram()
+        histogram.record(0.5)
+        histogram.record(1.5)
+        stats = {"latency_seconds": {"total_time": histogram, "ack_time": LatencyHistogram()}}
+
+        lines = format_openmetrics(stats, prefix="iot").splitlines()
+        assert "# TYPE iot_latency_seconds summary" in lines
+        median = [line for line in lines if 'stage="total_time",quantile="0.5"' in line]
+        assert float(median[0].split()[-1]) == pytest.approx(0.5, rel=1 / 64.0)
+        assert 'iot_latency_seconds{stage="total_time",quantile="0.999"} 1.5' in lines
+        assert 'iot_latency_seconds_sum{stage="total_time"} 2.0' in lines
+        assert 'iot_latency_seconds_count{stage="total_time"} 2' in lines
+        # Stages with nothing recorded are left out
+        assert not any('stage="ack_time"' in line for line in lines)
+
+    def test_formats_callback_histograms_labelled_with_the_callback(self):
+        histogram = LatencyHistogram()
+        histogram.record(0.25)
+        stats = {
+            "callback_seconds": {"on_mqtt_published": histogram},
+            "network_loop_busy_seconds": 0.25,
+            "callback_stalls": 0,
+        }
+
+        lines = format_openmetrics(stats, prefix="iot").splitlines()
+        assert "# TYPE iot_callback_seconds summary" in lines
+        assert 'iot_callback_seconds_count{callback="on_mqtt_published"} 1' in lines
+        assert "iot_network_loop_busy_seconds_total 0.25" in lines
+        assert "iot_callback_stalls_total 0" in lines
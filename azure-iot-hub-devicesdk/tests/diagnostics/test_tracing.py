@@ -0,0 +1,113 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+import threading
+from mock import MagicMock
+from azure.iot.hub.devicesdk import Message
+from azure.iot.hub.devicesdk.diagnostics import tracing
+from azure.iot.hub.devicesdk.diagnostics.tracing import Tracer, OpenTelemetryTracer
+
+
+class TestTracer(object):
+    def test_calls_hooks_as_spans_start_and_end(self):
+        on_start = MagicMock()
+        on_end = MagicMock()
+        tracer = Tracer(on_start=on_start, on_end=on_end)
+
+        span = tracer.start_span("operation", {"mid": 3})
+        on_start.assert_called_once_with(span)
+        on_end.assert_not_called()
+        span.add_event("published")
+        span.end()
+        span.end()
+
+        on_end.assert_called_once_with(span)
+        assert span.name == "operation"
+        assert span.attributes == {"mid": 3}
+        assert span.events[0][0] == "published"
+        assert span.duration >= 0
+        assert span.error is None
+
+    def test_records_error(self):
+        error = ValueError()
+        span = Tracer().start_span("operation")
+        span.end(error=error)
+        assert span.error is error
+
+    def test_exceptions_in_hooks_are_not_raised(self):
+        tracer = Tracer(
+            on_start=MagicMock(side_effect=ValueError), on_end=MagicMock(side_effect=ValueError)
+        )
+        span = tracer.start_span("operation")
+        span.end()
+        assert span.end_time is not None
+
+    def test_spans_started_in_an_active_span_are_its_children(self):
+        tracer = Tracer()
+        parent = tracer.start_span("parent")
+        with tracing.activate(parent):
+            assert tracing.current_span() is parent
+            child = tracer.start_span("child")
+        assert tracing.current_span() is None
+        assert child.parent is parent
+        assert tracer.start_span("other").parent is None
+
+    def test_activating_none_changes_nothing(self):
+        with tracing.activate(None):
+            assert tracing.current_span() is None
+
+    def test_bind_activates_span_on_the_calling_thread(self):
+        span = Tracer().start_span("parent")
+        seen = []
+        function = tracing.bind(span, lambda: seen.append(tracing.current_span()))
+        thread = threading.Thread(target=function)
+        thread.start()
+        thread.join()
+        assert seen == [span]
+
+    def test_bind_without_span_returns_function(self):
+        function = MagicMock()
+        assert tracing.bind(None, function) is function
+
+    def test_message_attributes(self):
+        message = Message("data", message_id="m1")
+        message.output_name = "out"
+        assert tracing.message_attributes(message) == {"message_id": "m1", "output_name": "out"}
+        assert tracing.message_attributes(Message("data")) == {}
+
+
+class TestOpenTelemetryTracer(object):
+    @pytest.mark.skipif(tracing.trace is not None, reason="opentelemetry is installed")
+    def test_requires_opentelemetry(self):
+        with pytest.raises(ImportError):
+            OpenTelemetryTracer()
+
+    def test_forwards_spans_to_opentelemetry(self, mocker):
+        trace = mocker.patch.object(tracing, "trace")
+        otel_tracer = MagicMock()
+        tracer = OpenTelemetryTracer(tracer=otel_tracer)
+
+        parent = tracer.start_span("parent", {"mid": 1})
+        otel_parent = otel_tracer.start_span.return_value
+        with tracing.activate(parent):
+            child = tracer.start_span("child")
+        child.set_attribute("topic", "t")
+        child.add_event("published")
+        error = ValueError("failed")
+        child.end(error=error)
+
+        (parent_args, parent_kwargs), (_, child_kwargs) = otel_tracer.start_span.call_args_list
+        assert parent_args == ("parent",)
+        assert parent_kwargs["context"] is None
+        assert parent_kwargs["attributes"] == {"mid": 1}
+        trace.set_span_in_context.assert_called_once_with(otel_parent)
+        assert child_kwargs["context"] is trace.set_span_in_context.return_value
+        otel_span = child.otel_span
+        otel_span.set_attribute.assert_called_with("topic", "t")
+        otel_span.add_event.assert_called_once_with("published", attributes=None)
+        otel_span.record_exception.assert_called_once_with(error)
+        assert otel_span.end.call_count == 1
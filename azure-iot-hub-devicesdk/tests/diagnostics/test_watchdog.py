@@ -0,0 +1,139 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import logging
+import threading
+import time
+import pytest
+from mock import MagicMock
+from azure.iot.hub.devicesdk.common.clock import SimulatedClock
+from azure.iot.hub.devicesdk.diagnostics.watchdog import CallbackWatchdog, handler_name
+
+
+@pytest.fixture
+def clock():
+    return SimulatedClock()
+
+
+@pytest.fixture
+def stalls():
+    return []
+
+
+@pytest.fixture
+def watchdog(clock, stalls):
+    return CallbackWatchdog(threshold=1.0, on_stall=stalls.append, clock=clock)
+
+
+class _Handlers(object):
+    def on_published(self, mid):
+        pass
+
+
+def _blocked_in_inbox(release):
+    release.wait(5)
+
+
+class TestCallbackWatchdog(object):
+    def test_times_callbacks(self, watchdog, clock, stalls):
+        assert watchdog.call("on_mqtt_published", clock.advance, 0.25) == 0
+        watchdog.call("on_mqtt_published", clock.advance, 0.5)
+
+        snapshot = watchdog.snapshot()
+        assert snapshot["network_loop_busy_seconds"] == 0.75
+        assert snapshot["callback_stalls"] == 0
+        histogram = snapshot["callback_seconds"]["on_mqtt_published"]
+        assert histogram.count == 2
+        assert histogram.max == pytest.approx(0.5, rel=1 / 64.0)
+        assert stalls == []
+
+    def test_passes_on_exceptions(self, watchdog):
+        with pytest.raises(ValueError):
+            watchdog.call("on_mqtt_connected", MagicMock(side_effect=ValueError("Stupefy")))
+        assert watchdog.snapshot()["callback_seconds"]["on_mqtt_connected"].count == 1
+
+    def test_reports_slow_callback_when_it_returns(self, watchdog, clock, stalls, caplog):
+        handler = MagicMock(side_effect=lambda: clock.advance(2))
+        watchdog.call("on_mqtt_connected", handler)
+
+        assert len(stalls) == 1
+        assert stalls[0].callback == "on_mqtt_connected"
+        assert stalls[0].handler is handler
+        assert stalls[0].seconds == 2
+        assert stalls[0].stack is None
+        assert watchdog.stall_count == 1
+        warnings = [r for r in caplog.records if r.levelno == logging.WARNING]
+        assert "on_mqtt_connected" in warnings[0].getMessage()
+
+    def test_check_reports_running_callback_with_its_stack(self, watchdog, clock, stalls):
+        release = threading.Event()
+        thread = threading.Thread(
+            target=watchdog.call, args=("on_mqtt_message_received", _blocked_in_inbox, release)
+        )
+        thread.start()
+        try:
+            while "on_mqtt_message_received" not in [r.callback for r in _running(watchdog)]:
+                time.sleep(0.001)
+            assert watchdog.check() == 0
+            clock.advance(1.5)
+            assert watchdog.check() == 1
+            # Each callback is only reported once
+            assert watchdog.check() == 0
+            assert watchdog.snapshot()["network_loop_busy_seconds"] == 1.5
+        finally:
+            release.set()
+            thread.join()
+
+        assert len(stalls) == 1
+        assert stalls[0].seconds == 1.5
+        assert stalls[0].thread == thread.ident
+        assert any("_blocked_in_inbox" in frame for frame in stalls[0].stack)
+        assert watchdog.stall_count == 1
+
+    def test_nested_callbacks_are_counted_once(self, watchdog, clock):
+        def outer():
+            clock.advance(0.25)
+            watchdog.call("on_mqtt_published", clock.advance, 0.5)
+
+        watchdog.call("on_mqtt_connected", outer)
+
+        snapshot = watchdog.snapshot()
+        assert snapshot["network_loop_busy_seconds"] == 0.75
+        assert snapshot["callback_seconds"]["on_mqtt_published"].count == 1
+        assert _running(watchdog) == []
+
+    def test_on_stall_errors_are_logged(self, clock, caplog):
+        watchdog = CallbackWatchdog(
+            threshold=1.0, on_stall=MagicMock(side_effect=ValueError()), clock=clock
+        )
+        watchdog.call("on_mqtt_connected", clock.advance, 1)
+        assert any(r.levelno == logging.ERROR for r in caplog.records)
+
+    def test_monitor_thread_reports_blocked_callback(self):
+        reported = threading.Event()
+        watchdog = CallbackWatchdog(threshold=0.05, on_stall=lambda report: reported.set())
+        watchdog.start()
+        try:
+            release = threading.Event()
+            thread = threading.Thread(
+                target=watchdog.call, args=("on_mqtt_published", _blocked_in_inbox, release)
+            )
+            thread.start()
+            assert reported.wait(5)
+            release.set()
+            thread.join()
+        finally:
+            watchdog.stop()
+        assert watchdog.stall_count == 1
+
+    def test_handler_name(self):
+        assert handler_name(_Handlers().on_published) == "_Handlers.on_published"
+        assert handler_name(_blocked_in_inbox) == __name__ + "._blocked_in_inbox"
+
+
+def _running(watchdog):
+    with watchdog._lock:
+        return list(watchdog._running.values())
@@ -11,6 +11,7 @@ import abc
 from azure.iot.hub.devicesdk.inbox_manager import InboxManager
 from azure.iot.hub.devicesdk.common import Message, MethodRequest
 from azure.iot.hub.devicesdk.sync_inbox import SyncClientInbox
+from azure.iot.hub.devicesdk.diagnostics import LatencyRecorder, Tracer
 
 
 @six.add_metaclass(abc.ABCMeta)
@@ -132,6 +133,78 @@ class InboxManagerSharedTests(object):
         delivered = manager.route_input_message("not_a_real_input", message)
         assert not delivered
 
+    def test_subscribe_to_input_messages_returns_new_inbox_each_time(self, manager):
+        subscriber1 = manager.subscribe_to_input_messages("some_input")
+        subscriber2 = manager.subscribe_to_input_messages("some_input")
+        assert type(subscriber1) == self.inbox_type
+        assert subscriber1 is not subscriber2
+        assert subscriber1 is not manager.get_input_message_inbox("some_input")
+
+    def test_route_input_message_fans_out_to_all_subscribers(self, manager, message):
+        subscriber1 = manager.subscribe_to_input_messages("some_input")
+        subscriber2 = manager.subscribe_to_input_messages("some_input")
+        other_subscriber = manager.subscribe_to_input_messages("some_other_input")
+        delivered = manager.route_input_message("some_input", message)
+        assert delivered
+        assert not subscriber1.empty()
+        assert not subscriber2.empty()
+        assert other_subscriber.empty()
+
+    def test_route_c2d_message_fans_out_to_all_subscribers(self, manager, message):
+        subscriber1 = manager.subscribe_to_c2d_messages()
+        subscriber2 = manager.subscribe_to_c2d_messages()
+        manager.route_c2d_message(message)
+        assert not subscriber1.empty()
+        assert not subscriber2.empty()
+        assert not manager.get_c2d_message_inbox().empty()
+
+    def test_full_subscriber_discards_oldest_without_blocking_others(self, manager):
+        slow_subscriber = manager.subscribe_to_c2d_messages(maxsize=1)
+        fast_subscriber = manager.subscribe_to_c2d_messages(maxsize=10)
+        manager.route_c2d_message(Message("first"))
+        manager.route_c2d_message(Message("second"))
+        assert manager.subscriber_discard_count == 1
+        assert not slow_subscriber.empty()
+        assert not fast_subscriber.empty()
+
+    def test_unsubscribe_stops_delivery(self, manager, message):
+        subscriber = manager.subscribe_to_input_messages("some_input")
+        assert manager.unsubscribe(subscriber)
+        manager.route_input_message("some_input", message)
+        assert subscriber.empty()
+        assert not manager.unsubscribe(subscriber)
+
+    def test_get_inbox_depths_names_every_inbox(self, manager, message):
+        manager.get_input_message_inbox("some_input")
+        manager.get_method_request_inbox("some_method")
+        manager.subscribe_to_c2d_messages()
+        manager.subscribe_to_input_messages("some_input")
+        manager.route_c2d_message(message)
+        manager.route_input_message("some_input", message)
+        manager.route_input_message("some_input", message)
+
+        assert manager.get_inbox_depths() == {
+            "c2d": 1,
+            "method": 0,
+            "input/some_input": 2,
+            "method/some_method": 0,
+            "c2d_subscriber/0": 1,
+            "input_subscriber/some_input/0": 2,
+        }
+
+    def test_inboxes_are_given_latency_recorder_and_tracer(self, message):
+        recorder = LatencyRecorder()
+        tracer = Tracer()
+        manager = InboxManager(inbox_type=self.inbox_type, latency_recorder=recorder, tracer=tracer)
+        for inbox in (
+            manager.get_c2d_message_inbox(),
+            manager.get_input_message_inbox("some_input"),
+            manager.get_method_request_inbox(),
+            manager.subscribe_to_c2d_messages(),
+        ):
+            assert inbox._latency_recorder is recorder
+            assert inbox._tracer is tracer
+
     @abc.abstractmethod
     def test_route_method_call_with_unknown_method_adds_method_to_generic_method_inbox(
         self, manager
@@ -163,6 +236,27 @@ class TestInboxManagerWithSyncInboxes(InboxManagerSharedTests):
         assert not input_inbox.empty()
         assert input_inbox.get() is message
 
+    def test_route_input_message_hands_same_message_to_subscribers(self, manager, message):
+        input_inbox = manager.get_input_message_inbox("some_input")
+        subscriber = manager.subscribe_to_input_messages("some_input")
+        manager.route_input_message("some_input", message)
+        assert input_inbox.get() is message
+        assert subscriber.get() is message
+
+    def test_route_input_message_with_only_subscribers_is_delivered(self, manager, message):
+        subscriber = manager.subscribe_to_input_messages("some_input")
+        delivered = manager.route_input_message("some_input", message)
+        assert delivered
+        assert subscriber.get() is message
+
+    def test_full_subscriber_keeps_most_recent_messages(self, manager):
+        subscriber = manager.subscribe_to_c2d_messages(maxsize=2)
+        messages = [Message(str(i)) for i in range(3)]
+        for m in messages:
+            manager.route_c2d_message(m)
+        assert subscriber.get() is messages[1]
+        assert subscriber.get() is messages[2]
+
     @pytest.mark.skip(reason="Not Implemented")
     def test_route_method_call_with_unknown_method_adds_method_to_generic_method_inbox(
         self, manager
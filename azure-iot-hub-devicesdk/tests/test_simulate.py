@@ -0,0 +1,217 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import json
+import threading
+import pytest
+from azure.iot.hub.devicesdk import simulate
+from azure.iot.hub.devicesdk.diagnostics.histogram import LatencyHistogram
+from azure.iot.hub.devicesdk.testing import FakeIoTHubProcess
+
+
+@pytest.fixture(scope="module")
+def hub():
+    try:
+        hub = FakeIoTHubProcess().start()
+    except RuntimeError as e:
+        pytest.skip(str(e))
+    yield hub
+    hub.stop()
+
+
+def _profile(hub, **kwargs):
+    return simulate.Profile(port=hub.tls_port, ca_cert=hub.ca_cert, **kwargs)
+
+
+class TestProfile(object):
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            pytest.param({"rate": 0}, id="rate"),
+            pytest.param({"duration": -1}, id="duration"),
+            pytest.param({"max_in_flight": 0}, id="max_in_flight"),
+            pytest.param({"arrival": "bursty"}, id="arrival"),
+            pytest.param({"payload": "xml"}, id="payload"),
+        ],
+    )
+    def test_rejects_invalid_settings(self, kwargs):
+        with pytest.raises(ValueError):
+            simulate.Profile(**kwargs)
+
+    def test_json_payload_is_padded_to_payload_size(self):
+        profile = simulate.Profile(payload_size=500)
+        payload, content_type = profile.make_payload("sim-device-0", 3)
+
+        assert content_type == "application/json"
+        assert len(payload) == 500
+        reading = json.loads(payload.decode("utf-8"))
+        assert reading["deviceId"] == "sim-device-0"
+        assert reading["sequence"] == 3
+
+    def test_binary_payload_has_payload_size_bytes(self):
+        profile = simulate.Profile(payload="binary", payload_size=100)
+        payload, content_type = profile.make_payload("sim-device-0", 0)
+
+        assert content_type is None
+        assert len(payload) == 100
+
+    def test_poisson_intervals_have_the_mean_of_the_rate(self):
+        profile = simulate.Profile(rate=10, arrival="poisson")
+        intervals = [profile.interval() for _ in range(5000)]
+
+        assert 0.09 < sum(intervals) / len(intervals) < 0.11
+        assert simulate.Profile(rate=10).interval() == 0.1
+
+
+class TestAggregate(object):
+    def _result(self, latencies, **counts):
+        histogram = LatencyHistogram()
+        for latency in latencies:
+            histogram.record(latency)
+        result = dict.fromkeys(
+            ("devices", "connected", "connect_failures", "disconnects", "sent", "completed"), 0
+        )
+        result.update(errors=0, skipped=0, bytes_sent=0, send_seconds=2.0)
+        result.update(counts, latency=histogram, connect_latency=LatencyHistogram())
+        return result
+
+    def test_sums_counts_and_merges_latencies(self):
+        report = simulate.aggregate(
+            [
+                self._result([0.001] * 9, devices=2, completed=9, bytes_sent=900),
+                self._result([0.1], devices=3, completed=1, bytes_sent=100),
+            ]
+        )
+
+        assert report["devices"] == 5
+        assert report["completed"] == 10
+        assert report["messages_per_second"] == 5.0
+        assert report["bytes_per_second"] == 500.0
+        assert report["latency_ms"]["p50"] == pytest.approx(1, rel=0.02)
+        assert report["latency_ms"]["max"] == pytest.approx(100, rel=0.02)
+        assert report["connect_latency_ms"]["p50"] is None
+
+
+class FakeTransport(object):
+    """Transport which reports being connected after the delay of its device."""
+
+    connect_delays = {}
+
+    def __init__(self, auth_provider, **kwargs):
+        self.device_id = auth_provider.device_id
+
+    def connect(self):
+        timer = threading.Timer(
+            self.connect_delays[self.device_id], self.on_transport_connected, ["connected"]
+        )
+        timer.start()
+
+    def disconnect(self):
+        pass
+
+
+class TestWorker(object):
+    def test_connect_latency_is_timed_per_device(self, mocker):
+        mocker.patch.object(simulate, "MQTTTransport", FakeTransport)
+        mocker.patch.object(simulate, "MqttMultiplexer")
+        mocker.patch.object(FakeTransport, "connect_delays", {"slow": 0.3, "fast": 0})
+        key = "SGVsbG8gV29ybGQ="
+        connection_strings = [
+            "HostName=fake.azure-devices.net;DeviceId={};SharedAccessKey={}".format(device_id, key)
+            for device_id in ("slow", "fast")
+        ]
+        worker = simulate._Worker(connection_strings, simulate.Profile())
+
+        worker.connect()
+
+        assert len(worker.devices) == 2
+        # The fast device is not charged for the time spent waiting for the slow one
+        assert worker.connect_latency.min < 0.2
+        assert worker.connect_latency.max >= 0.3
+
+
+class TestRun(object):
+    def test_devices_in_this_process_send_at_the_rate(self, hub):
+        connection_strings = [hub.connection_string("sim-{}".format(i)) for i in range(4)]
+
+        report = simulate.run(connection_strings, _profile(hub, rate=10, duration=1), processes=1)
+
+        assert report["connected"] == 4
+        assert report["errors"] == 0
+        # Each device sends about ten messages, the first at a random time in the first interval
+        assert 28 <= report["sent"] <= 44
+        assert report["completed"] == report["sent"]
+        assert report["bytes_sent"] == report["sent"] * simulate.DEFAULT_PAYLOAD_SIZE
+        assert report["latency_ms"]["p50"] > 0
+
+    def test_devices_are_spread_across_processes(self, hub):
+        connection_strings = [hub.connection_string("sim-{}".format(i)) for i in range(6)]
+
+        report = simulate.run(connection_strings, _profile(hub, rate=5, duration=1), processes=2)
+
+        assert report["devices"] == 6
+        assert report["connected"] == 6
+        assert report["completed"] > 0
+        assert report["completed"] == report["sent"]
+
+    def test_devices_which_cannot_connect_are_counted(self, hub):
+        without_key = "HostName={};DeviceId=sim-1".format(hub.hostname)
+        connection_strings = [hub.connection_string("sim-0"), without_key]
+        profile = _profile(hub, rate=5, duration=0.5, connect_timeout=2)
+
+        report = simulate.run(connection_strings, profile, processes=1)
+
+        assert report["connected"] == 1
+        assert report["connect_failures"] == 1
+        assert report["completed"] > 0
+
+    def test_sends_beyond_max_in_flight_are_skipped(self):
+        try:
+            hub = FakeIoTHubProcess(puback_delay=0.5).start()
+        except RuntimeError as e:
+            pytest.skip(str(e))
+        try:
+            profile = _profile(hub, rate=20, duration=1, max_in_flight=2)
+            report = simulate.run([hub.connection_string("sim-0")], profile, processes=1)
+        finally:
+            hub.stop()
+
+        assert report["skipped"] > 0
+        assert report["sent"] <= 6
+
+
+class TestMain(object):
+    def test_fake_hub_report_as_json(self, capsys):
+        simulate.main(
+            ["--fake-hub", "--devices", "3", "--processes", "1", "--rate", "5", "--duration", "0.5"]
+            + ["--json"]
+        )
+
+        report = json.loads(capsys.readouterr().out)["report"]
+        assert report["connected"] == 3
+        assert report["completed"] > 0
+        assert set(report["latency_ms"]) == {"p50", "p90", "p99", "p999", "max"}
+
+    def test_connection_strings_file(self, hub, tmpdir, capsys):
+        strings = tmpdir.join("devices.txt")
+        lines = ["# simulated devices", hub.connection_string("sim-a"), ""]
+        lines += [hub.connection_string("sim-b"), hub.connection_string("sim-c")]
+        strings.write("\n".join(lines))
+        ca_cert = tmpdir.join("ca.pem")
+        ca_cert.write(hub.ca_cert)
+
+        simulate.main(
+            ["--connection-strings-file", str(strings), "--devices", "2", "--processes", "1"]
+            + ["--port", str(hub.tls_port), "--ca-cert", str(ca_cert), "--duration", "0.5"]
+        )
+
+        output = capsys.readouterr().out
+        assert "2/2 devices connected" in output
+        assert "send latency (ms): p50" in output
+
+    def test_requires_a_source_of_devices(self):
+        with pytest.raises(SystemExit):
+            simulate.main(["--devices", "3"])
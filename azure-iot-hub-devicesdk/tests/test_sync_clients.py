@@ -8,6 +8,9 @@ import pytest
 from azure.iot.hub.devicesdk import DeviceClient, ModuleClient
 from azure.iot.hub.devicesdk.transport.mqtt import MQTTTransport
 from azure.iot.hub.devicesdk import Message
+from azure.iot.hub.devicesdk.common import MessageTemplate, MethodRequest
+from azure.iot.hub.devicesdk.errors import MessageExpiredError
+from azure.iot.hub.devicesdk.diagnostics import Tracer, tracing
 from azure.iot.hub.devicesdk.sync_inbox import SyncClientInbox
 from azure.iot.hub.devicesdk.transport import constant
 
@@ -55,6 +58,17 @@ class ClientSharedTests(object):
         with pytest.raises(ValueError):
             self.client_class.from_authentication_provider(auth_provider, "bad input")
 
+    def test_codecs_is_transport_codec_registry(self, client):
+        assert client.codecs is client._transport.codec_registry
+
+    def test_get_stats_adds_inbox_depths_to_transport_stats(self, client):
+        client._inbox_manager.route_method_request(MethodRequest("1", "some_method", "payload"))
+        stats = client.get_stats()
+        assert stats["messages_sent"] == 0
+        assert stats["state"] == "disconnected"
+        assert stats["inbox_depth"]["method"] == 1
+        assert stats["subscriber_discards"] == 0
+
     def test_instantiation_sets_on_connected_handler_in_transport(self, client):
         assert client._transport.on_transport_connected is not None
         assert client._transport.on_transport_connected == client._on_state_change
@@ -97,6 +111,51 @@ class ClientSharedTests(object):
         assert isinstance(sent_message, Message)
         assert sent_message.data == naked_string
 
+    def test_send_event_raises_error_from_transport(self, client, transport):
+        transport.send_event.side_effect = lambda message, callback: callback(
+            error=MessageExpiredError(message)
+        )
+        with pytest.raises(MessageExpiredError):
+            client.send_event(Message("this is a message"))
+
+    def test_send_event_is_traced_if_tracer_set(self, client, transport):
+        ended = []
+        transport.tracer = Tracer(on_end=ended.append)
+        active_spans = []
+        transport.send_event.side_effect = lambda message, callback: (
+            active_spans.append(tracing.current_span()) or callback()
+        )
+        client.send_event(Message("this is a message", message_id="m1"))
+
+        span = ended[0]
+        assert span.name == "client.send_event"
+        assert span.attributes == {"message_id": "m1"}
+        assert active_spans == [span]
+
+    def test_failed_send_event_ends_span_with_error(self, client, transport):
+        ended = []
+        transport.tracer = Tracer(on_end=ended.append)
+        transport.send_event.side_effect = lambda message, callback: callback(
+            error=MessageExpiredError(message)
+        )
+        with pytest.raises(MessageExpiredError):
+            client.send_event(Message("this is a message"))
+        assert isinstance(ended[0].error, MessageExpiredError)
+
+    def test_create_message_template_calls_transport(self, client, transport):
+        message = Message("this is a message")
+        template = client.create_message_template(message)
+        assert transport.create_message_template.call_count == 1
+        assert transport.create_message_template.call_args[0][0] == message
+        assert isinstance(template, MessageTemplate)
+
+    def test_send_event_from_template_calls_transport(self, client, transport):
+        template = client.create_message_template(Message("this is a message"))
+        client.send_event_from_template(template, b"payload")
+        assert transport.send_event_from_template.call_count == 1
+        assert transport.send_event_from_template.call_args[0][0] == template
+        assert transport.send_event_from_template.call_args[0][1] == b"payload"
+
     @pytest.mark.skip(reason="Not Implemented")
     def test_receive_method_request_enables_methods_only_if_not_already_enabled(
         self, client, transport
@@ -154,6 +213,13 @@ class TestModuleClient(ClientSharedTests):
         assert transport.send_output_event.call_args[0][0] == message
         assert message.output_name == output_name
 
+    def test_send_to_output_raises_error_from_transport(self, client, transport):
+        transport.send_output_event.side_effect = lambda message, callback: callback(
+            error=MessageExpiredError(message)
+        )
+        with pytest.raises(MessageExpiredError):
+            client.send_to_output(Message("this is a message"), "some_output")
+
     def test_send_to_output_calls_transport_wraps_data_in_message(self, client, transport):
         naked_string = "this is a message"
         output_name = "some_output"
@@ -186,6 +252,65 @@ class TestModuleClient(ClientSharedTests):
         client.receive_input_message(input_name)
         assert transport.enable_feature.call_count == 0
 
+    def test_receive_input_message_creates_inbox_before_enabling_input_messaging(
+        self, mocker, client, transport
+    ):
+        mocker.patch.object(SyncClientInbox, "get")  # patch this receive_input_message won't block
+        inbox_names = []
+
+        def enable_feature(feature_name, callback=None):
+            inbox_names.extend(client._inbox_manager.input_message_inboxes)
+            callback()
+
+        transport.feature_enabled.__getitem__.return_value = False
+        transport.enable_feature.side_effect = enable_feature
+        client.receive_input_message("some_input")
+        assert inbox_names == ["some_input"]
+
+    def test_receive_input_message_returns_message_which_arrives_as_subscription_completes(
+        self, client, transport
+    ):
+        message = Message("arrived with the SUBACK")
+
+        def enable_feature(feature_name, callback=None):
+            # The hub can deliver a message before the subscribe call has returned
+            transport.on_transport_input_message_received("some_input", message)
+            callback()
+
+        transport.feature_enabled.__getitem__.return_value = False
+        transport.enable_feature.side_effect = enable_feature
+        assert client.receive_input_message("some_input", block=False) is message
+
+    def test_subscribe_to_input_messages_enables_input_messaging_only_if_not_already_enabled(
+        self, client, transport
+    ):
+        transport.feature_enabled.__getitem__.return_value = False
+        client.subscribe_to_input_messages("some_input")
+        assert transport.enable_feature.call_count == 1
+        assert transport.enable_feature.call_args[0][0] == constant.INPUT_MSG
+
+        transport.enable_feature.reset_mock()
+        transport.feature_enabled.__getitem__.return_value = True
+        client.subscribe_to_input_messages("some_input")
+        assert transport.enable_feature.call_count == 0
+
+    def test_subscribers_receive_every_input_message_until_unsubscribed(self, client, transport):
+        message = Message("arrived with the SUBACK")
+
+        def enable_feature(feature_name, callback=None):
+            # The hub can deliver a message before the subscribe call has returned
+            transport.on_transport_input_message_received("some_input", message)
+            callback()
+
+        transport.feature_enabled.__getitem__.return_value = False
+        transport.enable_feature.side_effect = enable_feature
+        inbox = client.subscribe_to_input_messages("some_input", maxsize=10)
+        assert inbox.get(block=False) is message
+
+        assert client.unsubscribe(inbox)
+        transport.on_transport_input_message_received("some_input", message)
+        assert inbox.empty()
+
     def test_receive_input_message_returns_message_from_input_inbox(self, mocker, client):
         message = Message("this is a message")
         inbox_mock = mocker.MagicMock(autospec=SyncClientInbox)
@@ -253,6 +378,32 @@ class TestDeviceClient(ClientSharedTests):
         client.receive_c2d_message()
         assert transport.enable_feature.call_count == 0
 
+    def test_subscribe_to_c2d_messages_enables_c2d_messaging_only_if_not_already_enabled(
+        self, client, transport
+    ):
+        transport.feature_enabled.__getitem__.return_value = False
+        client.subscribe_to_c2d_messages()
+        assert transport.enable_feature.call_count == 1
+        assert transport.enable_feature.call_args[0][0] == constant.C2D_MSG
+
+        transport.enable_feature.reset_mock()
+        transport.feature_enabled.__getitem__.return_value = True
+        client.subscribe_to_c2d_messages()
+        assert transport.enable_feature.call_count == 0
+
+    def test_every_subscriber_receives_c2d_messages_until_unsubscribed(self, client, transport):
+        message = Message("this is a message")
+        transport.feature_enabled.__getitem__.return_value = True
+        inboxes = [client.subscribe_to_c2d_messages() for _ in range(2)]
+
+        transport.on_transport_c2d_message_received(message)
+        assert [inbox.get(block=False) for inbox in inboxes] == [message, message]
+
+        assert client.unsubscribe(inboxes[0])
+        transport.on_transport_c2d_message_received(message)
+        assert inboxes[0].empty()
+        assert inboxes[1].get(block=False) is message
+
     def test_receive_c2d_message_returns_message_from_c2d_inbox(self, mocker, client):
         message = Message("this is a message")
         inbox_mock = mocker.MagicMock(autospec=SyncClientInbox)
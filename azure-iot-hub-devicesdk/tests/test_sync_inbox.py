@@ -8,6 +8,7 @@ import pytest
 import threading
 import time
 from azure.iot.hub.devicesdk.sync_inbox import SyncClientInbox, InboxEmpty
+from azure.iot.hub.devicesdk.diagnostics import LatencyRecorder, Tracer, tracing
 
 
 class TestSyncClientInbox(object):
@@ -73,6 +74,19 @@ class TestSyncClientInbox(object):
         assert inbox.get() is item2
         assert inbox.get() is item3
 
+    def test__put_discarding_oldest_discards_oldest_item_when_full(self, mocker):
+        inbox = SyncClientInbox(maxsize=2)
+        item1 = mocker.MagicMock()
+        item2 = mocker.MagicMock()
+        item3 = mocker.MagicMock()
+        assert not inbox._put_discarding_oldest(item1)
+        assert not inbox._put_discarding_oldest(item2)
+        assert inbox._put_discarding_oldest(item3)
+
+        assert inbox.get() is item2
+        assert inbox.get() is item3
+        assert inbox.empty()
+
     def test_can_check_if_empty(self, mocker):
         inbox = SyncClientInbox()
         assert inbox.empty()
@@ -82,6 +96,40 @@ class TestSyncClientInbox(object):
         inbox.get()
         assert inbox.empty()
 
+    def test_qsize_counts_items(self, mocker):
+        inbox = SyncClientInbox()
+        assert inbox.qsize() == 0
+        inbox._put(mocker.MagicMock())
+        inbox._put(mocker.MagicMock())
+        assert inbox.qsize() == 2
+        inbox.get()
+        assert inbox.qsize() == 1
+
+    def test_records_wait_time_if_latency_recorder_given(self, mocker):
+        recorder = LatencyRecorder()
+        inbox = SyncClientInbox(maxsize=1, latency_recorder=recorder)
+        item1 = mocker.MagicMock()
+        item2 = mocker.MagicMock()
+        inbox._put(item1)
+        assert inbox._put_discarding_oldest(item2)
+        assert inbox.get() is item2
+        assert recorder.histograms["inbox_wait_time"].count == 1
+
+    def test_traces_wait_time_if_tracer_given(self, mocker):
+        ended = []
+        tracer = Tracer(on_end=ended.append)
+        inbox = SyncClientInbox(tracer=tracer)
+        item = mocker.MagicMock()
+        receive_span = tracer.start_span("transport.receive")
+        with tracing.activate(receive_span):
+            inbox._put(item)
+        assert inbox.get() is item
+
+        span = ended[0]
+        assert span.name == "inbox.wait"
+        assert span.parent is receive_span
+        assert span.start_time <= span.end_time
+
     def test_can_clear_all_items(self, mocker):
         inbox = SyncClientInbox()
         item1 = mocker.MagicMock()
@@ -0,0 +1,278 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import socket
+import time
+import pytest
+from azure.iot.hub.devicesdk import DeviceClient, ModuleClient, Message, InboxEmpty
+from azure.iot.hub.devicesdk.auth.authentication_provider_factory import from_connection_string
+from azure.iot.hub.devicesdk.common.clock import SimulatedClock
+from azure.iot.hub.devicesdk.transport import constant
+from azure.iot.hub.devicesdk.testing import FakeIoTHub
+from azure.iot.hub.devicesdk.testing import mqtt_packets
+
+device_id = "MyPensieve"
+module_id = "Divination"
+
+
+@pytest.fixture(scope="module")
+def tls_hub():
+    try:
+        hub = FakeIoTHub().start()
+    except RuntimeError as e:
+        pytest.skip(str(e))
+    yield hub
+    hub.stop()
+
+
+@pytest.fixture
+def hub():
+    with FakeIoTHub(tls=False) as hub:
+        yield hub
+
+
+def create_client(client_class, hub, module_id=None):
+    auth = from_connection_string(hub.connection_string(device_id, module_id))
+    auth.ca_cert = hub.ca_cert
+    return client_class.from_authentication_provider(auth, "mqtt", port=hub.tls_port)
+
+
+def sas_token(hub, client_device_id=device_id, key=None):
+    connection_string = hub.connection_string(client_device_id)
+    if key:
+        connection_string = connection_string.replace(hub.shared_access_key, key)
+    auth = from_connection_string(connection_string)
+    token = auth.get_current_sas_token()
+    auth.disconnect()
+    return token
+
+
+class RawClient(object):
+    """A minimal MQTT client which drives the fake hub over plain TCP, one packet at a time."""
+
+    def __init__(self, hub):
+        self.sock = socket.create_connection(("127.0.0.1", hub.tcp_port), timeout=5)
+        self.buffer = bytearray()
+
+    def send(self, packet):
+        self.sock.sendall(packet)
+
+    def receive(self):
+        while True:
+            packet = mqtt_packets.split_packet(self.buffer)
+            if packet:
+                return packet
+            data = self.sock.recv(65536)
+            if not data:
+                return None
+            self.buffer.extend(data)
+
+    def connect(self, hub, client_id=device_id, password=None):
+        username = "{}/{}/?api-version=2018-06-30".format(hub.hostname, client_id)
+        if password is None:
+            password = sas_token(hub, client_id)
+        self.send(mqtt_packets.connect(client_id, username, password))
+        packet_type, _, body = self.receive()
+        assert packet_type == mqtt_packets.CONNACK
+        return bytearray(body)[1]
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def raw_client(hub):
+    client = RawClient(hub)
+    yield client
+    client.close()
+
+
+class TestFakeIoTHubWithClients(object):
+    def test_receives_telemetry_from_device_client(self, tls_hub):
+        client = create_client(DeviceClient, tls_hub)
+        client.connect()
+        message = Message("Expecto Patronum")
+        message.message_id = "spell-1"
+        message.custom_properties["wand"] = "holly"
+        client.send_event(message)
+        client.disconnect()
+
+        received = tls_hub.received_messages.get(timeout=5)
+        assert received.device_id == device_id
+        assert received.module_id is None
+        assert received.payload == b"Expecto Patronum"
+        assert received.properties == {"$.mid": "spell-1", "wand": "holly"}
+
+    def test_delivers_c2d_message_to_device_client(self, tls_hub):
+        client = create_client(DeviceClient, tls_hub)
+        client.connect()
+        with pytest.raises(InboxEmpty):
+            # The first receive subscribes to C2D messages
+            client.receive_c2d_message(block=False)
+        assert tls_hub.wait_for_subscription(device_id, constant.C2D_MSG)
+
+        assert tls_hub.send_c2d_message(device_id, "Owl post", {"$.mid": "owl-1", "house": "X"})
+        message = client.receive_c2d_message(timeout=5)
+        client.disconnect()
+
+        assert message.data == b"Owl post"
+        assert message.message_id == "owl-1"
+        assert message.custom_properties == {"house": "X"}
+
+    def test_delivers_input_message_to_module_client(self, tls_hub):
+        client = create_client(ModuleClient, tls_hub, module_id)
+        client.connect()
+        with pytest.raises(InboxEmpty):
+            client.receive_input_message("sorting", block=False)
+        client_id = device_id + "/" + module_id
+        assert tls_hub.wait_for_subscription(client_id, constant.INPUT_MSG)
+
+        assert tls_hub.send_input_message(device_id, module_id, "sorting", b"Gryffindor")
+        message = client.receive_input_message("sorting", timeout=5)
+        client.disconnect()
+
+        assert message.data == b"Gryffindor"
+        assert message.input_name == "sorting"
+
+
+class TestFakeIoTHubAuthentication(object):
+    def test_accepts_valid_sas_token(self, hub, raw_client):
+        assert raw_client.connect(hub) == mqtt_packets.CONNACK_ACCEPTED
+        assert hub.wait_for_connection(device_id)
+        assert hub.connected_clients == [device_id]
+
+    def test_rejects_token_signed_with_wrong_key(self, hub, raw_client):
+        password = sas_token(hub, key="d3JvbmdrZXk=")
+        return_code = raw_client.connect(hub, password=password)
+        assert return_code == mqtt_packets.CONNACK_BAD_USERNAME_OR_PASSWORD
+        assert raw_client.receive() is None
+
+    def test_rejects_token_for_another_device(self, hub, raw_client):
+        password = sas_token(hub, "SomeoneElse")
+        assert raw_client.connect(hub, password=password) == mqtt_packets.CONNACK_NOT_AUTHORIZED
+
+    def test_rejects_malformed_password(self, hub, raw_client):
+        return_code = raw_client.connect(hub, password="alohomora")
+        assert return_code == mqtt_packets.CONNACK_BAD_USERNAME_OR_PASSWORD
+
+    def test_checks_expiry_against_clock(self, hub, raw_client):
+        hub.clock = SimulatedClock()
+        hub.clock.advance(3601)
+        assert raw_client.connect(hub) == mqtt_packets.CONNACK_NOT_AUTHORIZED
+
+    def test_closes_connection_when_token_expires(self, hub, raw_client):
+        hub.clock = SimulatedClock()
+        hub.enforce_token_expiry = True
+        raw_client.connect(hub)
+        assert hub.wait_for_connection(device_id)
+
+        hub.clock.advance(3500)
+        assert hub.connected_clients == [device_id]
+        hub.clock.advance(101)
+        assert raw_client.receive() is None
+        assert hub.expired_disconnects == 1
+
+    def test_cancels_expiry_when_connection_closes(self, hub, raw_client):
+        hub.clock = SimulatedClock()
+        hub.enforce_token_expiry = True
+        raw_client.connect(hub)
+        assert hub.wait_for_connection(device_id)
+        assert hub.clock.pending == 1
+
+        raw_client.send(mqtt_packets.disconnect())
+        assert raw_client.receive() is None
+        for _ in range(100):
+            if not hub.clock.pending:
+                break
+            time.sleep(0.01)
+        assert hub.clock.pending == 0
+
+
+class TestFakeIoTHubTraffic(object):
+    def test_invokes_method_and_records_response(self, hub, raw_client):
+        raw_client.connect(hub)
+        raw_client.send(mqtt_packets.subscribe(1, [("$iothub/methods/POST/#", 1)]))
+        assert raw_client.receive()[0] == mqtt_packets.SUBACK
+        assert hub.wait_for_subscription(device_id, constant.METHODS)
+
+        request_id = hub.invoke_method(device_id, "lumos", b'{"brightness": 3}')
+        packet_type, flags, body = raw_client.receive()
+        request = mqtt_packets.parse_publish(flags, body)
+        assert packet_type == mqtt_packets.PUBLISH
+        assert request.topic == "$iothub/methods/POST/lumos/?$rid=" + request_id
+        assert request.payload == b'{"brightness": 3}'
+
+        raw_client.send(mqtt_packets.puback(request.mid))
+        topic = "$iothub/methods/res/200/?$rid=" + request_id
+        raw_client.send(mqtt_packets.publish(topic, b"{}", qos=1, mid=2))
+        response = hub.method_responses.get(timeout=5)
+        assert (response.request_id, response.status, response.payload) == (request_id, 200, b"{}")
+
+    def test_does_not_deliver_without_subscription(self, hub, raw_client):
+        raw_client.connect(hub)
+        assert hub.wait_for_connection(device_id)
+        assert not hub.send_c2d_message(device_id, b"Howler")
+        assert hub.invoke_method(device_id, "lumos", b"") is None
+
+    def test_rejects_subscription_to_another_device(self, hub, raw_client):
+        raw_client.connect(hub)
+        raw_client.send(mqtt_packets.subscribe(1, [("devices/SomeoneElse/messages/#", 1)]))
+        _, _, body = raw_client.receive()
+        assert bytearray(body)[2] == mqtt_packets.SUBACK_FAILURE
+
+    def test_disconnects_client_publishing_on_forbidden_topic(self, hub, raw_client):
+        raw_client.connect(hub)
+        raw_client.send(mqtt_packets.publish("devices/SomeoneElse/messages/events/", b"", 1, 1))
+        assert raw_client.receive() is None
+
+    def test_delays_puback(self, hub, raw_client):
+        hub.puback_delay = 0.3
+        raw_client.connect(hub)
+        topic = "devices/{}/messages/events/".format(device_id)
+        start = time.time()
+        raw_client.send(mqtt_packets.publish(topic, b"Accio", qos=1, mid=7))
+        raw_client.send(mqtt_packets.publish(topic, b"Accio", qos=0))
+        raw_client.send(mqtt_packets.pingreq())
+        assert raw_client.receive()[0] == mqtt_packets.PINGRESP
+        packet_type, _, body = raw_client.receive()
+
+        assert time.time() - start >= 0.3
+        assert packet_type == mqtt_packets.PUBACK
+        assert mqtt_packets.parse_mid(body) == 7
+        assert hub.message_count == 2
+
+    def test_disconnect_client_closes_connection(self, hub, raw_client):
+        raw_client.connect(hub)
+        assert hub.wait_for_connection(device_id)
+        assert hub.disconnect_client(device_id)
+        assert raw_client.receive() is None
+
+
+class TestMQTTPackets(object):
+    @pytest.mark.parametrize(
+        "topic_filter,topic,expected",
+        [
+            pytest.param("a/b/#", "a/b/c/d", True, id="multi-level wildcard"),
+            pytest.param("a/b/#", "a/b", True, id="multi-level wildcard matches parent"),
+            pytest.param("a/+/c", "a/b/c", True, id="single-level wildcard"),
+            pytest.param("a/+/c", "a/b/d/c", False, id="single-level wildcard is one level"),
+            pytest.param("a/b", "a/b/c", False, id="longer topic"),
+        ],
+    )
+    def test_topic_matches(self, topic_filter, topic, expected):
+        assert mqtt_packets.topic_matches(topic_filter, topic) is expected
+
+    def test_split_packet_waits_for_complete_packet(self):
+        packet = mqtt_packets.publish("a/b", b"x" * 200, qos=1, mid=3)
+        buffer = bytearray(packet[:-1])
+        assert mqtt_packets.split_packet(buffer) is None
+
+        buffer.extend(packet[-1:] + mqtt_packets.pingresp())
+        packet_type, flags, body = mqtt_packets.split_packet(buffer)
+        publish = mqtt_packets.parse_publish(flags, body)
+        assert (packet_type, publish.topic, publish.mid) == (mqtt_packets.PUBLISH, "a/b", 3)
+        assert publish.payload == b"x" * 200
+        assert buffer == bytearray(mqtt_packets.pingresp())
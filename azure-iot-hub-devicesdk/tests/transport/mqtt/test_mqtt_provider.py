@@ -5,6 +5,7 @@
 # --------------------------------------------------------------------------
 
 from azure.iot.hub.devicesdk.transport.mqtt.mqtt_provider import MQTTProvider
+from azure.iot.hub.devicesdk.diagnostics import tracing, Tracer, FlightRecorder, CallbackWatchdog
 import paho.mqtt.client as mqtt
 import ssl
 import pytest
@@ -50,6 +51,15 @@ def test_connect_triggers_client_connect(MockMqttClient, MockSsl):
     assert mock_mqtt_client.on_subscribe is not None
 
 
+@patch.object(ssl, "SSLContext")
+@patch.object(mqtt, "Client")
+def test_connect_uses_given_port(MockMqttClient, MockSsl):
+    mqtt_provider = MQTTProvider(fake_device_id, fake_hostname, fake_username, port=18883)
+    mqtt_provider.connect(fake_password)
+
+    MockMqttClient.return_value.connect.assert_called_once_with(host=fake_hostname, port=18883)
+
+
 @patch.object(mqtt, "Client")
 @pytest.mark.parametrize(
     "client_callback_name, client_callback_args, provider_callback_name, provider_callback_args",
@@ -134,6 +144,17 @@ def test_publish_calls_publish_on_mqtt_client(MockMqttClient):
     mock_mqtt_client.publish.assert_called_once_with(topic=topic, payload=event, qos=1)
 
 
+@patch.object(mqtt, "Client")
+def test_publish_passes_qos_to_mqtt_client(MockMqttClient):
+    mock_mqtt_client = MockMqttClient.return_value
+    mock_mqtt_client.publish = MagicMock(return_value=mqtt.MQTTMessageInfo(fake_mid))
+
+    mqtt_provider = MQTTProvider(fake_device_id, fake_hostname, fake_username)
+    mqtt_provider.publish("topic/", "Tarantallegra", qos=0)
+
+    mock_mqtt_client.publish.assert_called_once_with(topic="topic/", payload="Tarantallegra", qos=0)
+
+
 @patch.object(mqtt, "Client")
 def test_reconnect_calls_username_pw_set_and_reconnect_on_mqtt_client(MockMqttClient):
     mock_mqtt_client = MockMqttClient.return_value
@@ -169,3 +190,161 @@ def test_unsubscribe_calls_unsubscribe_on_mqtt_client(MockMqttClient):
 
     assert unsub_mid == fake_mid
     mock_mqtt_client.unsubscribe.assert_called_once_with(fake_topic)
+
+
+@patch.object(mqtt, "Client")
+def test_publish_is_traced_if_tracer_set(MockMqttClient):
+    mock_mqtt_client = MockMqttClient.return_value
+    mock_mqtt_client.publish = MagicMock(return_value=mqtt.MQTTMessageInfo(fake_mid))
+    ended = []
+
+    mqtt_provider = MQTTProvider(fake_device_id, fake_hostname, fake_username)
+    mqtt_provider.tracer = Tracer(on_end=ended.append)
+    mqtt_provider.publish("topic/", "Tarantallegra")
+
+    span = ended[0]
+    assert span.name == "mqtt.publish"
+    assert span.attributes == {
+        "topic": "topic/",
+        "payload_size": len("Tarantallegra"),
+        "qos": 1,
+        "mid": fake_mid,
+        "rc": 0,
+    }
+
+
+@patch.object(mqtt, "Client")
+def test_received_message_is_traced_if_tracer_set(MockMqttClient):
+    mock_mqtt_client = MockMqttClient.return_value
+    ended = []
+    active_spans = []
+    mqtt_message = mqtt.MQTTMessage(mid=fake_mid, topic=b"fake/topic")
+    mqtt_message.payload = b"Tarantallegra"
+
+    mqtt_provider = MQTTProvider(fake_device_id, fake_hostname, fake_username)
+    mqtt_provider.tracer = Tracer(on_end=ended.append)
+    mqtt_provider.on_mqtt_message_received = lambda topic, payload: active_spans.append(
+        tracing.current_span()
+    )
+    mock_mqtt_client.on_message(None, None, mqtt_message)
+
+    span = ended[0]
+    assert span.name == "mqtt.receive"
+    assert span.attributes == {"topic": "fake/topic", "payload_size": 13, "mid": fake_mid}
+    assert active_spans == [span]
+    assert tracing.current_span() is None
+
+
+@patch.object(ssl, "SSLContext")
+@patch.object(mqtt, "Client")
+def test_connection_events_are_recorded_if_flight_recorder_set(MockMqttClient, MockSsl):
+    mock_mqtt_client = MockMqttClient.return_value
+    recorder = FlightRecorder()
+    mqtt_provider = MQTTProvider(fake_device_id, fake_hostname, fake_username)
+    mqtt_provider.flight_recorder = recorder
+    mqtt_provider.on_mqtt_connected = MagicMock()
+    mqtt_provider.on_mqtt_disconnected = MagicMock()
+    mqtt_provider.on_mqtt_published = MagicMock()
+    mqtt_provider.on_mqtt_subscribed = MagicMock()
+    mqtt_provider.on_mqtt_unsubscribed = MagicMock()
+
+    mqtt_provider.connect(fake_password)
+    mock_mqtt_client.on_connect(None, None, None, 0)
+    mock_mqtt_client.on_publish(None, None, 3)
+    mock_mqtt_client.on_subscribe(None, None, 4, (1,))
+    mock_mqtt_client.on_unsubscribe(None, None, 5)
+    mock_mqtt_client.on_disconnect(None, None, 7)
+    mqtt_provider.reconnect(new_fake_password)
+
+    assert [(e.event, e.key, e.value) for e in recorder.dump()] == [
+        ("connect", fake_hostname, 8883),
+        ("connack", 0, None),
+        ("puback", 3, None),
+        ("suback", 4, None),
+        ("unsuback", 5, None),
+        ("disconnect", 7, None),
+        ("reconnect", fake_hostname, 8883),
+    ]
+
+
+@patch.object(mqtt, "Client")
+def test_callback_error_is_recorded_and_dumped(MockMqttClient, caplog):
+    mock_mqtt_client = MockMqttClient.return_value
+    recorder = FlightRecorder()
+    mqtt_provider = MQTTProvider(fake_device_id, fake_hostname, fake_username)
+    mqtt_provider.flight_recorder = recorder
+    mqtt_provider.on_mqtt_published = MagicMock(side_effect=ValueError("Expelliarmus"))
+
+    mock_mqtt_client.on_publish(None, None, 3)
+
+    event = recorder.dump()[-1]
+    assert (event.event, event.key) == ("error", "on_mqtt_published")
+    assert "Expelliarmus" in event.value
+    dumps = [r for r in caplog.records if r.name.endswith("flight_recorder")]
+    assert len(dumps) == 1 and "puback 3" in dumps[0].getMessage()
+
+
+@patch.object(mqtt, "Client")
+def test_callbacks_are_timed_by_watchdog_if_set(MockMqttClient):
+    mock_mqtt_client = MockMqttClient.return_value
+    mqtt_provider = MQTTProvider(fake_device_id, fake_hostname, fake_username)
+    mqtt_provider.watchdog = CallbackWatchdog()
+    mqtt_provider.on_mqtt_published = MagicMock()
+    mqtt_provider.on_mqtt_message_received = MagicMock()
+    message = mqtt.MQTTMessage(mid=4, topic=b"devices/fake/messages/devicebound")
+    message.payload = b"payload"
+
+    mock_mqtt_client.on_publish(None, None, 9)
+    mock_mqtt_client.on_message(None, None, message)
+
+    mqtt_provider.on_mqtt_published.assert_called_once_with(9)
+    mqtt_provider.on_mqtt_message_received.assert_called_once_with(message._topic, b"payload")
+    histograms = mqtt_provider.watchdog.snapshot()["callback_seconds"]
+    assert sorted(histograms) == ["on_mqtt_message_received", "on_mqtt_published"]
+    assert histograms["on_mqtt_published"].count == 1
+
+
+@patch.object(mqtt, "Client")
+def test_callback_error_is_logged_if_watchdog_set(MockMqttClient, caplog):
+    mock_mqtt_client = MockMqttClient.return_value
+    mqtt_provider = MQTTProvider(fake_device_id, fake_hostname, fake_username)
+    mqtt_provider.watchdog = CallbackWatchdog()
+    mqtt_provider.on_mqtt_subscribed = MagicMock(side_effect=ValueError("Riddikulus"))
+
+    mock_mqtt_client.on_subscribe(None, None, 5, 1)
+
+    assert any("Riddikulus" in r.getMessage() for r in caplog.records)
+    assert mqtt_provider.watchdog.snapshot()["callback_seconds"]["on_mqtt_subscribed"].count == 1
+
+
+@patch.object(ssl, "SSLContext")
+@patch.object(mqtt, "Client")
+def test_client_is_called_through_multiplexer_channel_if_set(MockMqttClient, MockSsl):
+    multiplexer = MagicMock()
+    channel = multiplexer.attach.return_value
+    channel.call.side_effect = lambda function, *args, **kwargs: function(*args, **kwargs)
+    mock_mqtt_client = MockMqttClient.return_value
+    mock_mqtt_client.publish = MagicMock(return_value=mqtt.MQTTMessageInfo(fake_mid))
+    mock_mqtt_client.subscribe = MagicMock(return_value=(fake_rc, fake_mid))
+    mqtt_provider = MQTTProvider(
+        fake_device_id, fake_hostname, fake_username, multiplexer=multiplexer
+    )
+
+    mqtt_provider.connect(fake_password)
+    assert multiplexer.shared_ssl_context.call_args[0][0] is None
+    mock_mqtt_client.tls_set_context.assert_called_once_with(
+        multiplexer.shared_ssl_context.return_value
+    )
+    multiplexer.attach.assert_called_once_with(mock_mqtt_client)
+    assert channel.keep_connected is True
+    mock_mqtt_client.connect.assert_called_once_with(host=fake_hostname, port=8883)
+    assert mock_mqtt_client.loop_start.call_count == 0
+
+    assert mqtt_provider.publish(fake_topic, "Lumos") == fake_mid
+    mqtt_provider.subscribe(fake_topic)
+    assert channel.call.call_count == 3
+
+    mqtt_provider.disconnect()
+    mock_mqtt_client.disconnect.assert_called_once_with()
+    assert channel.keep_connected is False
+    channel.close.assert_called_once_with()
@@ -6,13 +6,29 @@
 
 import pytest
 import logging
+import threading
 import six.moves.urllib as urllib
 from azure.iot.hub.devicesdk import Message
+from azure.iot.hub.devicesdk.common.clock import SimulatedClock
+from azure.iot.hub.devicesdk.transport.mqtt import mqtt_transport
 from azure.iot.hub.devicesdk.transport.mqtt.mqtt_transport import MQTTTransport
 from azure.iot.hub.devicesdk.transport import constant
+from azure.iot.hub.devicesdk.transport.compression import PayloadCompressor
+from azure.iot.hub.devicesdk.transport.batching import BatchPolicy
+from azure.iot.hub.devicesdk.transport.chunking import ChunkingPolicy
+from azure.iot.hub.devicesdk.transport.dedupe import DedupePolicy
+from azure.iot.hub.devicesdk.transport.dispatch import ThreadDispatcher
+from azure.iot.hub.devicesdk.diagnostics import (
+    CallbackWatchdog,
+    FlightRecorder,
+    LatencyRecorder,
+    Tracer,
+    tracing,
+)
+from azure.iot.hub.devicesdk.errors import MessageExpiredError
 from azure.iot.hub.devicesdk.auth.authentication_provider_factory import from_connection_string
 from mock import MagicMock, patch
-from datetime import date
+from datetime import date, datetime, timedelta, tzinfo
 
 logging.basicConfig(level=logging.INFO)
 
@@ -173,7 +189,7 @@ class TestSendEvent:
         mock_mqtt_provider.connect.assert_called_once_with(
             device_transport._auth_provider.get_current_sas_token()
         )
-        mock_mqtt_provider.publish.assert_called_once_with(fake_topic, fake_msg.data)
+        mock_mqtt_provider.publish.assert_called_once_with(fake_topic, fake_msg.data, qos=1)
 
     def test_send_message_with_output_name(self, module_transport):
         fake_msg = Message("Petrificus Totalus")
@@ -205,7 +221,24 @@ class TestSendEvent:
         mock_mqtt_provider.connect.assert_called_once_with(
             module_transport._auth_provider.get_current_sas_token()
         )
-        mock_mqtt_provider.publish.assert_called_once_with(fake_output_topic, fake_msg.data)
+        mock_mqtt_provider.publish.assert_called_once_with(fake_output_topic, fake_msg.data, qos=1)
+
+    def test_send_event_publishes_with_configured_qos(self, authentication_provider):
+        with patch("azure.iot.hub.devicesdk.transport.mqtt.mqtt_transport.MQTTProvider"):
+            transport = MQTTTransport(authentication_provider, telemetry_qos=0)
+        fake_msg = Message("Petrificus Totalus")
+        mock_mqtt_provider = transport._mqtt_provider
+
+        transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        transport.send_event(fake_msg)
+        transport.disconnect()
+
+        mock_mqtt_provider.publish.assert_called_once_with(fake_topic, fake_msg.data, qos=0)
+
+    def test_raises_on_unsupported_qos(self, authentication_provider):
+        with pytest.raises(ValueError):
+            MQTTTransport(authentication_provider, telemetry_qos=2)
 
     def test_sendevent_calls_publish_on_provider(self, device_transport):
         fake_msg = create_fake_message()
@@ -219,7 +252,7 @@ class TestSendEvent:
         mock_mqtt_provider.connect.assert_called_once_with(
             device_transport._auth_provider.get_current_sas_token()
         )
-        mock_mqtt_provider.publish.assert_called_once_with(encoded_fake_topic, fake_msg.data)
+        mock_mqtt_provider.publish.assert_called_once_with(encoded_fake_topic, fake_msg.data, qos=1)
 
     def test_send_event_queues_and_connects_before_sending(self, device_transport):
         fake_msg = create_fake_message()
@@ -242,7 +275,7 @@ class TestSendEvent:
 
         # verify that our connected callback was called and verify that we published the event
         device_transport.on_transport_connected.assert_called_once_with("connected")
-        mock_mqtt_provider.publish.assert_called_once_with(encoded_fake_topic, fake_msg.data)
+        mock_mqtt_provider.publish.assert_called_once_with(encoded_fake_topic, fake_msg.data, qos=1)
 
     def test_send_event_queues_if_waiting_for_connect_complete(self, device_transport):
         fake_msg = create_fake_message()
@@ -267,7 +300,7 @@ class TestSendEvent:
 
         # verify that our connected callback was called and verify that we published the event
         device_transport.on_transport_connected.assert_called_once_with("connected")
-        mock_mqtt_provider.publish.assert_called_once_with(encoded_fake_topic, fake_msg.data)
+        mock_mqtt_provider.publish.assert_called_once_with(encoded_fake_topic, fake_msg.data, qos=1)
 
     def test_send_event_sends_overlapped_events(self, device_transport):
         fake_msg_1 = create_fake_message()
@@ -282,7 +315,9 @@ class TestSendEvent:
         # send an event
         callback_1 = MagicMock()
         device_transport.send_event(fake_msg_1, callback_1)
-        mock_mqtt_provider.publish.assert_called_once_with(encoded_fake_topic, fake_msg_1.data)
+        mock_mqtt_provider.publish.assert_called_once_with(
+            encoded_fake_topic, fake_msg_1.data, qos=1
+        )
 
         # while we're waiting for that send to complete, send another event
         callback_2 = MagicMock()
@@ -314,6 +349,62 @@ class TestSendEvent:
         # assert
         callback.assert_called_once_with()
 
+    def test_send_event_encodes_dict_payload_and_stamps_content_properties(self, device_transport):
+        fake_msg = Message({"spell": "Lumos"})
+
+        mock_mqtt_provider = device_transport._mqtt_provider
+
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        device_transport.send_event(fake_msg)
+
+        expected_topic = (
+            fake_topic
+            + before_sys_key
+            + "ct"
+            + after_sys_key
+            + urllib.parse.quote_plus("application/json")
+            + topic_separator
+            + before_sys_key
+            + "ce"
+            + after_sys_key
+            + "utf-8"
+        )
+        assert mock_mqtt_provider.publish.call_count == 1
+        topic, payload = mock_mqtt_provider.publish.call_args[0]
+        assert topic == expected_topic
+        assert isinstance(payload, bytes)
+        assert device_transport.codec_registry.decode(payload, "application/json") == fake_msg.data
+
+    def test_send_event_compresses_payload_above_threshold(self, device_transport):
+        device_transport.payload_compressor = PayloadCompressor(encoding="gzip", threshold=100)
+        fake_msg = Message("Petrificus Totalus " * 20)
+
+        mock_mqtt_provider = device_transport._mqtt_provider
+
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        device_transport.send_event(fake_msg)
+
+        expected_topic = fake_topic + before_sys_key + "ce" + after_sys_key + "gzip"
+        topic, payload = mock_mqtt_provider.publish.call_args[0]
+        assert topic == expected_topic
+        assert device_transport.payload_compressor.decompress(payload, "gzip") == (
+            fake_msg.data.encode("utf-8")
+        )
+
+    def test_send_event_does_not_compress_payload_below_threshold(self, device_transport):
+        device_transport.payload_compressor = PayloadCompressor(encoding="gzip", threshold=100)
+        fake_msg = Message("Petrificus Totalus")
+
+        mock_mqtt_provider = device_transport._mqtt_provider
+
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        device_transport.send_event(fake_msg)
+
+        mock_mqtt_provider.publish.assert_called_once_with(fake_topic, fake_msg.data, qos=1)
+
     def test_connect_send_disconnect(self, device_transport):
         fake_msg = create_fake_message()
 
@@ -332,6 +423,725 @@ class TestSendEvent:
         mock_mqtt_provider.disconnect.assert_called_once_with()
 
 
+class TestSendEventFromTemplate:
+    def test_template_encodes_topic_with_properties(self, device_transport):
+        template = device_transport.create_message_template(create_fake_message())
+        assert template._encoded_topic == encoded_fake_topic
+
+    def test_template_is_not_affected_by_later_changes_to_message(self, device_transport):
+        fake_msg = create_fake_message()
+        template = device_transport.create_message_template(fake_msg)
+        fake_msg.message_id = "changed"
+        assert template._encoded_topic == encoded_fake_topic
+
+    def test_template_for_output_message(self, module_transport):
+        template = module_transport.create_message_template(create_fake_output_message())
+        assert template.output_name == "fake_output_name"
+        assert before_sys_key + "on" + after_sys_key + "fake_output_name" in (
+            template._encoded_topic
+        )
+
+    def test_send_event_from_template_publishes_payload_on_template_topic(self, device_transport):
+        mock_mqtt_provider = device_transport._mqtt_provider
+        template = device_transport.create_message_template(create_fake_message())
+
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        device_transport.send_event_from_template(template, b"payload 1")
+        device_transport.send_event_from_template(template, b"payload 2")
+
+        assert mock_mqtt_provider.publish.call_count == 2
+        mock_mqtt_provider.publish.assert_called_with(encoded_fake_topic, b"payload 2", qos=1)
+
+    def test_send_event_from_template_calls_callback_on_puback(self, device_transport):
+        mock_mqtt_provider = device_transport._mqtt_provider
+        mock_mqtt_provider.publish.return_value = 7
+        template = device_transport.create_message_template(create_fake_message())
+        callback = MagicMock()
+
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        device_transport.send_event_from_template(template, b"payload", callback)
+        callback.assert_not_called()
+
+        mock_mqtt_provider.on_mqtt_published(7)
+        callback.assert_called_once_with()
+
+    def test_send_event_from_template_skips_payload_stages(self, device_transport):
+        device_transport.payload_compressor = PayloadCompressor(encoding="gzip", threshold=0)
+        mock_mqtt_provider = device_transport._mqtt_provider
+        template = device_transport.create_message_template(Message(None))
+        payload = b"x" * 1000
+
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        device_transport.send_event_from_template(template, payload)
+
+        mock_mqtt_provider.publish.assert_called_once_with(fake_topic, payload, qos=1)
+
+
+@pytest.fixture(scope="function")
+def chunking_transport(authentication_provider):
+    with patch("azure.iot.hub.devicesdk.transport.mqtt.mqtt_transport.MQTTProvider"):
+        transport = MQTTTransport(
+            authentication_provider,
+            chunking_policy=ChunkingPolicy(max_chunk_size=10, max_in_flight=2),
+        )
+    transport.on_transport_connected = MagicMock()
+    transport.on_transport_disconnected = MagicMock()
+    yield transport
+    transport.disconnect()
+
+
+class TestSendEventChunking:
+    def test_small_payload_is_not_chunked(self, chunking_transport):
+        mock_mqtt_provider = chunking_transport._mqtt_provider
+
+        chunking_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        chunking_transport.send_event(Message("tiny"))
+
+        mock_mqtt_provider.publish.assert_called_once_with(fake_topic, b"tiny", qos=1)
+
+    def test_large_payload_is_published_within_in_flight_window(self, chunking_transport):
+        mock_mqtt_provider = chunking_transport._mqtt_provider
+        mock_mqtt_provider.publish.side_effect = [1, 2, 3, 4]
+        callback = MagicMock()
+        payload = b"abcdefghij" * 4
+
+        chunking_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        chunking_transport.send_event(Message(payload), callback)
+        assert mock_mqtt_provider.publish.call_count == 2
+
+        mock_mqtt_provider.on_mqtt_published(1)
+        assert mock_mqtt_provider.publish.call_count == 3
+        mock_mqtt_provider.on_mqtt_published(2)
+        mock_mqtt_provider.on_mqtt_published(3)
+        assert mock_mqtt_provider.publish.call_count == 4
+        callback.assert_not_called()
+
+        mock_mqtt_provider.on_mqtt_published(4)
+        callback.assert_called_once_with()
+
+        chunks = [call[0][1] for call in mock_mqtt_provider.publish.call_args_list]
+        assert b"".join(chunks) == payload
+        topics = [call[0][0] for call in mock_mqtt_provider.publish.call_args_list]
+        assert all(topic.startswith(fake_topic + "iothub-chunk-id=") for topic in topics)
+        assert "iothub-chunk-index=3&iothub-chunk-count=4" in topics[3]
+
+    def test_chunked_payload_round_trips_through_reassembler(self, chunking_transport):
+        mock_mqtt_provider = chunking_transport._mqtt_provider
+        chunking_transport.on_transport_c2d_message_received = MagicMock()
+        payload = b"abcdefghij" * 3 + b"xyz"
+        fake_msg = Message(payload)
+        fake_msg.custom_properties[custom_property_name] = custom_property_value
+        mock_mqtt_provider.publish.side_effect = [0, 1, 2, 3]
+
+        chunking_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        chunking_transport.send_event(fake_msg)
+        for mid in range(4):
+            mock_mqtt_provider.on_mqtt_published(mid)
+
+        c2d_base = "devices/" + fake_device_id + "/messages/devicebound/"
+        for call in reversed(mock_mqtt_provider.publish.call_args_list):
+            topic, chunk = call[0]
+            c2d_topic = c2d_base + topic[len(fake_topic) :].lstrip("&")
+            chunking_transport._on_provider_message_received_callback(
+                c2d_topic.encode("utf-8"), chunk
+            )
+
+        assert chunking_transport.on_transport_c2d_message_received.call_count == 1
+        message = chunking_transport.on_transport_c2d_message_received.call_args[0][0]
+        assert message.data == payload
+        assert message.custom_properties == {custom_property_name: custom_property_value}
+
+
+class TestSendEventBatching:
+    @pytest.fixture
+    def batching_transport(self, authentication_provider):
+        with patch("azure.iot.hub.devicesdk.transport.mqtt.mqtt_transport.MQTTProvider"):
+            transport = MQTTTransport(
+                authentication_provider, batch_policy=BatchPolicy(max_count=2, max_linger_time=60)
+            )
+        transport.on_transport_connected = MagicMock()
+        transport.on_transport_disconnected = MagicMock()
+        yield transport
+        transport.disconnect()
+
+    def test_raises_on_batch_content_type_without_codec(self, authentication_provider):
+        with pytest.raises(ValueError):
+            MQTTTransport(
+                authentication_provider, batch_policy=BatchPolicy(content_type="text/csv")
+            )
+
+    def test_batched_messages_are_published_once(self, batching_transport):
+        mock_mqtt_provider = batching_transport._mqtt_provider
+        mock_mqtt_provider.publish.return_value = 4
+
+        batching_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        batching_transport.send_event(Message("first"))
+        mock_mqtt_provider.publish.assert_not_called()
+        batching_transport.send_event(Message("second"))
+
+        assert mock_mqtt_provider.publish.call_count == 1
+        topic, payload = mock_mqtt_provider.publish.call_args[0]
+        assert topic.startswith(fake_topic)
+        assert "iothub-batch-count=2" in topic
+        assert [
+            item["body"]
+            for item in batching_transport.codec_registry.decode(payload, "application/json")
+        ] == ["first", "second"]
+
+    def test_puback_completes_every_batched_message(self, batching_transport):
+        mock_mqtt_provider = batching_transport._mqtt_provider
+        mock_mqtt_provider.publish.return_value = 4
+        callback_1 = MagicMock()
+        callback_2 = MagicMock()
+
+        batching_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        batching_transport.send_event(Message("first"), callback_1)
+        batching_transport.send_event(Message("second"), callback_2)
+        callback_1.assert_not_called()
+
+        mock_mqtt_provider.on_mqtt_published(4)
+        callback_1.assert_called_once_with()
+        callback_2.assert_called_once_with()
+
+    def test_messages_with_output_name_are_not_batched(self, batching_transport):
+        mock_mqtt_provider = batching_transport._mqtt_provider
+
+        batching_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        batching_transport.send_event(create_fake_output_message())
+
+        assert mock_mqtt_provider.publish.call_count == 1
+
+    def test_disconnect_flushes_partial_batch(self, batching_transport):
+        mock_mqtt_provider = batching_transport._mqtt_provider
+
+        batching_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        batching_transport.send_event(Message("first"))
+        batching_transport.disconnect()
+
+        assert mock_mqtt_provider.publish.call_count == 1
+        mock_mqtt_provider.disconnect.assert_called_once_with()
+
+    def test_expired_message_is_failed_instead_of_batched(self, batching_transport):
+        mock_mqtt_provider = batching_transport._mqtt_provider
+        message = Message("expired")
+        message.expiry_time_utc = datetime.utcnow() - timedelta(seconds=1)
+        callback = MagicMock()
+
+        batching_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        batching_transport.send_event(message, callback)
+        batching_transport.send_event(Message("first"))
+        batching_transport.send_event(Message("second"))
+
+        error = callback.call_args[1]["error"]
+        assert isinstance(error, MessageExpiredError)
+        assert batching_transport.expired_message_count == 1
+        topic = mock_mqtt_provider.publish.call_args[0][0]
+        assert "iothub-batch-count=2" in topic
+
+
+class TestSendEventExpiry:
+    def test_expired_message_is_dropped_when_dequeued(self, device_transport):
+        fake_msg = create_fake_message()
+        fake_msg.expiry_time_utc = datetime.utcnow() + timedelta(milliseconds=10)
+        callback = MagicMock()
+        mock_mqtt_provider = device_transport._mqtt_provider
+
+        device_transport.send_event(fake_msg, callback)
+        fake_msg.expiry_time_utc = datetime.utcnow() - timedelta(seconds=1)
+        mock_mqtt_provider.on_mqtt_connected()
+
+        mock_mqtt_provider.publish.assert_not_called()
+        error = callback.call_args[1]["error"]
+        assert isinstance(error, MessageExpiredError)
+        assert error.message is fake_msg
+        assert device_transport.expired_message_count == 1
+
+    @pytest.mark.parametrize(
+        "expiry_time",
+        [
+            pytest.param(datetime.utcnow() + timedelta(hours=1), id="future datetime"),
+            pytest.param("2000-01-01T00:00:00", id="string"),
+            pytest.param(None, id="no expiry"),
+        ],
+    )
+    def test_unexpired_message_is_sent(self, device_transport, expiry_time):
+        fake_msg = create_fake_message()
+        fake_msg.expiry_time_utc = expiry_time
+        mock_mqtt_provider = device_transport._mqtt_provider
+
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        device_transport.send_event(fake_msg)
+
+        assert mock_mqtt_provider.publish.call_count == 1
+        assert device_transport.expired_message_count == 0
+
+    def test_timezone_aware_expiry_time_is_compared_in_utc(self, device_transport):
+        class FixedOffset(tzinfo):
+            def utcoffset(self, dt):
+                return timedelta(hours=10)
+
+            def dst(self, dt):
+                return timedelta(0)
+
+        fake_msg = create_fake_message()
+        # Later than utcnow in local time, but an hour ago in UTC
+        fake_msg.expiry_time_utc = (datetime.utcnow() + timedelta(hours=9)).replace(
+            tzinfo=FixedOffset()
+        )
+        callback = MagicMock()
+        mock_mqtt_provider = device_transport._mqtt_provider
+
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        device_transport.send_event(fake_msg, callback)
+
+        mock_mqtt_provider.publish.assert_not_called()
+        assert isinstance(callback.call_args[1]["error"], MessageExpiredError)
+
+    def test_expiry_time_is_compared_with_transport_clock(self, device_transport):
+        fake_msg = create_fake_message()
+        fake_msg.expiry_time_utc = datetime.utcnow() + timedelta(hours=1)
+        callback = MagicMock()
+        mock_mqtt_provider = device_transport._mqtt_provider
+        device_transport.clock = SimulatedClock()
+
+        device_transport.send_event(fake_msg, callback)
+        device_transport.clock.advance(3601)
+        mock_mqtt_provider.on_mqtt_connected()
+
+        mock_mqtt_provider.publish.assert_not_called()
+        assert isinstance(callback.call_args[1]["error"], MessageExpiredError)
+
+
+class TestFlightRecorder:
+    @pytest.fixture
+    def recorder(self):
+        return FlightRecorder()
+
+    @pytest.fixture
+    def recorded_transport(self, authentication_provider, recorder):
+        with patch("azure.iot.hub.devicesdk.transport.mqtt.mqtt_transport.MQTTProvider"):
+            transport = MQTTTransport(authentication_provider, flight_recorder=recorder)
+        yield transport
+        transport.disconnect()
+
+    def test_provider_shares_flight_recorder(self, recorded_transport, recorder):
+        assert recorded_transport._mqtt_provider.flight_recorder is recorder
+
+    def test_records_transitions_publishes_and_token_renewals(self, recorded_transport, recorder):
+        mock_mqtt_provider = recorded_transport._mqtt_provider
+        mock_mqtt_provider.publish.return_value = 12
+
+        recorded_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        recorded_transport.send_event(create_fake_message())
+        recorded_transport._on_shared_access_string_updated()
+        mock_mqtt_provider.on_mqtt_connected()
+
+        events = [(e.event, e.key, e.value) for e in recorder.dump()]
+        assert events[:2] == [
+            ("transition", "_trig_connect", "connecting"),
+            ("transition", "_trig_provider_connect_complete", "connected"),
+        ]
+        assert ("publish", 12, mock_mqtt_provider.publish.call_args[0][0]) in events
+        assert events[-3:] == [
+            ("token", None, None),
+            ("transition", "_trig_on_shared_access_string_updated", "connecting"),
+            ("transition", "_trig_provider_connect_complete", "connected"),
+        ]
+
+    def test_records_subscribes(self, recorded_transport, recorder):
+        mock_mqtt_provider = recorded_transport._mqtt_provider
+        mock_mqtt_provider.subscribe.return_value = 4
+        mock_mqtt_provider.unsubscribe.return_value = 5
+        recorded_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+
+        recorded_transport.enable_feature(constant.C2D_MSG)
+        recorded_transport.disable_feature(constant.C2D_MSG)
+
+        events = [(e.event, e.key) for e in recorder.dump()]
+        assert ("subscribe", 4) in events
+        assert ("unsubscribe", 5) in events
+
+    def test_records_expired_messages(self, recorded_transport, recorder):
+        fake_msg = create_fake_message()
+        fake_msg.expiry_time_utc = datetime.utcnow() - timedelta(seconds=1)
+        recorded_transport.send_event(fake_msg)
+        recorded_transport._mqtt_provider.on_mqtt_connected()
+
+        assert ("expired", fake_message_id) in [(e.event, e.key) for e in recorder.dump()]
+
+    def test_records_and_dumps_transition_errors(self, recorded_transport, recorder, caplog):
+        mock_mqtt_provider = recorded_transport._mqtt_provider
+        recorded_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        mock_mqtt_provider.publish.side_effect = ValueError("Confundo")
+
+        with pytest.raises(ValueError):
+            recorded_transport.send_event(create_fake_message())
+
+        event = recorder.dump()[-1]
+        assert (event.event, event.key) == ("error", "_trig_add_action_to_pending_queue")
+        assert "Confundo" in event.value
+        assert any("Flight recorder dump" in r.getMessage() for r in caplog.records)
+
+
+class TestCallbackWatchdog:
+    @pytest.fixture
+    def clock(self):
+        return SimulatedClock()
+
+    @pytest.fixture
+    def watchdog(self, clock):
+        return CallbackWatchdog(clock=clock)
+
+    @pytest.fixture
+    def watched_transport(self, authentication_provider, watchdog):
+        with patch("azure.iot.hub.devicesdk.transport.mqtt.mqtt_transport.MQTTProvider"):
+            transport = MQTTTransport(authentication_provider, watchdog=watchdog)
+        yield transport
+        transport.disconnect()
+
+    def test_provider_shares_watchdog(self, watched_transport, watchdog):
+        assert watched_transport._mqtt_provider.watchdog is watchdog
+
+    def test_stats_include_network_loop_busy_time(self, watched_transport, watchdog, clock):
+        watchdog.call("on_mqtt_connected", clock.advance, 0.25)
+
+        stats = watched_transport.get_stats()
+        assert stats["network_loop_busy_seconds"] == 0.25
+        assert stats["callback_stalls"] == 0
+        assert stats["callback_seconds"]["on_mqtt_connected"].count == 1
+
+    def test_stats_leave_out_watchdog_if_not_set(self, device_transport):
+        assert "network_loop_busy_seconds" not in device_transport.get_stats()
+
+
+class _RecordingDispatcher(object):
+    """Holds dispatched callbacks until the test runs them."""
+
+    def __init__(self):
+        self.dispatched = []
+
+    @property
+    def pending(self):
+        return len(self.dispatched)
+
+    def dispatch(self, key, function, *args):
+        self.dispatched.append((key, function, args))
+
+    def run_all(self):
+        dispatched, self.dispatched = self.dispatched, []
+        for _, function, args in dispatched:
+            function(*args)
+        return [key for key, _, _ in dispatched]
+
+
+class TestDispatcher:
+    @pytest.fixture
+    def dispatcher(self):
+        return _RecordingDispatcher()
+
+    @pytest.fixture
+    def dispatching_transport(self, authentication_provider, dispatcher):
+        with patch("azure.iot.hub.devicesdk.transport.mqtt.mqtt_transport.MQTTProvider"):
+            transport = MQTTTransport(authentication_provider, dispatcher=dispatcher)
+        transport.on_transport_connected = MagicMock()
+        transport.on_transport_disconnected = MagicMock()
+        yield transport
+        transport.disconnect()
+        dispatcher.run_all()
+
+    def test_connect_callbacks_run_on_dispatcher(self, dispatching_transport, dispatcher):
+        callback = MagicMock()
+        dispatching_transport.connect(callback=callback)
+        dispatching_transport._mqtt_provider.on_mqtt_connected()
+
+        assert dispatching_transport.state == "connected"
+        callback.assert_not_called()
+        dispatching_transport.on_transport_connected.assert_not_called()
+
+        assert dispatcher.run_all() == [(id(dispatching_transport), "connection")]
+        callback.assert_called_once_with()
+        dispatching_transport.on_transport_connected.assert_called_once_with("connected")
+
+    def test_send_completion_runs_on_dispatcher_keyed_by_mid(
+        self, dispatching_transport, dispatcher
+    ):
+        mock_mqtt_provider = dispatching_transport._mqtt_provider
+        mock_mqtt_provider.publish.return_value = 17
+        callback = MagicMock()
+        dispatching_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        dispatcher.run_all()
+
+        dispatching_transport.send_event(create_fake_message(), callback)
+        mock_mqtt_provider.on_mqtt_published(17)
+
+        callback.assert_not_called()
+        assert dispatching_transport.get_stats()["dispatch_backlog"] == 1
+        assert dispatcher.run_all() == [(id(dispatching_transport), "mid", 17)]
+        callback.assert_called_once_with()
+
+    def test_received_messages_are_decoded_and_delivered_on_dispatcher(
+        self, dispatching_transport, dispatcher
+    ):
+        c2d_topic = "devices/" + fake_device_id + "/messages/devicebound/%24.ct=application%2Fjson"
+        dispatching_transport.codec_registry.decode_received_payloads = True
+        dispatching_transport.on_transport_c2d_message_received = MagicMock()
+
+        for spell in ("Lumos", "Nox"):
+            payload = '{{"spell": "{}"}}'.format(spell).encode("utf-8")
+            dispatching_transport._on_provider_message_received_callback(
+                c2d_topic.encode("utf-8"), payload
+            )
+
+        dispatching_transport.on_transport_c2d_message_received.assert_not_called()
+        assert dispatcher.run_all() == [(id(dispatching_transport), "c2d")] * 2
+        delivered = dispatching_transport.on_transport_c2d_message_received.call_args_list
+        assert [call[0][0].data for call in delivered] == [{"spell": "Lumos"}, {"spell": "Nox"}]
+
+    def test_input_messages_are_keyed_by_input_name(self, dispatching_transport, dispatcher):
+        topic = "devices/{}/modules/{}/inputs/{}/%24.mid=1"
+        dispatching_transport.on_transport_input_message_received = MagicMock()
+        for input_name in ("north", "south"):
+            dispatching_transport._on_provider_message_received_callback(
+                topic.format(fake_device_id, fake_module_id, input_name).encode("utf-8"), b"x"
+            )
+
+        assert dispatcher.run_all() == [
+            (id(dispatching_transport), "input", "north"),
+            (id(dispatching_transport), "input", "south"),
+        ]
+        delivered = dispatching_transport.on_transport_input_message_received.call_args_list
+        assert [call[0][0] for call in delivered] == ["north", "south"]
+
+    def test_completions_run_on_dispatcher_thread(self, authentication_provider):
+        dispatcher = ThreadDispatcher()
+        with patch("azure.iot.hub.devicesdk.transport.mqtt.mqtt_transport.MQTTProvider"):
+            transport = MQTTTransport(authentication_provider, dispatcher=dispatcher)
+        mock_mqtt_provider = transport._mqtt_provider
+        mock_mqtt_provider.publish.return_value = 3
+        threads = []
+        transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        transport.send_event(
+            create_fake_message(), lambda: threads.append(threading.current_thread())
+        )
+        mock_mqtt_provider.on_mqtt_published(3)
+        transport.disconnect()
+        mock_mqtt_provider.on_mqtt_disconnected()
+        dispatcher.shutdown()
+
+        assert threads and threads[0] is not threading.current_thread()
+
+
+class TestSendEventLatency:
+    def test_latency_recorder_receives_timings_for_each_stage(self, device_transport):
+        on_timings = MagicMock()
+        device_transport.latency_recorder = LatencyRecorder(on_timings=on_timings)
+        mock_mqtt_provider = device_transport._mqtt_provider
+        mock_mqtt_provider.publish.return_value = 3
+        callback = MagicMock()
+
+        device_transport.send_event(create_fake_message(), callback)
+        device_transport._mqtt_provider.on_mqtt_connected()
+        on_timings.assert_not_called()
+
+        mock_mqtt_provider.on_mqtt_published(3)
+        callback.assert_called_once_with()
+        timings = on_timings.call_args[0][0]
+        assert timings.queue_time >= 0
+        assert timings.publish_time >= 0
+        assert timings.ack_time >= 0
+
+    def test_latency_recorder_stamps_send_time_if_enabled(self, device_transport):
+        device_transport.latency_recorder = LatencyRecorder(stamp_properties=True)
+        mock_mqtt_provider = device_transport._mqtt_provider
+
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        message = create_fake_message()
+        device_transport.send_event(message)
+
+        topic = mock_mqtt_provider.publish.call_args[0][0]
+        assert "iothub-send-time=" in topic
+        # The caller's message is not changed, so sending it again stamps it afresh
+        assert "iothub-send-time" not in message.custom_properties
+
+    def test_latency_recorder_stamps_message_without_properties(self, device_transport):
+        device_transport.latency_recorder = LatencyRecorder(stamp_properties=True)
+        mock_mqtt_provider = device_transport._mqtt_provider
+
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        device_transport.send_event(Message(fake_event))
+
+        topic = mock_mqtt_provider.publish.call_args[0][0]
+        assert topic.startswith(fake_topic + "iothub-send-time=")
+
+    def test_latency_recorder_records_time_before_queueing(self, device_transport):
+        device_transport.latency_recorder = LatencyRecorder()
+        mock_mqtt_provider = device_transport._mqtt_provider
+        mock_mqtt_provider.publish.return_value = 3
+
+        device_transport.send_event(create_fake_message())
+        mock_mqtt_provider.on_mqtt_connected()
+        mock_mqtt_provider.on_mqtt_published(3)
+
+        histograms = device_transport.latency_recorder.snapshot_histograms()
+        for stage in ("enqueue_time", "queue_time", "publish_time", "ack_time", "total_time"):
+            assert histograms[stage].count == 1
+
+    def test_latency_histograms_are_in_stats_if_enabled(self, device_transport):
+        assert "latency_seconds" not in device_transport.get_stats()
+        device_transport.latency_recorder = LatencyRecorder()
+        stats = device_transport.get_stats()
+        assert stats["latency_seconds"]["total_time"].count == 0
+
+
+class TestTracing:
+    @pytest.fixture
+    def ended(self):
+        return []
+
+    @pytest.fixture
+    def traced_transport(self, authentication_provider, ended):
+        with patch("azure.iot.hub.devicesdk.transport.mqtt.mqtt_transport.MQTTProvider"):
+            transport = MQTTTransport(authentication_provider, tracer=Tracer(on_end=ended.append))
+        transport.on_transport_connected = MagicMock()
+        yield transport
+        transport.disconnect()
+
+    def test_provider_is_given_the_tracer(self, traced_transport):
+        assert traced_transport._mqtt_provider.tracer is traced_transport.tracer
+
+    def test_send_is_traced_until_puback(self, traced_transport, ended):
+        mock_mqtt_provider = traced_transport._mqtt_provider
+        mock_mqtt_provider.publish.return_value = 3
+        client_span = traced_transport.tracer.start_span("client.send_event")
+        provider_spans = []
+        mock_mqtt_provider.publish.side_effect = lambda *args, **kwargs: (
+            provider_spans.append(tracing.current_span()) or 3
+        )
+
+        with tracing.activate(client_span):
+            traced_transport.send_event(create_fake_message())
+        mock_mqtt_provider.on_mqtt_connected()
+        assert ended == []
+        mock_mqtt_provider.on_mqtt_published(3)
+
+        span = ended[0]
+        assert span.name == "transport.send_event"
+        assert span.parent is client_span
+        assert span.attributes["message_id"] == fake_message_id
+        assert span.attributes["mid"] == 3
+        assert span.attributes["topic"].startswith(fake_topic)
+        assert span.attributes["payload_size"] == len(fake_event)
+        assert [event[0] for event in span.events] == ["queued", "dequeued", "published"]
+        assert span.events[0][2] == {"state": "disconnected"}
+        # The provider publishes inside the span, so that its own span is a child
+        assert provider_spans == [span]
+
+    def test_expired_send_ends_span_with_error(self, traced_transport, ended):
+        message = create_fake_message()
+        message.expiry_time_utc = datetime.utcnow() - timedelta(seconds=1)
+        callback = MagicMock()
+        traced_transport.send_event(message, callback)
+        traced_transport._mqtt_provider.on_mqtt_connected()
+
+        assert isinstance(ended[0].error, MessageExpiredError)
+        assert isinstance(callback.call_args[1]["error"], MessageExpiredError)
+
+    def test_received_message_is_traced_until_delivered(self, traced_transport, ended):
+        delivered_in = []
+        traced_transport.on_transport_c2d_message_received = lambda message: delivered_in.append(
+            tracing.current_span()
+        )
+        topic = "devices/" + fake_device_id + "/messages/devicebound/%24.mid=m1"
+        traced_transport._on_provider_message_received_callback(topic.encode("utf-8"), b"12345")
+        traced_transport._on_provider_message_received_callback(b"unhandled/topic", b"12345")
+
+        delivered, not_delivered = ended
+        assert delivered.name == "transport.receive"
+        assert delivered.attributes == {"topic": topic, "payload_size": 5, "delivered": True}
+        assert delivered_in == [delivered]
+        assert not_delivered.attributes["delivered"] is False
+
+
+class TestGetStats:
+    def test_stats_start_at_zero(self, device_transport):
+        stats = device_transport.get_stats()
+        assert stats["state"] == "disconnected"
+        assert stats["messages_sent"] == 0
+        assert stats["bytes_received"] == 0
+        assert stats["pending_actions"] == 0
+        assert stats["in_progress_actions"] == 0
+        assert "duplicates_suppressed" not in stats
+
+    def test_queued_messages_are_pending_until_connected(self, device_transport):
+        device_transport.send_event(create_fake_message())
+        device_transport.send_event(create_fake_message())
+        stats = device_transport.get_stats()
+        assert stats["state"] == "connecting"
+        assert stats["pending_actions"] == 2
+        assert stats["connects"] == 1
+        device_transport._mqtt_provider.on_mqtt_connected()
+
+    def test_sent_messages_are_in_progress_until_acknowledged(self, device_transport):
+        mock_mqtt_provider = device_transport._mqtt_provider
+        mock_mqtt_provider.publish.return_value = 7
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+
+        device_transport.send_event(create_fake_message())
+        topic, payload = mock_mqtt_provider.publish.call_args[0]
+        stats = device_transport.get_stats()
+        assert stats["state"] == "connected"
+        assert stats["pending_actions"] == 0
+        assert stats["in_progress_actions"] == 1
+        assert stats["messages_sent"] == 1
+        assert stats["bytes_sent"] == len(topic) + len(payload)
+
+        mock_mqtt_provider.on_mqtt_published(7)
+        assert device_transport.get_stats()["in_progress_actions"] == 0
+
+    def test_received_messages_are_counted(self, device_transport):
+        topic = ("devices/" + fake_device_id + "/messages/devicebound/%24.to=x").encode("utf-8")
+        device_transport.on_transport_c2d_message_received = MagicMock()
+        device_transport._on_provider_message_received_callback(topic, b"12345")
+        stats = device_transport.get_stats()
+        assert stats["messages_received"] == 1
+        assert stats["bytes_received"] == len(topic) + 5
+
+    def test_reconnects_and_disconnects_are_counted(self, device_transport):
+        mock_mqtt_provider = device_transport._mqtt_provider
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+        device_transport._on_shared_access_string_updated()
+        mock_mqtt_provider.on_mqtt_connected()
+        device_transport.disconnect()
+        mock_mqtt_provider.on_mqtt_disconnected()
+
+        stats = device_transport.get_stats()
+        assert stats["connects"] == 1
+        assert stats["reconnects"] == 1
+        assert stats["disconnects"] == 1
+
+
 class TestDisconnect:
     def test_disconnect_calls_disconnect_on_provider(self, device_transport):
         mock_mqtt_provider = device_transport._mqtt_provider
@@ -543,6 +1353,121 @@ class TestDisableMethods:
         pass
 
 
+class TestReceiveMessage:
+    c2d_topic = (
+        "devices/"
+        + fake_device_id
+        + "/messages/devicebound/%24.mid=spell-1234&%24.ct=application%2Fjson&%24.ce=utf-8"
+    )
+    c2d_payload = b'{"spell": "Lumos"}'
+
+    def test_c2d_payload_is_not_decoded_by_default(self, device_transport):
+        device_transport.on_transport_c2d_message_received = MagicMock()
+        device_transport._on_provider_message_received_callback(
+            self.c2d_topic.encode("utf-8"), self.c2d_payload
+        )
+        message = device_transport.on_transport_c2d_message_received.call_args[0][0]
+        assert message.data == self.c2d_payload
+        assert message.content_type == "application/json"
+        assert message.content_encoding == "utf-8"
+
+    def test_c2d_payload_is_decoded_if_enabled(self, device_transport):
+        device_transport.codec_registry.decode_received_payloads = True
+        device_transport.on_transport_c2d_message_received = MagicMock()
+        device_transport._on_provider_message_received_callback(
+            self.c2d_topic.encode("utf-8"), self.c2d_payload
+        )
+        message = device_transport.on_transport_c2d_message_received.call_args[0][0]
+        assert message.data == {"spell": "Lumos"}
+
+    def test_compressed_c2d_payload_is_decompressed_if_compression_enabled(self, device_transport):
+        compressor = PayloadCompressor(encoding="gzip", threshold=0)
+        compressed, _ = compressor.compress(self.c2d_payload * 10)
+        topic = "devices/" + fake_device_id + "/messages/devicebound/%24.ce=gzip"
+        device_transport.payload_compressor = compressor
+        device_transport.on_transport_c2d_message_received = MagicMock()
+        device_transport._on_provider_message_received_callback(topic.encode("utf-8"), compressed)
+        message = device_transport.on_transport_c2d_message_received.call_args[0][0]
+        assert message.data == self.c2d_payload * 10
+        assert message.content_encoding is None
+
+    def test_input_payload_is_decoded_if_enabled(self, module_transport):
+        topic = (
+            "devices/"
+            + fake_device_id
+            + "/modules/"
+            + fake_module_id
+            + "/inputs/fake_input/%24.ct=application%2Fjson"
+        )
+        module_transport.codec_registry.decode_received_payloads = True
+        module_transport.on_transport_input_message_received = MagicMock()
+        module_transport._on_provider_message_received_callback(
+            topic.encode("utf-8"), self.c2d_payload
+        )
+        input_name, message = module_transport.on_transport_input_message_received.call_args[0]
+        assert input_name == "fake_input"
+        assert message.data == {"spell": "Lumos"}
+
+    def test_latency_recorder_records_receive_time_of_delivered_messages(self, device_transport):
+        device_transport.latency_recorder = LatencyRecorder()
+        device_transport.on_transport_c2d_message_received = MagicMock()
+        device_transport._on_provider_message_received_callback(
+            self.c2d_topic.encode("utf-8"), self.c2d_payload
+        )
+        assert device_transport.latency_recorder.histograms["receive_time"].count == 1
+
+    def test_duplicate_messages_are_delivered_if_dedupe_disabled(self, device_transport):
+        device_transport.on_transport_c2d_message_received = MagicMock()
+        for _ in range(2):
+            device_transport._on_provider_message_received_callback(
+                self.c2d_topic.encode("utf-8"), self.c2d_payload
+            )
+        assert device_transport.on_transport_c2d_message_received.call_count == 2
+
+    def test_duplicate_c2d_messages_are_suppressed_if_dedupe_enabled(self, authentication_provider):
+        with patch("azure.iot.hub.devicesdk.transport.mqtt.mqtt_transport.MQTTProvider"):
+            transport = MQTTTransport(authentication_provider, dedupe_policy=DedupePolicy())
+        transport.on_transport_c2d_message_received = MagicMock()
+        for _ in range(3):
+            transport._on_provider_message_received_callback(
+                self.c2d_topic.encode("utf-8"), self.c2d_payload
+            )
+        assert transport.on_transport_c2d_message_received.call_count == 1
+        assert transport.deduplicator.duplicate_count == 2
+
+    def test_dedupe_window_follows_transport_clock(self, authentication_provider):
+        clock = SimulatedClock()
+        policy = DedupePolicy(lru_size=1, window=60)
+        with patch("azure.iot.hub.devicesdk.transport.mqtt.mqtt_transport.MQTTProvider"):
+            transport = MQTTTransport(authentication_provider, dedupe_policy=policy, clock=clock)
+        messages = [Message(b"payload") for _ in range(2)]
+        for i, message in enumerate(messages):
+            message.message_id = str(i)
+            transport.deduplicator.is_duplicate(message)
+
+        clock.advance(121)
+        assert not transport.deduplicator.is_duplicate(messages[0])
+
+    @pytest.mark.parametrize(
+        "name,create",
+        [
+            pytest.param("latency_recorder", LatencyRecorder, id="latency_recorder"),
+            pytest.param("flight_recorder", FlightRecorder, id="flight_recorder"),
+            pytest.param("watchdog", CallbackWatchdog, id="watchdog"),
+        ],
+    )
+    def test_diagnostics_use_transport_clock(self, authentication_provider, name, create):
+        clock = SimulatedClock()
+        own_clock = SimulatedClock()
+        with patch("azure.iot.hub.devicesdk.transport.mqtt.mqtt_transport.MQTTProvider"):
+            transport = MQTTTransport(authentication_provider, clock=clock, **{name: create()})
+            other = MQTTTransport(
+                authentication_provider, clock=clock, **{name: create(clock=own_clock)}
+            )
+        assert getattr(transport, name).clock is clock
+        assert getattr(other, name).clock is own_clock
+
+
 @pytest.mark.skip(reason="Not implemented")
 class TestSendMethodResponse:
     pass
@@ -637,3 +1562,58 @@ class TestProviderCallbacks:
 
         # verify that our callback was finally called
         callback.assert_called_once_with()
+
+
+class TestUnknownMidResponses:
+    @pytest.fixture
+    def clock(self, device_transport):
+        device_transport.clock = SimulatedClock()
+        return device_transport.clock
+
+    def test_unclaimed_responses_are_discarded_after_timeout(self, device_transport, clock):
+        device_transport._on_provider_publish_complete(1)
+        device_transport._on_provider_publish_complete(2)
+        assert device_transport.get_stats()["unknown_mid_responses"] == 2
+
+        clock.advance(mqtt_transport.UNKNOWN_MID_TIMEOUT + 1)
+        device_transport._on_provider_publish_complete(3)
+
+        stats = device_transport.get_stats()
+        assert stats["unknown_mid_responses"] == 1
+        assert stats["unknown_mid_responses_discarded"] == 2
+
+    def test_stale_response_does_not_complete_action_with_same_mid(self, device_transport, clock):
+        mock_mqtt_provider = device_transport._mqtt_provider
+        mock_mqtt_provider.publish.return_value = 5
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+
+        # A response for a MID which was never tracked, such as a duplicate PUBACK
+        device_transport._on_provider_publish_complete(5)
+        clock.advance(mqtt_transport.UNKNOWN_MID_TIMEOUT + 1)
+
+        # MIDs wrap around, so a later publish can be given the same MID
+        callback = MagicMock()
+        device_transport.send_event(create_fake_message(), callback)
+        callback.assert_not_called()
+        assert device_transport.get_stats()["in_progress_actions"] == 1
+
+        mock_mqtt_provider.on_mqtt_published(5)
+        callback.assert_called_once_with()
+
+    def test_recent_response_completes_action(self, device_transport, clock):
+        mock_mqtt_provider = device_transport._mqtt_provider
+        device_transport.connect()
+        mock_mqtt_provider.on_mqtt_connected()
+
+        def publish_acknowledged_early(*args, **kwargs):
+            device_transport._on_provider_publish_complete(9)
+            clock.advance(1)
+            return 9
+
+        mock_mqtt_provider.publish.side_effect = publish_acknowledged_early
+        callback = MagicMock()
+        device_transport.send_event(create_fake_message(), callback)
+
+        callback.assert_called_once_with()
+        assert device_transport.get_stats()["unknown_mid_responses"] == 0
@@ -0,0 +1,171 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import threading
+import pytest
+from azure.iot.hub.devicesdk import DeviceClient, Message, InboxEmpty
+from azure.iot.hub.devicesdk.auth.authentication_provider_factory import from_connection_string
+from azure.iot.hub.devicesdk.common.clock import SYSTEM_CLOCK
+from azure.iot.hub.devicesdk.transport import constant
+from azure.iot.hub.devicesdk.transport.mqtt.mqtt_provider import MQTTProvider
+from azure.iot.hub.devicesdk.transport.mqtt.mqtt_transport import MQTTTransport
+from azure.iot.hub.devicesdk.transport.mqtt.multiplexer import MqttMultiplexer
+from azure.iot.hub.devicesdk.testing import FakeIoTHub
+
+device_id = "MyNimbus"
+
+
+@pytest.fixture(scope="module")
+def tls_hub():
+    try:
+        hub = FakeIoTHub().start()
+    except RuntimeError as e:
+        pytest.skip(str(e))
+    yield hub
+    hub.stop()
+
+
+@pytest.fixture
+def multiplexer():
+    multiplexer = MqttMultiplexer(misc_interval=0.1)
+    yield multiplexer
+    multiplexer.stop()
+
+
+def create_auth_provider(hub, client_device_id):
+    auth_provider = from_connection_string(hub.connection_string(client_device_id))
+    auth_provider.ca_cert = hub.ca_cert
+    return auth_provider
+
+
+class TestTimers(object):
+    def test_calls_are_made_on_timer_thread(self, multiplexer):
+        called = threading.Event()
+        threads = []
+
+        def function():
+            threads.append(threading.current_thread().name)
+            called.set()
+
+        multiplexer.clock.call_later(0.01, function)
+        assert called.wait(5)
+        assert threads == ["MqttMultiplexer-timers"]
+        assert multiplexer.timer_count == 0
+
+    def test_cancelled_calls_are_not_made(self, multiplexer):
+        called = threading.Event()
+        timer = multiplexer.call_later(0.05, called.set)
+        assert multiplexer.timer_count == 1
+        timer.cancel()
+        assert multiplexer.timer_count == 0
+        assert not called.wait(0.2)
+
+    def test_earlier_call_wakes_io_thread(self, multiplexer):
+        called = threading.Event()
+        multiplexer.call_later(60, called.set)
+        multiplexer.call_later(0, called.set)
+        assert called.wait(5)
+
+
+class TestTransportWithMultiplexer(object):
+    def test_timed_calls_use_multiplexer_clock(self, multiplexer):
+        auth_provider = from_connection_string(
+            "HostName=hogwarts.azure-devices.net;DeviceId={};SharedAccessKey=Zm9vYmFy".format(
+                device_id
+            )
+        )
+        assert auth_provider.clock is SYSTEM_CLOCK
+
+        transport = MQTTTransport(auth_provider, multiplexer=multiplexer)
+
+        assert transport.clock is multiplexer.clock
+        assert auth_provider.clock is multiplexer.clock
+        assert transport._mqtt_provider._multiplexer is multiplexer
+        # Nothing is attached until the transport connects
+        assert multiplexer.connection_count == 0
+
+    def test_clients_share_io_thread(self, tls_hub, multiplexer):
+        clients = []
+        for index in range(5):
+            client = DeviceClient.from_authentication_provider(
+                create_auth_provider(tls_hub, "{}-{}".format(device_id, index)),
+                "mqtt",
+                port=tls_hub.tls_port,
+                multiplexer=multiplexer,
+            )
+            client.connect()
+            clients.append(client)
+        try:
+            assert multiplexer.connection_count == 5
+            # Each SAS token renewal is scheduled on the multiplexer rather than a Timer thread
+            assert multiplexer.timer_count == 5
+            contexts = set(
+                id(client._transport._mqtt_provider._mqtt_client._ssl_context) for client in clients
+            )
+            assert len(contexts) == 1
+            for client in clients:
+                assert client._transport._mqtt_provider._mqtt_client._thread is None
+
+            for client in clients:
+                client.send_event(Message("Accio"))
+            assert tls_hub.message_count >= 5
+
+            receiver = clients[2]
+            with pytest.raises(InboxEmpty):
+                receiver.receive_c2d_message(block=False)
+            assert tls_hub.wait_for_subscription(device_id + "-2", constant.C2D_MSG)
+            assert tls_hub.send_c2d_message(device_id + "-2", "Owl post")
+            assert receiver.receive_c2d_message(timeout=5).data == b"Owl post"
+        finally:
+            for client in clients:
+                client.disconnect()
+
+        assert multiplexer.timer_count == 0
+        _wait_for(lambda: multiplexer.connection_count == 0)
+
+
+class TestProviderWithMultiplexer(object):
+    def test_lost_connection_is_reconnected(self, tls_hub, multiplexer):
+        auth_provider = create_auth_provider(tls_hub, device_id)
+        provider = MQTTProvider(
+            device_id,
+            tls_hub.hostname,
+            tls_hub.hostname + "/" + device_id + "/?api-version=2018-06-30",
+            ca_cert=tls_hub.ca_cert,
+            port=tls_hub.tls_port,
+            multiplexer=multiplexer,
+        )
+        connected = threading.Semaphore(0)
+        disconnected = threading.Event()
+        published = threading.Event()
+        provider.on_mqtt_connected = connected.release
+        provider.on_mqtt_disconnected = disconnected.set
+        provider.on_mqtt_published = lambda mid: published.set()
+
+        provider.connect(auth_provider.get_current_sas_token())
+        try:
+            assert connected.acquire(timeout=5)
+            provider.publish("devices/{}/messages/events/".format(device_id), b"Reparo")
+            assert published.wait(5)
+
+            assert tls_hub.disconnect_client(device_id)
+            assert disconnected.wait(5)
+            # Reconnected by the multiplexer, after its first delay of one second
+            assert connected.acquire(timeout=5)
+            assert multiplexer.reconnect_count == 1
+        finally:
+            provider.disconnect()
+            auth_provider.disconnect()
+        _wait_for(lambda: multiplexer.connection_count == 0)
+
+
+def _wait_for(condition, timeout=5):
+    done = threading.Event()
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        done.wait(0.01)
+    assert condition()
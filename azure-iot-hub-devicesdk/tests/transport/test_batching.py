@@ -0,0 +1,220 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+import base64
+import json
+import threading
+from datetime import datetime, timedelta
+from mock import MagicMock
+from azure.iot.hub.devicesdk import Message
+from azure.iot.hub.devicesdk.common.clock import SimulatedClock
+from azure.iot.hub.devicesdk.common.payload_codecs import JsonCodec, MsgPackCodec, msgpack
+from azure.iot.hub.devicesdk.transport.batching import (
+    BatchPolicy,
+    MessageBatcher,
+    BATCH_COUNT_PROPERTY,
+)
+
+
+def create_batcher(**kwargs):
+    on_batch_ready = MagicMock()
+    kwargs.setdefault("max_linger_time", 60)
+    batcher = MessageBatcher(BatchPolicy(**kwargs), JsonCodec(), on_batch_ready)
+    return batcher, on_batch_ready
+
+
+def decode_envelope(envelope):
+    return json.loads(envelope.data.decode("utf-8"))
+
+
+class TestBatchPolicy(object):
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            pytest.param({"max_count": 0}, id="max_count"),
+            pytest.param({"max_bytes": 0}, id="max_bytes"),
+            pytest.param({"max_linger_time": -1}, id="max_linger_time"),
+        ],
+    )
+    def test_raises_on_invalid_limits(self, kwargs):
+        with pytest.raises(ValueError):
+            BatchPolicy(**kwargs)
+
+
+class TestMessageBatcher(object):
+    def test_sends_batch_when_max_count_reached(self):
+        batcher, on_batch_ready = create_batcher(max_count=3)
+        batcher.add(Message("a"))
+        batcher.add(Message("b"))
+        assert on_batch_ready.call_count == 0
+
+        batcher.add(Message("c"))
+        assert on_batch_ready.call_count == 1
+        envelope = on_batch_ready.call_args[0][0]
+        assert [item["body"] for item in decode_envelope(envelope)] == ["a", "b", "c"]
+        assert envelope.content_type == "application/json"
+        assert envelope.content_encoding == "utf-8"
+        assert envelope.custom_properties[BATCH_COUNT_PROPERTY] == "3"
+        assert len(batcher) == 0
+
+    def test_sends_batch_before_exceeding_max_bytes(self):
+        batcher, on_batch_ready = create_batcher(max_bytes=40)
+        batcher.add(Message("a" * 10))
+        batcher.add(Message("b" * 10))
+        assert on_batch_ready.call_count == 1
+        assert [item["body"] for item in decode_envelope(on_batch_ready.call_args[0][0])] == [
+            "a" * 10
+        ]
+        assert len(batcher) == 1
+
+    def test_sends_message_larger_than_max_bytes_on_its_own(self):
+        batcher, on_batch_ready = create_batcher(max_bytes=10)
+        batcher.add(Message("a" * 100))
+        assert on_batch_ready.call_count == 1
+        assert len(batcher) == 0
+
+    def test_sends_batch_when_linger_time_expires(self):
+        sent = threading.Event()
+        batcher = MessageBatcher(
+            BatchPolicy(max_linger_time=0.01), JsonCodec(), lambda envelope, cb: sent.set()
+        )
+        batcher.add(Message("a"))
+        assert sent.wait(5)
+        assert len(batcher) == 0
+
+    def test_linger_timer_is_scheduled_on_clock(self):
+        clock = SimulatedClock()
+        on_batch_ready = MagicMock()
+        batcher = MessageBatcher(
+            BatchPolicy(max_linger_time=60), JsonCodec(), on_batch_ready, clock=clock
+        )
+        batcher.add(Message("a"))
+        clock.advance(59)
+        assert on_batch_ready.call_count == 0
+        clock.advance(1)
+        assert on_batch_ready.call_count == 1
+        assert len(batcher) == 0
+
+    def test_flush_sends_partial_batch(self):
+        batcher, on_batch_ready = create_batcher()
+        batcher.add(Message("a"))
+        batcher.flush()
+        assert on_batch_ready.call_count == 1
+
+    def test_flush_does_nothing_if_batch_is_empty(self):
+        batcher, on_batch_ready = create_batcher()
+        batcher.flush()
+        assert on_batch_ready.call_count == 0
+
+    def test_batch_callback_completes_every_message(self):
+        batcher, on_batch_ready = create_batcher(max_count=3)
+        callbacks = [MagicMock(), None, MagicMock()]
+        for callback in callbacks:
+            batcher.add(Message("a"), callback)
+
+        batch_callback = on_batch_ready.call_args[0][1]
+        callbacks[0].assert_not_called()
+        batch_callback()
+        callbacks[0].assert_called_once_with()
+        callbacks[2].assert_called_once_with()
+
+    def test_items_carry_message_properties(self):
+        batcher, on_batch_ready = create_batcher()
+        msg = Message("a")
+        msg.message_id = "mid-1"
+        msg.correlation_id = "cid-1"
+        msg.content_type = "text/plain"
+        msg.custom_properties["alert"] = "yes"
+        batcher.add(msg)
+        batcher.add(Message("b"))
+        batcher.flush()
+
+        items = decode_envelope(on_batch_ready.call_args[0][0])
+        assert items[0] == {
+            "body": "a",
+            "properties": {"alert": "yes"},
+            "systemProperties": {
+                "messageId": "mid-1",
+                "correlationId": "cid-1",
+                "contentType": "text/plain",
+            },
+        }
+        assert items[1] == {"body": "b"}
+
+    def test_items_keep_structured_bodies(self):
+        batcher, on_batch_ready = create_batcher()
+        batcher.add(Message({"temperature": 20}))
+        batcher.flush()
+        assert decode_envelope(on_batch_ready.call_args[0][0]) == [{"body": {"temperature": 20}}]
+
+    def test_items_encode_binary_bodies(self):
+        batcher, on_batch_ready = create_batcher()
+        batcher.add(Message(b"utf-8 text"))
+        batcher.add(Message(b"\xff\xfe"))
+        batcher.flush()
+
+        items = decode_envelope(on_batch_ready.call_args[0][0])
+        assert items[0] == {"body": "utf-8 text"}
+        assert items[1] == {
+            "body": base64.b64encode(b"\xff\xfe").decode("ascii"),
+            "bodyEncoding": "base64",
+        }
+
+    def test_envelope_expires_with_its_earliest_message(self):
+        batcher, on_batch_ready = create_batcher()
+        earliest = datetime.utcnow() + timedelta(seconds=10)
+        for expiry in (None, earliest + timedelta(seconds=5), earliest):
+            msg = Message("a")
+            msg.expiry_time_utc = expiry
+            batcher.add(msg)
+        batcher.flush()
+
+        assert on_batch_ready.call_args[0][0].expiry_time_utc == earliest
+
+    def test_envelope_without_expiring_messages_does_not_expire(self):
+        batcher, on_batch_ready = create_batcher()
+        batcher.add(Message("a"))
+        batcher.flush()
+
+        assert on_batch_ready.call_args[0][0].expiry_time_utc is None
+
+    def test_batch_is_sent_without_holding_the_lock(self):
+        # A slow publish must not hold up producers adding to the next batch
+        publishing = threading.Event()
+        release = threading.Event()
+        sent = []
+
+        def on_batch_ready(envelope, callback):
+            sent.append(envelope)
+            if len(sent) == 1:
+                publishing.set()
+                release.wait(5)
+
+        batcher = MessageBatcher(BatchPolicy(max_count=1), JsonCodec(), on_batch_ready)
+        publisher = threading.Thread(target=batcher.add, args=(Message("a"),))
+        publisher.start()
+        assert publishing.wait(5)
+        producer = threading.Thread(target=batcher.add, args=(Message("b"),))
+        producer.start()
+        producer.join(5)
+        producer_finished = not producer.is_alive()
+        release.set()
+        publisher.join(5)
+
+        assert producer_finished
+        assert len(sent) == 2
+
+    @pytest.mark.skipif(msgpack is None, reason="msgpack is not installed")
+    def test_uses_codec_for_envelope(self):
+        on_batch_ready = MagicMock()
+        batcher = MessageBatcher(BatchPolicy(max_count=2), MsgPackCodec(), on_batch_ready)
+        batcher.add(Message("a"))
+        batcher.add(Message("b"))
+
+        envelope = on_batch_ready.call_args[0][0]
+        assert envelope.content_type == "application/msgpack"
+        assert msgpack.unpackb(envelope.data, raw=False) == [{"body": "a"}, {"body": "b"}]
@@ -0,0 +1,162 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+import six.moves.urllib as urllib
+from azure.iot.hub.devicesdk import Message
+from azure.iot.hub.devicesdk.common.clock import SimulatedClock
+from azure.iot.hub.devicesdk.transport.chunking import (
+    ChunkingPolicy,
+    ChunkedSend,
+    ChunkReassembler,
+    CHUNK_ID_PROPERTY,
+    CHUNK_INDEX_PROPERTY,
+    CHUNK_COUNT_PROPERTY,
+)
+
+fake_topic = "devices/MyPensieve/messages/events/"
+fake_payload = b"0123456789" * 10
+
+
+def chunk_properties(topic):
+    return dict(urllib.parse.parse_qsl(topic.split("/")[-1]))
+
+
+def create_chunk(chunk_id, index, count, data):
+    msg = Message(data)
+    msg.custom_properties[CHUNK_ID_PROPERTY] = chunk_id
+    msg.custom_properties[CHUNK_INDEX_PROPERTY] = str(index)
+    msg.custom_properties[CHUNK_COUNT_PROPERTY] = str(count)
+    return msg
+
+
+class TestChunkingPolicy(object):
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            pytest.param({"max_chunk_size": 0}, id="max_chunk_size"),
+            pytest.param({"max_in_flight": 0}, id="max_in_flight"),
+            pytest.param({"reassembly_timeout": 0}, id="reassembly_timeout"),
+            pytest.param({"max_reassembly_bytes": 0}, id="max_reassembly_bytes"),
+            pytest.param({"max_chunk_count": 0}, id="max_chunk_count"),
+        ],
+    )
+    def test_raises_on_invalid_limits(self, kwargs):
+        with pytest.raises(ValueError):
+            ChunkingPolicy(**kwargs)
+
+
+class TestChunkedSend(object):
+    def test_splits_payload_into_chunks(self):
+        chunked_send = ChunkedSend(fake_topic, fake_payload, 30, None)
+        chunks = []
+        while True:
+            next_chunk = chunked_send.next_chunk()
+            if not next_chunk:
+                break
+            chunks.append(next_chunk)
+
+        assert chunked_send.chunk_count == 4
+        assert b"".join(chunk for _, chunk in chunks) == fake_payload
+        assert [len(chunk) for _, chunk in chunks] == [30, 30, 30, 10]
+
+    def test_chunk_topics_carry_chunk_properties(self):
+        chunked_send = ChunkedSend(fake_topic, fake_payload, 60, None)
+        first_topic, _ = chunked_send.next_chunk()
+        second_topic, _ = chunked_send.next_chunk()
+
+        first = chunk_properties(first_topic)
+        second = chunk_properties(second_topic)
+        assert first[CHUNK_ID_PROPERTY] == second[CHUNK_ID_PROPERTY]
+        assert (first[CHUNK_INDEX_PROPERTY], second[CHUNK_INDEX_PROPERTY]) == ("0", "1")
+        assert first[CHUNK_COUNT_PROPERTY] == "2"
+
+    def test_chunk_topics_keep_message_properties(self):
+        topic = fake_topic + "%24.mid=spell-1234"
+        chunked_send = ChunkedSend(topic, fake_payload, 60, None)
+        chunk_topic, _ = chunked_send.next_chunk()
+        assert chunk_topic.startswith(topic + "&")
+        assert chunk_properties(chunk_topic)["$.mid"] == "spell-1234"
+
+    def test_chunk_acknowledged_reports_progress(self):
+        chunked_send = ChunkedSend(fake_topic, fake_payload, 50, None)
+        chunked_send.next_chunk()
+        assert chunked_send.chunk_acknowledged() == (False, True)
+        chunked_send.next_chunk()
+        assert chunked_send.chunk_acknowledged() == (True, False)
+
+
+class TestChunkReassembler(object):
+    def test_is_chunk(self):
+        assert ChunkReassembler.is_chunk(create_chunk("id", 0, 1, b""))
+        assert not ChunkReassembler.is_chunk(Message(b""))
+
+    def test_reassembles_chunks_received_out_of_order(self):
+        reassembler = ChunkReassembler(ChunkingPolicy())
+        assert reassembler.add(create_chunk("id", 1, 3, b"bb")) is None
+        assert reassembler.add(create_chunk("id", 2, 3, b"cc")) is None
+        message = reassembler.add(create_chunk("id", 0, 3, b"aa"))
+
+        assert message.data == b"aabbcc"
+        assert message.custom_properties == {}
+
+    def test_reassembled_message_keeps_custom_properties(self):
+        reassembler = ChunkReassembler(ChunkingPolicy())
+        first = create_chunk("id", 0, 2, b"aa")
+        first.custom_properties["alert"] = "yes"
+        reassembler.add(first)
+        message = reassembler.add(create_chunk("id", 1, 2, b"bb"))
+        assert message.custom_properties == {"alert": "yes"}
+
+    def test_ignores_duplicate_chunks(self):
+        reassembler = ChunkReassembler(ChunkingPolicy())
+        reassembler.add(create_chunk("id", 0, 2, b"aa"))
+        assert reassembler.add(create_chunk("id", 0, 2, b"aa")) is None
+        assert reassembler.add(create_chunk("id", 1, 2, b"bb")).data == b"aabb"
+
+    @pytest.mark.parametrize(
+        "index,count",
+        [pytest.param("x", "2", id="non-numeric"), pytest.param("5", "2", id="range")],
+    )
+    def test_discards_chunks_with_invalid_properties(self, index, count):
+        reassembler = ChunkReassembler(ChunkingPolicy())
+        msg = create_chunk("id", 0, 2, b"aa")
+        msg.custom_properties[CHUNK_INDEX_PROPERTY] = index
+        msg.custom_properties[CHUNK_COUNT_PROPERTY] = count
+        assert reassembler.add(msg) is None
+
+    def test_discards_chunks_of_payloads_with_too_many_chunks(self):
+        reassembler = ChunkReassembler(ChunkingPolicy(max_chunk_count=4))
+        assert reassembler.add(create_chunk("id", 0, 50000000, b"aa")) is None
+        assert reassembler.add(create_chunk("other", 0, 5, b"aa")) is None
+        assert reassembler.add(create_chunk("other", 1, 5, b"bb")) is None
+        assert reassembler._buffered_bytes == 0
+
+    def test_discards_chunks_whose_count_changes(self):
+        reassembler = ChunkReassembler(ChunkingPolicy())
+        reassembler.add(create_chunk("id", 0, 2, b"aa"))
+        assert reassembler.add(create_chunk("id", 3, 5, b"dd")) is None
+        assert reassembler.add(create_chunk("id", 1, 1, b"bb")) is None
+        assert reassembler.add(create_chunk("id", 1, 2, b"bb")).data == b"aabb"
+
+    def test_discards_oldest_payload_when_buffer_is_full(self):
+        reassembler = ChunkReassembler(ChunkingPolicy(max_reassembly_bytes=5))
+        reassembler.add(create_chunk("first", 0, 2, b"aaa"))
+        reassembler.add(create_chunk("second", 0, 2, b"bbb"))
+
+        assert reassembler.discarded_count == 1
+        assert reassembler.add(create_chunk("second", 1, 2, b"bb")).data == b"bbbbb"
+        assert reassembler.add(create_chunk("first", 1, 2, b"aaa")) is None
+
+    def test_discards_payload_after_timeout(self):
+        clock = SimulatedClock()
+        reassembler = ChunkReassembler(ChunkingPolicy(reassembly_timeout=10), clock=clock)
+        reassembler.add(create_chunk("id", 0, 2, b"aa"))
+
+        clock.advance(11)
+        assert reassembler.add(create_chunk("other", 0, 2, b"cc")) is None
+        assert reassembler.discarded_count == 1
+        assert reassembler.add(create_chunk("id", 1, 2, b"bb")) is None
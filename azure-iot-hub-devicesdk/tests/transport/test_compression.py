@@ -0,0 +1,95 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+import gzip
+import io
+import json
+import zlib
+from azure.iot.hub.devicesdk.transport.compression import PayloadCompressor
+
+fake_telemetry = json.dumps(
+    [{"temperature": 20 + i, "humidity": 40, "status": "nominal"} for i in range(100)]
+).encode("utf-8")
+fake_zdict = b'{"temperature": "humidity": "status": "nominal"}'
+
+
+class TestPayloadCompressor(object):
+    def test_raises_on_invalid_encoding(self):
+        with pytest.raises(ValueError):
+            PayloadCompressor(encoding="brotli")
+
+    def test_raises_on_zdict_with_gzip_encoding(self):
+        with pytest.raises(ValueError):
+            PayloadCompressor(encoding="gzip", zdict=fake_zdict)
+
+    def test_does_not_compress_payload_below_threshold(self):
+        compressor = PayloadCompressor(threshold=len(fake_telemetry) + 1)
+        payload, encoding = compressor.compress(fake_telemetry)
+        assert payload is fake_telemetry
+        assert encoding is None
+
+    def test_does_not_compress_if_compression_does_not_reduce_size(self):
+        compressor = PayloadCompressor(threshold=0)
+        payload, encoding = compressor.compress(b"x")
+        assert payload == b"x"
+        assert encoding is None
+
+    def test_returns_string_payload_unchanged_if_not_compressed(self):
+        compressor = PayloadCompressor()
+        payload, encoding = compressor.compress(u"short")
+        assert payload == u"short"
+        assert encoding is None
+
+    def test_gzip_payload_is_readable_by_gzip_module(self):
+        compressor = PayloadCompressor(encoding="gzip", threshold=0)
+        payload, encoding = compressor.compress(fake_telemetry)
+        assert encoding == "gzip"
+        assert len(payload) < len(fake_telemetry)
+        assert gzip.GzipFile(fileobj=io.BytesIO(payload)).read() == fake_telemetry
+
+    def test_deflate_payload_is_readable_by_zlib(self):
+        compressor = PayloadCompressor(encoding="deflate", threshold=0)
+        payload, encoding = compressor.compress(fake_telemetry)
+        assert encoding == "deflate"
+        assert zlib.decompress(payload) == fake_telemetry
+
+    @pytest.mark.parametrize(
+        "encoding,zdict",
+        [
+            pytest.param("gzip", None, id="gzip"),
+            pytest.param("deflate", None, id="deflate"),
+            pytest.param("deflate", fake_zdict, id="deflate with zdict"),
+        ],
+    )
+    def test_round_trips_payload(self, encoding, zdict):
+        compressor = PayloadCompressor(encoding=encoding, threshold=0, zdict=zdict)
+        payload, used_encoding = compressor.compress(fake_telemetry)
+        assert compressor.decompress(payload, used_encoding) == fake_telemetry
+
+    def test_zdict_makes_small_payloads_smaller(self):
+        small = b'{"temperature": 21, "humidity": 40, "status": "nominal"}'
+        plain = PayloadCompressor(encoding="deflate", threshold=0)
+        with_zdict = PayloadCompressor(encoding="deflate", threshold=0, zdict=fake_zdict)
+        plain_payload, _ = plain.compress(small)
+        zdict_payload, encoding = with_zdict.compress(small)
+        assert encoding == "deflate"
+        assert len(zdict_payload) < len(plain_payload)
+
+    def test_decompress_returns_payload_unchanged_for_other_encodings(self):
+        assert PayloadCompressor().decompress(b"payload", "utf-8") == b"payload"
+
+    @pytest.mark.parametrize(
+        "encoding,expected",
+        [
+            pytest.param("gzip", True, id="gzip"),
+            pytest.param("deflate", True, id="deflate"),
+            pytest.param("utf-8", False, id="utf-8"),
+            pytest.param(None, False, id="None"),
+        ],
+    )
+    def test_is_compressed(self, encoding, expected):
+        assert PayloadCompressor.is_compressed(encoding) == expected
@@ -0,0 +1,98 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import pytest
+from azure.iot.hub.devicesdk import Message
+from azure.iot.hub.devicesdk.common.clock import SimulatedClock
+from azure.iot.hub.devicesdk.transport.dedupe import DedupePolicy, BloomFilter, MessageDeduplicator
+
+
+def create_message(message_id):
+    msg = Message(b"payload")
+    msg.message_id = message_id
+    return msg
+
+
+@pytest.fixture
+def fake_clock():
+    return SimulatedClock()
+
+
+class TestDedupePolicy(object):
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            pytest.param({"lru_size": 0}, id="lru_size"),
+            pytest.param({"window": 0}, id="window"),
+            pytest.param({"window_capacity": 0}, id="window_capacity"),
+            pytest.param({"false_positive_rate": 0}, id="false_positive_rate zero"),
+            pytest.param({"false_positive_rate": 1}, id="false_positive_rate one"),
+        ],
+    )
+    def test_raises_on_invalid_settings(self, kwargs):
+        with pytest.raises(ValueError):
+            DedupePolicy(**kwargs)
+
+
+class TestBloomFilter(object):
+    def test_contains_added_items(self):
+        bloom = BloomFilter(1000, 1e-6)
+        items = ["message-" + str(i) for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+        assert all(item in bloom for item in items)
+
+    def test_false_positive_rate_is_near_target(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add("added-" + str(i))
+        false_positives = sum(1 for i in range(10000) if ("absent-" + str(i)) in bloom)
+        assert false_positives < 300
+
+    def test_clear(self):
+        bloom = BloomFilter(10, 0.01)
+        bloom.add("item")
+        bloom.clear()
+        assert "item" not in bloom
+
+
+class TestMessageDeduplicator(object):
+    def test_detects_and_counts_duplicates(self, fake_clock):
+        deduplicator = MessageDeduplicator(DedupePolicy(), clock=fake_clock)
+        assert not deduplicator.is_duplicate(create_message("a"))
+        assert not deduplicator.is_duplicate(create_message("b"))
+        assert deduplicator.is_duplicate(create_message("a"))
+        assert deduplicator.is_duplicate(create_message("a"))
+        assert deduplicator.duplicate_count == 2
+
+    def test_messages_without_message_id_are_never_duplicates(self, fake_clock):
+        deduplicator = MessageDeduplicator(DedupePolicy(), clock=fake_clock)
+        assert not deduplicator.is_duplicate(create_message(None))
+        assert not deduplicator.is_duplicate(create_message(None))
+
+    def test_lru_size_is_bounded(self, fake_clock):
+        deduplicator = MessageDeduplicator(DedupePolicy(lru_size=10), clock=fake_clock)
+        for i in range(100):
+            deduplicator.is_duplicate(create_message(str(i)))
+        assert len(deduplicator._recent) == 10
+
+    def test_detects_duplicates_evicted_from_lru_within_window(self, fake_clock):
+        deduplicator = MessageDeduplicator(DedupePolicy(lru_size=1, window=60), clock=fake_clock)
+        deduplicator.is_duplicate(create_message("a"))
+        deduplicator.is_duplicate(create_message("b"))
+
+        fake_clock.advance(90)
+        assert deduplicator.is_duplicate(create_message("a"))
+
+    def test_forgets_message_ids_after_two_windows(self, fake_clock):
+        deduplicator = MessageDeduplicator(DedupePolicy(lru_size=1, window=60), clock=fake_clock)
+        deduplicator.is_duplicate(create_message("a"))
+        deduplicator.is_duplicate(create_message("b"))
+
+        fake_clock.advance(61)
+        deduplicator.is_duplicate(create_message("c"))
+        fake_clock.advance(61)
+        assert not deduplicator.is_duplicate(create_message("a"))
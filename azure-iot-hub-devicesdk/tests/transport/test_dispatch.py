@@ -0,0 +1,76 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+
+import logging
+import threading
+import pytest
+from mock import MagicMock
+from azure.iot.hub.devicesdk.transport.dispatch import ThreadDispatcher, PoolDispatcher
+
+
+@pytest.fixture(params=[ThreadDispatcher, PoolDispatcher])
+def dispatcher(request):
+    dispatcher = request.param()
+    yield dispatcher
+    dispatcher.shutdown()
+
+
+class TestDispatchers(object):
+    def test_runs_callbacks_off_the_calling_thread(self, dispatcher):
+        threads = []
+        done = threading.Event()
+        dispatcher.dispatch("key", lambda: threads.append(threading.current_thread()))
+        dispatcher.dispatch("key", done.set)
+        assert done.wait(5)
+        assert threads[0] is not threading.current_thread()
+
+    def test_keeps_callbacks_with_the_same_key_in_order(self, dispatcher):
+        calls = {"c2d": [], "input": []}
+        for index in range(200):
+            key = "c2d" if index % 3 else "input"
+            dispatcher.dispatch(key, calls[key].append, index)
+        dispatcher.shutdown()
+
+        assert calls["c2d"] == [i for i in range(200) if i % 3]
+        assert calls["input"] == [i for i in range(200) if not i % 3]
+
+    def test_logs_exceptions_and_carries_on(self, dispatcher, caplog):
+        callback = MagicMock()
+        dispatcher.dispatch("key", MagicMock(side_effect=ValueError("Incendio")))
+        dispatcher.dispatch("key", callback, 1)
+        dispatcher.shutdown()
+
+        callback.assert_called_once_with(1)
+        assert any(r.levelno == logging.ERROR for r in caplog.records)
+
+    def test_rejects_callbacks_after_shutdown(self, dispatcher):
+        dispatcher.shutdown()
+        with pytest.raises(RuntimeError):
+            dispatcher.dispatch("key", MagicMock())
+
+
+class TestPoolDispatcher(object):
+    def test_blocked_key_does_not_hold_up_other_keys(self):
+        dispatcher = PoolDispatcher(workers=2)
+        release = threading.Event()
+        other = threading.Event()
+        behind = MagicMock()
+        try:
+            dispatcher.dispatch("slow", release.wait, 5)
+            dispatcher.dispatch("slow", behind)
+            dispatcher.dispatch("fast", other.set)
+            assert other.wait(5)
+            behind.assert_not_called()
+            assert dispatcher.pending == 1
+        finally:
+            release.set()
+            dispatcher.shutdown()
+        behind.assert_called_once_with()
+        assert dispatcher.pending == 0
+
+    def test_requires_a_worker(self):
+        with pytest.raises(ValueError):
+            PoolDispatcher(workers=0)